@@ -68,6 +68,9 @@ from .lib.attributes import *
 from .lib.data import *
 from .lib.groups import *
 from .lib.network import *
+from .lib.network_import import *
+from .lib.network_archive import *
+from .lib.topology import *
 from .lib.notes import *
 from .lib.objects import *
 from .lib.plugins import *
@@ -77,6 +80,7 @@ from .lib.scenario import *
 from .lib.sharing import *
 from .lib.static import *
 from .lib.template import *
+from .lib.template.resource import get_network_validation_errors
 from .lib.units import *
 from .lib.users import *
 from .lib.service import *
@@ -17,6 +17,8 @@
 # along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
 #
 
+from contextlib import contextmanager
+
 import sqlalchemy
 from sqlalchemy.orm import scoped_session
 from sqlalchemy import create_engine
@@ -196,13 +198,18 @@ def close_session():
 def rollback_transaction():
     DBSession.rollback()
 
-def bulk_insert_ignore(model, rows):
+def bulk_insert_ignore(model, rows, chunk_size=1000):
     """
     Bulk insert rows into model, silently skipping any that would violate a
     unique constraint. Cross-database compatible.
 
+    The statement is compiled once and executed with the rows as an
+    executemany, chunk_size rows at a time. Rows with different keys are
+    inserted separately, so columns left out of a row keep their defaults.
+
     Does not return inserted IDs — query back as needed after calling.
     """
+    rows = list(rows)
     if not rows:
         return
 
@@ -213,17 +220,177 @@ def bulk_insert_ignore(model, rows):
 
     if dialect_name == 'mysql':
         from sqlalchemy.dialects.mysql import insert as _insert
-        stmt = _insert(model).values(rows).prefix_with('IGNORE')
+        stmt = _insert(model.__table__).prefix_with('IGNORE')
     elif dialect_name == 'postgresql':
         from sqlalchemy.dialects.postgresql import insert as _insert
-        stmt = _insert(model).values(rows).on_conflict_do_nothing()
+        stmt = _insert(model.__table__).on_conflict_do_nothing()
     elif dialect_name == 'sqlite':
         from sqlalchemy.dialects.sqlite import insert as _insert
-        stmt = _insert(model).values(rows).on_conflict_do_nothing()
+        stmt = _insert(model.__table__).on_conflict_do_nothing()
     else:
         raise HydraError(f"bulk_insert_ignore: unsupported dialect '{dialect_name}'")
 
-    DBSession.execute(stmt)
+    rows_by_keys = {}
+    for row in rows:
+        rows_by_keys.setdefault(tuple(sorted(row.keys())), []).append(row)
+
+    for key_rows in rows_by_keys.values():
+        for idx in range(0, len(key_rows), chunk_size):
+            DBSession.execute(stmt, key_rows[idx:idx+chunk_size])
+
+def _natural_key_columns(table, row_keys):
+    """
+    Get the columns of table's unique constraints which are set in a row with
+    the given keys, which identify a newly inserted row without its ID.
+    """
+    key_columns = []
+    for constraint in table.constraints:
+        if not isinstance(constraint, sqlalchemy.UniqueConstraint):
+            continue
+        for column in constraint.columns:
+            if column.name in row_keys and column not in key_columns:
+                key_columns.append(column)
+    return key_columns
+
+def _read_back_ids(table, chunk, first_id, step):
+    """
+    Get the IDs of a chunk of rows which have just been inserted in a single
+    statement whose first ID is first_id.
+
+    The IDs are normally first_id, first_id + step ... but they need not be
+    when auto-increment locking is interleaved, so the rows with those IDs are
+    checked against the chunk on their natural key (the columns of the table's
+    unique constraints). If they don't match, the rows are looked up on their
+    natural key instead.
+    """
+    key_columns = _natural_key_columns(table, chunk[0].keys())
+    if len(key_columns) == 0:
+        raise HydraError(f"bulk_insert_returning_ids: {table.name} has no unique "
+                         "columns to read back the new rows with")
+
+    def row_key(row):
+        return tuple(row[c.name] for c in key_columns)
+
+    chunk_keys = [row_key(row) for row in chunk]
+
+    expected_ids = [first_id + i * step for i in range(len(chunk))]
+    found = dict((row.id, tuple(row[1:])) for row in DBSession.execute(
+        sqlalchemy.select(table.c.id, *key_columns).where(
+            table.c.id.in_(expected_ids))))
+    if all(found.get(new_id) == key for new_id, key in zip(expected_ids, chunk_keys)):
+        return expected_ids
+
+    log.warning("New IDs in %s are not consecutive. Reading them back by name.", table.name)
+
+    key_filter = []
+    for i, column in enumerate(key_columns):
+        values = set(key[i] for key in chunk_keys if key[i] is not None)
+        column_filter = column.in_(values) if len(values) > 0 else None
+        if any(key[i] is None for key in chunk_keys):
+            column_filter = column.is_(None) if column_filter is None\
+                    else sqlalchemy.or_(column_filter, column.is_(None))
+        key_filter.append(column_filter)
+
+    ids_by_key = {}
+    for row in DBSession.execute(
+            sqlalchemy.select(table.c.id, *key_columns).where(
+                table.c.id >= first_id, *key_filter).order_by(table.c.id)):
+        ids_by_key.setdefault(tuple(row[1:]), row.id)
+
+    chunk_ids = [ids_by_key.get(key) for key in chunk_keys]
+    if None in chunk_ids or len(set(chunk_ids)) != len(chunk_ids):
+        raise HydraError(f"bulk_insert_returning_ids: unable to read back the "
+                         f"new rows in {table.name}")
+    return chunk_ids
+
+def bulk_insert_returning_ids(model, rows, chunk_size=1000):
+    """
+    Bulk insert rows into model, returning the new primary keys in the same
+    order as rows.
+
+    Where the dialect can return IDs from an executemany in parameter order
+    (PostgreSQL, SQLite >= 3.35, MariaDB), INSERT ... RETURNING is used.
+    Otherwise (MySQL) each chunk is inserted as a single multi-row INSERT,
+    and its IDs are read back starting from the statement's last insert ID,
+    checking them against the rows' natural key (see _read_back_ids).
+
+    All rows must have the same keys.
+    """
+    rows = list(rows)
+    if not rows:
+        return []
+
+    if engine is None:
+        raise HydraError("bulk_insert_returning_ids: No database engine available. Please call connect() first.")
+
+    table = model.__table__
+    returning = engine.dialect.insert_executemany_returning_sort_by_parameter_order
+    step = 1
+    if not returning:
+        step = DBSession.execute(text("SELECT @@auto_increment_increment")).scalar()
+
+    new_ids = []
+    for idx in range(0, len(rows), chunk_size):
+        chunk = rows[idx:idx+chunk_size]
+        if returning:
+            result = DBSession.execute(
+                table.insert().returning(table.c.id, sort_by_parameter_order=True),
+                chunk)
+            new_ids.extend(result.scalars().all())
+        else:
+            result = DBSession.execute(table.insert().values(chunk))
+            new_ids.extend(_read_back_ids(table, chunk, result.lastrowid, step))
+    return new_ids
+
+def bulk_delete(model, column, ids, chunk_size=999):
+    """
+    Delete the rows of model where column is in ids, in chunks of chunk_size
+    so the number of bound parameters in each statement stays bounded.
+    This bypasses the ORM, so no cascades are applied and nothing is loaded
+    into the session.
+
+    Returns the number of rows deleted.
+    """
+    ids = list(ids)
+    deleted = 0
+    for idx in range(0, len(ids), chunk_size):
+        result = DBSession.execute(model.__table__.delete().where(
+            column.in_(ids[idx:idx+chunk_size])))
+        deleted += result.rowcount
+    return deleted
+
+@contextmanager
+def temporary_id_map(name, id_map=None, chunk_size=10000):
+    """
+    Load a dictionary of old ID -> new ID into a temporary table with
+    'old_id' and 'new_id' columns, so it can be joined against in
+    INSERT ... SELECT statements. The table is dropped on exit.
+    If id_map is None, the table is left empty, to be filled by the caller
+    (for example with an INSERT ... SELECT).
+
+    The table lives on the session's connection, so it is only visible
+    within the current transaction's connection.
+    """
+    metadata = sqlalchemy.MetaData()
+    table = sqlalchemy.Table(name, metadata,
+                             sqlalchemy.Column('old_id', sqlalchemy.Integer(), primary_key=True),
+                             sqlalchemy.Column('new_id', sqlalchemy.Integer(), nullable=False),
+                             prefixes=['TEMPORARY'])
+
+    connection = DBSession.connection()
+    table.create(bind=connection)
+    try:
+        rows = [{'old_id': old_id, 'new_id': new_id} for old_id, new_id in (id_map or {}).items()]
+        for idx in range(0, len(rows), chunk_size):
+            connection.execute(table.insert(), rows[idx:idx+chunk_size])
+        yield table
+    finally:
+        try:
+            table.drop(bind=connection)
+        except sqlalchemy.exc.SQLAlchemyError as err:
+            #The transaction is already failing, and rolling it back
+            #will remove the table anyway.
+            log.warning("Unable to drop temporary table %s: %s", name, err)
 
 
 def restart_session(caller='-- not specified --'):
@@ -87,7 +87,7 @@ class ResourceAttr(Base, Inspect):
         elif ref_key == 'LINK':
             return self.link.network
         elif ref_key == 'GROUP':
-            return self.group.network
+            return self.resourcegroup.network
         elif ref_key == 'PROJECT':
             return None
 
@@ -141,6 +141,10 @@ class Scenario(Base, Inspect):
             the ones closest to this scenario (my immediate parent's values are used instead
             of its parents)
 
+            The whole inheritance tree is resolved in a single query, rather than
+            one query per ancestor, so the filters passed in here apply to
+            inherited data as well as this scenario's own data.
+
             If an explicit list of RAs is provided, only return data for these. This is used
             when requesting data for a specific resource, for example.
         """
@@ -151,12 +155,17 @@ class Scenario(Base, Inspect):
             child_data = []
 
         #Idenify all existing resource attr ids, which take priority over anything in here
-        childrens_ras = []
-        for child_rs in child_data:
-            childrens_ras.append(child_rs.resource_attr_id)
+        childrens_ras = set(child_rs.resource_attr_id for child_rs in child_data)
+
+        if get_parent_data is True:
+            scenario_ids = self.get_lineage()
+        else:
+            scenario_ids = [self.id]
+
         t = time.time()
         resourcescenarios = self.get_all_resourcescenarios(
             user_id,
+            scenario_ids=scenario_ids,
             ra_ids=ra_ids,
             include_results=include_results,
             include_only_results=include_only_results,
@@ -172,14 +181,91 @@ class Scenario(Base, Inspect):
             if this_rs.resource_attr_id not in childrens_ras:
                 child_data.append(this_rs)
 
-        if self.parent is not None and get_parent_data is True:
-            return self.parent.get_data(user_id, child_data=child_data,
-                                        get_parent_data=get_parent_data,
-                                       ra_ids=ra_ids)
-
         return child_data
 
+    def get_lineage(self):
+        """
+            Return the IDs of this scenario and all of its ancestors, ordered
+            from this scenario up to the root of the inheritance tree.
+        """
+        lineage = [self.id]
+        parent_id = self.parent_id
+        while parent_id is not None and parent_id not in lineage:
+            lineage.append(parent_id)
+            parent_id = get_session().query(Scenario.parent_id).filter(
+                Scenario.id == parent_id).scalar()
+
+        return lineage
+
+    def _filter_nearest_rs(self, rs_qry, user_id, scenario_ids, ra_ids=None):
+        """
+            Restrict a resource scenario query which spans a scenario lineage
+            so that each resource attribute only resolves to the visible
+            resource scenario in the scenario nearest the start of scenario_ids.
+        """
+        if len(scenario_ids) < 2:
+            return rs_qry
+
+        #Rank each scenario by its distance from this one, then keep only
+        #the nearest visible resource scenario for each resource attribute.
+        depth = case(dict((s_id, i) for i, s_id in enumerate(scenario_ids)),
+                     value=ResourceScenario.scenario_id)
+
+        nearest_qry = get_session().query(
+            ResourceScenario.resource_attr_id,
+            func.min(depth).label('depth')
+        ).join(Dataset, Dataset.id==ResourceScenario.dataset_id
+        ).outerjoin(DatasetOwner, and_(DatasetOwner.dataset_id==Dataset.id, DatasetOwner.user_id==user_id)
+        ).filter(or_(Dataset.hidden=='N', Dataset.created_by==user_id, DatasetOwner.user_id != None),
+                 ResourceScenario.scenario_id.in_(scenario_ids))
+
+        if ra_ids is not None:
+            nearest_qry = nearest_qry.filter(ResourceScenario.resource_attr_id.in_(ra_ids))
+
+        nearest = nearest_qry.group_by(ResourceScenario.resource_attr_id).subquery()
+
+        return rs_qry.filter(
+            nearest.c.resource_attr_id == ResourceScenario.resource_attr_id,
+            nearest.c.depth == depth)
+
+    def get_dataset_hashes(self, user_id, get_parent_data=False, include_results=True):
+        """
+            Return a lightweight list of the resource scenarios visible in this
+            scenario, with the dataset ID and hash but not the dataset value.
+            This is used to identify which datasets differ between scenarios
+            before loading any values.
+        """
+        if get_parent_data is True:
+            scenario_ids = self.get_lineage()
+        else:
+            scenario_ids = [self.id]
+
+        rs_qry = get_session().query(
+                    ResourceScenario.resource_attr_id,
+                    ResourceScenario.dataset_id,
+                    Dataset.hash,
+                    ResourceAttr.ref_key,
+                    ResourceAttr.node_id,
+                    ResourceAttr.link_id,
+                    ResourceAttr.group_id,
+                    ResourceAttr.network_id,
+                    Attr.name.label('attr_name')
+        ).outerjoin(DatasetOwner, and_(DatasetOwner.dataset_id==Dataset.id, DatasetOwner.user_id==user_id)).filter(
+                    or_(Dataset.hidden=='N', Dataset.created_by==user_id, DatasetOwner.user_id != None),
+                    ResourceAttr.id == ResourceScenario.resource_attr_id,
+                    ResourceScenario.scenario_id.in_(scenario_ids),
+                    Dataset.id==ResourceScenario.dataset_id,
+                    Attr.id==ResourceAttr.attr_id)
+
+        if include_results is False:
+            rs_qry = rs_qry.filter(ResourceAttr.attr_is_var=='N')
+
+        rs_qry = self._filter_nearest_rs(rs_qry, user_id, scenario_ids)
+
+        return rs_qry.all()
+
     def get_all_resourcescenarios(self, user_id,
+        scenario_ids=None,
         ra_ids=None,
         include_results=True,
         include_only_results=False,
@@ -192,9 +278,19 @@ class Scenario(Base, Inspect):
         """
             Get all the resource scenarios in a network, across all scenarios
             returns a dictionary of dict objects, keyed on scenario_id
+
+            If a list of scenario_ids is provided (this scenario followed by its
+            ancestors, as returned by get_lineage), each resource attribute
+            resolves to the visible resource scenario from the scenario nearest
+            the start of the list.
         """
         log.debug("Starting dataset query")
 
+        if scenario_ids is None:
+            scenario_ids = [self.id]
+
+        visible_filter = or_(Dataset.hidden=='N', Dataset.created_by==user_id, DatasetOwner.user_id != None)
+
         rs_qry = get_session().query(
                     Dataset.type,
                     Dataset.unit_id,
@@ -217,13 +313,14 @@ class Scenario(Base, Inspect):
                     Attr.name.label('attr_name'),
                     Attr.description.label('attr_description')
         ).outerjoin(DatasetOwner, and_(DatasetOwner.dataset_id==Dataset.id, DatasetOwner.user_id==user_id)).filter(
-                    or_(Dataset.hidden=='N', Dataset.created_by==user_id, DatasetOwner.user_id != None),
+                    visible_filter,
                     ResourceAttr.id == ResourceScenario.resource_attr_id,
-                    Scenario.id==ResourceScenario.scenario_id,
-                    Scenario.id==self.id,
+                    ResourceScenario.scenario_id.in_(scenario_ids),
                     Dataset.id==ResourceScenario.dataset_id,
                     Attr.id==ResourceAttr.attr_id)
 
+        rs_qry = self._filter_nearest_rs(rs_qry, user_id, scenario_ids, ra_ids=ra_ids)
+
         if include_results is False:
             rs_qry = rs_qry.filter(ResourceAttr.attr_is_var=='N')
 
@@ -305,7 +402,7 @@ class Scenario(Base, Inspect):
             metadata = get_session().query(Metadata)\
                         .join(Dataset)\
                         .join(ResourceScenario)\
-                        .filter(ResourceScenario.scenario_id == self.id).all()
+                        .filter(ResourceScenario.scenario_id.in_(scenario_ids)).all()
             for m in metadata:
                 if metadata_lookup.get(m.dataset_id):
                     metadata_lookup[m.dataset_id][m.key] = m.value
@@ -331,9 +428,7 @@ class Scenario(Base, Inspect):
             child_items = []
 
         #Idenify all existing resource attr ids, which take priority over anything in here
-        childrens_groups = []
-        for child_rgi in child_items:
-            childrens_groups.append(child_rgi.group_id)
+        childrens_groups = set(child_rgi.group_id for child_rgi in child_items)
 
         #Add resource attributes which are not defined already
         for this_rgi in self.resourcegroupitems:
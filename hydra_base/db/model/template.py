@@ -204,7 +204,33 @@ class Template(Base, Inspect):
         return parent_ids
 
 
-    def get_types(self, type_tree={}, child_types=None, get_parent_types=True, child_template_id=None):
+    def get_lineage(self):
+        """
+            Return this template followed by its parent, its parent's parent
+            and so on up to the root template.
+        """
+        lineage = [self]
+        while lineage[-1].parent_id is not None:
+            lineage.append(lineage[-1].parent)
+        return lineage
+
+    @staticmethod
+    def _get_type_parent_ids(ttype_id, type_parents):
+        """
+            As get_type_parent_ids, but using a dict of type ID to parent type
+            ID which has already been loaded, only querying the DB if a
+            parent type is not in it.
+        """
+        parent_ids = []
+        parent_id = type_parents[ttype_id]
+        while parent_id:
+            if parent_id not in type_parents:
+                return Template.get_type_parent_ids(ttype_id)
+            parent_ids.insert(0, parent_id)
+            parent_id = type_parents[parent_id]
+        return parent_ids
+
+    def get_types(self, get_parent_types=True):
         """
             Return all the templatetypes relevant to this template.
             If this template inherits from another, look up the tree to compile
@@ -212,104 +238,114 @@ class Template(Base, Inspect):
             the ones closest to this template (my immediate parent's values are used instead
             of its parents)
 
+            The types and type attributes of all the templates in the tree are
+            loaded in one query each, and the inheritance is resolved in memory.
         """
         log.info("Getting Template Types..")
 
-        #This avoids python's mutable keyword arguments causing child_data to keep its values between
-        #function calls
-        if child_types is None:
-            child_types = []
-            type_tree = {}
+        lineage = self.get_lineage() if get_parent_types is True else [self]
+        template_ids = [t.id for t in lineage]
 
-        #Add resource attributes which are not defined already
-        types_i = get_session().query(TemplateType).filter(
-            TemplateType.template_id == self.id).options(noload(TemplateType.typeattrs)).all()
-        types = [JSONObject(t) for t in types_i]
-
-        if child_template_id is None:
-            child_template_id = self.id
-
-        for i, this_type in enumerate(types):
-            if this_type.parent_id is not None:
-                this_type.parent_ids = Template.get_type_parent_ids(this_type.id)
-
-            this_type.child_template_id = child_template_id
-
-            #This keeps track of which type attributes are currently associated
-            #to this type. We'll use the data in this dict to set the 'typeattrs'
-            #at the end
-            if not hasattr(this_type, 'ta_tree') or this_type.ta_tree is None:
-                this_type.ta_tree = {}
-
-            #get all the type attrs for this type, and add any which are missing
-            typeattrs_i = get_session().query(TypeAttr)\
-                .filter(TypeAttr.type_id == this_type.id)\
-                .options(joinedload(TypeAttr.attr))\
-                .options(joinedload(TypeAttr.default_dataset)).all()
-
-            typeattrs = [JSONObject(ta) for ta in typeattrs_i]
-
-            #Is this type the parent of a type. If so, we don't want to add a new type
-            #we want to update an existing one with any data that it's missing
-            if this_type.id in type_tree:
-                #This is a deleted type, so ignore it in the parent
-                if type_tree[this_type.id] is  None:
-                    continue
+        all_types_i = get_session().query(TemplateType).filter(
+            TemplateType.template_id.in_(template_ids))\
+            .options(noload(TemplateType.typeattrs))\
+            .order_by(TemplateType.id).all()
 
-                #Find the child type and update it.
-                child_type = type_tree[this_type.id]
+        all_typeattrs_i = get_session().query(TypeAttr)\
+            .join(TemplateType, TypeAttr.type_id == TemplateType.id)\
+            .filter(TemplateType.template_id.in_(template_ids))\
+            .options(joinedload(TypeAttr.attr))\
+            .options(joinedload(TypeAttr.default_dataset))\
+            .order_by(TypeAttr.id).all()
 
-                child_type = self.set_inherited_columns(this_type, child_type, types_i[i])
+        type_parents = dict((t.id, t.parent_id) for t in all_types_i)
 
-                #check the child's typeattrs. If a typeattr exists on the parent, with the
-                #same attr_id, then it should be ignore. THis can happen when adding a typeattr
-                #to the child first, then the parent
-                child_typeattrs = [ta.attr_id for ta in child_type.typeattrs]
+        types_by_template = defaultdict(list)
+        for type_i in all_types_i:
+            types_by_template[type_i.template_id].append(type_i)
 
-                for typeattr in typeattrs:
-                    if typeattr.attr_id in child_typeattrs:
-                        log.debug("Found a typeattr for attribute %s on the "
-                             "child type %s (%s). Ignoring",
-                             typeattr.attr_id, child_type.name, child_type.id)
+        typeattrs_by_type = defaultdict(list)
+        for typeattr_i in all_typeattrs_i:
+            typeattrs_by_type[typeattr_i.type_id].append(JSONObject(typeattr_i))
+
+        child_types = []
+        #A lookup from a parent type ID to the child type which inherits from it.
+        type_tree = {}
+
+        #Work from this template up to the root, so the types lower down
+        #the tree take priority.
+        for template in lineage:
+            types_i = types_by_template[template.id]
+            types = [JSONObject(t) for t in types_i]
+
+            for i, this_type in enumerate(types):
+                if this_type.parent_id is not None:
+                    this_type.parent_ids = Template._get_type_parent_ids(this_type.id, type_parents)
+
+                this_type.child_template_id = self.id
+
+                #This keeps track of which type attributes are currently associated
+                #to this type. We'll use the data in this dict to set the 'typeattrs'
+                #at the end
+                if not hasattr(this_type, 'ta_tree') or this_type.ta_tree is None:
+                    this_type.ta_tree = {}
+
+                typeattrs = typeattrs_by_type[this_type.id]
+
+                #Is this type the parent of a type. If so, we don't want to add a new type
+                #we want to update an existing one with any data that it's missing
+                if this_type.id in type_tree:
+                    #This is a deleted type, so ignore it in the parent
+                    if type_tree[this_type.id] is  None:
                         continue
 
-                    #Does this typeattr have a child?
-                    child_typeattr = type_tree[this_type.id].ta_tree.get(typeattr.id)
-                    if child_typeattr is None:
+                    #Find the child type and update it.
+                    child_type = type_tree[this_type.id]
 
-                        #there is no child, so check if it is a child
-                        if typeattr.parent_id is not None:
-                            #it has a parent, so add it to the type's tree dict
-                            #for processing farther up the tree
-                            type_tree[this_type.id].ta_tree[typeattr.parent_id] = typeattr
-                        child_type.typeattrs.append(typeattr)
-                    else:
-                        child_typeattr = self.set_inherited_columns(typeattr, child_typeattr, types_i[i])
+                    child_type = self.set_inherited_columns(this_type, child_type, types_i[i])
 
+                    #check the child's typeattrs. If a typeattr exists on the parent, with the
+                    #same attr_id, then it should be ignore. THis can happen when adding a typeattr
+                    #to the child first, then the parent
+                    child_typeattrs = [ta.attr_id for ta in child_type.typeattrs]
 
-                if this_type.parent_id is not None:
-                    type_tree[this_type.parent_id] = child_type
+                    for typeattr in typeattrs:
+                        if typeattr.attr_id in child_typeattrs:
+                            log.debug("Found a typeattr for attribute %s on the "
+                                 "child type %s (%s). Ignoring",
+                                 typeattr.attr_id, child_type.name, child_type.id)
+                            continue
 
-            else:
-                if not hasattr(this_type, 'typeattrs'):
-                    setattr(this_type, 'typeattrs', [])
-                for typeattr in typeattrs:
-                    #is this a child? if so, register it as one
-                    if typeattr.parent_id is not None:
-                        this_type.ta_tree[typeattr.parent_id] = typeattr
-                    this_type.typeattrs.append(typeattr)
+                        #Does this typeattr have a child?
+                        child_typeattr = type_tree[this_type.id].ta_tree.get(typeattr.id)
+                        if child_typeattr is None:
 
-                child_types.append(this_type)
-                #set
-                if this_type.parent_id is not None:
-                    type_tree[this_type.parent_id] = this_type
+                            #there is no child, so check if it is a child
+                            if typeattr.parent_id is not None:
+                                #it has a parent, so add it to the type's tree dict
+                                #for processing farther up the tree
+                                type_tree[this_type.id].ta_tree[typeattr.parent_id] = typeattr
+                            child_type.typeattrs.append(typeattr)
+                        else:
+                            child_typeattr = self.set_inherited_columns(typeattr, child_typeattr, types_i[i])
 
 
-        if self.parent is not None and get_parent_types is True:
-            return self.parent.get_types(type_tree=type_tree,
-                                         child_types=child_types,
-                                         get_parent_types=get_parent_types,
-                                        child_template_id=child_template_id)
+                    if this_type.parent_id is not None:
+                        type_tree[this_type.parent_id] = child_type
+
+                else:
+                    if not hasattr(this_type, 'typeattrs'):
+                        setattr(this_type, 'typeattrs', [])
+                    for typeattr in typeattrs:
+                        #is this a child? if so, register it as one
+                        if typeattr.parent_id is not None:
+                            this_type.ta_tree[typeattr.parent_id] = typeattr
+                        this_type.typeattrs.append(typeattr)
+
+                    child_types.append(this_type)
+                    #set
+                    if this_type.parent_id is not None:
+                        type_tree[this_type.parent_id] = this_type
 
         #clean up
         for child_type in child_types:
@@ -0,0 +1,641 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# (c) Copyright 2013 to 2017 University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    Finding and merging duplicate attributes and resource attributes.
+
+    Duplicates are found in the database with window functions and GROUP BY,
+    and are processed in batches, ordered by ID. For each batch, only the rows
+    which would collide once remapped (the same resource, type or group ending
+    up with the same attribute twice) are loaded, to decide which row is kept.
+    Everything else is remapped with bulk UPDATEs.
+
+    Each batch removes the duplicates it handles, so a run which is stopped
+    part way can be carried on by running it again. In a dry run nothing is
+    changed, and the report says what would have been.
+"""
+from collections import defaultdict
+
+from sqlalchemy import func, and_, bindparam
+from sqlalchemy.orm import aliased
+
+from .. import db
+from ..db.model import Attr, AttrMap, AttrGroupItem, ResourceAttr, ResourceAttrMap,\
+        ResourceScenario, ResourceType, TypeAttr, TemplateType, Node, Link, ResourceGroup
+from .data import qry_in_threshold
+from .objects import JSONObject
+from . import attribute_scope
+from .resource_attribute_cache import clear_network_resource_attributes_cache
+from .template.utils import new_template_version
+
+import logging
+log = logging.getLogger(__name__)
+
+#The number of duplicates handled in each batch. Each batch's IDs, and the IDs
+#they are remapped to, must fit in one IN clause.
+DEDUP_BATCH_SIZE = qry_in_threshold // 2
+
+#The columns of a resource attribute which point to its resource
+_RESOURCE_COLUMNS = ('node_id', 'link_id', 'group_id', 'network_id', 'project_id')
+
+_NETWORK_RESOURCES = {'node_id': Node, 'link_id': Link, 'group_id': ResourceGroup}
+
+def _chunks(ids):
+    ids = list(ids)
+    for idx in range(0, len(ids), qry_in_threshold):
+        yield ids[idx:idx+qry_in_threshold]
+
+def _execute_many(statement, rows):
+    if len(rows) > 0:
+        db.DBSession.execute(statement, rows)
+
+def new_report(dry_run):
+    """
+        A report of what a deduplication has done, or would do in a dry run.
+    """
+    return JSONObject({
+        'dry_run': dry_run,
+        'batches': 0,
+        'duplicates': [],
+        'attributes_deleted': 0,
+        'resource_attributes_remapped': 0,
+        'resource_attributes_deleted': 0,
+        'resource_scenarios_moved': 0,
+        'resource_scenarios_deleted': 0,
+        'resource_attribute_maps_remapped': 0,
+        'type_attributes_remapped': 0,
+        'type_attributes_deleted': 0,
+        'attribute_group_items_remapped': 0,
+        'attribute_group_items_deleted': 0,
+        'attribute_maps_remapped': 0,
+    })
+
+def _end_batch(report, commit):
+    report.batches += 1
+    if report.dry_run is True:
+        return
+    if commit is True:
+        db.DBSession.commit()
+    else:
+        db.DBSession.flush()
+
+def find_duplicate_attributes(after_id=0, limit=DEDUP_BATCH_SIZE):
+    """
+        Find attributes which have the same name and dimension as another in
+        the same scope, and the attribute each should be merged into, which is
+        the one of them with the lowest ID.
+        args:
+            after_id (int): Only return duplicates with a higher ID than this
+            limit (int): The maximum number of duplicates to return
+        returns:
+            A dict of duplicate attribute ID to the ID of the attribute to
+            keep, ordered by the duplicate ID.
+    """
+    keeper_id = func.min(Attr.id).over(
+        partition_by=(Attr.name, Attr.dimension_id, Attr.project_id, Attr.network_id))
+    ranked = db.DBSession.query(Attr.id.label('attr_id'),
+                                keeper_id.label('keeper_id')).subquery()
+
+    rows = db.DBSession.query(ranked.c.attr_id, ranked.c.keeper_id).filter(
+        ranked.c.attr_id != ranked.c.keeper_id,
+        ranked.c.attr_id > after_id).order_by(ranked.c.attr_id).limit(limit)
+
+    return dict((row.attr_id, row.keeper_id) for row in rows)
+
+def _get_affected_network_ids(column, ids):
+    """
+        Get the IDs of the networks containing the resource attributes whose
+        column (attr_id or id) is in ids.
+    """
+    network_ids = set()
+    for chunk in _chunks(ids):
+        network_ids.update(r.network_id for r in db.DBSession.query(
+            ResourceAttr.network_id).filter(
+            column.in_(chunk), ResourceAttr.network_id != None).distinct())
+        for ref_column, resource in _NETWORK_RESOURCES.items():
+            network_ids.update(r.network_id for r in db.DBSession.query(
+                resource.network_id).join(
+                ResourceAttr, getattr(ResourceAttr, ref_column) == resource.id).filter(
+                column.in_(chunk)).distinct())
+    return network_ids
+
+def _pick_survivors(groups, is_keeper):
+    """
+        For each group of colliding rows, keep the one which already has the
+        attribute being kept, or otherwise the one with the lowest ID.
+        args:
+            groups: A dict of key -> {row ID: attr ID}
+            is_keeper: A function of (key, attr ID) which is True for the
+                       attribute being kept.
+        returns:
+            A dict of the ID of each row to be removed to the ID of the row
+            which replaces it.
+    """
+    replaced = {}
+    for key, members in groups.items():
+        if len(members) < 2:
+            continue
+        keepers = [row_id for row_id, attr_id in members.items() if is_keeper(key, attr_id)]
+        survivor = keepers[0] if len(keepers) > 0 else min(members)
+        for row_id in members:
+            if row_id != survivor:
+                replaced[row_id] = survivor
+    return replaced
+
+def _plan_resource_attr_collisions(attr_map):
+    """
+        Find the resource attributes which would collide with another on the
+        same resource once attr_map is applied, and the resource attribute
+        each should be merged into.
+    """
+    attr_ids = list(set(attr_map) | set(attr_map.values()))
+    groups = defaultdict(dict)
+    for column in _RESOURCE_COLUMNS:
+        dupe_ra = aliased(ResourceAttr, name='dupe_ra')
+        other_ra = aliased(ResourceAttr, name='other_ra')
+        rows = db.DBSession.query(
+            dupe_ra.id.label('dupe_id'), dupe_ra.attr_id.label('dupe_attr_id'),
+            getattr(dupe_ra, column).label('resource_id'),
+            other_ra.id.label('other_id'), other_ra.attr_id.label('other_attr_id')).join(
+            other_ra, getattr(other_ra, column) == getattr(dupe_ra, column)).filter(
+            dupe_ra.attr_id.in_(list(attr_map)),
+            other_ra.attr_id.in_(attr_ids),
+            other_ra.id != dupe_ra.id)
+
+        for row in rows:
+            target = attr_map[row.dupe_attr_id]
+            if attr_map.get(row.other_attr_id, row.other_attr_id) != target:
+                continue
+            key = (column, row.resource_id, target)
+            groups[key][row.dupe_id] = row.dupe_attr_id
+            groups[key][row.other_id] = row.other_attr_id
+
+    return _pick_survivors(groups, lambda key, attr_id: attr_id == key[2])
+
+def remap_resource_scenarios(ra_map, report):
+    """
+        Move the data of each resource attribute in ra_map onto the resource
+        attribute it maps to, in any scenario where that has no data already.
+        Data which can't be moved is deleted, along with that of any resource
+        attribute which maps to None.
+    """
+    old_ids = sorted(ra_map)
+    new_ids = set(new_id for new_id in ra_map.values() if new_id is not None)
+
+    existing = set()
+    old_rs = []
+    for chunk in _chunks(old_ids + list(new_ids)):
+        for rs in db.DBSession.query(ResourceScenario.scenario_id,
+                                     ResourceScenario.resource_attr_id).filter(
+                ResourceScenario.resource_attr_id.in_(chunk)):
+            if rs.resource_attr_id in ra_map:
+                old_rs.append((rs.resource_attr_id, rs.scenario_id))
+            else:
+                existing.add((rs.scenario_id, rs.resource_attr_id))
+
+    to_move, to_delete = [], []
+    for old_id, scenario_id in sorted(old_rs):
+        new_id = ra_map[old_id]
+        if new_id is None or (scenario_id, new_id) in existing:
+            to_delete.append({'b_scenario_id': scenario_id, 'b_old_id': old_id})
+        else:
+            existing.add((scenario_id, new_id))
+            to_move.append({'b_scenario_id': scenario_id, 'b_old_id': old_id, 'b_new_id': new_id})
+
+    report.resource_scenarios_moved += len(to_move)
+    report.resource_scenarios_deleted += len(to_delete)
+    if report.dry_run is True:
+        return
+
+    rs_table = ResourceScenario.__table__
+    rs_filter = and_(rs_table.c.scenario_id == bindparam('b_scenario_id'),
+                     rs_table.c.resource_attr_id == bindparam('b_old_id'))
+    _execute_many(rs_table.update().where(rs_filter).values(
+        resource_attr_id=bindparam('b_new_id')), to_move)
+    _execute_many(rs_table.delete().where(rs_filter), to_delete)
+
+def remap_resource_attr_maps(ra_map, report):
+    """
+        Point the resource attribute mappings of each resource attribute in
+        ra_map to the resource attribute it maps to, removing any mapping to
+        None or between a resource attribute and itself.
+    """
+    old_maps = set()
+    for chunk in _chunks(ra_map):
+        for column in (ResourceAttrMap.resource_attr_id_a, ResourceAttrMap.resource_attr_id_b):
+            old_maps.update(tuple(row) for row in db.DBSession.query(
+                ResourceAttrMap.network_a_id, ResourceAttrMap.network_b_id,
+                ResourceAttrMap.resource_attr_id_a, ResourceAttrMap.resource_attr_id_b).filter(
+                column.in_(chunk)))
+
+    new_maps = []
+    for network_a_id, network_b_id, ra_a_id, ra_b_id in old_maps:
+        new_a = ra_map.get(ra_a_id, ra_a_id)
+        new_b = ra_map.get(ra_b_id, ra_b_id)
+        if new_a is not None and new_b is not None and new_a != new_b:
+            new_maps.append({'network_a_id': network_a_id, 'network_b_id': network_b_id,
+                             'resource_attr_id_a': new_a, 'resource_attr_id_b': new_b})
+
+    report.resource_attribute_maps_remapped += len(old_maps)
+    if report.dry_run is True:
+        return
+
+    map_table = ResourceAttrMap.__table__
+    _execute_many(map_table.delete().where(and_(
+        map_table.c.network_a_id == bindparam('b_network_a_id'),
+        map_table.c.network_b_id == bindparam('b_network_b_id'),
+        map_table.c.resource_attr_id_a == bindparam('b_ra_a_id'),
+        map_table.c.resource_attr_id_b == bindparam('b_ra_b_id'))),
+        [{'b_network_a_id': m[0], 'b_network_b_id': m[1], 'b_ra_a_id': m[2], 'b_ra_b_id': m[3]}
+         for m in old_maps])
+    db.bulk_insert_ignore(ResourceAttrMap, new_maps)
+
+def delete_resource_attributes(ra_map, report):
+    """
+        Delete the resource attributes in ra_map, first moving their data and
+        mappings onto the resource attributes they map to.
+    """
+    if len(ra_map) == 0:
+        return
+    remap_resource_scenarios(ra_map, report)
+    remap_resource_attr_maps(ra_map, report)
+    report.resource_attributes_deleted += len(ra_map)
+    if report.dry_run is False:
+        db.bulk_delete(ResourceAttr, ResourceAttr.id, ra_map)
+
+def _remap_type_attrs(attr_map, report):
+    """
+        Point type attributes at the attributes they are remapped to, deleting
+        any which would then be on a type twice. Returns the IDs of the
+        templates which have changed.
+    """
+    attr_ids = list(set(attr_map) | set(attr_map.values()))
+    type_ids = set(r.type_id for r in db.DBSession.query(TypeAttr.type_id).filter(
+        TypeAttr.attr_id.in_(list(attr_map))).distinct())
+    if len(type_ids) == 0:
+        return set()
+
+    groups = defaultdict(dict)
+    for chunk in _chunks(type_ids):
+        for ta in db.DBSession.query(TypeAttr.id, TypeAttr.type_id, TypeAttr.attr_id).filter(
+                TypeAttr.type_id.in_(chunk), TypeAttr.attr_id.in_(attr_ids)):
+            groups[(ta.type_id, attr_map.get(ta.attr_id, ta.attr_id))][ta.id] = ta.attr_id
+
+    ta_map = _pick_survivors(groups, lambda key, attr_id: attr_id == key[1])
+
+    report.type_attributes_deleted += len(ta_map)
+    report.type_attributes_remapped += sum(
+        1 for key, members in groups.items() for ta_id, attr_id in members.items()
+        if attr_id in attr_map and ta_id not in ta_map)
+
+    template_ids = set()
+    for chunk in _chunks(type_ids):
+        template_ids.update(r.template_id for r in db.DBSession.query(
+            TemplateType.template_id).filter(TemplateType.id.in_(chunk)).distinct())
+
+    if report.dry_run is True:
+        return template_ids
+
+    ta_table = TypeAttr.__table__
+    #Type attributes of child templates point to the one they inherit from
+    _execute_many(ta_table.update().where(ta_table.c.parent_id == bindparam('b_old_id')).values(
+        parent_id=bindparam('b_new_id')),
+        [{'b_old_id': old_id, 'b_new_id': new_id} for old_id, new_id in ta_map.items()])
+    db.bulk_delete(TypeAttr, TypeAttr.id, ta_map)
+    _execute_many(ta_table.update().where(ta_table.c.attr_id == bindparam('b_old_id')).values(
+        attr_id=bindparam('b_new_id')),
+        [{'b_old_id': old_id, 'b_new_id': new_id} for old_id, new_id in attr_map.items()])
+
+    return template_ids
+
+def _remap_attr_group_items(attr_map, report):
+    """
+        Point attribute group items at the attributes they are remapped to,
+        deleting any which would then be in a group twice.
+    """
+    attr_ids = list(set(attr_map) | set(attr_map.values()))
+    group_ids = set(r.group_id for r in db.DBSession.query(AttrGroupItem.group_id).filter(
+        AttrGroupItem.attr_id.in_(list(attr_map))).distinct())
+    if len(group_ids) == 0:
+        return
+
+    groups = defaultdict(dict)
+    for chunk in _chunks(group_ids):
+        for item in db.DBSession.query(AttrGroupItem).filter(
+                AttrGroupItem.group_id.in_(chunk), AttrGroupItem.attr_id.in_(attr_ids)):
+            key = (item.group_id, item.network_id, attr_map.get(item.attr_id, item.attr_id))
+            #Group items have no ID of their own, so they are identified by their attribute
+            groups[key][item.attr_id] = item.attr_id
+
+    to_delete = []
+    for key, members in groups.items():
+        keep = key[2] if key[2] in members else min(members)
+        to_delete.extend({'b_group_id': key[0], 'b_network_id': key[1], 'b_attr_id': attr_id}
+                         for attr_id in members if attr_id != keep)
+
+    report.attribute_group_items_deleted += len(to_delete)
+    report.attribute_group_items_remapped += sum(
+        1 for members in groups.values() for attr_id in members if attr_id in attr_map) \
+        - len(to_delete)
+
+    if report.dry_run is True:
+        return
+
+    item_table = AttrGroupItem.__table__
+    _execute_many(item_table.delete().where(and_(
+        item_table.c.group_id == bindparam('b_group_id'),
+        item_table.c.network_id == bindparam('b_network_id'),
+        item_table.c.attr_id == bindparam('b_attr_id'))), to_delete)
+    _execute_many(item_table.update().where(item_table.c.attr_id == bindparam('b_old_id')).values(
+        attr_id=bindparam('b_new_id')),
+        [{'b_old_id': old_id, 'b_new_id': new_id} for old_id, new_id in attr_map.items()])
+
+def _remap_attr_maps(attr_map, report):
+    """
+        Point attribute mappings at the attributes they are remapped to,
+        removing any mapping between an attribute and itself.
+    """
+    old_maps = set()
+    for column in (AttrMap.attr_id_a, AttrMap.attr_id_b):
+        old_maps.update(tuple(row) for row in db.DBSession.query(
+            AttrMap.attr_id_a, AttrMap.attr_id_b).filter(column.in_(list(attr_map))))
+
+    new_maps = []
+    for attr_id_a, attr_id_b in old_maps:
+        new_a = attr_map.get(attr_id_a, attr_id_a)
+        new_b = attr_map.get(attr_id_b, attr_id_b)
+        if new_a != new_b:
+            new_maps.append({'attr_id_a': new_a, 'attr_id_b': new_b})
+
+    report.attribute_maps_remapped += len(old_maps)
+    if report.dry_run is True:
+        return
+
+    map_table = AttrMap.__table__
+    _execute_many(map_table.delete().where(and_(
+        map_table.c.attr_id_a == bindparam('b_attr_id_a'),
+        map_table.c.attr_id_b == bindparam('b_attr_id_b'))),
+        [{'b_attr_id_a': a, 'b_attr_id_b': b} for a, b in old_maps])
+    db.bulk_insert_ignore(AttrMap, new_maps)
+
+def remap_attributes(attr_map, report):
+    """
+        Point everything which references each attribute in attr_map
+        (resource attributes, type attributes, attribute group items and
+        attribute mappings) to the attribute it maps to. Where a resource, type
+        or group would then have the same attribute twice, one is kept and the
+        other's data is moved onto it.
+        args:
+            attr_map (dict): Attribute ID -> the attribute ID to replace it with
+            report (JSONObject): A report from new_report, which is updated
+    """
+    if len(attr_map) == 0:
+        return
+
+    #Make sure any pending changes are seen by the queries below
+    db.DBSession.flush()
+
+    network_ids = set()
+    if report.dry_run is False:
+        network_ids = _get_affected_network_ids(ResourceAttr.attr_id, attr_map)
+
+    ra_map = _plan_resource_attr_collisions(attr_map)
+    delete_resource_attributes(ra_map, report)
+
+    num_remapped = 0
+    for chunk in _chunks(attr_map):
+        num_remapped += db.DBSession.query(func.count(ResourceAttr.id)).filter(
+            ResourceAttr.attr_id.in_(chunk)).scalar()
+    if report.dry_run is True:
+        num_remapped -= len(ra_map)
+    report.resource_attributes_remapped += num_remapped
+
+    if report.dry_run is False:
+        ra_table = ResourceAttr.__table__
+        _execute_many(ra_table.update().where(ra_table.c.attr_id == bindparam('b_old_id')).values(
+            attr_id=bindparam('b_new_id')),
+            [{'b_old_id': old_id, 'b_new_id': new_id} for old_id, new_id in attr_map.items()])
+
+    template_ids = _remap_type_attrs(attr_map, report)
+    _remap_attr_group_items(attr_map, report)
+    _remap_attr_maps(attr_map, report)
+
+    if report.dry_run is False:
+        db.DBSession.expire_all()
+        for network_id in network_ids:
+            clear_network_resource_attributes_cache(network_id)
+        for template_id in template_ids:
+            new_template_version(template_id)
+
+def merge_attributes(attr_map, report):
+    """
+        Remap everything which references each attribute in attr_map to the
+        attribute it maps to, then delete it.
+    """
+    if len(attr_map) == 0:
+        return
+    remap_attributes(attr_map, report)
+    report.attributes_deleted += len(attr_map)
+    if report.dry_run is False:
+        db.bulk_delete(Attr, Attr.id, attr_map)
+        db.DBSession.expire_all()
+        attribute_scope.new_attr_scope_version()
+
+def merge_duplicate_attributes(batch_size=DEDUP_BATCH_SIZE, dry_run=False, commit=False,
+                               max_batches=None):
+    """
+        Merge every attribute with the same name and dimension as another in
+        the same scope into the one of them with the lowest ID, in batches.
+        args:
+            batch_size (int): The number of duplicates to merge in each batch
+            dry_run (bool): If True, change nothing, only report what would change
+            commit (bool): If True, commit after each batch, so that if the run
+                           is stopped, the batches done so far are kept. Running
+                           it again carries on with the duplicates which remain.
+            max_batches (int): Stop after this many batches
+        returns:
+            A report of the duplicates found and what was (or would be) changed.
+    """
+    batch_size = max(1, min(batch_size, DEDUP_BATCH_SIZE))
+    report = new_report(dry_run)
+
+    after_id = 0
+    while max_batches is None or report.batches < max_batches:
+        attr_map = find_duplicate_attributes(after_id=after_id, limit=batch_size)
+        if len(attr_map) == 0:
+            break
+        after_id = max(attr_map)
+
+        log.info("Merging %s duplicate attributes, up to ID %s", len(attr_map), after_id)
+        report.duplicates.extend(JSONObject({'attr_id': attr_id, 'keeper_id': keeper_id})
+                                 for attr_id, keeper_id in attr_map.items())
+        merge_attributes(attr_map, report)
+        _end_batch(report, commit)
+
+    return report
+
+def _get_template_attr_ids(column, resource_ids, type_cache):
+    """
+        Get the IDs of the attributes defined by each resource's types,
+        including those inherited from a parent template.
+    """
+    template_attr_ids = defaultdict(set)
+    for chunk in _chunks(resource_ids):
+        for rt in db.DBSession.query(ResourceType).filter(
+                getattr(ResourceType, column).in_(chunk)):
+            key = (rt.type_id, rt.child_template_id)
+            if key not in type_cache:
+                type_cache[key] = set(ta.attr_id for ta in rt.get_templatetype().typeattrs)
+            template_attr_ids[getattr(rt, column)].update(type_cache[key])
+    return template_attr_ids
+
+def find_duplicate_resource_attributes(column, network_id=None, inputs_only=False):
+    """
+        Find the resources which have more than one attribute with the same
+        name (but a different dimension).
+        args:
+            column (str): The resource attribute column of the resource type:
+                          node_id, link_id, group_id or network_id
+            network_id (int): Only look in this network
+            inputs_only (bool): Only consider resource attributes which are
+                                not variables
+        returns:
+            A list of (resource ID, attribute name), ordered by resource ID
+    """
+    ref_column = getattr(ResourceAttr, column)
+    qry = db.DBSession.query(ref_column.label('resource_id'), Attr.name).join(
+        Attr, Attr.id == ResourceAttr.attr_id).filter(ref_column != None)
+
+    if network_id is not None:
+        if column == 'network_id':
+            qry = qry.filter(ref_column == network_id)
+        else:
+            resource = _NETWORK_RESOURCES[column]
+            qry = qry.join(resource, resource.id == ref_column).filter(
+                resource.network_id == network_id)
+
+    if inputs_only is True:
+        qry = qry.filter(ResourceAttr.attr_is_var == 'N')
+
+    return [(r.resource_id, r.name) for r in qry.group_by(ref_column, Attr.name).having(
+        func.count(ResourceAttr.id) > 1).order_by(ref_column, Attr.name)]
+
+def _plan_resource_attr_dedup(column, keys, inputs_only, type_cache):
+    """
+        Decide which of each set of resource attributes with the same name on
+        the same resource are deleted, and which resource attribute, if any,
+        each one's data is moved onto.
+
+        The resource attributes whose attribute is defined in one of the
+        resource's types are kept, and the others are deleted, with their data
+        moved to the kept one. If none are defined in a type, those with no
+        data are deleted and those with data are left alone.
+    """
+    resource_ids = sorted(set(k[0] for k in keys))
+    wanted = set(keys)
+
+    groups = defaultdict(dict)
+    ref_column = getattr(ResourceAttr, column)
+    for chunk in _chunks(resource_ids):
+        qry = db.DBSession.query(ResourceAttr.id, ResourceAttr.attr_id,
+                                 ref_column.label('resource_id'), Attr.name).join(
+            Attr, Attr.id == ResourceAttr.attr_id).filter(ref_column.in_(chunk))
+        if inputs_only is True:
+            qry = qry.filter(ResourceAttr.attr_is_var == 'N')
+        for ra in qry:
+            if (ra.resource_id, ra.name) in wanted:
+                groups[(ra.resource_id, ra.name)][ra.id] = ra.attr_id
+
+    template_attr_ids = _get_template_attr_ids(column, resource_ids, type_cache)
+
+    all_ra_ids = [ra_id for members in groups.values() for ra_id in members]
+    ra_ids_with_data = set()
+    for chunk in _chunks(all_ra_ids):
+        ra_ids_with_data.update(r.resource_attr_id for r in db.DBSession.query(
+            ResourceScenario.resource_attr_id).filter(
+            ResourceScenario.resource_attr_id.in_(chunk)).distinct())
+
+    ra_map = {}
+    for (resource_id, name), members in groups.items():
+        type_attr_ids = template_attr_ids.get(resource_id, set())
+        keepers = sorted(ra_id for ra_id, attr_id in members.items() if attr_id in type_attr_ids)
+        if len(keepers) == 0:
+            for ra_id in members:
+                if ra_id in ra_ids_with_data:
+                    log.info("A duplicate of %s found on %s %s. Not deleting as it has data.",
+                             name, column, resource_id)
+                else:
+                    ra_map[ra_id] = None
+            continue
+        for ra_id, attr_id in members.items():
+            if attr_id not in type_attr_ids:
+                ra_map[ra_id] = keepers[0]
+
+    return ra_map
+
+def merge_duplicate_resource_attributes(network_id=None, inputs_only=False,
+                                        batch_size=DEDUP_BATCH_SIZE, dry_run=False,
+                                        commit=False, max_batches=None):
+    """
+        Remove resource attributes which have the same name as another on the
+        same resource, in batches of resources. See _plan_resource_attr_dedup
+        for which are removed.
+        args:
+            network_id (int): Only look in this network
+            inputs_only (bool): Only consider resource attributes which are not
+                                variables
+            batch_size (int): The number of duplicated names to handle in each batch
+            dry_run (bool): If True, change nothing, only report what would change
+            commit (bool): If True, commit after each batch, so that if the run
+                           is stopped, the batches done so far are kept. Running
+                           it again carries on with the duplicates which remain.
+            max_batches (int): Stop after this many batches
+        returns:
+            A report of the duplicates found and what was (or would be) changed.
+    """
+    batch_size = max(1, min(batch_size, DEDUP_BATCH_SIZE))
+    report = new_report(dry_run)
+    type_cache = {}
+
+    db.DBSession.flush()
+
+    for column in ('network_id', 'node_id', 'link_id', 'group_id'):
+        keys = find_duplicate_resource_attributes(column, network_id=network_id,
+                                                  inputs_only=inputs_only)
+        for idx in range(0, len(keys), batch_size):
+            if max_batches is not None and report.batches >= max_batches:
+                return report
+
+            ra_map = _plan_resource_attr_dedup(column, keys[idx:idx+batch_size],
+                                               inputs_only, type_cache)
+            report.duplicates.extend(JSONObject({'resource_attr_id': ra_id, 'keeper_id': keeper_id})
+                                     for ra_id, keeper_id in sorted(ra_map.items()))
+
+            network_ids = set()
+            if dry_run is False:
+                network_ids = _get_affected_network_ids(ResourceAttr.id, ra_map)
+
+            delete_resource_attributes(ra_map, report)
+
+            if dry_run is False:
+                db.DBSession.expire_all()
+                for changed_network_id in network_ids:
+                    clear_network_resource_attributes_cache(changed_network_id)
+            _end_batch(report, commit)
+
+    return report
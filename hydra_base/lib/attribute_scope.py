@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# (c) Copyright 2013 to 2017 University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    An index of which attribute a name and dimension resolve to from within a
+    project or network.
+
+    Attributes are either global, or scoped to a project or a network. An
+    attribute scoped to a project is visible to all the projects and networks
+    beneath it, and an attribute scoped lower down takes precedence over one
+    with the same name and dimension scoped higher up.
+
+    The attributes of each scope, and the merged index for each project and
+    network (the global attributes, then each project from the root down, then
+    the network), are held in the cache. Each is stored with a signature made
+    of a version token and the highest attribute ID, so that new attributes
+    are noticed even if they were not added through the attributes library.
+    The token is changed when a transaction which updated, deleted or rescoped
+    attributes or moved projects or networks ends, whether it was committed or
+    rolled back. Until then, that session builds its indexes without caching
+    them, so they never hold uncommitted changes. Recently used indexes are
+    also kept in memory, so a lookup does not need to unpickle them again.
+"""
+import uuid
+from collections import OrderedDict
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from .. import db
+from ..db.model import Attr, Project, Network
+from ..exceptions import HydraError, ResourceNotFoundError
+from .cache import cache
+from .data import qry_in_threshold
+
+import logging
+log = logging.getLogger(__name__)
+
+ATTR_SCOPE_CACHE_KEY = 'attr_scope'
+ATTR_SCOPE_VERSION_KEY = 'attr_scope_version'
+#Set in a session's info when it has changed attribute scoping
+ATTR_SCOPE_PENDING_KEY = 'attr_scope_pending'
+
+#The number of indexes to keep in memory
+LOCAL_CACHE_SIZE = 128
+
+_local_cache = OrderedDict()
+
+def new_attr_scope_version():
+    """
+        Invalidate all the attribute scope indexes once the current transaction
+        ends. Call this whenever an attribute is added, updated, deleted or
+        rescoped, or a project or a network is moved to another project.
+    """
+    db.DBSession().info[ATTR_SCOPE_PENDING_KEY] = True
+
+def _renew_version():
+    cache.set(ATTR_SCOPE_VERSION_KEY, uuid.uuid4().hex)
+
+@event.listens_for(Session, 'after_transaction_end')
+def _renew_version_after_transaction(session, transaction):
+    """
+        Invalidate the indexes after a transaction which changed attribute
+        scoping is committed or rolled back. Indexes built while it was
+        open were not cached, so none can be stored under the new version.
+    """
+    if transaction.parent is None and session.info.pop(ATTR_SCOPE_PENDING_KEY, False):
+        _renew_version()
+
+def _get_signature():
+    version = cache.get(ATTR_SCOPE_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(ATTR_SCOPE_VERSION_KEY, version)
+    max_attr_id = db.DBSession.query(func.max(Attr.id)).scalar()
+    return (version, max_attr_id)
+
+def _cached(key, signature, build):
+    """
+        Get a value from the in-memory cache or the shared cache if it was
+        stored with the current signature, otherwise build and store it.
+        If the session has uncommitted changes to attribute scoping, the
+        value is built from them and not cached.
+    """
+    if db.DBSession().info.get(ATTR_SCOPE_PENDING_KEY, False):
+        return build()
+
+    cached = _local_cache.get(key)
+    if cached is not None and cached[0] == signature:
+        _local_cache.move_to_end(key)
+        return cached[1]
+
+    cached = cache.get(f"{ATTR_SCOPE_CACHE_KEY}_{key}")
+    if cached is not None and cached.get('signature') == signature:
+        value = cached['value']
+    else:
+        value = build()
+        cache.set(f"{ATTR_SCOPE_CACHE_KEY}_{key}", {'signature': signature, 'value': value}, 60*60)
+
+    _local_cache[key] = (signature, value)
+    _local_cache.move_to_end(key)
+    while len(_local_cache) > LOCAL_CACHE_SIZE:
+        _local_cache.popitem(last=False)
+
+    return value
+
+def _get_scope_attrs(signature, network_id=None, project_id=None):
+    """
+        Get the attributes scoped directly to a network, a project, or globally
+        if neither is specified.
+        returns:
+            A dict keyed on (lower case name, dimension_id) of (attr_id, name)
+    """
+    if network_id is not None:
+        key = f"scope_network_{network_id}"
+        scope_filter = (Attr.network_id == network_id,)
+    elif project_id is not None:
+        key = f"scope_project_{project_id}"
+        scope_filter = (Attr.project_id == project_id,)
+    else:
+        key = "scope_global"
+        scope_filter = (Attr.network_id == None, Attr.project_id == None)
+
+    def build():
+        attrs = {}
+        for attr_id, name, dimension_id in db.DBSession.query(
+                Attr.id, Attr.name, Attr.dimension_id).filter(*scope_filter).order_by(Attr.id):
+            attrs.setdefault((name.lower(), dimension_id), (attr_id, name))
+        return attrs
+
+    return _cached(key, signature, build)
+
+def _get_project_lineage(project_id):
+    """
+        Get the IDs of a project and all the projects above it, from the root down.
+    """
+    lineage = []
+    while project_id is not None:
+        if project_id in lineage:
+            raise HydraError(f"Project {project_id} is its own ancestor")
+        project = db.DBSession.query(Project.id, Project.parent_id).filter(
+            Project.id == project_id).first()
+        if project is None:
+            raise ResourceNotFoundError("Project %s not found"%(project_id))
+        lineage.append(project.id)
+        project_id = project.parent_id
+    return lineage[::-1]
+
+def _build_index(signature, network_id=None, project_id=None):
+    if network_id is not None:
+        network = db.DBSession.query(Network.project_id).filter(Network.id == network_id).first()
+        if network is None:
+            raise ResourceNotFoundError("Network %s not found"%(network_id))
+        project_id = network.project_id
+
+    project_ids = _get_project_lineage(project_id)
+
+    #Each scope is merged over the ones above it, recording how far down the
+    #hierarchy each attribute is scoped. 0 is global.
+    scopes = [_get_scope_attrs(signature)]
+    scopes.extend(_get_scope_attrs(signature, project_id=pid) for pid in project_ids)
+    if network_id is not None:
+        scopes.append(_get_scope_attrs(signature, network_id=network_id))
+
+    attrs = {}
+    for level, scope_attrs in enumerate(scopes):
+        for key, (attr_id, name) in scope_attrs.items():
+            attrs[key] = (attr_id, name, level)
+
+    return {'project_ids': project_ids, 'attrs': attrs}
+
+def get_attribute_scope_index(network_id=None, project_id=None):
+    """
+        Get the attributes visible from a network or a project, or only the
+        global attributes if neither is specified. If both are specified, the
+        network is used.
+        returns:
+            A dict with:
+                project_ids: The IDs of the projects in the hierarchy above the
+                             network or project, from the root down.
+                attrs: A dict keyed on (lower case name, dimension_id) of
+                       (attr_id, name, level), where level is 0 for a global
+                       attribute and increases down the hierarchy.
+    """
+    signature = _get_signature()
+    if network_id is not None:
+        key = f"index_network_{network_id}"
+    elif project_id is not None:
+        key = f"index_project_{project_id}"
+    else:
+        key = "index_global"
+    return _cached(key, signature,
+                   lambda: _build_index(signature, network_id=network_id, project_id=project_id))
+
+def get_project_lineage(network_id=None, project_id=None):
+    """
+        Get the IDs of the projects above a network or project, from the root
+        down, from the attribute scope index.
+    """
+    return get_attribute_scope_index(network_id=network_id, project_id=project_id)['project_ids']
+
+def _entry_scope(index, level, network_id=None):
+    """
+        Get the (project_id, network_id) which an attribute in a merged index
+        entry at a given level is scoped to.
+    """
+    if level == 0:
+        return (None, None)
+    if level <= len(index['project_ids']):
+        return (index['project_ids'][level-1], None)
+    return (None, network_id)
+
+def _is_current(attr_i, name, dimension_id, scope):
+    """
+        Check an attribute is still the one an index entry says it is,
+        including the scope it was indexed under.
+    """
+    return attr_i is not None\
+            and attr_i.name.lower() == name.lower()\
+            and attr_i.dimension_id == dimension_id\
+            and (attr_i.project_id, attr_i.network_id) == scope
+
+def _index_out_of_date():
+    log.info("Attribute scope index is out of date. Rebuilding.")
+    _local_cache.clear()
+    _renew_version()
+
+def resolve_attribute(name, dimension_id=None, network_id=None, project_id=None,
+                      include_global=True):
+    """
+        Get the attribute which a name and dimension resolve to from a network
+        or project, which is the one scoped lowest in its hierarchy.
+        The name is matched case-insensitively.
+        args:
+            include_global (bool): If False, only return attributes scoped to
+                                   the network or a project above it.
+        returns:
+            The Attr, or None if there isn't one.
+    """
+    for _ in range(2):
+        index = get_attribute_scope_index(network_id=network_id, project_id=project_id)
+        entry = index['attrs'].get((name.lower(), dimension_id))
+        if entry is None or (include_global is False and entry[2] == 0):
+            return None
+        attr_i = db.DBSession.query(Attr).filter(Attr.id == entry[0]).first()
+        if _is_current(attr_i, name, dimension_id,
+                       _entry_scope(index, entry[2], network_id=network_id)):
+            return attr_i
+        _index_out_of_date()
+    return None
+
+def resolve_attributes(keys, network_id=None, project_id=None):
+    """
+        Resolve many (lower case name, dimension_id) pairs at once, for adding
+        attributes in bulk. Attributes scoped to the project's hierarchy are
+        resolved first, then those scoped to the network's hierarchy are laid
+        over them, except for projects the two hierarchies share.
+        returns:
+            A dict keyed on (lower case name, dimension_id) of Attr, containing
+            only the keys which resolved to an attribute.
+    """
+    keys = set(keys)
+    for attempt in range(2):
+        #key -> (attr_id, (project_id, network_id))
+        entries = {}
+        shared_project_ids = set()
+        if project_id is not None:
+            index = get_attribute_scope_index(project_id=project_id)
+            shared_project_ids = set(index['project_ids'])
+        else:
+            index = get_attribute_scope_index()
+        for key, (attr_id, _, level) in index['attrs'].items():
+            if key in keys:
+                entries[key] = (attr_id, _entry_scope(index, level))
+
+        if network_id is not None:
+            index = get_attribute_scope_index(network_id=network_id)
+            for key, (attr_id, _, level) in index['attrs'].items():
+                if key not in keys or level == 0:
+                    continue
+                scope = _entry_scope(index, level, network_id=network_id)
+                if scope[0] in shared_project_ids:
+                    continue
+                entries[key] = (attr_id, scope)
+
+        attr_ids = [entry[0] for entry in entries.values()]
+        attrs_i = {}
+        for lower in range(0, len(attr_ids), qry_in_threshold):
+            for attr_i in db.DBSession.query(Attr).filter(
+                    Attr.id.in_(attr_ids[lower:lower+qry_in_threshold])):
+                attrs_i[attr_i.id] = attr_i
+
+        resolved = {}
+        for key, (attr_id, scope) in entries.items():
+            attr_i = attrs_i.get(attr_id)
+            if _is_current(attr_i, key[0], key[1], scope):
+                resolved[key] = attr_i
+            elif attempt == 0:
+                break
+        else:
+            return resolved
+        _index_out_of_date()
+
+    return resolved
@@ -23,8 +23,10 @@ import logging
 
 from collections import defaultdict
 
+import numpy as np
+
 from sqlalchemy import or_, and_, func, tuple_
-from sqlalchemy.orm import aliased, joinedload
+from sqlalchemy.orm import aliased
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.exc import IntegrityError
 from ..db.model import Attr,\
@@ -54,8 +56,12 @@ from ..exceptions import HydraError, ResourceNotFoundError
 from ..util.permissions import required_perms, required_role
 
 from . import units
+from . import attribute_scope
+from . import attribute_dedup
+from .data import qry_in_threshold
+from .resource_attribute_cache import REF_KEYS, REF_COLUMNS, get_network_resource_attributes,\
+        clear_network_resource_attributes_cache
 from .objects import JSONObject
-from .cache import cache
 
 log = logging.getLogger(__name__)
 
@@ -178,6 +184,36 @@ def get_attribute_by_name_and_dimension(name, dimension_id=None, network_id=None
     except NoResultFound:
         return None
 
+@required_perms('get_network')
+def resolve_attribute(name, dimension_id=None, network_id=None, project_id=None, **kwargs):
+    """
+        Get the attribute which a name and dimension resolve to from within a
+        network or project: the one scoped lowest in its project hierarchy, or
+        the global one if there is no scoped one.
+        args:
+            name (str): The name of the attribute, compared case-insensitively
+            dimension_id (int): the ID of the dimension of the attribute
+            network_id (int): The network to look from
+            project_id (int): The project to look from, if no network is specified
+        returns:
+            JSONObject of the attribute, or None if there is none.
+    """
+    user_id = kwargs.get('user_id')
+
+    if network_id is not None:
+        _get_network(network_id).check_read_permission(user_id)
+    elif project_id is not None:
+        _get_project(project_id).check_read_permission(user_id)
+
+    attr_i = attribute_scope.resolve_attribute(name.strip(),
+                                               dimension_id,
+                                               network_id=network_id,
+                                               project_id=project_id)
+    if attr_i is None:
+        return None
+
+    return JSONObject(attr_i)
+
 def search_attributes(name, network_id=None, project_id=None, **kwargs):
     """
         Search for all attributes matching the given name, ignoring case
@@ -185,53 +221,85 @@ def search_attributes(name, network_id=None, project_id=None, **kwargs):
     user_id = kwargs.get('user_id')
     name = name.lower()
     try:
-        proj_attrs_i = []
+        #The scoped attributes matching the name, keyed on name. Lower scopes are
+        #added last so they supercede higher ones.
+        scoped_attrs = {}
         if project_id is not None:
             proj_i = db.DBSession.query(Project).filter(Project.id==project_id).one()
             proj_i.check_read_permission(user_id)
 
-            proj_attrs_i = proj_i.get_scoped_attributes(name_match=name, include_hierarchy=True)
-        attrs_dict = {a.name:a for a in proj_attrs_i}
+            project_index = attribute_scope.get_attribute_scope_index(project_id=project_id)
+            _add_matching_scoped_attrs(scoped_attrs, project_index['attrs'], name)
 
         #Then get network-scoped attributes in case there are any scoped to the proejct
         #which supercede the project attributes
-        net_attrs_i = []
         if network_id is not None:
             net_i = db.DBSession.query(Network).filter(Network.id==network_id).one()
             net_i.check_read_permission(user_id)
-            include_network_hierarchy=True
-            if project_id is not None:
-                include_network_hierarchy=False
-            net_attrs_i = net_i.get_scoped_attributes(name_match=name, include_hierarchy=include_network_hierarchy)
 
-        for na in net_attrs_i:
-            attrs_dict[na.name] = na
+            network_index = attribute_scope.get_attribute_scope_index(network_id=network_id)
+            network_attrs = network_index['attrs']
+            if project_id is not None:
+                #The project hierarchy has already been searched, so only
+                #look at the attributes scoped to the network itself.
+                network_level = len(network_index['project_ids']) + 1
+                network_attrs = {key: entry for key, entry in network_attrs.items()
+                                 if entry[2] == network_level}
+            _add_matching_scoped_attrs(scoped_attrs, network_attrs, name)
 
         #Finally add in all the global attributes which do not have the same
         #name as the scoped attributes. WHy? Becuase we assume that within scoping,
         #names must be unique --- you can't have a 'cost' at different dimensions within a scope,
         #so if there is a 'cost' which is scoped, then all 'cost' (regardless of dimension) can be ignored.
-        global_attrs_i = db.DBSession.query(Attr).filter(
-            func.lower(Attr.name).like(f'%{name}%'),
-            Attr.network_id==None,
-            Attr.project_id==None).all()
-
-        for a in global_attrs_i:
-            if a.name not in attrs_dict:
-                attrs_dict[a.name] = JSONObject(a)
+        global_attr_ids = []
+        global_index = attribute_scope.get_attribute_scope_index()
+        for (lower_name, _), (attr_id, attr_name, _) in global_index['attrs'].items():
+            if name in lower_name and attr_name not in scoped_attrs:
+                global_attr_ids.append(attr_id)
+
+        attr_ids = [entry[0] for entry in scoped_attrs.values()] + global_attr_ids
+        attrs_i = {}
+        for lower in range(0, len(attr_ids), qry_in_threshold):
+            for attr_i in db.DBSession.query(Attr).filter(
+                    Attr.id.in_(attr_ids[lower:lower+qry_in_threshold])):
+                attrs_i[attr_i.id] = attr_i
+
+        project_names = dict(db.DBSession.query(Project.id, Project.name).filter(
+            Project.id.in_(set(a.project_id for a in attrs_i.values() if a.project_id is not None))))
+
+        dimension_ids = set(a.dimension_id for a in attrs_i.values() if a.dimension_id is not None)
+        dimensions = {}
+        if len(dimension_ids) > 0:
+            dimensions = {d.id: JSONObject(d) for d in db.DBSession.query(Dimension).filter(
+                Dimension.id.in_(dimension_ids))}
 
         return_attrs = []
         #now load the dimension for each attribute.
-        for a_j in attrs_dict.values():
+        for attr_id in attr_ids:
+            if attr_id not in attrs_i:
+                continue
+            a_j = JSONObject(attrs_i[attr_id])
+            if a_j.project_id is not None:
+                #This is for convenience to avoid having to do extra calls to get the project name
+                a_j.project_name = project_names.get(a_j.project_id)
             if a_j.dimension_id is not None:
-                dimension_i = db.DBSession.query(Dimension).filter(Dimension.id==a_j.dimension_id).one()
-                a_j.dimension = JSONObject(dimension_i)
+                a_j.dimension = dimensions[a_j.dimension_id]
             return_attrs.append(a_j)
         log.debug("%s attributes matching %s", len(return_attrs), name)
         return return_attrs
     except NoResultFound:
         return None
 
+def _add_matching_scoped_attrs(scoped_attrs, index_attrs, name):
+    """
+        Add the entries in an attribute scope index which are not global and
+        whose names contain a search term to a dict keyed on attribute name,
+        so that the lowest scoped attribute with each name is kept.
+    """
+    matching = [entry for (lower_name, _), entry in index_attrs.items()
+                if entry[2] > 0 and name in lower_name]
+    for entry in sorted(matching, key=lambda e: e[2]):
+        scoped_attrs[entry[1]] = entry
 
 def _add_attribute(attr, user_id, flush=True, do_reassign=False):
     """
@@ -297,6 +365,9 @@ def _add_attribute(attr, user_id, flush=True, do_reassign=False):
         if flush is True:
             db.DBSession.flush()
 
+    if flush is True:
+        attribute_scope.new_attr_scope_version()
+
     # Return ORM object if not flushed (to get ID after batch flush)
     # Return JSONObject if already flushed
     if flush is False:
@@ -460,39 +531,37 @@ def add_attribute(attr, check_existing=True, **kwargs):
         attr_i = _add_attribute(attr, user_id=user_id)
         return attr_i
 
-    try:
-        attr_qry = db.DBSession.query(Attr).filter(func.lower(Attr.name) == attr.name.lower(),
-                                                   Attr.dimension_id == attr.dimension_id)
-
-        # We only need these 2 clauses, as the network ID is the lowest possible level
-        # so there is no need for a clause checking for the project id additionally,
-        # as the project ID must be the parent of the network ID, so it is redundant
-        # to check explicitly
-        if attr.network_id is not None and attr.project_id is None:
-            # don't just check for attributes scoped to this network but to attributes
-            # scoped to it and all parent projects
-            network_project_ids = _get_projects_referenced_by_network_id(
-                attr.network_id, **kwargs)
-
-            attr_qry = attr_qry.filter(or_(Attr.network_id == attr.network_id,
-                                           Attr.project_id.in_(network_project_ids)
-                                          ))
-        elif attr.project_id is not None:
-            # don't just check for attributes scoped to this project, but to all
-            # projects in its hierarchy
-            project_project_ids = _get_projects_referenced_by_project_id(
-                attr.project_id, **kwargs)
-
-            attr_qry = attr_qry.filter(Attr.project_id.in_(project_project_ids))
-
-
-        attr_i = attr_qry.one()
-
+    # We only need these 2 cases, as the network ID is the lowest possible level
+    # so there is no need for a case checking for the project id additionally,
+    # as the project ID must be the parent of the network ID, so it is redundant
+    # to check explicitly
+    if attr.network_id is not None and attr.project_id is None:
+        # don't just check for attributes scoped to this network but to attributes
+        # scoped to it and all parent projects
+        _get_project(_get_network(attr.network_id).project_id).check_read_permission(user_id)
+        attr_i = attribute_scope.resolve_attribute(attr.name, attr.dimension_id,
+                                                   network_id=attr.network_id,
+                                                   include_global=False)
+    elif attr.project_id is not None:
+        # don't just check for attributes scoped to this project, but to all
+        # projects in its hierarchy
+        _get_project(attr.project_id).check_read_permission(user_id)
+        attr_i = attribute_scope.resolve_attribute(attr.name, attr.dimension_id,
+                                                   project_id=attr.project_id,
+                                                   include_global=False)
+    else:
+        try:
+            attr_i = db.DBSession.query(Attr).filter(
+                func.lower(Attr.name) == attr.name.lower(),
+                Attr.dimension_id == attr.dimension_id).one()
+        except NoResultFound:
+            attr_i = None
+
+    if attr_i is not None:
         attr_i = JSONObject(attr_i)
 
         log.info("Attr already exists")
-
-    except NoResultFound:
+    else:
         #set the user ID to 2 here, as this requires admin priviliges. THis is
         #safe to do because this function has already been checked for add_attribute
         #permission from the caller
@@ -547,6 +616,7 @@ def update_attribute(attr, **kwargs):
     attr_i.project_id = attr.project_id
 
     db.DBSession.flush()
+    attribute_scope.new_attr_scope_version()
     return JSONObject(attr_i)
 
 
@@ -555,6 +625,7 @@ def delete_attribute(attr_id, **kwargs):
         attribute = db.DBSession.query(Attr).filter(Attr.id == attr_id).one()
         db.DBSession.delete(attribute)
         db.DBSession.flush()
+        attribute_scope.new_attr_scope_version()
         return True
     except NoResultFound:
         raise ResourceNotFoundError("Attribute (attribute id=%s) does not exist"%(attr_id))
@@ -571,18 +642,11 @@ def _get_projects_referenced_by_network_id(network_id, **kwargs):
     #projects in which the networks reside
     project_id_rs = db.DBSession.query(Network.project_id).filter(
         Network.id==network_id).one()
-    project_id = project_id_rs.project_id
 
-    network_project_ids = []
-    #imported here to avoid a circular import
-    from . import project as projectlib
-    #we can't just get the project ID. we need to get the whole hierarchy.
-    hier = projectlib.get_project_hierarchy(project_id, **kwargs)
-    for p in reversed(hier):
-        if p.id not in network_project_ids:
-            network_project_ids.append(p.id)
+    _get_project(project_id_rs.project_id).check_read_permission(kwargs.get('user_id'))
 
-    return network_project_ids
+    #we can't just get the project ID. we need to get the whole hierarchy.
+    return list(attribute_scope.get_project_lineage(network_id=network_id))
 
 def _get_projects_referenced_by_project_id(project_id, **kwargs):
     """
@@ -590,19 +654,30 @@ def _get_projects_referenced_by_project_id(project_id, **kwargs):
         This is used to determine whether there are attributes defined at the project
         level, when trying to add an attribute at the network level.
     """
-    #projects in which the networks reside
+    _get_project(project_id).check_read_permission(kwargs.get('user_id'))
 
-    #imported here to avoid a circular import
-    from . import project as projectlib
     #we can't just get the project ID. we need to get the whole hierarchy.
-    parent_project_ids = []
-    hier = projectlib.get_project_hierarchy(project_id, **kwargs)
-    for p in reversed(hier):
-        if p.id not in parent_project_ids:
-            parent_project_ids.append(p.id)
+    return list(attribute_scope.get_project_lineage(project_id=project_id))
 
-    return parent_project_ids
 
+def _get_attrs_by_name_and_scope(lower_names, project_ids, network_ids):
+    """
+        Get the attributes whose lower case name is in lower_names, which are
+        global or scoped directly to one of the projects or networks.
+    """
+    scope_filter = [and_(Attr.network_id == None, Attr.project_id == None)]
+    if len(project_ids) > 0:
+        scope_filter.append(Attr.project_id.in_(project_ids))
+    if len(network_ids) > 0:
+        scope_filter.append(Attr.network_id.in_(network_ids))
+
+    attrs_i = []
+    for idx in range(0, len(lower_names), qry_in_threshold):
+        attrs_i.extend(db.DBSession.query(Attr).filter(
+            func.lower(Attr.name).in_(lower_names[idx:idx+qry_in_threshold]),
+            or_(*scope_filter)).order_by(Attr.id).all())
+
+    return attrs_i
 
 def add_attributes(attrs, **kwargs):
     """
@@ -621,6 +696,8 @@ def add_attributes(attrs, **kwargs):
     Attributes can only be added to one network / project a a time. Raises a
     Hydra Error if it finds different networks or project IDs in the request.
 
+    All the attributes are resolved together from the attribute scope index,
+    and the new ones are inserted together and read back in one query.
     """
 
     #Check to see if any of the attributs being added are already there.
@@ -629,34 +706,24 @@ def add_attributes(attrs, **kwargs):
     #add a new attribute.
     user_id = kwargs.get('user_id')
 
+    attrs = [a for a in attrs if a is not None]
+
     # Deduplicate to unique lowercase names for an efficient IN filter.
     # Exact (name, dimension_id) matching is done in Python via attr_dict below.
-    unique_lower_names = list({a.name.lower() for a in attrs if a is not None})
+    unique_lower_names = list({a.name.lower() for a in attrs})
 
     if not unique_lower_names:
         return []
 
-    # All global attributes matching incoming names
-    global_attrs = db.DBSession.query(Attr).filter(
-        Attr.network_id == None,
-        Attr.project_id == None,
-        func.lower(Attr.name).in_(unique_lower_names)
-    ).all()
-
-    #project-scoped attributes
-    project_attrs = []
-
     network_ids = list(set([a.network_id for a in filter(lambda x:x.network_id is not None and x.project_id is None, attrs)]))
 
     if len(network_ids) > 1:
         raise HydraError("Cannot bulk add attributes to different networks.")
 
-    #if the attributes are specified with a network ID but not a project ID, then find the
-    #project IDS for those network so we can check if there are
-    #matching attributes scoped to the container projects
-    network_project_ids = []
+    #if the attributes are specified with a network ID but not a project ID, then
+    #check if there are matching attributes scoped to the network's projects too
     if len(network_ids) > 0:
-        network_project_ids = _get_projects_referenced_by_network_id(network_ids[0], **kwargs)
+        _get_projects_referenced_by_network_id(network_ids[0], **kwargs)
 
     #Get all the project IDs specified in the incoming attributes.
     #Attributes can only ne added to one project at a time
@@ -666,82 +733,85 @@ def add_attributes(attrs, **kwargs):
     if len(direct_project_ids) > 1:
         raise HydraError("Cannot bulk add attributes to different projects.")
 
-    project_ids = []
     if len(direct_project_ids) > 0:
-        project_ids = _get_projects_referenced_by_project_id(direct_project_ids[0], **kwargs)
-
-    #go top down, saving the attributes, and overwriting the duplicates as we
-    #go down the tree.
-    all_project_ids = project_ids + network_project_ids
-    project_attr_dict = {}
-    if all_project_ids:
-        project_attrs = db.DBSession.query(Attr).filter(
-            Attr.project_id.in_(all_project_ids),
-            func.lower(Attr.name).in_(unique_lower_names)
-        ).all()
-        # all_project_ids is ordered parent-first (root → leaf); sorting by that
-        # order ensures child entries overwrite parent entries for the same key.
-        project_id_order = {pid: i for i, pid in enumerate(all_project_ids)}
-        for project_attr in sorted(project_attrs, key=lambda a: project_id_order[a.project_id]):
-            project_attr_dict[(project_attr.name, project_attr.dimension_id)] = project_attr
-
-    #network scoped attributes
-    network_attrs = []
-    if len(network_ids) > 0:
-        network_attrs = db.DBSession.query(Attr).filter(
-            Attr.network_id.in_(network_ids),
-            func.lower(Attr.name).in_(unique_lower_names)
-        ).all()
-
-    all_attrs = global_attrs + list(project_attr_dict.values()) + network_attrs
+        _get_projects_referenced_by_project_id(direct_project_ids[0], **kwargs)
 
-    #this iterates from the highest scope to the lowst, thus overwriting higher-level
-    #attributes with lower level ones.
-    attr_dict = {}
-    for attr in all_attrs:
-        attr_dict[(attr.name.lower(), attr.dimension_id)] = JSONObject(attr)
+    #Resolve all the matching attributes in every scope at once from the
+    #attribute scope index, so lower-level attributes take precedence.
+    resolved_attrs = attribute_scope.resolve_attributes(
+        [(a.name.lower(), a.dimension_id) for a in attrs],
+        network_id=network_ids[0] if len(network_ids) > 0 else None,
+        project_id=direct_project_ids[0] if len(direct_project_ids) > 0 else None)
+    attr_dict = {key: JSONObject(attr_i) for key, attr_i in resolved_attrs.items()}
 
-    attrs_to_add = []
     existing_attrs = []
+    #(lower case name, dimension_id, project_id, network_id) -> attribute to add
+    attrs_to_add = {}
     for potential_new_attr in attrs:
-        if potential_new_attr is not None:
-            # If the attrinute is None we cannot manage it
-            log.debug("Adding attribute: %s", potential_new_attr)
-            key = (potential_new_attr.name.lower(), potential_new_attr.dimension_id)
-            if attr_dict.get(key) is not None:
-                existing_attrs.append(attr_dict.get(key))
-            else:
-                attrs_to_add.append(JSONObject(potential_new_attr))
-
-    # Deduplicate to prevent IntegrityError when a caller submits two attrs
-    # with the same (name, dimension_id, scope) in one batch — the deferred
-    # flush means _check_can_add_attribute can't catch in-batch duplicates.
-    seen_new_keys = set()
-    deduped_attrs_to_add = []
-    for attr in attrs_to_add:
-        dedup_key = (attr.name.lower(), attr.dimension_id,
-                     getattr(attr, 'project_id', None),
-                     getattr(attr, 'network_id', None))
-        if dedup_key not in seen_new_keys:
-            seen_new_keys.add(dedup_key)
-            deduped_attrs_to_add.append(attr)
-
-    # Batch insert: collect ORM objects without flushing individually
-    orm_attrs = []
-    for attr in deduped_attrs_to_add:
-        new_attr_i = _add_attribute(attr, flush=False, user_id=user_id)
-        orm_attrs.append(new_attr_i)
-
-    # Single flush for all new attributes instead of per-attribute flushes
-    db.DBSession.flush()
+        log.debug("Adding attribute: %s", potential_new_attr)
+        key = (potential_new_attr.name.lower(), potential_new_attr.dimension_id)
+        if attr_dict.get(key) is not None:
+            existing_attrs.append(attr_dict.get(key))
+            continue
 
-    # Convert ORM objects to JSONObjects AFTER flush so they have IDs assigned
-    new_attrs = [JSONObject(a) for a in orm_attrs]
+        # Deduplicate to prevent IntegrityError when a caller submits two attrs
+        # with the same (name, dimension_id, scope) in one batch
+        new_key = key + (potential_new_attr.project_id, potential_new_attr.network_id)
+        if new_key in attrs_to_add:
+            continue
 
-    # Combine with existing attributes (which are already JSONObjects)
-    new_attrs = new_attrs + existing_attrs
+        if potential_new_attr.network_id is not None and potential_new_attr.project_id is not None:
+            raise HydraError(f"Unable to add attrubute {potential_new_attr.name}. "+
+                             "An attribute cannot have both a project_id and network_id")
+
+        attrs_to_add[new_key] = potential_new_attr
+
+    if len(attrs_to_add) == 0:
+        return existing_attrs
+
+    #users can only add attributes to networks or projects which they own,
+    #and only admins can add global attributes.
+    new_network_ids = set(k[3] for k in attrs_to_add if k[3] is not None)
+    for network_id in new_network_ids:
+        _get_network(network_id).check_write_permission(user_id)
+
+    new_project_ids = set(k[2] for k in attrs_to_add if k[2] is not None)
+    for project_id in new_project_ids:
+        _get_project(project_id).check_write_permission(user_id)
+
+    if any(k[2] is None and k[3] is None for k in attrs_to_add):
+        user = db.DBSession.query(User).filter(User.id == user_id).one()
+        if not user.is_admin():
+            raise PermissionError(f"User {user.username} does not have permission to add a global attribute."+
+                                  "Please specify a network_id or project_id to the attribute.")
 
-    return new_attrs
+    log.info("Adding %s new attributes", len(attrs_to_add))
+    db.bulk_insert_ignore(Attr, [{
+        'name': attr.name,
+        'dimension_id': attr.dimension_id,
+        'description': attr.description,
+        'project_id': attr.project_id,
+        'network_id': attr.network_id,
+    } for attr in attrs_to_add.values()])
+
+    attribute_scope.new_attr_scope_version()
+
+    #Read all the new attributes back at once, matching them on their scope
+    new_attr_dict = {}
+    for attr in _get_attrs_by_name_and_scope(list(set(k[0] for k in attrs_to_add)),
+                                             list(new_project_ids), list(new_network_ids)):
+        new_attr_dict.setdefault(
+            (attr.name.lower(), attr.dimension_id, attr.project_id, attr.network_id), attr)
+
+    new_attrs = []
+    for key in attrs_to_add:
+        new_attr_i = new_attr_dict.get(key)
+        if new_attr_i is None:
+            raise HydraError(f"Unable to add attribute {attrs_to_add[key].name}")
+        new_attrs.append(JSONObject(new_attr_i))
+
+    # Combine with existing attributes (which are already JSONObjects)
+    return new_attrs + existing_attrs
 
 def get_attributes(network_id=None,
                    project_id=None,
@@ -880,7 +950,7 @@ def delete_resource_attribute(resource_attr_id, **kwargs):
     db.DBSession.delete(ra)
     db.DBSession.flush()
     if network is not None:
-        cache.delete(f'network_resource_attributes_{network.id}')
+        clear_network_resource_attributes_cache(network.id)
     return 'OK'
 
 def add_resource_attributes(resource_attributes, **kwargs):
@@ -958,7 +1028,7 @@ def add_resource_attributes(resource_attributes, **kwargs):
         log.info("Inserting %s resource attributes (duplicates will be skipped)", len(rows))
         db.bulk_insert_ignore(ResourceAttr, rows)
         db.DBSession.flush()
-        cache.delete(f'network_resource_attributes_{network_id}')
+        clear_network_resource_attributes_cache(network_id)
 
     #4. Query back IDs for all requested (attr_id, resource_id) combinations
     inserted_ids = {}
@@ -1052,6 +1122,10 @@ def add_resource_attribute(resource_type, resource_id, attr_id, is_var, error_on
     new_ra = resource_i.add_attribute(attr_id, attr_is_var)
     db.DBSession.flush()
 
+    network = new_ra.get_network()
+    if network is not None:
+        clear_network_resource_attributes_cache(network.id)
+
     return new_ra
 
 def add_resource_attrs_from_type(type_id, resource_type, resource_id, **kwargs):
@@ -1089,6 +1163,11 @@ def add_resource_attrs_from_type(type_id, resource_type, resource_id, **kwargs):
 
     db.DBSession.flush()
 
+    if len(new_resource_attrs) > 0:
+        network = new_resource_attrs[0].get_network()
+        if network is not None:
+            clear_network_resource_attributes_cache(network.id)
+
     return new_resource_attrs
 
 def get_all_network_resourceattributes(network_id, template_id=None, return_orm=False, **kwargs):
@@ -1120,62 +1199,74 @@ def get_all_network_resourceattributes(network_id, template_id=None, return_orm=
     net = _get_network(network_id)
     net.check_read_permission(user_id, do_raise=True)
 
-    if cache.get(f'network_resource_attributes_{network_id}') is not None:
-        return cache.get(f'network_resource_attributes_{network_id}')
-
-    network_attrs = db.DBSession.query(ResourceAttr).\
-            join(Attr, ResourceAttr.attr_id == Attr.id).\
-            join(Network, Network.id == ResourceAttr.network_id).\
-            filter(ResourceAttr.network_id != None).\
-            filter(Network.id==network_id).all()
+    template_attr_ids = None
+    if template_id is not None:
+        template_attr_ids = [r.attr_id for r in db.DBSession.query(TypeAttr.attr_id).join(
+            TemplateType,
+            TemplateType.id == TypeAttr.type_id).filter(
+            TemplateType.template_id == template_id)]
 
-    node_attrs = db.DBSession.query(ResourceAttr).\
-            join(Attr, ResourceAttr.attr_id == Attr.id).\
-            join(Node, Node.id == ResourceAttr.node_id).\
-            join(Network, Network.id == Node.network_id).\
-            filter(ResourceAttr.node_id != None).\
-            filter(Network.id==network_id).all()
+    if return_orm is True:
+        return _get_all_network_resourceattributes_orm(network_id, template_attr_ids)
 
-    link_attrs = db.DBSession.query(ResourceAttr).\
-            join(Attr, ResourceAttr.attr_id == Attr.id).\
-            join(Link, Link.id == ResourceAttr.link_id).\
-            join(Network, Network.id == Link.network_id).\
-            filter(ResourceAttr.link_id != None).\
-            filter(Network.id==network_id).all()
+    payload = get_network_resource_attributes(network_id)
 
-    group_attrs = db.DBSession.query(ResourceAttr).\
-            join(Attr, ResourceAttr.attr_id == Attr.id).\
-            join(ResourceGroup, ResourceGroup.id == ResourceAttr.group_id).\
-            join(Network, Network.id == ResourceGroup.network_id).\
-            filter(ResourceAttr.group_id != None).\
-            filter(Network.id==network_id).all()
+    positions = range(len(payload['ids']))
+    if template_attr_ids is not None:
+        positions = np.flatnonzero(np.isin(payload['attr_ids'], template_attr_ids)).tolist()
 
-    resource_attrs = network_attrs + node_attrs + link_attrs + group_attrs
+    ids = payload['ids'].tolist()
+    attr_ids = payload['attr_ids'].tolist()
+    ref_keys = payload['ref_keys'].tolist()
+    ref_ids = payload['ref_ids'].tolist()
+    is_var = payload['is_var'].tolist()
+    attrs = payload['attrs']
 
-    if template_id is not None:
-        attr_ids = []
-        rs = db.DBSession.query(TypeAttr).join(
-            TemplateType,
-            TemplateType.id == TypeAttr.type_id).filter(
-            TemplateType.template_id == template_id).all()
+    network_attributes = []
+    for i in positions:
+        ref_key = REF_KEYS[ref_keys[i]]
+        ra = {
+            'id': ids[i],
+            'attr_id': attr_ids[i],
+            'ref_key': ref_key,
+            'network_id': None,
+            'project_id': None,
+            'node_id': None,
+            'link_id': None,
+            'group_id': None,
+            'attr_is_var': 'Y' if is_var[i] else 'N',
+            'cr_date': payload['cr_dates'][i],
+        }
+        ra[REF_COLUMNS[ref_key]] = ref_ids[i]
+        #The cached values are already normalised, so they are copied in
+        #directly rather than through the JSONObject constructor.
+        ra_j = JSONObject()
+        ra_j.update(ra)
+        ra_j.attr = JSONObject()
+        ra_j.attr.update(attrs[attr_ids[i]])
+        network_attributes.append(ra_j)
 
-        for r in rs:
-            attr_ids.append(r.attr_id)
+    return network_attributes
 
-        resource_attrs = filter(lambda x: x.attr_id in attr_ids, resource_attrs)
+def _get_all_network_resourceattributes_orm(network_id, template_attr_ids=None):
+    """
+        Get the ResourceAttr objects on a network and all its nodes, links and
+        groups, optionally only those with one of the given attribute IDs.
+    """
+    resource_attrs = db.DBSession.query(ResourceAttr).filter(
+        ResourceAttr.network_id == network_id).all()
 
-    network_attributes = []
-    for ra in resource_attrs:
-        if return_orm is True:
-            network_attributes.append(ra)
-        else:
-            ra_j = JSONObject(ra)
-            ra_j.attr = JSONObject(ra.attr)
-            network_attributes.append(ra_j)
+    for ref_key, resource in (('NODE', Node), ('LINK', Link), ('GROUP', ResourceGroup)):
+        ref_column = getattr(ResourceAttr, REF_COLUMNS[ref_key])
+        resource_attrs.extend(db.DBSession.query(ResourceAttr).join(
+            resource, resource.id == ref_column).filter(
+            resource.network_id == network_id).all())
 
-    cache.set(f'network_resource_attributes_{network_id}', network_attributes, 60*60)
+    if template_attr_ids is not None:
+        template_attr_ids = set(template_attr_ids)
+        resource_attrs = [ra for ra in resource_attrs if ra.attr_id in template_attr_ids]
 
-    return network_attributes
+    return resource_attrs
 
 
 def get_all_network_attributes(network_id, template_id=None, **kwargs):
@@ -1960,7 +2051,8 @@ def delete_attribute_group_items(attributegroupitems, **kwargs):
     return 'OK'
 
 @required_role('admin')
-def delete_all_duplicate_attributes(**kwargs):
+def delete_all_duplicate_attributes(batch_size=attribute_dedup.DEDUP_BATCH_SIZE,
+                                    dry_run=False, commit=False, **kwargs):
     """
         duplicate attributes can appear in the DB when attributes are added
         with a dimension of None (because mysql allows multiple entries
@@ -1970,144 +2062,57 @@ def delete_all_duplicate_attributes(**kwargs):
         to that attribute, before deleting all other duplicate attributes.
 
         steps are:
-            1: Identify all duplicate attributes
-            2: Select one of the duplicates to be the one to keep
-            3: Remap all resource attributes and type attributes to point from
-               duplicate attrs to the keeper.
+            1: Identify all duplicate attributes: those with the same name and
+               dimension in the same scope
+            2: Select the one with the lowest ID to be the one to keep
+            3: Remap all resource attributes, type attributes, attribute group
+               items and attribute mappings to point from duplicate attrs to
+               the keeper.
             4: Delete the duplicates.
-    """
-
-    #step 1: get all attributes and filter out the duplicates
-    all_attributes = db.DBSession.query(Attr).all()
-
-    #a lookup based on name/dimension (The apparent unique identifier for an attribute)
-    attribute_lookup = defaultdict(lambda: [])
-    for attribute in all_attributes:
-        key = (attribute.name, attribute.dimension_id)
-        attribute_lookup[key].append(attribute)
-
-    #Now identify the dupes -- any of the dict's values which has a length > 1
-    duplicate_attributes = filter(lambda x: len(x) > 1, attribute_lookup.values())
-
-    for dupe_list in duplicate_attributes:
-        log.info("Duplicate attributes found: name: %s, dimension: %s",
-                 dupe_list[0].name, dupe_list[0].dimension_id)
-        delete_duplicate_attributes(dupe_list)
-
-    db.DBSession.flush()
 
+        args:
+            batch_size (int): The number of duplicates to handle at a time
+            dry_run (bool): If True, change nothing, only report what would change
+            commit (bool): If True, commit after each batch, so that an
+                           interrupted run can be carried on by calling this again.
+        returns:
+            A report of the duplicates and the number of rows changed
+    """
+    return attribute_dedup.merge_duplicate_attributes(batch_size=batch_size,
+                                                      dry_run=dry_run,
+                                                      commit=commit)
 
 @required_perms('delete_attribute', 'edit_network')
-def delete_duplicate_resourceattributes(network_id=None, **kwargs):
+def delete_duplicate_resourceattributes(network_id=None,
+                                        batch_size=attribute_dedup.DEDUP_BATCH_SIZE,
+                                        dry_run=False, commit=False, **kwargs):
     """
     for every resource, find any situations where there are duplicate attribute
     names, ex 2 max_flows, but where the attribute IDs are different. In this case,
     remove one of them, and keep the one which is used in the template for that node.
-    """
+    Any data on the removed one is moved to the one which is kept, in each
+    scenario where that has none.
+    If none of them is used in the template, delete the ones with no data.
 
-    if network_id is None:
-        #get all the resource attrs in the system -- but limit by only inputs
-        all_ras = db.DBSession.query(ResourceAttr)\
-            .filter(ResourceAttr.attr_is_var == 'N')\
-            .options(joinedload(ResourceAttr.attr)).all()
-    else:
-        all_ras = get_all_network_resourceattributes(network_id, return_orm=True, **kwargs)
-
-    #create a mapping for a node's resource attrs by its ID and the name of the attr
-    ra_lookup = defaultdict(lambda: [])
-    for ra in all_ras:
-        key = (ra.ref_key, ra.get_resource_id(), ra.attr.name)
-        ra_lookup[key].append(ra)
-
-    duplicate_ra_list = filter(lambda x: len(x) > 1, ra_lookup.values())
-
-    #we now have the duplicate resourceattrs. We need to identify which of them
-    #to delete.
-    for duplicate_ras in duplicate_ra_list:
-        #first get the type of the resource
-        resource = duplicate_ras[0].get_resource()
-        #now get all the typeattrs defined for that resource
-        resource_typeattrs = []
-        for rt in resource.types:
-            for ta in rt.get_templatetype().typeattrs:
-                resource_typeattrs.append(ta.attr_id)
-
-        data_to_transfer = {}
-        ras_to_delete = []
-        #now identify the attributes which are not defined in a typeattr, and
-        #mark them for deletion
-        for duplicate_ra in duplicate_ras:
-            if duplicate_ra.attr_id not in resource_typeattrs:
-
-                #we've found  a resource attribute not defined on the type.
-                #Now check if there's data associated to it, and not the other.
-
-                ra_rs = db.DBSession.query(ResourceScenario)\
-                        .filter(ResourceScenario.resource_attr_id == duplicate_ra.id).first()
-
-                #If this is the case, then remap the resource scenario to the RA
-                #we wish to keep.
-                if ra_rs is not None:
-                    data_to_transfer[ra.attr.name] = ra_rs
-
-                ras_to_delete.append(duplicate_ra)
-
-        #None of the dupes are associated to a template, then delete any with
-        #no data. Leave any with data, and let the user deal with them individually
-        if len(ras_to_delete) == len(duplicate_ras):
-            for ra_to_delete in ras_to_delete:
-                ra_rs = db.DBSession.query(ResourceScenario)\
-                        .filter(ResourceScenario.resource_attr_id == ra_to_delete.id).first()
-                if ra_rs is None:
-                    log.info("A duplicate found for %s on %s %s. Deleting as it has no data.",
-                             ra_to_delete.attr.name,
-                             ra_to_delete.ref_key,
-                             resource.name)
-                    db.DBSession.delete(ra_to_delete)
-                else:
-                    log.info("A duplicate found for %s on %s %s. Not deleting as it has data.",
-                             ra_to_delete.attr.name,
-                             ra_to_delete.ref_key,
-                             resource.name)
-
-            #no need to go further, so continue the outer loop
-            continue
-
-        #do a second pass, this time transferring data from the bad resourceattributes
-        #to the keepers
-        for duplicate_ra in duplicate_ras:
-            #focus now on the keepers i.e. the ones defined in the template
-            if duplicate_ra.attr_id in resource_typeattrs:
-                ra_rs = db.DBSession.query(ResourceScenario)\
-                    .filter(ResourceScenario.resource_attr_id == duplicate_ra.id).first()
-
-                dupes_rs = data_to_transfer.get(ra.attr.name)
-                if ra_rs is None:
-                    #if this has no value, see if the dupe has a value and transfer it
-                    if dupes_rs is not None:
-                        log.info("Updating resource scenario with new reference to %s",
-                                 duplicate_ra.attr.name)
-                        newrs = ResourceScenario()
-                        newrs.scenario_id = dupes_rs.scenario_id
-                        newrs.resource_attr_id = duplicate_ra.id
-                        newrs.dataset_id = dupes_rs.dataset_id
-                        db.DBSession.add(newrs)
-                else:
-                    #delete any RS which are not needed
-                    if dupes_rs is not None:
-                        db.DBSession.delete(dupes_rs)
-
-
-        #now finally delete all the dupes
-        for ra_to_delete in ras_to_delete:
+    Without a network_id, all the resources in the system are checked, but only
+    their input (non-variable) attributes.
 
-            log.info("Deleting resource attr %s (id: %s) from %s %s",\
-                     duplicate_ra.attr.name,\
-                     duplicate_ra.id,\
-                     duplicate_ra.ref_key,\
-                     resource.name)
-            db.DBSession.delete(ra_to_delete)
+        args:
+            batch_size (int): The number of duplicates to handle at a time
+            dry_run (bool): If True, change nothing, only report what would change
+            commit (bool): If True, commit after each batch, so that an
+                           interrupted run can be carried on by calling this again.
+        returns:
+            A report of the duplicates and the number of rows changed
+    """
+    if network_id is not None:
+        _get_network(network_id).check_write_permission(kwargs.get('user_id'))
 
+    return attribute_dedup.merge_duplicate_resource_attributes(network_id=network_id,
+                                                               inputs_only=network_id is None,
+                                                               batch_size=batch_size,
+                                                               dry_run=dry_run,
+                                                               commit=commit)
 
 def delete_duplicate_attributes(dupe_list):
     """
@@ -2127,15 +2132,9 @@ def delete_duplicate_attributes(dupe_list):
 
     keeper = dupe_list[0]
 
-    #remove all the rest in the list
-    attrs_to_remove = dupe_list[1:]
-
-    #remap all the attributes from those to delete to the keeper so they can be removed safely
-    for attr_to_remove in attrs_to_remove:
-        remap_attribute_reference(attr_to_remove.id, keeper.id)
-
-        #now that the remapping is done, we can safely delete the old attribute
-        delete_attribute(attr_to_remove.id)
+    #remap all the attributes from the rest to the keeper, and delete them
+    attribute_dedup.merge_attributes(dict((attr.id, keeper.id) for attr in dupe_list[1:]),
+                                     attribute_dedup.new_report(dry_run=False))
 
     db.DBSession.flush()
 
@@ -2146,59 +2145,8 @@ def remap_attribute_reference(old_attr_id, new_attr_id, flush=False):
         Remap everything which references old_attr_id to reference
         new_attr_id
     """
-    #first, remap all the resource attributes
-    ras_to_remap = db.DBSession.query(ResourceAttr)\
-        .filter(ResourceAttr.attr_id == old_attr_id).all()
-
-    deleted_ras = []
-    for ra_to_remap in ras_to_remap:
-        #is there an RA with the new attribute already on the same resource?
-        existing_ra = db.DBSession.query(ResourceAttr)\
-            .filter(ResourceAttr.attr_id == new_attr_id,
-                    ResourceAttr.ref_key == ra_to_remap.ref_key,
-                    ResourceAttr.node_id == ra_to_remap.node_id,
-                    ResourceAttr.link_id == ra_to_remap.link_id,
-                    ResourceAttr.group_id == ra_to_remap.group_id,
-                    ResourceAttr.network_id == ra_to_remap.network_id).first()
-
-        #if so, then it must be deleted so there is only one on the resource.
-        if existing_ra is not None:
-            #if the RA to be deleted is linked with data and the one to keep
-            #is not, then remap the resource scenario.
-            old_ra_rs = db.DBSession.query(ResourceScenario)\
-                .filter(ResourceScenario.resource_attr_id == ra_to_remap.id).first()
-            new_ra_rs = db.DBSession.query(ResourceScenario)\
-                .filter(ResourceScenario.resource_attr_id == existing_ra.id).first()
-
-            if old_ra_rs is not None and new_ra_rs is None:
-                old_ra_rs.resource_attr_id = existing_ra.id
-
-            #mark the RA as deleted so it can be ignored in the remapping
-            #process later
-            deleted_ras.append(ra_to_remap.id)
-            db.DBSession.delete(ra_to_remap)
-
-
-    for ra_to_remap in ras_to_remap:
-        #no need to remap as it's been deleted
-        if ra_to_remap.id in deleted_ras:
-            continue
-        ra_to_remap.attr_id = new_attr_id
-
-    tas_to_remap = db.DBSession.query(TypeAttr)\
-        .filter(TypeAttr.attr_id == old_attr_id).all()
-
-    for ta_to_remap in tas_to_remap:
-        #is there an existing type attr on the type with the same attr?
-        existing_ta = db.DBSession.query(TypeAttr)\
-            .filter(TypeAttr.attr_id == new_attr_id,
-                    TypeAttr.type_id == ta_to_remap.type_id).first()
-
-        #if so, delete it
-        if existing_ta is not None:
-            db.DBSession.delete(ta_to_remap)
-        else:
-            ta_to_remap.attr_id = new_attr_id
+    attribute_dedup.remap_attributes({old_attr_id: new_attr_id},
+                                     attribute_dedup.new_report(dry_run=False))
 
     if flush is True:
         db.DBSession.flush()
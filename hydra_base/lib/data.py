@@ -27,7 +27,7 @@ import pandas as pd
 from collections import namedtuple
 from decimal import Decimal
 
-from sqlalchemy import func, null, and_, or_, distinct
+from sqlalchemy import func, null, and_, or_, distinct, exists
 from sqlalchemy.orm import aliased, make_transient, joinedload
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm.exc import NoResultFound
@@ -587,33 +587,7 @@ def _bulk_insert_data(bulk_data, user_id=None, source=None):
             new_data_for_insert.append(d)
             new_data_hashes.append(d['hash'])
 
-    """
-    Identify datasets whose size exceeds the external storage threshold,
-    add these to external storage rather than the main db, and replace
-    the dataset.value of these with a reference to the external ObjectId.
-    Update the metadata to indicate the storage location.
-    Note that it isn't necessary to update the hashes calculated above,
-    index positions are preserved so these still act as unique identifiers
-    for datasets and metadata.
-    """
-    mongo = MongoStorageAdapter()
-    mongo_config = mongo.get_mongo_config()
-    threshold_sz = mongo_config["threshold"]
-    mongo_location_token = mongo_config["direct_location_token"]
-    loc_key = mongo_config["value_location_key"]
-    mongo_data = {}
-
-    for idx, ds in enumerate(new_data_for_insert):
-        ds_size = len(ds["value"])
-        if ds_size > threshold_sz:
-            mongo_data[idx] = ds["value"]
-            ds_metadata = metadata[ds["hash"]]
-            ds_metadata[loc_key] = mongo_location_token
-
-    if mongo_data:
-        inserted = mongo.bulk_insert_values(list(mongo_data.values()))
-        for idx, key in enumerate(mongo_data):
-            new_data_for_insert[key]["value"] = str(inserted.inserted_ids[idx])  # Replace ds.values with _id ref
+    _store_large_values_externally(new_data_for_insert, metadata)
 
     if len(new_data_for_insert) > 0:
     	#If we're working with mysql, we have to lock the table..
@@ -651,6 +625,38 @@ def _bulk_insert_data(bulk_data, user_id=None, source=None):
 
     return returned_ids
 
+def _store_large_values_externally(datasets, metadata):
+    """
+    Identify datasets whose size exceeds the external storage threshold,
+    add these to external storage rather than the main db, and replace
+    the dataset.value of these with a reference to the external ObjectId.
+    Update the metadata to indicate the storage location.
+    Note that it isn't necessary to update the hashes calculated beforehand,
+    index positions are preserved so these still act as unique identifiers
+    for datasets and metadata.
+
+    datasets: A list of dataset dicts, about to be inserted
+    metadata: A dict of metadata dicts, keyed on dataset hash
+    """
+    mongo = MongoStorageAdapter()
+    mongo_config = mongo.get_mongo_config()
+    threshold_sz = mongo_config["threshold"]
+    mongo_location_token = mongo_config["direct_location_token"]
+    loc_key = mongo_config["value_location_key"]
+    mongo_data = {}
+
+    for idx, ds in enumerate(datasets):
+        ds_size = len(ds["value"])
+        if ds_size > threshold_sz:
+            mongo_data[idx] = ds["value"]
+            ds_metadata = metadata[ds["hash"]]
+            ds_metadata[loc_key] = mongo_location_token
+
+    if mongo_data:
+        inserted = mongo.bulk_insert_values(list(mongo_data.values()))
+        for idx, key in enumerate(mongo_data):
+            datasets[key]["value"] = str(inserted.inserted_ids[idx])  # Replace ds.values with _id ref
+
 def _insert_metadata(metadata_hash_dict, dataset_id_hash_dict):
     if metadata_hash_dict is None or len(metadata_hash_dict) == 0:
         return
@@ -1098,6 +1104,33 @@ def delete_dataset(dataset_id,**kwargs):
     #Remove ORM references to children of this dataset (metadata, collection items)
     db.DBSession.expunge_all()
 
+def _delete_unused_datasets(dataset_ids):
+    """
+        Of the given datasets, delete those which are no longer used by any
+        resource scenario or as the default of a type attribute, along with
+        their metadata, owners and collection items. This uses set-based
+        statements rather than the ORM, so should be called after the resource
+        scenarios being removed have been deleted.
+
+        Returns the IDs of the deleted datasets.
+    """
+    dataset_ids = list(set(dataset_ids))
+
+    unused_ids = []
+    for idx in range(0, len(dataset_ids), qry_in_threshold):
+        unused_ids.extend(d.id for d in db.DBSession.query(Dataset.id).filter(
+            Dataset.id.in_(dataset_ids[idx:idx+qry_in_threshold]),
+            ~exists().where(ResourceScenario.dataset_id == Dataset.id),
+            ~exists().where(TypeAttr.default_dataset_id == Dataset.id)).all())
+
+    for model in (Metadata, DatasetOwner, DatasetCollectionItem):
+        db.bulk_delete(model, model.dataset_id, unused_ids, chunk_size=qry_in_threshold)
+    db.bulk_delete(Dataset, Dataset.id, unused_ids, chunk_size=qry_in_threshold)
+
+    log.info("Deleted %s unused datasets", len(unused_ids))
+
+    return unused_ids
+
 def read_json(json_string):
     pd.read_json(json_string)
 
@@ -18,6 +18,7 @@
 #
 
 import datetime
+from decimal import Decimal
 import time
 import json
 import six
@@ -27,16 +28,21 @@ from ..exceptions import HydraError, ResourceNotFoundError
 from . import scenario, rules
 from . import data
 from . import units
+from . import topology
+from .topology import clear_topology_cache
+from .resource_attribute_cache import clear_network_resource_attributes_cache
+from .attribute_scope import new_attr_scope_version
 from .objects import JSONObject
 
 from ..util.permissions import required_perms
 from hydra_base.lib import template, attributes
 from ..db.model import Project, Network, Scenario, Node, Link, ResourceGroup,\
         ResourceAttr, Attr, ResourceType, ResourceGroupItem, Dataset, Metadata, DatasetOwner,\
-        ResourceScenario, TemplateType, TypeAttr, Template, NetworkOwner, User
+        ResourceScenario, TemplateType, TypeAttr, Template, NetworkOwner, User,\
+        Note, Rule, RuleTypeLink, AttrGroupItem, ResourceAttrMap
 from sqlalchemy.orm import noload, joinedload
 from .. import db
-from sqlalchemy import func, and_, or_, distinct
+from sqlalchemy import func, and_, or_, distinct, select, literal, exists, bindparam
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm import aliased
 from ..util import hdb
@@ -45,6 +51,7 @@ from sqlalchemy import case
 from sqlalchemy.sql import null
 
 from collections import namedtuple
+from contextlib import ExitStack
 
 from hydra_base import config
 
@@ -58,6 +65,9 @@ try:
 except NameError:
     unicode = str
 
+#A lightweight stand-in for a newly inserted row, when only its ID and name
+#are needed, so the row does not have to be loaded back through the ORM.
+_NewRow = namedtuple('NewRow', ['id', 'name'])
 
 def _update_attributes(resource_i, attributes):
     if attributes is None:
@@ -291,6 +301,7 @@ def _bulk_add_resource_attrs(network_id, ref_key, resources, resource_name_map,
     logging.info("Resource attributes from types added in %s",
                  (datetime.datetime.now() - start_time))
 
+    resource_attr_dict = {}
     if len(resource_attrs) > 0:
         all_resource_attrs = []
         for na in resource_attrs.values():
@@ -300,62 +311,24 @@ def _bulk_add_resource_attrs(network_id, ref_key, resources, resource_name_map,
 
 
         if len(all_resource_attrs) > 0:
-            db.DBSession.bulk_insert_mappings(ResourceAttr, all_resource_attrs)
+            #Map the new attributes in the DB to the attributes in the incoming
+            #data so that the resource scenarios know what to refer to.
+            new_ra_ids = db.bulk_insert_returning_ids(ResourceAttr, all_resource_attrs)
             logging.info("ResourceAttr insert took %s secs", str(time.time() - t0))
+            for resource_attr, ra_id in zip(all_resource_attrs, new_ra_ids):
+                key = (_get_resource_id(resource_attr), resource_attr['attr_id'])
+                resource_attr_dict[key] = _NewRow(ra_id, None)
+                if defaults.get(key):
+                    defaults[key]['id'] = ra_id
         else:
             logging.warning("No attributes on any %s....", ref_key.lower())
 
     logging.info("Resource attributes insertion from types done in %s",\
                  (datetime.datetime.now() - start_time))
 
-    #Now that the attributes are in, we need to map the attributes in the DB
-    #to the attributes in the incoming data so that the resource scenarios
-    #know what to refer to.
-    res_qry = db.DBSession.query(ResourceAttr)
-    if ref_key == 'NODE':
-        res_qry = res_qry.join(Node).filter(Node.network_id == network_id)
-    elif ref_key == 'GROUP':
-        res_qry = res_qry.join(ResourceGroup).filter(ResourceGroup.network_id == network_id)
-    elif ref_key == 'LINK':
-        res_qry = res_qry.join(Link).filter(Link.network_id == network_id)
-    elif ref_key == 'NETWORK':
-        res_qry = res_qry.filter(ResourceAttr.network_id == network_id)
-
-    real_resource_attrs = res_qry.all()
-    logging.info("retrieved %s entries in %s",
-                 len(real_resource_attrs), (datetime.datetime.now() - start_time))
-
-    resource_attr_dict = {}
-    for resource_attr in real_resource_attrs:
-        if ref_key == 'NODE':
-            ref_id = resource_attr.node_id
-        elif ref_key == 'GROUP':
-            ref_id = resource_attr.group_id
-        elif ref_key == 'LINK':
-            ref_id = resource_attr.link_id
-        elif ref_key == 'NETWORK':
-            ref_id = resource_attr.network_id
-
-        resource_attr_dict[(ref_id, resource_attr.attr_id)] = resource_attr
-
-        if defaults.get((ref_id, resource_attr.attr_id)):
-            defaults[(ref_id, resource_attr.attr_id)]['id'] = resource_attr.id
-
-    logging.info("Processing Query results took %s",
-                 (datetime.datetime.now() - start_time))
-
-
     resource_attrs = {}
     for resource in resources:
-        iface_resource = resource_name_map[str(resource.name)]
-        if ref_key == 'NODE':
-            ref_id = iface_resource.node_id
-        elif ref_key == 'GROUP':
-            ref_id = iface_resource.group_id
-        elif ref_key == 'LINK':
-            ref_id = iface_resource.link_id
-        elif ref_key == 'NETWORK':
-            ref_id = iface_resource.id
+        ref_id = resource_name_map[str(resource.name)].id
 
         if resource.attributes is not None:
             for ra in resource.attributes:
@@ -367,10 +340,19 @@ def _bulk_add_resource_attrs(network_id, ref_key, resources, resource_name_map,
     return resource_attrs, defaults, template_lookup
 
 def _add_nodes_to_database(net_i, nodes):
+    """
+        Insert the nodes and return a map from the (string) name of each
+        node to its new ID and name.
+    """
     #First add all the nodes
     log.info("Adding nodes to network %s", net_i.id)
     node_list = []
+    node_names = set()
     for node in nodes:
+        #cast node.name as str here as a node name can sometimes be a number
+        if str(node.name) in node_names:
+            raise HydraError("Duplicate Node Name: %s"%(node.name))
+        node_names.add(str(node.name))
         node_dict = {'network_id'   : net_i.id,
                     'name' : node.name,
                      'description': node.description,
@@ -382,11 +364,12 @@ def _add_nodes_to_database(net_i, nodes):
                     }
         node_list.append(node_dict)
     t0 = time.time()
-    if len(node_list):
-        db.DBSession.bulk_insert_mappings(Node, node_list)
-    db.DBSession.flush()
+    new_ids = db.bulk_insert_returning_ids(Node, node_list)
     logging.info("Node insert took %s secs"% str(time.time() - t0))
 
+    return dict((str(n['name']), _NewRow(new_id, n['name']))
+                for n, new_id in zip(node_list, new_ids))
+
 def _add_nodes(net_i, nodes, template_lookup):
 
     #check_perm(user_id, 'edit_topology')
@@ -402,14 +385,7 @@ def _add_nodes(net_i, nodes, template_lookup):
     if nodes is None or len(nodes) == 0:
         return node_id_map, node_attrs, {}
 
-    _add_nodes_to_database(net_i, nodes)
-
-    iface_nodes = dict()
-    for n_i in net_i.nodes:
-        if iface_nodes.get(n_i.name) is not None:
-            raise HydraError("Duplicate Node Name: %s"%(n_i.name))
-
-        iface_nodes[n_i.name] = n_i
+    iface_nodes = _add_nodes_to_database(net_i, nodes)
 
     for node in nodes:
         #cast node.name as str here as a node name can sometimes be a number
@@ -422,6 +398,10 @@ def _add_nodes(net_i, nodes, template_lookup):
     return node_id_map, node_attrs, defaults
 
 def _add_links_to_database(net_i, links, node_id_map):
+    """
+        Insert the links and return a map from the (string) name of each
+        link to its new ID and name.
+    """
     log.info("Adding links to network")
     link_dicts = []
     for link in links:
@@ -438,8 +418,10 @@ def _add_links_to_database(net_i, links, node_id_map):
                            'node_1_id' : node_1.id,
                            'node_2_id' : node_2.id
                           })
-    if len(link_dicts) > 0:
-        db.DBSession.bulk_insert_mappings(Link, link_dicts)
+    new_ids = db.bulk_insert_returning_ids(Link, link_dicts)
+
+    return dict((str(l['name']), _NewRow(new_id, l['name']))
+                for l, new_id in zip(link_dicts, new_ids))
 
 def _add_links(net_i, links, node_id_map, template_lookup):
 
@@ -470,15 +452,9 @@ def _add_links(net_i, links, node_id_map, template_lookup):
 
     #Then add all the links.
 #################################################################
-    _add_links_to_database(net_i, links, node_id_map)
+    iface_links = _add_links_to_database(net_i, links, node_id_map)
 ###################################################################
     log.info("Links added in %s", get_timing(start_time))
-    iface_links = {}
-
-    for l_i in net_i.links:
-        iface_links[str(l_i.name)] = l_i
-
-    log.info("Link Map created %s", get_timing(start_time))
 
     for link in links:
         link_id_map[link.id] = iface_links[str(link.name)]
@@ -503,39 +479,25 @@ def _add_resource_groups(net_i, resourcegroups, template_lookup):
     #Then add all the groups.
     log.info("Adding groups to network")
     group_dicts = []
-    if resourcegroups:
-        for group in resourcegroups:
+    group_names = set()
+    for group in resourcegroups:
+        if str(group.name) in group_names:
+            raise HydraError("Duplicate Resource Group: %s"%(group.name))
+        group_names.add(str(group.name))
 
-            group_dicts.append({'network_id' : net_i.id,
-                           'name' : group.name,
-                           'description' : group.description,
-                          })
-
-    iface_groups = {}
-
-    if len(group_dicts) > 0:
-        db.DBSession.bulk_insert_mappings(ResourceGroup, group_dicts)
-        log.info("Resource Groups added in %s", get_timing(start_time))
+        group_dicts.append({'network_id' : net_i.id,
+                       'name' : group.name,
+                       'description' : group.description,
+                      })
 
-        for g_i in net_i.resourcegroups:
+    new_ids = db.bulk_insert_returning_ids(ResourceGroup, group_dicts)
+    log.info("Resource Groups added in %s", get_timing(start_time))
 
-            if iface_groups.get(g_i.name) is not None:
-                raise HydraError("Duplicate Resource Group: %s"%(g_i.name))
+    iface_groups = dict((str(g['name']), _NewRow(new_id, g['name']))
+                        for g, new_id in zip(group_dicts, new_ids))
 
-            iface_groups[g_i.name] = g_i
-
-        for group in resourcegroups:
-            if group.id not in group_id_map:
-                group_i = iface_groups[group.name]
-                group_attrs[group.id] = []
-                for ra in group.attributes:
-                    group_attrs[group.id].append({
-                        'ref_key' : 'GROUP',
-                        'group_id' : group_i.id,
-                        'attr_id' : ra.attr_id,
-                        'attr_is_var' : ra.attr_is_var,
-                    })
-                group_id_map[group.id] = group_i
+    for group in resourcegroups:
+        group_id_map[group.id] = iface_groups[str(group.name)]
 
     group_attrs, defaults, template_lookup = _bulk_add_resource_attrs(net_i.id, 'GROUP', resourcegroups, iface_groups, template_lookup)
     log.info("Groups added in %s", get_timing(start_time))
@@ -681,14 +643,14 @@ def add_network(network, **kwargs):
             if s.resourcegroupitems is not None:
                 for group_item in s.resourcegroupitems:
                     group_item_i = ResourceGroupItem()
-                    group_item_i.group = grp_id_map[group_item.group_id]
+                    group_item_i.group_id = grp_id_map[group_item.group_id].id
                     group_item_i.ref_key  = group_item.ref_key
                     if group_item.ref_key == 'NODE':
-                        group_item_i.node = node_id_map[group_item.ref_id]
+                        group_item_i.node_id = node_id_map[group_item.ref_id].id
                     elif group_item.ref_key == 'LINK':
-                        group_item_i.link = link_id_map[group_item.ref_id]
+                        group_item_i.link_id = link_id_map[group_item.ref_id].id
                     elif group_item.ref_key == 'GROUP':
-                        group_item_i.subgroup = grp_id_map[group_item.ref_id]
+                        group_item_i.subgroup_id = grp_id_map[group_item.ref_id].id
                     else:
                         raise HydraError("A ref key of %s is not valid for a "
                                          "resource group item."%group_item.ref_key)
@@ -705,6 +667,12 @@ def add_network(network, **kwargs):
     db.DBSession.flush()
     log.info("Insertion of network took: %s",(datetime.datetime.now()-insert_start))
 
+    #The resources were inserted without going through the ORM, so
+    #lazy load them for the caller.
+    net_i.nodes
+    net_i.links
+    net_i.resourcegroups
+
     return net_i
 
 def _get_all_resource_attributes(network_id, template_id=None, include_non_template_attributes=False):
@@ -1492,6 +1460,8 @@ def update_network(network,
     except NoResultFound:
         raise ResourceNotFoundError("Network with id %s not found"%(network.id))
 
+    if net_i.project_id != network.project_id:
+        new_attr_scope_version()
     net_i.project_id = network.project_id
     net_i.name = network.name
     net_i.description = network.description
@@ -1499,107 +1469,78 @@ def update_network(network,
     net_i.layout = network.get_json('layout')
     net_i.appdata = network.get_json('appdata')
 
-    all_resource_attrs = {}
-    new_network_attributes = _update_attributes(net_i, network.attributes)
-    all_resource_attrs.update(new_network_attributes)
-    hdb.add_resource_types(net_i, network.types)
+    #Write the network's own changes before updating its contents beneath the ORM
+    db.DBSession.flush()
 
-    #Maps temporary node_ids to real node_ids
+    changes = dict(nodes_added=0, nodes_updated=0,
+                   links_added=0, links_updated=0,
+                   groups_added=0, groups_updated=0,
+                   attributes_added=0, attributes_updated=0,
+                   types_added=0)
+
+    #The (ref_key, resource id, incoming resource) of every resource whose
+    #attributes and types need to be compared.
+    resources = [('NETWORK', net_i.id, network)]
+
+    #Maps incoming node_ids, which are negative for new nodes, to real node_ids
     node_id_map = dict()
 
     if network.nodes is not None and update_nodes is True:
         log.info("Updating nodes")
         t0 = time.time()
-        #First add all the nodes
-        node_id_map = dict([(n.id, n) for n in net_i.nodes])
-        for node in network.nodes:
-            #If we get a negative or null node id, we know
-            #it is a new node.
-            if node.id is not None and node.id > 0:
-                n = node_id_map[node.id]
-                n.name        = node.name
-                n.description = node.description
-                n.x           = node.x
-                n.y           = node.y
-                n.alt_x       = node.alt_x
-                n.alt_y       = node.alt_y
-                n.status      = node.status
-                n.layout      = node.get_layout()
-            else:
-                log.info("Adding new node %s", node.name)
-                n = net_i.add_node(node.name,
-                                   node.description,
-                                   node.get_layout(),
-                                   node.x,
-                                   node.y,
-                                   node.alt_x,
-                                   node.alt_y)
-                net_i.nodes.append(n)
-                node_id_map[n.id] = n
-
-            all_resource_attrs.update(_update_attributes(n, node.attributes))
-            hdb.add_resource_types(n, node.types)
+        node_id_map = _apply_resource_diff(Node, net_i.id, network.nodes,
+            lambda node: dict(name=node.name,
+                              description=node.description,
+                              x=node.x,
+                              y=node.y,
+                              alt_x=node.alt_x,
+                              alt_y=node.alt_y,
+                              status=node.status,
+                              layout=node.get_layout()),
+            changes, 'nodes')
+        resources.extend(('NODE', node_id_map[node.id], node) for node in network.nodes)
         log.info("Updating nodes took %s", time.time() - t0)
 
-    link_id_map = dict()
     if network.links is not None and update_links is True:
         log.info("Updating links")
         t0 = time.time()
-        link_id_map = dict([(l.link_id, l) for l in net_i.links])
-        for link in network.links:
-            node_1 = node_id_map[link.node_1_id]
-
-            node_2 = node_id_map[link.node_2_id]
-
-            if link.id is None or link.id < 0:
-                log.info("Adding new link %s", link.name)
-                l = net_i.add_link(link.name,
-                                   link.description,
-                                   link.get_layout(),
-                                   node_1,
-                                   node_2)
-                net_i.links.append(l)
-                link_id_map[link.id] = l
-            else:
-                l = link_id_map[link.id]
-                l.name       = link.name
-                l.link_descripion = link.description
-                l.node_a          = node_1
-                l.node_b          = node_2
-                l.layout          = link.get_layout()
 
-
-            all_resource_attrs.update(_update_attributes(l, link.attributes))
-            hdb.add_resource_types(l, link.types)
+        def _get_link_values(link):
+            if link.node_1_id not in node_id_map or link.node_2_id not in node_id_map:
+                node_id_map.update((n.id, n.id) for n in db.DBSession.query(Node.id).filter(
+                    Node.network_id == net_i.id))
+            try:
+                node_1_id = node_id_map[link.node_1_id]
+                node_2_id = node_id_map[link.node_2_id]
+            except KeyError as e:
+                raise ResourceNotFoundError("Node %s of link %s not found in network %s"%(e, link.name, net_i.id))
+            return dict(name=link.name,
+                        description=link.description,
+                        node_1_id=node_1_id,
+                        node_2_id=node_2_id,
+                        layout=link.get_layout())
+
+        link_id_map = _apply_resource_diff(Link, net_i.id, network.links, _get_link_values, changes, 'links')
+        resources.extend(('LINK', link_id_map[link.id], link) for link in network.links)
         log.info("Updating links took %s", time.time() - t0)
 
-    group_id_map = dict()
     #Next all the groups
     if network.resourcegroups is not None and update_groups is True:
         log.info("Updating groups")
         t0 = time.time()
-        group_id_map = dict([(g.group_id, g) for g in net_i.resourcegroups])
-        for group in network.resourcegroups:
-            #If we get a negative or null group id, we know
-            #it is a new group.
-            if group.id is not None and group.id > 0:
-                g_i = group_id_map[group.id]
-                g_i.name        = group.name
-                g_i.description = group.description
-                g_i.status           = group.status
-            else:
-                log.info("Adding new group %s", group.name)
-                g_i = net_i.add_group(group.name,
-                                      group.description,
-                                      group.status)
-                net_i.resourcegroups.append(net_i)
-                group_id_map[g_i.group_id] = g_i
-
-            all_resource_attrs.update(_update_attributes(g_i, group.attributes))
-            hdb.add_resource_types(g_i, group.types)
-            group_id_map[group.id] = g_i
+        group_id_map = _apply_resource_diff(ResourceGroup, net_i.id, network.resourcegroups,
+            lambda group: dict(name=group.name,
+                               description=group.description,
+                               status=group.status),
+            changes, 'groups')
+        resources.extend(('GROUP', group_id_map[group.id], group) for group in network.resourcegroups)
         log.info("Updating groups took %s", time.time() - t0)
 
+    _apply_attribute_and_type_diff(net_i.id, resources, changes)
+
+    #Remove any objects in the session which are now out of date
+    db.DBSession.expire_all()
+
     errors = []
     if network.scenarios is not None and update_scenarios is True:
         for s in network.scenarios:
@@ -1626,9 +1567,191 @@ def update_network(network,
 
     db.DBSession.flush()
 
+    clear_topology_cache(network.id)
+    clear_network_resource_attributes_cache(network.id)
+
+    log.info("Network %s updated: %s", network.id, changes)
+
     updated_net = get_network(network.id, summary=True, **kwargs)
+    updated_net.changes = changes
     return updated_net
 
+def _values_equal(current_value, new_value):
+    """
+        Compare a value in the DB with an incoming value. Coordinates are
+        stored as decimals, so numbers are compared as floats.
+    """
+    if current_value is None or new_value is None:
+        return current_value is None and new_value is None
+    if isinstance(current_value, (int, float, Decimal)) and isinstance(new_value, (int, float, Decimal)):
+        return float(current_value) == float(new_value)
+    return current_value == new_value
+
+def _apply_resource_diff(resource_class, network_id, incoming, get_values, changes, change_key):
+    """
+        Compare incoming nodes, links or groups with a projection of the current
+        resources of that type in the network, then update those which have changed
+        in a single executemany UPDATE, and insert the new ones (those with a null
+        or negative ID).
+
+        args:
+            resource_class: Node, Link or ResourceGroup
+            incoming: The incoming resources
+            get_values: A function returning the column values of an incoming resource
+            changes: The dictionary of counts to update
+            change_key: The prefix of the counts in changes ('nodes', 'links' or 'groups')
+        returns:
+            A dictionary of incoming ID to real ID, for both new and existing resources
+    """
+    fields = None
+    current = dict()
+    id_map = dict()
+    updates = []
+    new_resources = []
+    for resource in incoming:
+        values = get_values(resource)
+        if fields is None:
+            fields = list(values.keys())
+            current = dict((r.id, r) for r in db.DBSession.query(
+                resource_class.id, *[getattr(resource_class, f) for f in fields]).filter(
+                    resource_class.network_id == network_id))
+            current_names = set(r.name for r in current.values())
+
+        if resource.id is None or resource.id < 0:
+            if resource.name in current_names:
+                raise HydraError("A %s with name %s is already in network %s"%(
+                    resource_class.__name__.lower(), resource.name, network_id))
+            new_resources.append((resource.id, values))
+            continue
+
+        current_resource = current.get(resource.id)
+        if current_resource is None:
+            raise ResourceNotFoundError("%s %s not found in network %s"%(
+                resource_class.__name__, resource.id, network_id))
+        id_map[resource.id] = resource.id
+
+        if not all(_values_equal(getattr(current_resource, f), values[f]) for f in fields):
+            updates.append(dict([('b_id', resource.id)] + [('b_'+f, values[f]) for f in fields]))
+
+    if len(updates) > 0:
+        table = resource_class.__table__
+        db.DBSession.execute(table.update().where(table.c.id == bindparam('b_id')).values(
+            **dict((f, bindparam('b_'+f)) for f in fields)), updates)
+
+    if len(new_resources) > 0:
+        log.info("Adding %s new %s", len(new_resources), change_key)
+        #Leave unset values to the column defaults
+        new_resources_i = [resource_class(network_id=network_id,
+                                          **dict((k, v) for k, v in values.items() if v is not None))
+                           for _, values in new_resources]
+        db.DBSession.add_all(new_resources_i)
+        db.DBSession.flush()
+        for (incoming_id, _), resource_i in zip(new_resources, new_resources_i):
+            id_map[incoming_id] = resource_i.id
+
+    changes[change_key + '_updated'] += len(updates)
+    changes[change_key + '_added'] += len(new_resources)
+
+    return id_map
+
+def _apply_attribute_and_type_diff(network_id, resources, changes):
+    """
+        Compare the attributes and types of the incoming resources with a projection
+        of those currently in the network, then insert the new resource attributes
+        and types, and update any resource attributes whose attr_is_var has changed,
+        in bulk.
+
+        args:
+            resources: A list of (ref_key, resource id, incoming resource)
+            changes: The dictionary of counts to update
+    """
+    ref_cols = {'NETWORK': 'network_id', 'NODE': 'node_id', 'LINK': 'link_id', 'GROUP': 'group_id'}
+
+    network_nodes = select(Node.id).where(Node.network_id == network_id)
+    network_links = select(Link.id).where(Link.network_id == network_id)
+    network_groups = select(ResourceGroup.id).where(ResourceGroup.network_id == network_id)
+
+    def _resource_key(row):
+        for ref_key, ref_col in ref_cols.items():
+            if getattr(row, ref_col) is not None:
+                return (ref_key, getattr(row, ref_col))
+
+    if any(r.attributes is not None for _, _, r in resources):
+        current_ras = dict()
+        current_resource_attrs = set()
+        for ra in db.DBSession.query(ResourceAttr.id, ResourceAttr.attr_id, ResourceAttr.attr_is_var,
+                                     ResourceAttr.network_id, ResourceAttr.node_id,
+                                     ResourceAttr.link_id, ResourceAttr.group_id).filter(or_(
+                                         ResourceAttr.network_id == network_id,
+                                         ResourceAttr.node_id.in_(network_nodes),
+                                         ResourceAttr.link_id.in_(network_links),
+                                         ResourceAttr.group_id.in_(network_groups))):
+            current_ras[ra.id] = ra
+            current_resource_attrs.add((_resource_key(ra), ra.attr_id))
+
+        ra_updates = []
+        new_ras = []
+        for ref_key, resource_id, resource in resources:
+            if resource.attributes is None:
+                continue
+            for ra in resource.attributes:
+                attr_is_var = ra.attr_is_var if ra.attr_is_var is not None else 'N'
+                if ra.id is None or ra.id < 0:
+                    if ((ref_key, resource_id), ra.attr_id) in current_resource_attrs:
+                        continue
+                    current_resource_attrs.add(((ref_key, resource_id), ra.attr_id))
+                    new_ras.append({ref_cols[ref_key]: resource_id,
+                                    'ref_key': ref_key,
+                                    'attr_id': ra.attr_id,
+                                    'attr_is_var': attr_is_var})
+                else:
+                    current_ra = current_ras.get(ra.id)
+                    if current_ra is None:
+                        raise ResourceNotFoundError("Resource attribute %s not found in network %s"%(ra.id, network_id))
+                    if current_ra.attr_is_var != attr_is_var:
+                        ra_updates.append({'b_id': ra.id, 'b_attr_is_var': attr_is_var})
+
+        if len(ra_updates) > 0:
+            ra_table = ResourceAttr.__table__
+            db.DBSession.execute(ra_table.update().where(ra_table.c.id == bindparam('b_id')).values(
+                attr_is_var=bindparam('b_attr_is_var')), ra_updates)
+        for ref_col in ref_cols.values():
+            ref_col_ras = [ra for ra in new_ras if ref_col in ra]
+            if len(ref_col_ras) > 0:
+                db.DBSession.execute(ResourceAttr.__table__.insert(), ref_col_ras)
+
+        changes['attributes_updated'] += len(ra_updates)
+        changes['attributes_added'] += len(new_ras)
+
+    if any(r.types is not None for _, _, r in resources):
+        current_types = set()
+        for rt in db.DBSession.query(ResourceType.type_id, ResourceType.network_id, ResourceType.node_id,
+                                     ResourceType.link_id, ResourceType.group_id).filter(or_(
+                                         ResourceType.network_id == network_id,
+                                         ResourceType.node_id.in_(network_nodes),
+                                         ResourceType.link_id.in_(network_links),
+                                         ResourceType.group_id.in_(network_groups))):
+            current_types.add((_resource_key(rt), rt.type_id))
+
+        new_types = []
+        for ref_key, resource_id, resource in resources:
+            if resource.types is None:
+                continue
+            for templatetype in resource.types:
+                if ((ref_key, resource_id), templatetype.id) in current_types:
+                    continue
+                current_types.add(((ref_key, resource_id), templatetype.id))
+                new_types.append({ref_cols[ref_key]: resource_id,
+                                  'ref_key': ref_key,
+                                  'type_id': templatetype.id})
+
+        for ref_col in ref_cols.values():
+            ref_col_types = [rt for rt in new_types if ref_col in rt]
+            if len(ref_col_types) > 0:
+                db.DBSession.execute(ResourceType.__table__.insert(), ref_col_types)
+
+        changes['types_added'] += len(new_types)
+
 @required_perms("edit_network")
 def move_network(network_id, target_project_id, **kwargs):
     """
@@ -1648,6 +1771,8 @@ def move_network(network_id, target_project_id, **kwargs):
 
     db.DBSession.flush()
 
+    new_attr_scope_version()
+
     return JSONObject(net_i)
 
 def update_resource_layout(resource_type, resource_id, key, value, **kwargs):
@@ -1823,24 +1948,16 @@ def add_nodes(network_id, nodes,**kwargs):
     except NoResultFound:
         raise ResourceNotFoundError("Network %s not found"%(network_id))
 
-    _add_nodes_to_database(net_i, nodes)
+    iface_nodes = _add_nodes_to_database(net_i, nodes)
 
     net_i.project_id = net_i.project_id
     db.DBSession.flush()
 
-    node_s =  db.DBSession.query(Node).filter(Node.network_id == network_id).all()
-
-    #Maps temporary node_ids to real node_ids
-    node_id_map = dict()
-
-    iface_nodes = dict()
-    for n_i in node_s:
-        iface_nodes[n_i.name] = n_i
-
-    for node in nodes:
-        node_id_map[node.id] = iface_nodes[node.name]
-
     _bulk_add_resource_attrs(network_id, 'NODE', nodes, iface_nodes)
+    clear_topology_cache(network_id)
+    clear_network_resource_attributes_cache(network_id)
+
+    node_s =  db.DBSession.query(Node).filter(Node.network_id == network_id).all()
 
     log.info("Nodes added in %s", get_timing(start_time))
     return node_s
@@ -1864,18 +1981,17 @@ def add_links(network_id, links,**kwargs):
     except NoResultFound:
         raise ResourceNotFoundError("Network %s not found"%(network_id))
     node_id_map=dict()
-    for node in net_i.nodes:
+    for node in db.DBSession.query(Node.id, Node.name).filter(Node.network_id == network_id):
        node_id_map[node.id] = node
 
-    _add_links_to_database(net_i, links, node_id_map)
+    iface_links = _add_links_to_database(net_i, links, node_id_map)
 
     net_i.project_id = net_i.project_id
     db.DBSession.flush()
-    link_s = db.DBSession.query(Link).filter(Link.network_id == network_id).all()
-    iface_links = {}
-    for l_i in link_s:
-        iface_links[l_i.name] = l_i
     _bulk_add_resource_attrs(net_i.id, 'LINK', links, iface_links)
+    clear_topology_cache(network_id)
+    clear_network_resource_attributes_cache(network_id)
+    link_s = db.DBSession.query(Link).filter(Link.network_id == network_id).all()
     log.info("Nodes added in %s", get_timing(start_time))
     return link_s
 #########################################
@@ -1899,6 +2015,8 @@ def add_node(network_id, node, **kwargs):
     hdb.add_resource_attributes(new_node, node.attributes)
 
     db.DBSession.flush()
+    clear_topology_cache(network_id)
+    clear_network_resource_attributes_cache(network_id)
 
     if node.types is not None and len(node.types) > 0:
         res_types = []
@@ -1917,17 +2035,12 @@ def add_node(network_id, node, **kwargs):
         if len(res_types) > 0:
             db.DBSession.bulk_insert_mappings(ResourceType, res_types)
         if len(res_attrs) > 0:
-            db.DBSession.bulk_insert_mappings(ResourceAttr, res_attrs)
-
-            new_res_attrs = db.DBSession.query(ResourceAttr)\
-                    .order_by(ResourceAttr.id.desc())\
-                    .limit(len(res_attrs)).all()
+            new_res_attr_ids = db.bulk_insert_returning_ids(ResourceAttr, res_attrs)
 
             all_rs = []
-            for ra in new_res_attrs:
-                ra_id = ra.id
-                if ra.attr_id in res_scenarios:
-                    rs_list = res_scenarios[ra.attr_id]
+            for ra, ra_id in zip(res_attrs, new_res_attr_ids):
+                if ra['attr_id'] in res_scenarios:
+                    rs_list = res_scenarios[ra['attr_id']]
                     for rs in rs_list:
                         rs_list[rs]['resource_attr_id'] = ra_id
                         all_rs.append(rs_list[rs])
@@ -1974,6 +2087,9 @@ def update_node(node, flush=True, **kwargs):
     if node.types is not None:
         hdb.add_resource_types(node_i, node.types)
 
+    if node.attributes is not None or node.types is not None:
+        clear_network_resource_attributes_cache(node_i.network_id)
+
     if flush is True:
         db.DBSession.flush()
 
@@ -2021,6 +2137,7 @@ def set_node_status(node_id, status, **kwargs):
         link.status = status
 
     db.DBSession.flush()
+    clear_topology_cache(node_i.network_id)
 
     return node_i
 
@@ -2056,6 +2173,9 @@ def purge_network(network_id, purge_data,**kwargs):
         Use purge_data to try to delete the data associated with only this network.
         If no other resources link to this data, it will be deleted.
 
+        The network's contents are deleted with set-based statements, table by table,
+        rather than by loading the network into the session and relying on
+        cascades, so this remains feasible for very large networks.
     """
     user_id = kwargs.get('user_id')
     try:
@@ -2066,49 +2186,160 @@ def purge_network(network_id, purge_data,**kwargs):
     log.info("Deleting network %s, id=%s", net_i.name, network_id)
 
     net_i.check_write_permission(user_id)
-    db.DBSession.delete(net_i)
+
+    #Write any pending changes before deleting beneath the ORM
     db.DBSession.flush()
+
+    _purge_network_contents(network_id, purge_data)
+    clear_topology_cache(network_id)
+    clear_network_resource_attributes_cache(network_id)
+
+    #The session may still hold the objects which have now been deleted
+    db.DBSession.expunge_all()
+
     return 'OK'
 
+def _purge_network_contents(network_id, purge_data):
+    """
+        Delete a network and everything in it, children before parents, using
+        chunked DELETE statements on lists of IDs. Progress is logged per table.
+    """
+    t0 = time.time()
+
+    network_nodes = select(Node.id).where(Node.network_id == network_id)
+    network_links = select(Link.id).where(Link.network_id == network_id)
+    network_groups = select(ResourceGroup.id).where(ResourceGroup.network_id == network_id)
+
+    node_ids = [n.id for n in db.DBSession.query(Node.id).filter(Node.network_id == network_id)]
+    link_ids = [l.id for l in db.DBSession.query(Link.id).filter(Link.network_id == network_id)]
+    group_ids = [g.id for g in db.DBSession.query(ResourceGroup.id).filter(
+        ResourceGroup.network_id == network_id)]
+    scenario_ids = [s.id for s in db.DBSession.query(Scenario.id).filter(
+        Scenario.network_id == network_id)]
+    rule_ids = [r.id for r in db.DBSession.query(Rule.id).filter(Rule.network_id == network_id)]
+    ra_ids = [ra.id for ra in db.DBSession.query(ResourceAttr.id).filter(or_(
+        ResourceAttr.network_id == network_id,
+        ResourceAttr.node_id.in_(network_nodes),
+        ResourceAttr.link_id.in_(network_links),
+        ResourceAttr.group_id.in_(network_groups)))]
+
+    dataset_ids = []
+    if purge_data == 'Y':
+        dataset_ids = [d.dataset_id for d in db.DBSession.query(ResourceScenario.dataset_id).filter(
+            ResourceScenario.scenario_id.in_(select(Scenario.id).where(
+                Scenario.network_id == network_id))).distinct()]
+
+    log.info("Purging network %s: %s nodes, %s links, %s groups, %s scenarios, %s resource attributes",
+             network_id, len(node_ids), len(link_ids), len(group_ids), len(scenario_ids), len(ra_ids))
+
+    chunk_size = data.qry_in_threshold
+
+    def _delete(model, column, ids):
+        deleted = db.bulk_delete(model, column, ids, chunk_size=chunk_size)
+        log.info("Purging network %s: deleted %s rows from %s (%.2fs)",
+                 network_id, deleted, model.__tablename__, time.time() - t0)
+
+    def _delete_network_rows(model, *conditions):
+        deleted = db.DBSession.execute(model.__table__.delete().where(or_(*conditions))).rowcount
+        log.info("Purging network %s: deleted %s rows from %s (%.2fs)",
+                 network_id, deleted, model.__tablename__, time.time() - t0)
+
+    #Scenario data
+    _delete(ResourceScenario, ResourceScenario.scenario_id, scenario_ids)
+    _delete(ResourceGroupItem, ResourceGroupItem.scenario_id, scenario_ids)
+
+    #Things attached to resources
+    _delete(Note, Note.scenario_id, scenario_ids)
+    _delete(Note, Note.node_id, node_ids)
+    _delete(Note, Note.link_id, link_ids)
+    _delete(Note, Note.group_id, group_ids)
+    _delete_network_rows(Note, Note.network_id == network_id)
+    _delete(ResourceType, ResourceType.node_id, node_ids)
+    _delete(ResourceType, ResourceType.link_id, link_ids)
+    _delete(ResourceType, ResourceType.group_id, group_ids)
+    _delete_network_rows(ResourceType, ResourceType.network_id == network_id)
+    _delete_network_rows(ResourceAttrMap,
+                         ResourceAttrMap.network_a_id == network_id,
+                         ResourceAttrMap.network_b_id == network_id)
+    _delete(ResourceAttr, ResourceAttr.id, ra_ids)
+    _delete_network_rows(AttrGroupItem, AttrGroupItem.network_id == network_id)
+    _delete_network_rows(Attr, Attr.network_id == network_id)
+    _delete(RuleTypeLink, RuleTypeLink.rule_id, rule_ids)
+    _delete(Rule, Rule.id, rule_ids)
+
+    #Scenarios can be the parents of other scenarios in the network, so break
+    #those links first, as a chunk of scenarios may include a parent but not its child.
+    db.DBSession.execute(Scenario.__table__.update().where(
+        Scenario.network_id == network_id).values(parent_id=None))
+    _delete(Scenario, Scenario.id, scenario_ids)
+
+    #Links reference nodes, so must go first.
+    _delete(Link, Link.id, link_ids)
+    _delete(Node, Node.id, node_ids)
+    _delete(ResourceGroup, ResourceGroup.id, group_ids)
+    _delete_network_rows(NetworkOwner, NetworkOwner.network_id == network_id)
+    _delete_network_rows(Network, Network.id == network_id)
+
+    if purge_data == 'Y':
+        data._delete_unused_datasets(dataset_ids)
+
+    log.info("Network %s purged in %.2fs", network_id, time.time() - t0)
 
-def _purge_datasets_unique_to_resource(ref_key, ref_id):
+def _purge_datasets_unique_to_resource(ref_key, ref_ids):
     """
-        Find the number of times a a resource and dataset combination
-        occurs. If this equals the number of times the dataset appears, then
-        we can say this dataset is unique to this resource, therefore it can be deleted
+        Delete the datasets which are used only by the given resources, in any
+        scenario. Datasets which are also used by any other resource are kept.
+        This is intended for use when deleting the resources, so all the resource
+        scenarios of the resources are removed, not only those of the deleted datasets.
+
+        The exclusively-used datasets are found with one grouped anti-join per chunk
+        of resources: the datasets used by these resources for which no resource
+        scenario exists on any other resource attribute. Chunks are processed in
+        order, so a dataset shared between two chunks is found in the second.
+
+        args:
+            ref_key (string): 'NODE', 'LINK' or 'GROUP'
+            ref_ids (int or list(int)): The IDs of the resources
+        returns:
+            The IDs of the deleted datasets
     """
-    count_qry = db.DBSession.query(ResourceScenario.dataset_id,
-                                   func.count(ResourceScenario.dataset_id)).group_by(
-                                       ResourceScenario.dataset_id).filter(
-                                       ResourceScenario.resource_attr_id==ResourceAttr.id)
+    ref_cols = {'NODE': ResourceAttr.node_id,
+                'LINK': ResourceAttr.link_id,
+                'GROUP': ResourceAttr.group_id}
+    if ref_key not in ref_cols:
+        raise HydraError("Unable to purge datasets of %s. Must be NODE, LINK or GROUP" % (ref_key,))
 
-    if ref_key == 'NODE':
-        count_qry.filter(ResourceAttr.node_id == ref_id)
-    elif ref_key == 'LINK':
-        count_qry.filter(ResourceAttr.link_id == ref_id)
-    elif ref_key == 'GROUP':
-        count_qry.filter(ResourceAttr.group_id == ref_id)
+    if not isinstance(ref_ids, (list, tuple, set)):
+        ref_ids = [ref_ids]
+    ref_ids = list(ref_ids)
+
+    #Write any pending deletions (group items etc) before deleting beneath the ORM
+    db.DBSession.flush()
 
-    count_rs = count_qry.all()
+    other_rs = aliased(ResourceScenario)
+    deleted_dataset_ids = []
+    for idx in range(0, len(ref_ids), data.qry_in_threshold):
+        resource_ras = select(ResourceAttr.id).where(
+            ref_cols[ref_key].in_(ref_ids[idx:idx+data.qry_in_threshold]))
 
-    for dataset_id, count in count_rs:
-        full_dataset_count = db.DBSession.query(ResourceScenario)\
-                .filter(ResourceScenario.dataset_id==dataset_id).count()
-        if full_dataset_count == count:
-            """First delete all the resource scenarios"""
-            datasets_rs_to_delete = db.DBSession.query(ResourceScenario)\
-                    .filter(ResourceScenario.dataset_id==dataset_id).all()
-            for dataset_rs in datasets_rs_to_delete:
-                db.DBSession.delete(dataset_rs)
+        unique_dataset_ids = [r.dataset_id for r in db.DBSession.query(ResourceScenario.dataset_id).filter(
+            ResourceScenario.resource_attr_id.in_(resource_ras),
+            ~exists().where(other_rs.dataset_id == ResourceScenario.dataset_id,
+                            other_rs.resource_attr_id.not_in(resource_ras))
+        ).group_by(ResourceScenario.dataset_id)]
 
-            """Then delete all the datasets"""
-            dataset_to_delete = db.DBSession.query(Dataset)\
-                    .filter(Dataset.id == dataset_id).one()
+        db.DBSession.execute(ResourceScenario.__table__.delete().where(
+            ResourceScenario.resource_attr_id.in_(resource_ras)))
 
-            log.info("Deleting %s dataset %s (%s)",\
-                     ref_key, dataset_to_delete.name, dataset_to_delete.id)
+        deleted_dataset_ids.extend(data._delete_unused_datasets(unique_dataset_ids))
 
-            db.DBSession.delete(dataset_to_delete)
+    log.info("Deleted %s datasets unique to %s %s",
+             len(deleted_dataset_ids), ref_key, ref_ids if len(ref_ids) < 10 else "(%s resources)" % len(ref_ids))
+
+    #Make sure the ORM does not try to delete the removed resource scenarios again
+    db.DBSession.expire_all()
+
+    return deleted_dataset_ids
 
 def delete_node(node_id, purge_data,**kwargs):
     """
@@ -2137,6 +2368,8 @@ def delete_node(node_id, purge_data,**kwargs):
     node_i.network.check_write_permission(user_id)
     db.DBSession.delete(node_i)
     db.DBSession.flush()
+    clear_topology_cache(node_i.network_id)
+    clear_network_resource_attributes_cache(node_i.network_id)
     return 'OK'
 
 def add_link(network_id, link,**kwargs):
@@ -2163,6 +2396,8 @@ def add_link(network_id, link,**kwargs):
     hdb.add_resource_attributes(link_i, link.attributes)
 
     db.DBSession.flush()
+    clear_topology_cache(network_id)
+    clear_network_resource_attributes_cache(network_id)
 
     if link.types is not None and len(link.types) > 0:
         res_types = []
@@ -2180,14 +2415,12 @@ def add_link(network_id, link,**kwargs):
         if len(res_types) > 0:
             db.DBSession.bulk_insert_mappings(ResourceType, res_types)
         if len(res_attrs) > 0:
-            db.DBSession.bulk_insert_mappings(ResourceAttr, res_attrs)
+            new_res_attr_ids = db.bulk_insert_returning_ids(ResourceAttr, res_attrs)
 
-            new_res_attrs = db.DBSession.query(ResourceAttr).order_by(ResourceAttr.id.desc()).limit(len(res_attrs)).all()
             all_rs = []
-            for ra in new_res_attrs:
-                ra_id = ra.id
-                if ra.attr_id in res_scenarios:
-                    rs_list = res_scenarios[ra.attr_id]
+            for ra, ra_id in zip(res_attrs, new_res_attr_ids):
+                if ra['attr_id'] in res_scenarios:
+                    rs_list = res_scenarios[ra['attr_id']]
                     for rs in rs_list:
                         rs_list[rs]['resource_attr_id'] = ra_id
                         all_rs.append(rs_list[rs])
@@ -2228,6 +2461,8 @@ def update_link(link, flush=False, **kwargs):
         link_i.node_1_id = link.node_1_id
     if link.node_2_id is not None:
         link_i.node_2_id = link.node_2_id
+    if link.node_1_id is not None or link.node_2_id is not None:
+        clear_topology_cache(link_i.network_id)
     if link.description is not None:
         link_i.description = link.description
     if link.layout is not None:
@@ -2236,6 +2471,8 @@ def update_link(link, flush=False, **kwargs):
         hdb.add_resource_attributes(link_i, link.attributes)
     if link.types is not None:
         hdb.add_resource_types(link_i, link.types)
+    if link.attributes is not None or link.types is not None:
+        clear_network_resource_attributes_cache(link_i.network_id)
     if flush is True:
         db.DBSession.flush()
     return link_i
@@ -2255,6 +2492,7 @@ def set_link_status(link_id, status, **kwargs):
 
     link_i.status = status
     db.DBSession.flush()
+    clear_topology_cache(link_i.network_id)
 
 def delete_link(link_id, purge_data,**kwargs):
     """
@@ -2282,6 +2520,8 @@ def delete_link(link_id, purge_data,**kwargs):
     link_i.network.check_write_permission(user_id)
     db.DBSession.delete(link_i)
     db.DBSession.flush()
+    clear_topology_cache(link_i.network_id)
+    clear_network_resource_attributes_cache(link_i.network_id)
 
 def add_group(network_id, group,**kwargs):
     """
@@ -2315,14 +2555,12 @@ def add_group(network_id, group,**kwargs):
         if len(res_types) > 0:
             db.DBSession.bulk_insert_mappings(ResourceType, res_types)
         if len(res_attrs) > 0:
-            db.DBSession.bulk_insert_mappings(ResourceAttr, res_attrs)
+            new_res_attr_ids = db.bulk_insert_returning_ids(ResourceAttr, res_attrs)
 
-            new_res_attrs = db.DBSession.query(ResourceAttr).order_by(ResourceAttr.id.desc()).limit(len(res_attrs)).all()
             all_rs = []
-            for ra in new_res_attrs:
-                ra_id = ra.id
-                if ra.attr_id in res_scenarios:
-                    rs_list = res_scenarios[ra.attr_id]
+            for ra, ra_id in zip(res_attrs, new_res_attr_ids):
+                if ra['attr_id'] in res_scenarios:
+                    rs_list = res_scenarios[ra['attr_id']]
                     for rs in rs_list:
                         rs_list[rs]['resource_attr_id'] = ra_id
                         all_rs.append(rs_list[rs])
@@ -2330,6 +2568,8 @@ def add_group(network_id, group,**kwargs):
             if len(all_rs) > 0:
                 db.DBSession.bulk_insert_mappings(ResourceScenario, all_rs)
 
+    clear_network_resource_attributes_cache(network_id)
+
     db.DBSession.refresh(res_grp_i)
     #lazy load attributes
     res_grp_i.attributes
@@ -2361,6 +2601,9 @@ def update_group(group,**kwargs):
 
     db.DBSession.flush()
 
+    if group.attributes is not None or group.types is not None:
+        clear_network_resource_attributes_cache(group_i.network_id)
+
     return group_i
 
 
@@ -2409,6 +2652,112 @@ def delete_group(group_id, purge_data,**kwargs):
     group_i.network.check_write_permission(user_id)
     db.DBSession.delete(group_i)
     db.DBSession.flush()
+    clear_network_resource_attributes_cache(group_i.network_id)
+
+def _delete_resources(ref_key, ref_ids, purge_data, user_id):
+    """
+        Delete many nodes, links or groups with set-based statements. Write
+        permission is checked once per network. Nodes take their attached
+        links with them, as when deleting a single node.
+    """
+    resource_classes = {'NODE': Node, 'LINK': Link, 'GROUP': ResourceGroup}
+    resource_class = resource_classes[ref_key]
+
+    ref_ids = list(set(ref_ids))
+    resource_rows = []
+    for idx in range(0, len(ref_ids), data.qry_in_threshold):
+        resource_rows.extend(db.DBSession.query(resource_class.id, resource_class.network_id).filter(
+            resource_class.id.in_(ref_ids[idx:idx+data.qry_in_threshold])).all())
+
+    missing_ids = set(ref_ids) - set(r.id for r in resource_rows)
+    if len(missing_ids) > 0:
+        raise ResourceNotFoundError("%s(s) %s not found"%(resource_class.__name__, sorted(missing_ids)))
+
+    network_ids = set(r.network_id for r in resource_rows)
+    for net_i in db.DBSession.query(Network).filter(Network.id.in_(network_ids)).all():
+        net_i.check_write_permission(user_id)
+
+    #Write any pending changes before deleting beneath the ORM
+    db.DBSession.flush()
+
+    to_delete = [(ref_key, ref_ids)]
+    if ref_key == 'NODE':
+        link_ids = set()
+        for idx in range(0, len(ref_ids), data.qry_in_threshold):
+            chunk = ref_ids[idx:idx+data.qry_in_threshold]
+            link_ids.update(l.id for l in db.DBSession.query(Link.id).filter(
+                or_(Link.node_1_id.in_(chunk), Link.node_2_id.in_(chunk))))
+        #Links must be deleted before the nodes they connect
+        to_delete.insert(0, ('LINK', list(link_ids)))
+
+    for resource_ref_key, resource_ids in to_delete:
+        if len(resource_ids) == 0:
+            continue
+
+        if purge_data == 'Y':
+            _purge_datasets_unique_to_resource(resource_ref_key, resource_ids)
+
+        log.info("Deleting %s %ss", len(resource_ids), resource_ref_key.lower())
+
+        resource_class = resource_classes[resource_ref_key]
+        ra_col = {'NODE': ResourceAttr.node_id,
+                  'LINK': ResourceAttr.link_id,
+                  'GROUP': ResourceAttr.group_id}[resource_ref_key]
+        ref_col_name = ra_col.key
+
+        for idx in range(0, len(resource_ids), data.qry_in_threshold):
+            chunk = resource_ids[idx:idx+data.qry_in_threshold]
+            resource_ras = select(ResourceAttr.id).where(ra_col.in_(chunk))
+
+            group_item_filter = getattr(ResourceGroupItem, ref_col_name).in_(chunk)
+            if resource_ref_key == 'GROUP':
+                group_item_filter = or_(group_item_filter, ResourceGroupItem.subgroup_id.in_(chunk))
+
+            for stmt in (
+                ResourceGroupItem.__table__.delete().where(group_item_filter),
+                ResourceScenario.__table__.delete().where(
+                    ResourceScenario.resource_attr_id.in_(resource_ras)),
+                ResourceAttrMap.__table__.delete().where(or_(
+                    ResourceAttrMap.resource_attr_id_a.in_(resource_ras),
+                    ResourceAttrMap.resource_attr_id_b.in_(resource_ras))),
+                ResourceAttr.__table__.delete().where(ra_col.in_(chunk)),
+                Note.__table__.delete().where(getattr(Note, ref_col_name).in_(chunk)),
+                ResourceType.__table__.delete().where(getattr(ResourceType, ref_col_name).in_(chunk)),
+                resource_class.__table__.delete().where(resource_class.id.in_(chunk))):
+                db.DBSession.execute(stmt)
+
+    for network_id in network_ids:
+        clear_topology_cache(network_id)
+        clear_network_resource_attributes_cache(network_id)
+
+    #The session may still hold the objects which have now been deleted
+    db.DBSession.expire_all()
+
+    return 'OK'
+
+@required_perms("edit_network")
+def delete_nodes(node_ids, purge_data='N', **kwargs):
+    """
+        Remove many nodes from the DB completely, along with any links connected
+        to them. Use purge_data to delete the data used only by these nodes.
+    """
+    return _delete_resources('NODE', node_ids, purge_data, kwargs.get('user_id'))
+
+@required_perms("edit_network")
+def delete_links(link_ids, purge_data='N', **kwargs):
+    """
+        Remove many links from the DB completely.
+        Use purge_data to delete the data used only by these links.
+    """
+    return _delete_resources('LINK', link_ids, purge_data, kwargs.get('user_id'))
+
+@required_perms("edit_network")
+def delete_groups(group_ids, purge_data='N', **kwargs):
+    """
+        Remove many groups from the DB completely, along with their group items.
+        Use purge_data to delete the data used only by these groups.
+    """
+    return _delete_resources('GROUP', group_ids, purge_data, kwargs.get('user_id'))
 
 def get_scenarios(network_id,**kwargs):
     """
@@ -2436,25 +2785,7 @@ def validate_network_topology(network_id,**kwargs):
     except NoResultFound:
         raise ResourceNotFoundError("Network %s not found"%(network_id))
 
-    nodes = []
-    for node_i in net_i.nodes:
-        if node_i.status == 'A':
-            nodes.append(node_i.node_id)
-
-    link_nodes = []
-    for link_i in net_i.links:
-        if link_i.status != 'A':
-            continue
-        if link_i.node_1_id not in link_nodes:
-            link_nodes.append(link_i.node_1_id)
-
-        if link_i.node_2_id not in link_nodes:
-            link_nodes.append(link_i.node_2_id)
-
-    nodes = set(nodes)
-    link_nodes = set(link_nodes)
-
-    isolated_nodes = nodes - link_nodes
+    isolated_nodes = set(topology.get_orphan_nodes(network_id, **kwargs))
 
     return isolated_nodes
 
@@ -2922,6 +3253,98 @@ def clone_network(network_id,
 
     ex_net.check_read_permission(user_id)
 
+    newnetworkid = _clone_network(ex_net,
+                                  user_id,
+                                  recipient_user_id=recipient_user_id,
+                                  new_network_name=new_network_name,
+                                  new_network_description=new_network_description,
+                                  project_id=project_id,
+                                  project_name=project_name,
+                                  new_project=new_project,
+                                  include_outputs=include_outputs,
+                                  scenario_ids=scenario_ids,
+                                  creator_is_owner=creator_is_owner)
+
+    Project.clear_cache(user_id)
+
+    return newnetworkid
+
+_clone_network_args = ('recipient_user_id', 'new_network_name', 'new_network_description',
+                       'project_id', 'project_name', 'new_project', 'include_outputs',
+                       'scenario_ids', 'creator_is_owner')
+
+def clone_network_many(network_id, targets, **kwargs):
+    """
+     Create several clones of a network in one call, for example to produce
+     the copies of a base network used in a scenario-planning study.
+
+     Each target is a dictionary of the clone_network arguments for that copy
+     (recipient_user_id, new_network_name, project_id, project_name, new_project,
+     include_outputs, scenario_ids, creator_is_owner). Missing arguments take
+     the clone_network defaults.
+
+     The source network, its scoped attributes and the requesting user are
+     read, and permissions checked, once for all the copies, and the project
+     cache is cleared once at the end.
+
+     returns:
+        The IDs of the new networks, in the same order as the targets, so the
+        ID of the copy made for targets[i] is at index i.
+    """
+
+    user_id = kwargs['user_id']
+
+    for target in targets:
+        unknown_args = set(target.keys()) - set(_clone_network_args)
+        if len(unknown_args) > 0:
+            raise HydraError("Unable to clone network. Unrecognised arguments: %s" % (sorted(unknown_args),))
+
+    try:
+        ex_net = db.DBSession.query(Network).filter(Network.id==network_id).one()
+    except NoResultFound:
+        raise ResourceNotFoundError("Network %s not found"%(network_id))
+
+    ex_net.check_read_permission(user_id)
+
+    user = db.DBSession.query(User).filter(User.id==user_id).one()
+    ex_proj = db.DBSession.query(Project).filter(Project.id==ex_net.project_id).one()
+
+    scoped_attrs = _get_clone_scoped_attrs(network_id, user_id)
+
+    new_network_ids = []
+    for idx, target in enumerate(targets):
+        log.info("Cloning network %s (%s of %s)", network_id, idx + 1, len(targets))
+        new_network_ids.append(_clone_network(ex_net, user_id, user=user, ex_proj=ex_proj,
+                                              scoped_attrs=scoped_attrs, **target))
+
+    Project.clear_cache(user_id)
+
+    return new_network_ids
+
+def _clone_network(ex_net,
+                   user_id,
+                   recipient_user_id=None,
+                   new_network_name=None,
+                   new_network_description=None,
+                   project_id=None,
+                   project_name=None,
+                   new_project=True,
+                   include_outputs=False,
+                   scenario_ids=[],
+                   creator_is_owner=False,
+                   user=None,
+                   ex_proj=None,
+                   scoped_attrs=None):
+    """
+        Clone a network which has already been retrieved, and its read permission
+        checked, for clone_network and clone_network_many. The requesting user,
+        the source network's project and the scoped attributes used in cloning
+        (see _get_clone_scoped_attrs) can be passed in if they have already
+        been retrieved. Returns the ID of the new network.
+    """
+
+    network_id = ex_net.id
+
     if recipient_user_id is None:
         recipient_user_id = user_id
 
@@ -2929,9 +3352,11 @@ def clone_network(network_id,
 
         log.info("Creating a new project for cloned network")
 
-        ex_proj = db.DBSession.query(Project).filter(Project.id==ex_net.project_id).one()
+        if ex_proj is None:
+            ex_proj = db.DBSession.query(Project).filter(Project.id==ex_net.project_id).one()
 
-        user = db.DBSession.query(User).filter(User.id==user_id).one()
+        if user is None:
+            user = db.DBSession.query(User).filter(User.id==user_id).one()
 
         project = Project()
         if project_name is None or project_name=="":
@@ -2999,42 +3424,42 @@ def clone_network(network_id,
 
     newnetworkid = newnet.id
 
-    log.info('CLoning Nodes')
-    node_id_map = _clone_nodes(network_id, newnetworkid, user_id)
-
-    log.info('Cloning Links')
-    link_id_map = _clone_links(network_id, newnetworkid, node_id_map, user_id)
-
-    log.info('CLoning Groups')
-    group_id_map = _clone_groups(network_id,
-                                 newnetworkid,
-                                 node_id_map,
-                                 link_id_map,
-                                 user_id)
-
-    log.info("Cloning Resource Attributes")
-    ra_id_map = _clone_resourceattrs(network_id,
-                                     newnetworkid,
-                                     node_id_map,
-                                     link_id_map,
-                                     group_id_map,
-                                     newnet.project_id,
-                                     ex_net.project_id,
-                                     user_id)
-
-    log.info("Cloning Resource Types")
-    _clone_resourcetypes(network_id, newnetworkid, node_id_map, link_id_map, group_id_map)
-
-    log.info('Cloning Scenarios')
-    scenario_id_map = _clone_scenarios(network_id,
-                                       newnetworkid,
-                                       ra_id_map,
-                                       node_id_map,
-                                       link_id_map,
-                                       group_id_map,
-                                       user_id,
-                                       include_outputs=include_outputs,
-                                       scenario_ids=scenario_ids)
+    #The network is copied entirely within the database, using INSERT ... SELECT
+    #statements and temporary old ID -> new ID tables to remap the references
+    #between the copied rows. The node and group maps are needed twice, as
+    #MySQL cannot refer to a temporary table more than once in the same query.
+    with ExitStack() as stack:
+        map_tables = dict((name, stack.enter_context(db.temporary_id_map(f'tmp_clone_{name}_map')))
+                          for name in ('node', 'node_2', 'link', 'group', 'subgroup', 'ra'))
+
+        log.info('Cloning Nodes')
+        _clone_nodes(network_id, newnetworkid, map_tables)
+
+        log.info('Cloning Links')
+        _clone_links(network_id, newnetworkid, map_tables)
+
+        log.info('Cloning Groups')
+        _clone_groups(network_id, newnetworkid, map_tables)
+
+        log.info("Cloning Resource Attributes")
+        _clone_resourceattrs(network_id,
+                             newnetworkid,
+                             map_tables,
+                             newnet.project_id,
+                             ex_net.project_id,
+                             user_id,
+                             scoped_attrs=scoped_attrs)
+
+        log.info("Cloning Resource Types")
+        _clone_resourcetypes(network_id, newnetworkid, map_tables)
+
+        log.info('Cloning Scenarios')
+        scenario_id_map = _clone_scenarios(network_id,
+                                           newnetworkid,
+                                           map_tables,
+                                           user_id,
+                                           include_outputs=include_outputs,
+                                           scenario_ids=scenario_ids)
 
     _clone_network_rules(
         network_id,
@@ -3044,8 +3469,6 @@ def clone_network(network_id,
 
     db.DBSession.flush()
 
-    Project.clear_cache(user_id)
-
     return newnetworkid
 
 def clone_node(node_id,
@@ -3241,6 +3664,7 @@ def _clone_node(
     log.info("Inserting new resource attributes")
     db.DBSession.bulk_insert_mappings(ResourceAttr, new_ras)
     db.DBSession.flush()
+    clear_network_resource_attributes_cache(newnode.network_id)
 
     log.info("Creating mapping from old resource attribute IDs to new")
     new_node_ras = db.DBSession.query(ResourceAttr).filter(
@@ -3300,107 +3724,94 @@ def _clone_network_rules(old_network_id, new_network_id, user_id):
                                target_ref_id=new_network_id,
                                user_id=user_id)
 
-def _clone_nodes(old_network_id, new_network_id, user_id):
-
-    nodes = db.DBSession.query(Node).filter(Node.network_id==old_network_id).all()
-    newnodes = []
-    old_node_name_map = {}
-    id_map = {}
-    for ex_n in nodes:
-        new_n = dict(
-            network_id=new_network_id,
-            name = ex_n.name,
-            description = ex_n.description,
-            x = ex_n.x,
-            y = ex_n.y,
-            alt_x = ex_n.alt_x,
-            alt_y = ex_n.alt_y,
-            layout = ex_n.layout,
-            status = ex_n.status,
-        )
-
-        old_node_name_map[ex_n.name] = ex_n.node_id
-
-        newnodes.append(new_n)
-
-    db.DBSession.bulk_insert_mappings(Node, newnodes)
-
-    db.DBSession.flush()
-    #map old IDS to new IDS
-
-    nodes = db.DBSession.query(Node).filter(Node.network_id==new_network_id).all()
-
-    for n in nodes:
-        old_node_id = old_node_name_map[n.name]
-        id_map[old_node_id] = n.node_id
-
-
-    return id_map
-
-def _clone_links(old_network_id, new_network_id, node_id_map, user_id):
-
-    links = db.DBSession.query(Link).filter(Link.network_id==old_network_id).all()
-    newlinks = []
-    old_link_name_map = {}
-    id_map = {}
-    for ex_l in links:
-        new_l = dict(
-            network_id=new_network_id,
-            name = ex_l.name,
-            description = ex_l.description,
-            node_1_id = node_id_map[ex_l.node_1_id],
-            node_2_id = node_id_map[ex_l.node_2_id],
-            layout = ex_l.layout,
-            status = ex_l.status,
-        )
-
-        newlinks.append(new_l)
-
-        old_link_name_map[ex_l.name] = ex_l.id
-
-    db.DBSession.bulk_insert_mappings(Link, newlinks)
-
-    db.DBSession.flush()
-    #map old IDS to new IDS
-
-    links = db.DBSession.query(Link).filter(Link.network_id==new_network_id).all()
-    for l in links:
-        old_link_id = old_link_name_map[l.name]
-        id_map[old_link_id] = l.link_id
-
-    return id_map
-
-def _clone_groups(old_network_id, new_network_id, node_id_map, link_id_map, user_id):
-
-    groups = db.DBSession.query(ResourceGroup).filter(ResourceGroup.network_id==old_network_id).all()
-    newgroups = []
-    old_group_name_map = {}
-    id_map = {}
-    for ex_g in groups:
-        new_g = dict(
-            network_id=new_network_id,
-            name = ex_g.name,
-            description = ex_g.group_description,
-            status = ex_g.status,
-        )
-
-        newgroups.append(new_g)
-
-        old_group_name_map[ex_g.name] = ex_g.id
-
-    db.DBSession.bulk_insert_mappings(ResourceGroup, newgroups)
-
-    db.DBSession.flush()
-    #map old IDS to new IDS
-
-    groups = db.DBSession.query(ResourceGroup).filter(ResourceGroup.network_id==new_network_id).all()
-    for g in groups:
-        old_group_id = old_group_name_map[g.name]
-        id_map[old_group_id] = g.group_id
-
-    return id_map
+def _clone_nodes(old_network_id, new_network_id, map_tables):
+    """
+        Copy the nodes of a network, and fill the 'node' and 'node_2' map tables,
+        matching the old and new nodes on their name and status, which are
+        unique within a network.
+    """
+    node_cols = ['name', 'description', 'x', 'y', 'alt_x', 'alt_y', 'layout', 'status']
+    db.DBSession.execute(Node.__table__.insert().from_select(
+        ['network_id'] + node_cols,
+        select(literal(new_network_id), *[getattr(Node, c) for c in node_cols]
+               ).where(Node.network_id == old_network_id)))
+
+    old_node = aliased(Node)
+    id_select = select(old_node.id, Node.id).select_from(old_node).join(
+        Node, and_(Node.network_id == new_network_id,
+                   Node.name == old_node.name,
+                   Node.status == old_node.status)
+    ).where(old_node.network_id == old_network_id)
+
+    for map_name in ('node', 'node_2'):
+        db.DBSession.execute(map_tables[map_name].insert().from_select(['old_id', 'new_id'], id_select))
+
+def _clone_links(old_network_id, new_network_id, map_tables):
+    """
+        Copy the links of a network, pointing them at the new nodes, and fill
+        the 'link' map table, matching the old and new links on their name and nodes.
+    """
+    node_map = map_tables['node']
+    node_2_map = map_tables['node_2']
+
+    link_cols = ['name', 'description', 'layout', 'status']
+    db.DBSession.execute(Link.__table__.insert().from_select(
+        ['network_id', 'node_1_id', 'node_2_id'] + link_cols,
+        select(literal(new_network_id), node_map.c.new_id, node_2_map.c.new_id,
+               *[getattr(Link, c) for c in link_cols]
+        ).select_from(Link
+        ).join(node_map, node_map.c.old_id == Link.node_1_id
+        ).join(node_2_map, node_2_map.c.old_id == Link.node_2_id
+        ).where(Link.network_id == old_network_id)))
+
+    old_link = aliased(Link)
+    id_select = select(old_link.id, Link.id).select_from(old_link
+    ).join(node_map, node_map.c.old_id == old_link.node_1_id
+    ).join(node_2_map, node_2_map.c.old_id == old_link.node_2_id
+    ).join(Link, and_(Link.network_id == new_network_id,
+                      Link.node_1_id == node_map.c.new_id,
+                      Link.node_2_id == node_2_map.c.new_id,
+                      or_(Link.name == old_link.name,
+                          and_(Link.name == None, old_link.name == None)))
+    ).where(old_link.network_id == old_network_id)
+
+    db.DBSession.execute(map_tables['link'].insert().from_select(['old_id', 'new_id'], id_select))
+
+def _clone_groups(old_network_id, new_network_id, map_tables):
+    """
+        Copy the groups of a network, and fill the 'group' and 'subgroup' map
+        tables, matching the old and new groups on their name.
+    """
+    group_cols = ['name', 'description', 'status']
+    db.DBSession.execute(ResourceGroup.__table__.insert().from_select(
+        ['network_id'] + group_cols,
+        select(literal(new_network_id), *[getattr(ResourceGroup, c) for c in group_cols]
+               ).where(ResourceGroup.network_id == old_network_id)))
+
+    old_group = aliased(ResourceGroup)
+    id_select = select(old_group.id, ResourceGroup.id).select_from(old_group).join(
+        ResourceGroup, and_(ResourceGroup.network_id == new_network_id,
+                            ResourceGroup.name == old_group.name)
+    ).where(old_group.network_id == old_network_id)
+
+    for map_name in ('group', 'subgroup'):
+        db.DBSession.execute(map_tables[map_name].insert().from_select(['old_id', 'new_id'], id_select))
+
+def _get_clone_scoped_attrs(network_id, user_id):
+    """
+        Get the attributes scoped to a network which is being cloned, so they
+        can be shared between the copies made by clone_network_many.
+        returns:
+            A dict of:
+                network: The attributes scoped directly to the network
+                project: A dict of project ID -> the attributes scoped to that
+                         project, filled in as each project is needed.
+    """
+    return {'network': attributes.get_attributes(network_id=network_id, user_id=user_id),
+            'project': {}}
 
-def _clone_attributes(network_id, newnetworkid, exnet_project_id, newnet_project_id, user_id):
+def _clone_attributes(network_id, newnetworkid, exnet_project_id, newnet_project_id, user_id,
+                      scoped_attrs=None):
     """
         Clone the attributes scoped to a network nad its project when cloning a network
         @returns:
@@ -3411,17 +3822,23 @@ def _clone_attributes(network_id, newnetworkid, exnet_project_id, newnet_project
     #first find any attributes which are scoped to the source network, and scope them to the parent project if the source
     #and target are in the same project, otherwise clone all the scoped attributes.
 
+    if scoped_attrs is None:
+        scoped_attrs = _get_clone_scoped_attrs(network_id, user_id)
+
     #find any attributes scoped directly to the source
-    network_scoped_attrs = attributes.get_attributes(network_id=network_id, user_id=user_id)
-    project_scoped_attrs = []
+    network_scoped_attrs = scoped_attrs['network']
     #get all the attributes scoped to the project of the source network (if it's not the same project as the target)
     new_scoped_attrs_lookup = {}
 
     if exnet_project_id != newnet_project_id:
         orig_scoped_attr_lookup = {}
         new_attributes = []
-        exnet_project_scoped_attrs = attributes.get_attributes(project_id=exnet_project_id, user_id=user_id)
+        if exnet_project_id not in scoped_attrs['project']:
+            scoped_attrs['project'][exnet_project_id] = attributes.get_attributes(
+                project_id=exnet_project_id, user_id=user_id)
+        exnet_project_scoped_attrs = scoped_attrs['project'][exnet_project_id]
         for a in exnet_project_scoped_attrs:
+            a = JSONObject(a)
             a.project_id = newnet_project_id
             new_attributes.append(a)
             orig_scoped_attr_lookup[a.name] = a.id
@@ -3446,187 +3863,88 @@ def _clone_attributes(network_id, newnetworkid, exnet_project_id, newnet_project
             a.network_id=None
             a.project_id=exnet_project_id
             attributes.update_attribute(a)
+        #The attributes are now scoped to the project, so any later copies find them there.
+        if len(network_scoped_attrs) > 0:
+            scoped_attrs['network'] = []
+            scoped_attrs['project'].pop(exnet_project_id, None)
 
     return new_scoped_attrs_lookup
 
-def _clone_resourceattrs(network_id, newnetworkid, node_id_map, link_id_map, group_id_map, exnet_project_id, newnet_project_id, user_id):
+def _clone_resourceattrs(network_id, newnetworkid, map_tables, exnet_project_id, newnet_project_id, user_id,
+                         scoped_attrs=None):
+    """
+        Copy the resource attributes of a network and its nodes, links and groups,
+        referring to any newly cloned scoped attributes, and fill the 'ra' map table.
+    """
 
     #clone any attributes which are scoped to a network or to the network's project (if the networks)
     #are in different projects.
-    new_scoped_attr_lookup = _clone_attributes(network_id, newnetworkid, exnet_project_id, newnet_project_id, user_id)
-
-    log.info("Cloning Network Attributes")
-    network_ras = db.DBSession.query(ResourceAttr).filter(ResourceAttr.network_id==network_id)
-    id_map = {}
-    new_ras = []
-    old_ra_name_map = {}
-    for ra in network_ras:
-        new_attr = new_scoped_attr_lookup.get(ra.attr_id)
-        attr_id = ra.attr_id
-        if new_attr:
-            attr_id = new_attr.id
-        new_ras.append(dict(
-            network_id=newnetworkid,
-            node_id=None,
-            group_id=None,
-            link_id=None,
-            ref_key='NETWORK',
-            attr_id=attr_id,
-            attr_is_var=ra.attr_is_var,
-        ))
-        #key is (network_id, node_id, link_id, group_id) -- only one of which can be not null for a given row
-        old_ra_name_map[(newnetworkid, None, None, None, attr_id)] = ra.id
-    log.info("Cloning Node Attributes")
-    node_ras = db.DBSession.query(ResourceAttr).filter(and_(ResourceAttr.node_id==Node.id, Node.network_id==network_id)).all()
-    for ra in node_ras:
-        new_attr = new_scoped_attr_lookup.get(ra.attr_id)
-        attr_id = ra.attr_id
-        if new_attr:
-            attr_id = new_attr.id
-        new_ras.append(dict(
-            node_id=node_id_map[ra.node_id],
-            network_id=None,
-            link_id=None,
-            group_id=None,
-            attr_id=attr_id,
-            attr_is_var=ra.attr_is_var,
-            ref_key=ra.ref_key,
-        ))
-        old_ra_name_map[(None, node_id_map[ra.node_id], None, None, attr_id)] = ra.id
-    log.info("Cloning Link Attributes")
-    link_ras = db.DBSession.query(ResourceAttr).filter(and_(ResourceAttr.link_id==Link.id, Link.network_id==network_id)).all()
-    for ra in link_ras:
-        new_attr = new_scoped_attr_lookup.get(ra.attr_id)
-        attr_id = ra.attr_id
-        if new_attr:
-            attr_id = new_attr.id
-        new_ras.append(dict(
-            link_id=link_id_map[ra.link_id],
-            network_id=ra.network_id,
-            node_id=ra.node_id,
-            group_id=ra.group_id,
-            attr_id=attr_id,
-            attr_is_var=ra.attr_is_var,
-            ref_key=ra.ref_key,
-        ))
-        old_ra_name_map[(None, None, link_id_map[ra.link_id], None, attr_id)] = ra.id
-
-    log.info("Cloning Group Attributes")
-    group_ras = db.DBSession.query(ResourceAttr).filter(and_(ResourceAttr.group_id==ResourceGroup.id, ResourceGroup.network_id==network_id)).all()
-    for ra in group_ras:
-        new_attr = new_scoped_attr_lookup.get(ra.attr_id)
-        attr_id = ra.attr_id
-        if new_attr:
-            attr_id = new_attr.id
-        new_ras.append(dict(
-            group_id=group_id_map[ra.group_id],
-            network_id=ra.network_id,
-            link_id=ra.link_id,
-            node_id=ra.node_id,
-            attr_id=attr_id,
-            attr_is_var=ra.attr_is_var,
-            ref_key=ra.ref_key,
-        ))
-        old_ra_name_map[(None, None, None, group_id_map[ra.group_id], attr_id)] = ra.id
-
-    log.info("Inserting new resource attributes")
-    db.DBSession.bulk_insert_mappings(ResourceAttr, new_ras)
-    db.DBSession.flush()
-    log.info("Insertion Complete")
-
-    log.info("Getting new RAs and building ID map")
-
-    new_network_ras = db.DBSession.query(ResourceAttr).filter(ResourceAttr.network_id==newnetworkid).all()
-    for ra in new_network_ras:
-        id_map[old_ra_name_map[(ra.network_id, ra.node_id, ra.link_id, ra.group_id, ra.attr_id)]] = ra.id
-
-    new_node_ras = db.DBSession.query(ResourceAttr).filter(and_(ResourceAttr.node_id==Node.id, Node.network_id==newnetworkid)).all()
-    for ra in new_node_ras:
-        id_map[old_ra_name_map[(ra.network_id, ra.node_id, ra.link_id, ra.group_id, ra.attr_id)]] = ra.id
-
-
-    new_link_ras = db.DBSession.query(ResourceAttr).filter(and_(ResourceAttr.link_id==Link.id, Link.network_id==newnetworkid)).all()
-    for ra in new_link_ras:
-        id_map[old_ra_name_map[(ra.network_id, ra.node_id, ra.link_id, ra.group_id, ra.attr_id)]] = ra.id
-
-    new_group_ras = db.DBSession.query(ResourceAttr).filter(and_(ResourceAttr.group_id==ResourceGroup.id, ResourceGroup.network_id==newnetworkid)).all()
-    for ra in new_group_ras:
-        id_map[old_ra_name_map[(ra.network_id, ra.node_id, ra.link_id, ra.group_id, ra.attr_id)]] = ra.id
-    log.info("ID map completed. Returning")
-
-    return id_map
-
-def _clone_resourcetypes(network_id, newnetworkid, node_id_map, link_id_map, group_id_map):
-
-    log.info("Cloning Network Types")
-    network_rts = db.DBSession.query(ResourceType).filter(
-        ResourceType.network_id==network_id).all()
-    new_rts = []
-    for rt in network_rts:
-        new_rts.append(dict(
-            ref_key=rt.ref_key,
-            network_id=newnetworkid,
-            node_id=rt.node_id,
-            link_id=rt.link_id,
-            group_id=rt.group_id,
-            type_id=rt.type_id,
-            child_template_id=rt.child_template_id,
-        ))
-    log.info("Cloning Node Types")
-    node_rts = db.DBSession.query(ResourceType).filter(and_(
-        ResourceType.node_id==Node.id,
-        Node.network_id==network_id)).all()
-    for rt in node_rts:
-        new_rts.append(dict(
-            ref_key=rt.ref_key,
-            network_id=rt.network_id,
-            node_id=node_id_map[rt.node_id],
-            link_id=rt.link_id,
-            group_id=rt.group_id,
-            type_id=rt.type_id,
-            child_template_id=rt.child_template_id,
-        ))
-    log.info("Cloning Link Types")
-    link_rts = db.DBSession.query(ResourceType).filter(and_(
-        ResourceType.link_id==Link.id,
-        Link.network_id==network_id)).all()
-    for rt in link_rts:
-        new_rts.append(dict(
-            ref_key=rt.ref_key,
-            network_id=rt.network_id,
-            node_id=rt.node_id,
-            link_id=link_id_map[rt.link_id],
-            group_id=rt.group_id,
-            type_id=rt.type_id,
-            child_template_id=rt.child_template_id,
-        ))
+    new_scoped_attr_lookup = _clone_attributes(network_id, newnetworkid, exnet_project_id, newnet_project_id, user_id,
+                                               scoped_attrs=scoped_attrs)
+    attr_id_map = dict((old_attr_id, new_attr.id) for old_attr_id, new_attr in new_scoped_attr_lookup.items())
+
+    def _new_attr_id(ra):
+        if len(attr_id_map) == 0:
+            return ra.attr_id
+        return case(attr_id_map, value=ra.attr_id, else_=ra.attr_id)
+
+    old_ra = aliased(ResourceAttr)
+    ra_map = map_tables['ra']
+    for ref_key, ref_col in (('NETWORK', 'network_id'),
+                             ('NODE', 'node_id'),
+                             ('LINK', 'link_id'),
+                             ('GROUP', 'group_id')):
+        log.info("Cloning %s Attributes", ref_key.title())
+        if ref_key == 'NETWORK':
+            new_ref_id = literal(newnetworkid)
+            ra_select = select(new_ref_id, _new_attr_id(ResourceAttr), ResourceAttr.attr_is_var,
+                               ResourceAttr.ref_key).where(ResourceAttr.network_id == network_id)
+            id_select = select(old_ra.id, ResourceAttr.id).select_from(old_ra).join(
+                ResourceAttr, and_(ResourceAttr.network_id == newnetworkid,
+                                   ResourceAttr.attr_id == _new_attr_id(old_ra))
+            ).where(old_ra.network_id == network_id)
+        else:
+            ref_map = map_tables[ref_key.lower()]
+            ra_select = select(ref_map.c.new_id, _new_attr_id(ResourceAttr), ResourceAttr.attr_is_var,
+                               ResourceAttr.ref_key).select_from(ResourceAttr).join(
+                ref_map, ref_map.c.old_id == getattr(ResourceAttr, ref_col))
+            id_select = select(old_ra.id, ResourceAttr.id).select_from(old_ra).join(
+                ref_map, ref_map.c.old_id == getattr(old_ra, ref_col)
+            ).join(ResourceAttr, and_(getattr(ResourceAttr, ref_col) == ref_map.c.new_id,
+                                      ResourceAttr.attr_id == _new_attr_id(old_ra)))
+
+        db.DBSession.execute(ResourceAttr.__table__.insert().from_select(
+            [ref_col, 'attr_id', 'attr_is_var', 'ref_key'], ra_select))
+        db.DBSession.execute(ra_map.insert().from_select(['old_id', 'new_id'], id_select))
+
+    log.info("Resource attributes cloned")
+
+def _clone_resourcetypes(network_id, newnetworkid, map_tables):
+    """
+        Copy the resource types of a network and its nodes, links and groups.
+    """
+    for ref_key, ref_col in (('NETWORK', 'network_id'),
+                             ('NODE', 'node_id'),
+                             ('LINK', 'link_id'),
+                             ('GROUP', 'group_id')):
+        log.info("Cloning %s Types", ref_key.title())
+        if ref_key == 'NETWORK':
+            rt_select = select(literal(newnetworkid), ResourceType.ref_key, ResourceType.type_id,
+                               ResourceType.child_template_id).where(ResourceType.network_id == network_id)
+        else:
+            ref_map = map_tables[ref_key.lower()]
+            rt_select = select(ref_map.c.new_id, ResourceType.ref_key, ResourceType.type_id,
+                               ResourceType.child_template_id).select_from(ResourceType).join(
+                ref_map, ref_map.c.old_id == getattr(ResourceType, ref_col))
 
-    log.info("Cloning Group Types")
-    group_rts = db.DBSession.query(ResourceType).filter(and_(
-        ResourceType.group_id==ResourceGroup.id,
-        ResourceGroup.network_id==network_id)).all()
-    for rt in group_rts:
-        new_rts.append(dict(
-            ref_key=rt.ref_key,
-            network_id=rt.network_id,
-            node_id=rt.node_id,
-            link_id=rt.link_id,
-            group_id=group_id_map[rt.group_id],
-            type_id=rt.type_id,
-            child_template_id=rt.child_template_id,
-        ))
+        db.DBSession.execute(ResourceType.__table__.insert().from_select(
+            [ref_col, 'ref_key', 'type_id', 'child_template_id'], rt_select))
 
-    log.info("Inserting new resource types")
-    db.DBSession.bulk_insert_mappings(ResourceType, new_rts)
-    db.DBSession.flush()
-    log.info("Insertion Complete")
+    log.info("Resource types cloned")
 
 def _clone_scenarios(network_id,
                      newnetworkid,
-                     ra_id_map,
-                     node_id_map,
-                     link_id_map,
-                     group_id_map,
+                     map_tables,
                      user_id,
                      include_outputs=False,
                      scenario_ids=[]):
@@ -3645,10 +3963,7 @@ def _clone_scenarios(network_id,
         if scenario.status == 'A':
             new_scenario_id = _clone_scenario(scenario,
                                               newnetworkid,
-                                              ra_id_map,
-                                              node_id_map,
-                                              link_id_map,
-                                              group_id_map,
+                                              map_tables,
                                               user_id,
                                               include_outputs=include_outputs)
             id_map[scenario.id] = new_scenario_id
@@ -3657,12 +3972,15 @@ def _clone_scenarios(network_id,
 
 def _clone_scenario(old_scenario,
                     newnetworkid,
-                    ra_id_map,
-                    node_id_map,
-                    link_id_map,
-                    group_id_map,
+                    map_tables,
                     user_id,
                     include_outputs=False):
+    """
+        Clone a scenario into a new network. 'map_tables' contains the temporary
+        old ID -> new ID tables for resource attributes, nodes, links and groups
+        (and subgroups), as created in _clone_scenarios, which allow the data to be
+        copied entirely within the database.
+    """
 
     log.info("Adding scenario shell to get scenario ID")
     news = Scenario()
@@ -3683,48 +4001,45 @@ def _clone_scenario(old_scenario,
     scenario_id = news.id
     log.info("New Scenario %s created", scenario_id)
 
-    log.info("Getting old resource scenarios for scenario %s", old_scenario.id)
-    old_rscen_qry = db.DBSession.query(ResourceScenario).filter(
-        ResourceScenario.scenario_id == old_scenario.id,
-        ResourceAttr.id == ResourceScenario.resource_attr_id,
-    )
+    log.info("Cloning resource scenarios for scenario %s", old_scenario.id)
+    ra_map = map_tables['ra']
+    rs_select = select(
+        ResourceScenario.dataset_id,
+        literal(scenario_id),
+        ra_map.c.new_id
+    ).join(ra_map, ra_map.c.old_id == ResourceScenario.resource_attr_id
+    ).where(ResourceScenario.scenario_id == old_scenario.id)
 
     #Filter out output data unless explicitly requested not to.
     if include_outputs is not True:
-        old_rscen_qry = old_rscen_qry.filter(ResourceAttr.attr_is_var == 'N')
-
-    old_rscen_rs = old_rscen_qry.all()
+        rs_select = rs_select.join(ResourceAttr, ResourceAttr.id == ResourceScenario.resource_attr_id
+                                   ).where(ResourceAttr.attr_is_var == 'N')
 
-    new_rscens = []
-    for old_rscen in old_rscen_rs:
-        new_rscens.append(dict(
-            dataset_id=old_rscen.dataset_id,
-            scenario_id=scenario_id,
-            resource_attr_id=ra_id_map[old_rscen.resource_attr_id],
-        ))
-
-    log.info("Inserting new resource scenarios")
-    db.DBSession.bulk_insert_mappings(ResourceScenario, new_rscens)
+    db.DBSession.execute(ResourceScenario.__table__.insert().from_select(
+        ['dataset_id', 'scenario_id', 'resource_attr_id'], rs_select))
     log.info("Insertion Complete")
 
-
-
-    log.info("Getting old resource group items for scenario %s", old_scenario.id)
-    old_rgis = db.DBSession.query(ResourceGroupItem).filter(
-        ResourceGroupItem.scenario_id == old_scenario.id).all()
-
-    new_rgis = []
-    for old_rgi in old_rgis:
-        new_rgis.append(dict(
-            ref_key=old_rgi.ref_key,
-            node_id=node_id_map.get(old_rgi.node_id),
-            link_id=link_id_map.get(old_rgi.link_id),
-            subgroup_id=group_id_map.get(old_rgi.subgroup_id),
-            group_id=group_id_map.get(old_rgi.group_id),
-            scenario_id=scenario_id,
-        ))
-
-    db.DBSession.bulk_insert_mappings(ResourceGroupItem, new_rgis)
+    log.info("Cloning resource group items for scenario %s", old_scenario.id)
+    node_map = map_tables['node']
+    link_map = map_tables['link']
+    group_map = map_tables['group']
+    subgroup_map = map_tables['subgroup']
+    rgi_select = select(
+        ResourceGroupItem.ref_key,
+        node_map.c.new_id,
+        link_map.c.new_id,
+        subgroup_map.c.new_id,
+        group_map.c.new_id,
+        literal(scenario_id)
+    ).select_from(ResourceGroupItem
+    ).outerjoin(node_map, node_map.c.old_id == ResourceGroupItem.node_id
+    ).outerjoin(link_map, link_map.c.old_id == ResourceGroupItem.link_id
+    ).outerjoin(subgroup_map, subgroup_map.c.old_id == ResourceGroupItem.subgroup_id
+    ).outerjoin(group_map, group_map.c.old_id == ResourceGroupItem.group_id
+    ).where(ResourceGroupItem.scenario_id == old_scenario.id)
+
+    db.DBSession.execute(ResourceGroupItem.__table__.insert().from_select(
+        ['ref_key', 'node_id', 'link_id', 'subgroup_id', 'group_id', 'scenario_id'], rgi_select))
 
     return scenario_id
 
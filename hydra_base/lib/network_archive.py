@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# (c) Copyright 2013 to 2017 University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    Export a network to, and import it from, a compressed archive: a zip
+    file holding one NDJSON table per kind of record, in the layout read by
+    hydra_base.lib.network_import, plus:
+
+        datasets.ndjson    Each dataset used by the network, once, keyed on
+                           its hash.
+
+    and with the data rows referring to their dataset by 'dataset_hash'
+    rather than holding it, so a dataset shared by many resources or
+    scenarios is only stored once. Tables are written and read a chunk
+    at a time.
+"""
+import io
+import json
+import zipfile
+
+from ..exceptions import HydraError, ResourceNotFoundError
+from . import data
+from . import objects
+from .objects import JSONObject
+from .network_import import _PART_IMPORTERS, _add_network_header, _make_context,\
+        _add_resource_scenarios, _read_ndjson, _chunks
+from ..util.permissions import required_perms
+from .. import db
+from ..db.model import Network, Node, Link, ResourceGroup, ResourceGroupItem,\
+        ResourceAttr, ResourceScenario, ResourceType, Scenario, Dataset
+from ..db.model.dataset import mongo_storage_location_key
+
+import logging
+log = logging.getLogger(__name__)
+
+ARCHIVE_FORMAT_VERSION = 1
+
+_RESOURCE_CLASSES = {'NODE': Node, 'LINK': Link, 'GROUP': ResourceGroup}
+
+_REF_COLUMNS = {'NODE': 'node_id', 'LINK': 'link_id', 'GROUP': 'group_id', 'NETWORK': 'network_id'}
+
+def _write_table(archive, name, records):
+    """
+        Write an iterable of records to the archive as an NDJSON table,
+        one record at a time.
+    """
+    count = 0
+    with archive.open(name, 'w') as table:
+        for record in records:
+            table.write((json.dumps(record, default=str) + '\n').encode('utf-8'))
+            count += 1
+    log.info("Wrote %s records to %s", count, name)
+    return count
+
+def _read_table(archive, name):
+    """
+        Generate the records of an NDJSON table in the archive, one at a time.
+        A table which is not in the archive has no records.
+    """
+    if name not in archive.namelist():
+        return
+    with archive.open(name) as table:
+        for record in _read_ndjson(io.TextIOWrapper(table, encoding='utf-8')):
+            yield record
+
+def _float(value):
+    return float(value) if value is not None else None
+
+def _get_attributes_and_types(ref_key, resource_ids):
+    """
+        Get the attributes and types of a chunk of resources, as two dicts
+        keyed on resource ID.
+    """
+    ref_column = _REF_COLUMNS[ref_key]
+    attributes = dict((resource_id, []) for resource_id in resource_ids)
+    types = dict((resource_id, []) for resource_id in resource_ids)
+
+    for idx in range(0, len(resource_ids), data.qry_in_threshold):
+        chunk_ids = resource_ids[idx:idx+data.qry_in_threshold]
+        ras = db.DBSession.query(getattr(ResourceAttr, ref_column).label('resource_id'),
+                                 ResourceAttr.attr_id,
+                                 ResourceAttr.attr_is_var).filter(
+                                     getattr(ResourceAttr, ref_column).in_(chunk_ids)).order_by(ResourceAttr.id)
+        for ra in ras:
+            attributes[ra.resource_id].append({'attr_id': ra.attr_id, 'attr_is_var': ra.attr_is_var})
+
+        rts = db.DBSession.query(getattr(ResourceType, ref_column).label('resource_id'),
+                                 ResourceType.type_id,
+                                 ResourceType.child_template_id).filter(
+                                     getattr(ResourceType, ref_column).in_(chunk_ids)).order_by(ResourceType.id)
+        for rt in rts:
+            types[rt.resource_id].append({'id': rt.type_id, 'child_template_id': rt.child_template_id})
+
+    return attributes, types
+
+def _get_names(ref_key, resource_ids):
+    """
+        Get a dict of ID -> name for some nodes, links or groups.
+    """
+    resource_class = _RESOURCE_CLASSES[ref_key]
+    resource_ids = list(set(resource_ids))
+    names = {}
+    for idx in range(0, len(resource_ids), data.qry_in_threshold):
+        rows = db.DBSession.query(resource_class.id, resource_class.name).filter(
+            resource_class.id.in_(resource_ids[idx:idx+data.qry_in_threshold]))
+        names.update((r.id, r.name) for r in rows)
+    return names
+
+def _resource_records(ref_key, network_id, chunk_size):
+    """
+        Generate the node, link or group records of a network, a chunk at a time.
+    """
+    resource_class = _RESOURCE_CLASSES[ref_key]
+    columns = [resource_class.id, resource_class.name, resource_class.description]
+    if ref_key == 'NODE':
+        columns.extend([Node.x, Node.y, Node.alt_x, Node.alt_y, Node.layout])
+    elif ref_key == 'LINK':
+        columns.extend([Link.node_1_id, Link.node_2_id, Link.layout])
+
+    qry = db.DBSession.query(*columns).filter(
+        resource_class.network_id == network_id,
+        resource_class.status == 'A').order_by(resource_class.id)
+
+    for chunk in _chunks(iter(qry.yield_per(chunk_size)), chunk_size):
+        resource_ids = [r.id for r in chunk]
+        attributes, types = _get_attributes_and_types(ref_key, resource_ids)
+        if ref_key == 'LINK':
+            node_names = _get_names('NODE', [r.node_1_id for r in chunk] + [r.node_2_id for r in chunk])
+
+        for r in chunk:
+            record = {'name': r.name, 'description': r.description}
+            if ref_key == 'NODE':
+                record.update({'x': _float(r.x), 'y': _float(r.y),
+                               'alt_x': _float(r.alt_x), 'alt_y': _float(r.alt_y),
+                               'layout': r.layout})
+            elif ref_key == 'LINK':
+                record.update({'node_1': node_names[r.node_1_id],
+                               'node_2': node_names[r.node_2_id],
+                               'layout': r.layout})
+            record['attributes'] = attributes[r.id]
+            record['types'] = types[r.id]
+            yield record
+
+def _groupitem_records(scenario_ids, chunk_size):
+    qry = db.DBSession.query(ResourceGroupItem.ref_key,
+                             ResourceGroupItem.group_id,
+                             ResourceGroupItem.node_id,
+                             ResourceGroupItem.link_id,
+                             ResourceGroupItem.subgroup_id,
+                             Scenario.name.label('scenario')).join(
+                                 Scenario, Scenario.id == ResourceGroupItem.scenario_id).filter(
+                                     Scenario.id.in_(scenario_ids)).order_by(ResourceGroupItem.id)
+
+    for chunk in _chunks(iter(qry.yield_per(chunk_size)), chunk_size):
+        group_names = _get_names('GROUP', [i.group_id for i in chunk] + [i.subgroup_id for i in chunk if i.subgroup_id])
+        node_names = _get_names('NODE', [i.node_id for i in chunk if i.node_id])
+        link_names = _get_names('LINK', [i.link_id for i in chunk if i.link_id])
+        for item in chunk:
+            if item.ref_key == 'NODE':
+                resource = node_names[item.node_id]
+            elif item.ref_key == 'LINK':
+                resource = link_names[item.link_id]
+            else:
+                resource = group_names[item.subgroup_id]
+            yield {'scenario': item.scenario,
+                   'group': group_names[item.group_id],
+                   'ref_key': item.ref_key,
+                   'resource': resource}
+
+def _dataset_records(dataset_ids, user_id, unreadable, chunk_size):
+    """
+        Generate the dataset records, a chunk at a time. Hidden datasets the
+        user cannot read are left out, and their IDs added to 'unreadable'.
+    """
+    for idx in range(0, len(dataset_ids), chunk_size):
+        datasets = db.DBSession.query(Dataset).filter(
+            Dataset.id.in_(dataset_ids[idx:idx+chunk_size])).all()
+        for d in datasets:
+            if d.check_read_permission(user_id, do_raise=False) is False:
+                unreadable.add(d.id)
+                continue
+            metadata = d.get_metadata_as_dict()
+            #Where the value is stored is up to the importing system.
+            metadata.pop(mongo_storage_location_key, None)
+            record = {'hash': d.hash,
+                      'type': d.type,
+                      'name': d.name,
+                      'unit_id': d.unit_id,
+                      'value': d.value,
+                      'metadata': metadata}
+            #Don't keep the datasets in the session once they've been read
+            db.DBSession.expunge(d)
+            yield record
+
+def _data_records(network_id, scenario_ids, hashes, unreadable, chunk_size):
+    for ref_key, ref_column in _REF_COLUMNS.items():
+        columns = [Scenario.name.label('scenario'),
+                   ResourceAttr.attr_id,
+                   ResourceScenario.dataset_id]
+        qry = db.DBSession.query(*columns).join(
+            ResourceAttr, ResourceAttr.id == ResourceScenario.resource_attr_id).join(
+                Scenario, Scenario.id == ResourceScenario.scenario_id).filter(
+                    ResourceScenario.scenario_id.in_(scenario_ids))
+
+        if ref_key == 'NETWORK':
+            qry = qry.add_columns(ResourceAttr.network_id.label('resource_id')).filter(
+                ResourceAttr.network_id == network_id)
+        else:
+            resource_class = _RESOURCE_CLASSES[ref_key]
+            qry = qry.add_columns(resource_class.name.label('resource')).join(
+                resource_class, resource_class.id == getattr(ResourceAttr, ref_column)).filter(
+                    resource_class.network_id == network_id,
+                    resource_class.status == 'A')
+
+        for rs in qry.order_by(ResourceScenario.scenario_id, ResourceScenario.resource_attr_id).yield_per(chunk_size):
+            if rs.dataset_id in unreadable:
+                continue
+            yield {'scenario': rs.scenario,
+                   'ref_key': ref_key,
+                   'resource': None if ref_key == 'NETWORK' else rs.resource,
+                   'attr_id': rs.attr_id,
+                   'dataset_hash': hashes[rs.dataset_id]}
+
+@required_perms("get_network", "get_data")
+def export_network_archive(network_id, archive_path, scenario_ids=None, chunk_size=1000, **kwargs):
+    """
+        Write a network, with all its data, to a zip archive of NDJSON tables
+        which can be loaded with import_network_archive.
+
+        args:
+            network_id (int): The network to export
+            archive_path (str): The path of the archive to write
+            scenario_ids (list(int)): Optional. Only export the data of these
+                                      scenarios. By default all the network's
+                                      scenarios are exported.
+            chunk_size (int): The number of records to read at a time
+        returns:
+            A JSONObject with the number of records written to each table
+    """
+    user_id = kwargs.get('user_id')
+
+    net_i = db.DBSession.query(Network).filter(Network.id == network_id).first()
+    if net_i is None:
+        raise ResourceNotFoundError("Network %s not found"%(network_id))
+    net_i.check_read_permission(user_id)
+
+    scen_qry = db.DBSession.query(Scenario).filter(Scenario.network_id == network_id,
+                                                   Scenario.status == 'A')
+    if scenario_ids is not None:
+        scen_qry = scen_qry.filter(Scenario.id.in_(scenario_ids))
+    scenarios = scen_qry.order_by(Scenario.id).all()
+    scenario_ids = [s.id for s in scenarios]
+
+    attributes, types = _get_attributes_and_types('NETWORK', [net_i.id])
+    header = {
+        'format_version': ARCHIVE_FORMAT_VERSION,
+        'name': net_i.name,
+        'description': net_i.description,
+        'projection': net_i.projection,
+        'layout': net_i.layout,
+        'appdata': net_i.appdata,
+        'attributes': attributes[net_i.id],
+        'types': types[net_i.id],
+        'scenarios': [{'name': s.name,
+                       'description': s.description,
+                       'layout': s.layout,
+                       'start_time': s.start_time,
+                       'end_time': s.end_time,
+                       'time_step': s.time_step} for s in scenarios],
+    }
+
+    written = {}
+    with zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('network.json', json.dumps(header, default=str))
+
+        written['nodes'] = _write_table(archive, 'nodes.ndjson',
+                                        _resource_records('NODE', network_id, chunk_size))
+        written['links'] = _write_table(archive, 'links.ndjson',
+                                        _resource_records('LINK', network_id, chunk_size))
+        written['groups'] = _write_table(archive, 'groups.ndjson',
+                                         _resource_records('GROUP', network_id, chunk_size))
+        written['groupitems'] = _write_table(archive, 'groupitems.ndjson',
+                                             _groupitem_records(scenario_ids, chunk_size))
+
+        #Each dataset is written once, however many times it is used.
+        dataset_ids = [r.dataset_id for r in db.DBSession.query(ResourceScenario.dataset_id).filter(
+            ResourceScenario.scenario_id.in_(scenario_ids)).distinct()]
+        hashes = {}
+        for idx in range(0, len(dataset_ids), data.qry_in_threshold):
+            hashes.update(db.DBSession.query(Dataset.id, Dataset.hash).filter(
+                Dataset.id.in_(dataset_ids[idx:idx+data.qry_in_threshold])).all())
+        unreadable = set()
+        written['datasets'] = _write_table(archive, 'datasets.ndjson',
+                                           _dataset_records(dataset_ids, user_id, unreadable, chunk_size))
+        written['data'] = _write_table(archive, 'data.ndjson',
+                                       _data_records(network_id, scenario_ids, hashes, unreadable, chunk_size))
+
+    return JSONObject(written)
+
+@required_perms("add_network")
+def import_network_archive(archive_path, project_id=None, chunk_size=1000, **kwargs):
+    """
+        Add a network from an archive written by export_network_archive,
+        reading and inserting chunk_size records at a time.
+
+        args:
+            archive_path (str): The path of the archive
+            project_id (int): The project to add the network to
+            chunk_size (int): The number of records to insert at a time
+        returns:
+            A JSONObject with the new network's id and name
+    """
+    with zipfile.ZipFile(archive_path) as archive:
+        if 'network.json' not in archive.namelist():
+            raise HydraError(f"{archive_path} is not a network archive")
+
+        header = json.loads(archive.read('network.json'))
+        if header.get('format_version', ARCHIVE_FORMAT_VERSION) > ARCHIVE_FORMAT_VERSION:
+            raise HydraError(f"Unable to read network archive format version"
+                             f" {header['format_version']}")
+
+        net_i = _add_network_header(header, project_id, **kwargs)
+        context = _make_context(net_i, **kwargs)
+
+        for kind in ('nodes', 'links', 'groups', 'groupitems'):
+            for chunk in _chunks(_read_table(archive, f'{kind}.ndjson'), chunk_size):
+                _PART_IMPORTERS[kind](context, chunk)
+
+        #Map the hashes in the archive to the IDs of the datasets in this database.
+        hash_id_map = {}
+        for chunk in _chunks(_read_table(archive, 'datasets.ndjson'), chunk_size):
+            incoming = []
+            for record in chunk:
+                value = record['value']
+                incoming.append(objects.Dataset({
+                    'type': record['type'],
+                    'name': record['name'],
+                    'unit_id': record['unit_id'],
+                    'value': value if value is None or isinstance(value, str) else json.dumps(value),
+                    'metadata': record['metadata'],
+                }))
+            new_datasets = data._bulk_insert_data(incoming, context['user_id'], context['source'])
+            hash_id_map.update((r['hash'], d.id) for r, d in zip(chunk, new_datasets))
+
+        for chunk in _chunks(_read_table(archive, 'data.ndjson'), chunk_size):
+            _add_resource_scenarios(context, chunk, [hash_id_map[r['dataset_hash']] for r in chunk])
+
+    db.DBSession.flush()
+
+    return JSONObject({'id': net_i.id, 'name': net_i.name})
@@ -0,0 +1,598 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# (c) Copyright 2013 to 2017 University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    Import a network from a directory of NDJSON or CSV parts, a chunk at a
+    time, so that networks too large to hold in memory as a single
+    JSONObject can be loaded.
+
+    The directory contains:
+
+        network.json       The network itself: name, description, layout,
+                           attributes, types and its scenarios (without
+                           any data). Required.
+        nodes*.ndjson      One node per line, with name, description,
+        nodes*.csv         x, y, alt_x, alt_y, and (NDJSON only) layout,
+                           attributes and types.
+        links*.ndjson      One link per line, as for nodes, with the names
+        links*.csv         of the nodes it joins in node_1 and node_2.
+        groups*.ndjson     One resource group per line, as for nodes.
+        groups*.csv
+        groupitems*.ndjson One group item per line: scenario, group,
+        groupitems*.csv    ref_key and resource, all as names.
+        data*.ndjson       One resource scenario per line: scenario, ref_key,
+        data*.csv          resource (name, ignored for NETWORK) and attr_id,
+                           plus the dataset, either as a 'dataset' object
+                           (NDJSON) or in type, name, unit_id, value and
+                           metadata columns (CSV).
+
+    Parts of each kind are read in name order, and '.jsonl' is accepted
+    as well as '.ndjson'. Everything is referred to by name rather than
+    by ID, so nothing about the network needs to be held in memory between
+    chunks. A resource attribute referred to by a data row which is not
+    already on its resource is added to it.
+"""
+import os
+import csv
+import json
+import itertools
+
+from ..exceptions import HydraError, ResourceNotFoundError
+from . import network
+from . import data
+from .resource_attribute_cache import clear_network_resource_attributes_cache
+from .objects import JSONObject, Dataset
+from ..util.permissions import required_perms
+from .. import db
+from ..db.model import Network, Node, Link, ResourceGroup, ResourceGroupItem,\
+        ResourceAttr, ResourceScenario, Scenario, Attr
+
+import logging
+log = logging.getLogger(__name__)
+
+#The kinds of part, in the order in which they are imported.
+_PART_KINDS = ('nodes', 'links', 'groups', 'groupitems', 'data')
+
+_PART_EXTENSIONS = ('.ndjson', '.jsonl', '.csv')
+
+_RESOURCE_CLASSES = {'NODE': Node, 'LINK': Link, 'GROUP': ResourceGroup}
+
+_RA_COLUMNS = {'NODE': 'node_id', 'LINK': 'link_id', 'GROUP': 'group_id', 'NETWORK': 'network_id'}
+
+#CSV columns which hold numbers, by kind of part. Everything else is read as a string.
+_CSV_FLOAT_COLUMNS = {
+    'nodes': ('x', 'y', 'alt_x', 'alt_y'),
+}
+_CSV_INT_COLUMNS = {
+    'data': ('attr_id', 'unit_id'),
+}
+
+def _list_parts(directory, kind):
+    """
+        Get the file names of all the parts of a given kind, in name order.
+    """
+    parts = []
+    for filename in sorted(os.listdir(directory)):
+        name, ext = os.path.splitext(filename)
+        if ext in _PART_EXTENSIONS and name.startswith(kind):
+            parts.append(filename)
+    return parts
+
+def _read_records(path, kind, skip=0):
+    """
+        Generate the records in a part file one at a time, as dicts,
+        skipping the first 'skip' of them (those already imported).
+    """
+    with open(path, newline='') as part_file:
+        if path.endswith('.csv'):
+            float_cols = _CSV_FLOAT_COLUMNS.get(kind, ())
+            int_cols = _CSV_INT_COLUMNS.get(kind, ())
+            records = csv.DictReader(part_file)
+            for record in itertools.islice(records, skip, None):
+                for k, v in record.items():
+                    if v == '':
+                        record[k] = None
+                    elif k in float_cols:
+                        record[k] = float(v)
+                    elif k in int_cols:
+                        record[k] = int(v)
+                yield record
+        else:
+            for record in _read_ndjson(part_file, skip=skip):
+                yield record
+
+def _read_ndjson(part_file, skip=0):
+    """
+        Generate the records in an open NDJSON file one at a time,
+        skipping blank lines and the first 'skip' records.
+    """
+    lines = (line for line in part_file if line.strip() != '')
+    for line in itertools.islice(lines, skip, None):
+        yield json.loads(line)
+
+def _chunks(records, chunk_size):
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+def _load_checkpoint(checkpoint_path):
+    if checkpoint_path is None or not os.path.exists(checkpoint_path):
+        return {'network_id': None, 'parts': {}}
+    with open(checkpoint_path) as checkpoint_file:
+        return json.load(checkpoint_file)
+
+def _save_checkpoint(checkpoint_path, checkpoint):
+    """
+        Write the checkpoint to a temporary file first, so an interruption
+        can't leave a half-written checkpoint behind.
+    """
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(tmp_path, checkpoint_path)
+
+def _get_resource_ids(network_id, ref_key, names):
+    """
+        Get a dict of name -> ID for the named nodes, links or groups
+        in a network.
+    """
+    resource_class = _RESOURCE_CLASSES.get(ref_key)
+    if resource_class is None:
+        raise HydraError(f"A ref key of {ref_key} is not valid here.")
+
+    names = list(set(str(n) for n in names))
+    id_map = {}
+    for idx in range(0, len(names), data.qry_in_threshold):
+        rows = db.DBSession.query(resource_class.id, resource_class.name).filter(
+            resource_class.network_id == network_id,
+            resource_class.name.in_(names[idx:idx+data.qry_in_threshold])).all()
+        id_map.update((str(r.name), r.id) for r in rows)
+
+    missing = [n for n in names if n not in id_map]
+    if len(missing) > 0:
+        raise ResourceNotFoundError(f"{ref_key.capitalize()}s not found in network"
+                                    f" {network_id}: {missing}")
+    return id_map
+
+def _make_resources(records):
+    """
+        Turn a chunk of incoming node, link or group records into the
+        JSONObjects expected by the network functions, giving them and
+        their attributes temporary negative IDs.
+    """
+    resources = []
+    ra_id = -1
+    for i, record in enumerate(records):
+        resource = JSONObject(record)
+        resource.id = -(i + 1)
+        if resource.get('attributes') is None:
+            resource.attributes = []
+        for ra in resource.attributes:
+            ra.id = ra_id
+            ra_id -= 1
+            if ra.get('attr_is_var') is None:
+                ra.attr_is_var = 'N'
+        if resource.get('types') is None:
+            resource.types = []
+        resources.append(resource)
+    return resources
+
+def _add_default_data(context, defaults):
+    """
+        Add the default datasets of newly added resource attributes to every
+        scenario in the network.
+    """
+    rs_rows = []
+    for default in defaults.values():
+        for scenario_id in context['scenario_ids'].values():
+            rs_rows.append({'scenario_id': scenario_id,
+                            'resource_attr_id': default['id'],
+                            'dataset_id': default['dataset_id'],
+                            'source': context['source']})
+    if len(rs_rows) > 0:
+        db.DBSession.bulk_insert_mappings(ResourceScenario, rs_rows)
+
+def _import_nodes(context, records):
+    nodes = _make_resources(records)
+    name_map = network._add_nodes_to_database(context['network'], nodes)
+    _, defaults, context['template_lookup'] = network._bulk_add_resource_attrs(
+        context['network'].id, 'NODE', nodes, name_map, context['template_lookup'])
+    _add_default_data(context, defaults)
+
+def _import_links(context, records):
+    links = _make_resources(records)
+    node_names = []
+    for link in links:
+        #The links refer to their nodes by name, which the node map is keyed on
+        link.node_1_id = str(link.node_1)
+        link.node_2_id = str(link.node_2)
+        node_names.extend([link.node_1_id, link.node_2_id])
+
+    node_ids = _get_resource_ids(context['network'].id, 'NODE', node_names)
+    node_map = dict((name, network._NewRow(node_id, name)) for name, node_id in node_ids.items())
+
+    name_map = network._add_links_to_database(context['network'], links, node_map)
+    _, defaults, context['template_lookup'] = network._bulk_add_resource_attrs(
+        context['network'].id, 'LINK', links, name_map, context['template_lookup'])
+    _add_default_data(context, defaults)
+
+def _import_groups(context, records):
+    groups = _make_resources(records)
+    group_rows = [{'network_id': context['network'].id,
+                   'name': g.name,
+                   'description': g.description} for g in groups]
+    new_ids = db.bulk_insert_returning_ids(ResourceGroup, group_rows)
+    name_map = dict((str(g.name), network._NewRow(group_id, g.name))
+                    for g, group_id in zip(groups, new_ids))
+    _, defaults, context['template_lookup'] = network._bulk_add_resource_attrs(
+        context['network'].id, 'GROUP', groups, name_map, context['template_lookup'])
+    _add_default_data(context, defaults)
+
+def _get_scenario_id(context, scenario_name):
+    scenario_id = context['scenario_ids'].get(scenario_name)
+    if scenario_id is None:
+        raise ResourceNotFoundError(f"Scenario {scenario_name} not found in network"
+                                    f" {context['network'].id}")
+    return scenario_id
+
+def _import_groupitems(context, records):
+    names_by_ref_key = {'GROUP': [r['group'] for r in records]}
+    for record in records:
+        names_by_ref_key.setdefault(record['ref_key'], []).append(record['resource'])
+
+    id_maps = dict((ref_key, _get_resource_ids(context['network'].id, ref_key, names))
+                   for ref_key, names in names_by_ref_key.items())
+
+    item_rows = []
+    for record in records:
+        ref_key = record['ref_key']
+        ref_id = id_maps[ref_key][str(record['resource'])]
+        item_rows.append({
+            'scenario_id': _get_scenario_id(context, record['scenario']),
+            'group_id': id_maps['GROUP'][str(record['group'])],
+            'ref_key': ref_key,
+            'node_id': ref_id if ref_key == 'NODE' else None,
+            'link_id': ref_id if ref_key == 'LINK' else None,
+            'subgroup_id': ref_id if ref_key == 'GROUP' else None,
+        })
+    db.DBSession.bulk_insert_mappings(ResourceGroupItem, item_rows)
+
+def _get_resource_attr_ids(context, records):
+    """
+        Get a dict of (ref_key, resource name, attr_id) -> resource attribute ID
+        for the data records, adding any resource attributes which do not
+        exist yet. The resource name is None for network attributes.
+    """
+    network_id = context['network'].id
+
+    #(ref_key, resource name, attr_id) -> resource ID
+    wanted = {}
+    for ref_key in set(r['ref_key'] for r in records):
+        keyed_records = [r for r in records if r['ref_key'] == ref_key]
+        if ref_key == 'NETWORK':
+            for r in keyed_records:
+                wanted[('NETWORK', None, r['attr_id'])] = network_id
+        else:
+            id_map = _get_resource_ids(network_id, ref_key, [r['resource'] for r in keyed_records])
+            for r in keyed_records:
+                name = str(r['resource'])
+                wanted[(ref_key, name, r['attr_id'])] = id_map[name]
+
+    ra_ids = {}
+    id_key_map = dict(((k[0], resource_id, k[2]), k) for k, resource_id in wanted.items())
+    attr_ids = list(set(k[2] for k in wanted))
+    for ref_key in set(k[0] for k in wanted):
+        ra_column = getattr(ResourceAttr, _RA_COLUMNS[ref_key])
+        resource_ids = list(set(v for k, v in wanted.items() if k[0] == ref_key))
+        for idx in range(0, len(resource_ids), data.qry_in_threshold):
+            rows = db.DBSession.query(ResourceAttr.id, ra_column.label('resource_id'), ResourceAttr.attr_id).filter(
+                ra_column.in_(resource_ids[idx:idx+data.qry_in_threshold]),
+                ResourceAttr.attr_id.in_(attr_ids)).all()
+            for row in rows:
+                key = id_key_map.get((ref_key, row.resource_id, row.attr_id))
+                if key is not None:
+                    ra_ids[key] = row.id
+
+    missing = [k for k in wanted if k not in ra_ids]
+    if len(missing) > 0:
+        missing_attr_ids = set(k[2] for k in missing)
+        existing_attr_ids = set(a.id for a in db.DBSession.query(Attr.id).filter(
+            Attr.id.in_(missing_attr_ids)))
+        for attr_id in missing_attr_ids - existing_attr_ids:
+            raise HydraError(f"Unable to process attribute {attr_id} as it does not exist")
+
+        new_ras = []
+        for ref_key, name, attr_id in missing:
+            resource_id = wanted[(ref_key, name, attr_id)]
+            new_ras.append({
+                'ref_key': ref_key,
+                'node_id': resource_id if ref_key == 'NODE' else None,
+                'link_id': resource_id if ref_key == 'LINK' else None,
+                'group_id': resource_id if ref_key == 'GROUP' else None,
+                'network_id': resource_id if ref_key == 'NETWORK' else None,
+                'attr_id': attr_id,
+                'attr_is_var': 'N',
+            })
+        new_ids = db.bulk_insert_returning_ids(ResourceAttr, new_ras)
+        ra_ids.update(zip(missing, new_ids))
+        clear_network_resource_attributes_cache(network_id)
+
+    return ra_ids
+
+def _import_data(context, records):
+    ra_ids = _get_resource_attr_ids(context, records)
+
+    datasets = []
+    for record in records:
+        if record.get('dataset') is not None:
+            dataset = Dataset(record['dataset'])
+        else:
+            dataset = Dataset({'type': record.get('type'),
+                               'name': record.get('name'),
+                               'unit_id': record.get('unit_id'),
+                               'value': record.get('value'),
+                               'metadata': record.get('metadata')})
+        if dataset.value is not None and not isinstance(dataset.value, str):
+            dataset.value = json.dumps(dataset.value)
+        if dataset.name is None:
+            dataset.name = str(record.get('resource') or 'network') + ' ' + str(record['attr_id'])
+        datasets.append(dataset)
+
+    new_datasets = data._bulk_insert_data(datasets, context['user_id'], context['source'])
+
+    _add_resource_scenarios(context, records, [d.id for d in new_datasets], ra_ids)
+
+def _add_resource_scenarios(context, records, dataset_ids, ra_ids=None):
+    """
+        Add a resource scenario for each data record, with the dataset
+        of the same index in dataset_ids.
+    """
+    if ra_ids is None:
+        ra_ids = _get_resource_attr_ids(context, records)
+
+    rs_rows = []
+    for record, dataset_id in zip(records, dataset_ids):
+        ref_key = record['ref_key']
+        name = None if ref_key == 'NETWORK' else str(record['resource'])
+        rs_rows.append({'scenario_id': _get_scenario_id(context, record['scenario']),
+                        'resource_attr_id': ra_ids[(ref_key, name, record['attr_id'])],
+                        'dataset_id': dataset_id,
+                        'source': context['source']})
+    db.DBSession.bulk_insert_mappings(ResourceScenario, rs_rows)
+
+def _skip_imported_resources(context, kind, records):
+    """
+        Remove the nodes, links or groups which are already in the network.
+    """
+    ref_key = {'nodes': 'NODE', 'links': 'LINK', 'groups': 'GROUP'}[kind]
+    resource_class = _RESOURCE_CLASSES[ref_key]
+    names = list(set(str(r['name']) for r in records))
+    existing = set()
+    for idx in range(0, len(names), data.qry_in_threshold):
+        existing.update(str(r.name) for r in db.DBSession.query(resource_class.name).filter(
+            resource_class.network_id == context['network'].id,
+            resource_class.name.in_(names[idx:idx+data.qry_in_threshold])))
+    return [r for r in records if str(r['name']) not in existing]
+
+def _skip_imported_groupitems(context, records):
+    """
+        Remove the group items which are already in their scenarios.
+    """
+    names_by_ref_key = {'GROUP': [r['group'] for r in records]}
+    for record in records:
+        names_by_ref_key.setdefault(record['ref_key'], []).append(record['resource'])
+
+    id_maps = dict((ref_key, _get_resource_ids(context['network'].id, ref_key, names))
+                   for ref_key, names in names_by_ref_key.items())
+
+    existing = set()
+    for item in db.DBSession.query(ResourceGroupItem).filter(
+            ResourceGroupItem.group_id.in_(list(id_maps['GROUP'].values()))):
+        existing.add((item.scenario_id, item.group_id, item.ref_key,
+                      item.node_id or item.link_id or item.subgroup_id))
+
+    remaining = []
+    for record in records:
+        ref_key = record['ref_key']
+        key = (_get_scenario_id(context, record['scenario']),
+               id_maps['GROUP'][str(record['group'])],
+               ref_key,
+               id_maps[ref_key][str(record['resource'])])
+        if key not in existing:
+            remaining.append(record)
+    return remaining
+
+def _skip_imported_data(context, records):
+    """
+        Remove the data records which already have a resource scenario.
+    """
+    network_id = context['network'].id
+    existing = set()
+    for ref_key in set(r['ref_key'] for r in records):
+        ra_column = getattr(ResourceAttr, _RA_COLUMNS[ref_key])
+        if ref_key == 'NETWORK':
+            names = {None: network_id}
+        else:
+            names = _get_resource_ids(network_id, ref_key,
+                                      [r['resource'] for r in records if r['ref_key'] == ref_key])
+        resource_names = dict((resource_id, name) for name, resource_id in names.items())
+        resource_ids = list(resource_names)
+        for idx in range(0, len(resource_ids), data.qry_in_threshold):
+            rows = db.DBSession.query(ResourceScenario.scenario_id,
+                                      ra_column.label('resource_id'),
+                                      ResourceAttr.attr_id).filter(
+                ResourceScenario.resource_attr_id == ResourceAttr.id,
+                ra_column.in_(resource_ids[idx:idx+data.qry_in_threshold]),
+                ResourceScenario.scenario_id.in_(list(context['scenario_ids'].values()))).all()
+            existing.update((row.scenario_id, ref_key, resource_names[row.resource_id], row.attr_id)
+                            for row in rows)
+
+    remaining = []
+    for record in records:
+        ref_key = record['ref_key']
+        name = None if ref_key == 'NETWORK' else str(record['resource'])
+        key = (_get_scenario_id(context, record['scenario']), ref_key, name, record['attr_id'])
+        if key not in existing:
+            remaining.append(record)
+    return remaining
+
+def _skip_imported(context, kind, records):
+    """
+        Remove the records of the first chunk read when resuming an import
+        which are already in the database. The chunk may have been committed
+        before the import was interrupted, but not recorded in the checkpoint.
+    """
+    if kind == 'groupitems':
+        remaining = _skip_imported_groupitems(context, records)
+    elif kind == 'data':
+        remaining = _skip_imported_data(context, records)
+    else:
+        remaining = _skip_imported_resources(context, kind, records)
+    if len(remaining) < len(records):
+        log.info("Skipping %s %s which were already imported", len(records) - len(remaining), kind)
+    return remaining
+
+_PART_IMPORTERS = {
+    'nodes': _import_nodes,
+    'links': _import_links,
+    'groups': _import_groups,
+    'groupitems': _import_groupitems,
+    'data': _import_data,
+}
+
+def _add_network_header(header, project_id, **kwargs):
+    """
+        Add the network described in a network.json header, with its
+        scenarios but none of its resources.
+    """
+    header = JSONObject(header)
+
+    if project_id is not None:
+        header.project_id = project_id
+
+    header.id = None
+    for i, ra in enumerate(header.get('attributes') or []):
+        ra.id = -(i + 1)
+        if ra.get('attr_is_var') is None:
+            ra.attr_is_var = 'N'
+    header.nodes = []
+    header.links = []
+    header.resourcegroups = []
+    for s in header.get('scenarios') or []:
+        s.resourcescenarios = []
+        s.resourcegroupitems = []
+
+    return network.add_network(header, **kwargs)
+
+def _make_context(net_i, **kwargs):
+    """
+        The state shared by the importers of each kind of part.
+    """
+    scenario_ids = dict(db.DBSession.query(Scenario.name, Scenario.id).filter(
+        Scenario.network_id == net_i.id).all())
+
+    return {
+        'network': net_i,
+        'scenario_ids': scenario_ids,
+        'template_lookup': {},
+        'user_id': kwargs.get('user_id'),
+        'source': kwargs.get('app_name'),
+    }
+
+@required_perms("add_network")
+def import_network_directory(directory, project_id=None, checkpoint_path=None, chunk_size=1000, **kwargs):
+    """
+        Add a network from a directory of NDJSON or CSV parts (see the
+        description at the top of this module), reading and inserting
+        chunk_size records at a time.
+
+        args:
+            directory (str): The directory containing network.json and the parts
+            project_id (int): The project to add the network to. Overrides any
+                              project_id in network.json
+            checkpoint_path (str): Optional path of a checkpoint file. If given,
+                              the transaction is committed after each chunk and
+                              the progress recorded in this file, so that if the
+                              import is interrupted, calling this again with the
+                              same checkpoint resumes where it stopped, skipping
+                              any records which were committed but not recorded.
+            chunk_size (int): The number of records to insert at a time
+        returns:
+            A JSONObject with the network's id and name, and the number of
+            records of each kind imported by this call.
+    """
+    user_id = kwargs.get('user_id')
+
+    checkpoint = _load_checkpoint(checkpoint_path)
+
+    net_i = None
+    if checkpoint['network_id'] is not None:
+        log.info("Resuming import of network %s from %s", checkpoint['network_id'], checkpoint_path)
+        net_i = db.DBSession.query(Network).filter(Network.id == checkpoint['network_id']).first()
+        if net_i is None or net_i.name != checkpoint.get('network_name'):
+            #The checkpoint is written before the network is committed, so
+            #the import may have been interrupted before the network was added.
+            log.info("Network %s from checkpoint %s was not added. Starting again.",
+                     checkpoint['network_id'], checkpoint_path)
+            net_i = None
+            checkpoint = {'network_id': None, 'parts': {}}
+        else:
+            net_i.check_write_permission(user_id)
+
+    resuming = net_i is not None
+    if net_i is None:
+        header_path = os.path.join(directory, 'network.json')
+        if not os.path.exists(header_path):
+            raise HydraError(f"No network.json found in {directory}")
+        with open(header_path) as header_file:
+            header = json.load(header_file)
+
+        net_i = _add_network_header(header, project_id, **kwargs)
+        checkpoint['network_id'] = net_i.id
+        checkpoint['network_name'] = net_i.name
+        if checkpoint_path is not None:
+            _save_checkpoint(checkpoint_path, checkpoint)
+            db.DBSession.commit()
+
+    context = _make_context(net_i, **kwargs)
+
+    imported = dict((kind, 0) for kind in _PART_KINDS)
+    for kind in _PART_KINDS:
+        for part in _list_parts(directory, kind):
+            done = checkpoint['parts'].get(part, 0)
+            records = _read_records(os.path.join(directory, part), kind, skip=done)
+            for chunk in _chunks(records, chunk_size):
+                #Each chunk is committed before the checkpoint is saved, so
+                #only the first one read when resuming can be in the database already.
+                new_records = _skip_imported(context, kind, chunk) if resuming else chunk
+                resuming = False
+                if len(new_records) > 0:
+                    _PART_IMPORTERS[kind](context, new_records)
+                done += len(chunk)
+                imported[kind] += len(new_records)
+                if checkpoint_path is not None:
+                    db.DBSession.commit()
+                    checkpoint['parts'][part] = done
+                    _save_checkpoint(checkpoint_path, checkpoint)
+                else:
+                    db.DBSession.flush()
+            log.info("Imported %s records from %s", done, part)
+
+    return JSONObject({'id': net_i.id, 'name': net_i.name, 'imported': imported})
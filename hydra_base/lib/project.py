@@ -31,6 +31,7 @@ from . import network
 from .objects import JSONObject
 from ..util.permissions import required_perms
 from . import scenario
+from .attribute_scope import new_attr_scope_version
 from ..exceptions import ResourceNotFoundError
 from datetime import datetime
 
@@ -156,10 +157,12 @@ def update_project(project, **kwargs):
             #check the user has the correct permission to write to the target project
             _get_project(project.parent_id, user_id, check_write=True)
             proj_i.parent_id = project.parent_id
+            new_attr_scope_version()
     else:
         # parent_id has changed to None
         if proj_i.parent_id is not None:
             proj_i.parent_id = None
+            new_attr_scope_version()
 
     if project.attributes:
         attr_map = hdb.add_resource_attributes(proj_i, project.attributes)
@@ -221,6 +224,8 @@ def move_project(project_id, target_project_id, **kwargs):
 
     db.DBSession.flush()
 
+    new_attr_scope_version()
+
     return proj_i
 
 @required_perms('edit_project')
@@ -234,6 +239,7 @@ def remove_project_parent(project_id, **kwargs):
     Project.clear_cache(user_id)
     proj_i.parent_id = None
     db.DBSession.flush()
+    new_attr_scope_version()
 
     return proj_i
 
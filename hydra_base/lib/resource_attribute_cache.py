@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# (c) Copyright 2013 to 2017 University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    A cache of all the resource attributes in a network, across the network
+    itself and its nodes, links and groups.
+
+    The resource attributes are held as columns: arrays of the resource
+    attribute IDs, attribute IDs, ref keys, resource IDs and is_var flags,
+    with each distinct attribute stored once. Each network has a generation
+    token in the cache, and the columns are stored under the current
+    generation, so one change invalidates them everywhere. The token is
+    changed when a transaction which added or removed resource attributes in
+    the network ends, whether it was committed or rolled back. Until then,
+    that session reads the network's resource attributes from the database
+    without caching them. Recently used networks are also kept in memory, so
+    a lookup does not need to unpickle them again.
+"""
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .. import db
+from ..db.model import Attr, ResourceAttr, Node, Link, ResourceGroup
+from .cache import cache
+from .objects import JSONObject
+from .data import qry_in_threshold
+
+import logging
+log = logging.getLogger(__name__)
+
+NETWORK_RA_CACHE_KEY = 'network_resource_attributes'
+#Set in a session's info to the IDs of the networks whose resource attributes it has changed
+NETWORK_RA_PENDING_KEY = 'network_resource_attributes_pending'
+
+#The order of the ref keys, whose positions are stored in the 'ref_keys' array
+REF_KEYS = ('NETWORK', 'NODE', 'LINK', 'GROUP')
+
+REF_COLUMNS = {'NETWORK': 'network_id', 'NODE': 'node_id', 'LINK': 'link_id', 'GROUP': 'group_id'}
+
+_ATTR_COLUMNS = ('id', 'name', 'dimension_id', 'description', 'cr_date', 'project_id', 'network_id')
+
+#The number of networks to keep in memory
+LOCAL_CACHE_SIZE = 32
+
+_local_cache = OrderedDict()
+
+def _generation_key(network_id):
+    return f"{NETWORK_RA_CACHE_KEY}_generation_{network_id}"
+
+def _payload_key(network_id, generation):
+    return f"{NETWORK_RA_CACHE_KEY}_{network_id}_{generation}"
+
+def clear_network_resource_attributes_cache(network_id):
+    """
+        Invalidate the cached resource attributes of a network once the
+        current transaction ends. Call this whenever resource attributes are
+        added to or removed from the network or any of its nodes, links or
+        groups, or their is_var flag changes.
+    """
+    if network_id is None:
+        return
+    db.DBSession().info.setdefault(NETWORK_RA_PENDING_KEY, set()).add(network_id)
+    _local_cache.pop(network_id, None)
+
+def _renew_generation(network_id):
+    old_generation = cache.get(_generation_key(network_id))
+    cache.set(_generation_key(network_id), uuid.uuid4().hex)
+    if old_generation is not None:
+        cache.delete(_payload_key(network_id, old_generation))
+    _local_cache.pop(network_id, None)
+
+@event.listens_for(Session, 'after_transaction_end')
+def _renew_generations_after_transaction(session, transaction):
+    """
+        Invalidate the cached resource attributes of the networks changed in a
+        transaction once it is committed or rolled back. They were not cached
+        while it was open, so none can be stored under the new generations.
+    """
+    if transaction.parent is None:
+        for network_id in session.info.pop(NETWORK_RA_PENDING_KEY, ()):
+            _renew_generation(network_id)
+
+def _get_generation(network_id):
+    generation = cache.get(_generation_key(network_id))
+    if generation is None:
+        generation = uuid.uuid4().hex
+        cache.set(_generation_key(network_id), generation)
+    return generation
+
+def _query_resource_attributes(network_id):
+    """
+        Get the resource attributes on a network and its nodes, links and
+        groups as (ref_key, resource attribute row) pairs.
+    """
+    ra_columns = (ResourceAttr.id, ResourceAttr.attr_id, ResourceAttr.attr_is_var,
+                  ResourceAttr.cr_date)
+
+    yield from (('NETWORK', ra) for ra in db.DBSession.query(
+        *ra_columns, ResourceAttr.network_id.label('ref_id')).filter(
+        ResourceAttr.network_id == network_id))
+
+    for ref_key, resource in (('NODE', Node), ('LINK', Link), ('GROUP', ResourceGroup)):
+        ref_column = getattr(ResourceAttr, REF_COLUMNS[ref_key])
+        yield from ((ref_key, ra) for ra in db.DBSession.query(
+            *ra_columns, ref_column.label('ref_id')).join(
+            resource, resource.id == ref_column).filter(
+            resource.network_id == network_id))
+
+def _build_payload(network_id):
+    ids, attr_ids, ref_keys, ref_ids, is_var, cr_dates = [], [], [], [], [], []
+    for ref_key, ra in _query_resource_attributes(network_id):
+        ids.append(ra.id)
+        attr_ids.append(ra.attr_id)
+        ref_keys.append(REF_KEYS.index(ref_key))
+        ref_ids.append(ra.ref_id)
+        is_var.append(ra.attr_is_var == 'Y')
+        cr_dates.append(str(ra.cr_date) if ra.cr_date is not None else None)
+
+    distinct_attr_ids = sorted(set(attr_ids))
+    attrs = {}
+    for idx in range(0, len(distinct_attr_ids), qry_in_threshold):
+        chunk = distinct_attr_ids[idx:idx+qry_in_threshold]
+        for attr in db.DBSession.query(*[getattr(Attr, c) for c in _ATTR_COLUMNS]).filter(
+                Attr.id.in_(chunk)):
+            attrs[attr.id] = dict(JSONObject(attr._asdict()))
+
+    return {
+        'ids': np.array(ids, dtype=np.int64),
+        'attr_ids': np.array(attr_ids, dtype=np.int64),
+        'ref_keys': np.array(ref_keys, dtype=np.int8),
+        'ref_ids': np.array(ref_ids, dtype=np.int64),
+        'is_var': np.array(is_var, dtype=bool),
+        'cr_dates': cr_dates,
+        'attrs': attrs,
+    }
+
+def get_network_resource_attributes(network_id):
+    """
+        Get the resource attributes of a network, from memory or the cache if
+        they are there for its current generation, otherwise from the database.
+        returns:
+            A dict of arrays 'ids', 'attr_ids', 'ref_keys' (positions in
+            REF_KEYS), 'ref_ids' and 'is_var', a list 'cr_dates', all in the
+            same order, and a dict 'attrs' of each attribute's columns keyed
+            on its ID, already normalised as a JSONObject would be.
+        If the session has uncommitted changes to the network's resource
+        attributes, they are read from the database and not cached.
+    """
+    if network_id in db.DBSession().info.get(NETWORK_RA_PENDING_KEY, ()):
+        return _build_payload(network_id)
+
+    generation = _get_generation(network_id)
+
+    cached = _local_cache.get(network_id)
+    if cached is not None and cached[0] == generation:
+        _local_cache.move_to_end(network_id)
+        return cached[1]
+
+    payload = cache.get(_payload_key(network_id, generation))
+    if payload is None:
+        log.info("Building resource attribute cache for network %s", network_id)
+        payload = _build_payload(network_id)
+        cache.set(_payload_key(network_id, generation), payload, 60*60)
+
+    _local_cache[network_id] = (generation, payload)
+    _local_cache.move_to_end(network_id)
+    while len(_local_cache) > LOCAL_CACHE_SIZE:
+        _local_cache.popitem(last=False)
+
+    return payload
@@ -17,8 +17,12 @@
 # along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
 #
 
+import json
 import logging
 import time
+
+import numpy as np
+import pandas as pd
 from ..exceptions import HydraError, PermissionError, ResourceNotFoundError
 from .. import db
 from ..util.permissions import required_perms
@@ -35,18 +39,23 @@ from ..db.model import Scenario,\
         Link,\
         User,\
         ResourceGroup,\
-        ResourceAttrMap
+        ResourceAttrMap,\
+        DatasetOwner
 
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy import or_, and_, func
+from sqlalchemy import or_, and_, func, select, literal, bindparam
 from sqlalchemy.orm import joinedload, aliased
 from . import data
+from .resource_attribute_cache import clear_network_resource_attributes_cache
 from collections import namedtuple
 from copy import deepcopy
 
 from .network import get_resource
 
 from .objects import JSONObject, Dataset as JSONDataset
+from .HydraTypes.Registry import HydraObjectFactory
+from ..util import generate_data_hash
+from .. import config
 
 log = logging.getLogger(__name__)
 
@@ -173,6 +182,7 @@ def merge_scenarios(source_scenario_id, target_scenario_id, match_all_names=True
                     db.DBSession.add(new_ra)
                     db.DBSession.flush()
                     target_ra_id = new_ra.id
+                    clear_network_resource_attributes_cache(target_network.id)
 
                     log.info(f"Adding new attribute {source_ra.attr.name} to {target_resource.name}")
 
@@ -609,47 +619,39 @@ def clone_scenario(scenario_id, retain_results=False, scenario_name=None, **kwar
     log.info("New scenario created. Scenario ID: %s", cloned_scenario_id)
 
 
-    log.info("Getting in resource scenarios to clone from scenario %s", scenario_id)
+    #Datasets are shared by reference, so the resource scenarios and group
+    #items can be copied entirely within the database.
+    log.info("Cloning resource scenarios from scenario %s", scenario_id)
+    app_name = kwargs.get('app_name')
+    rs_select = select(
+        ResourceScenario.dataset_id,
+        literal(cloned_scenario_id),
+        ResourceScenario.resource_attr_id,
+        literal(app_name) if app_name is not None else ResourceScenario.source
+    ).where(ResourceScenario.scenario_id == scenario_id)
+
     if retain_results is False:
-        old_rscen_rs = db.DBSession.query(ResourceScenario).filter(
-            ResourceScenario.scenario_id == scenario_id,
+        rs_select = rs_select.where(
             ResourceAttr.id == ResourceScenario.resource_attr_id,
-            ResourceAttr.attr_is_var == 'N'
-        ).all()
-    else:
-        old_rscen_rs = db.DBSession.query(ResourceScenario).filter(
-            ResourceScenario.scenario_id == scenario_id
-        ).all()
-
-    new_rscens = []
-    for old_rscen in old_rscen_rs:
-        new_rscens.append(dict(
-            dataset_id=old_rscen.dataset_id,
-            scenario_id=cloned_scenario_id,
-            resource_attr_id=old_rscen.resource_attr_id,
-            source = kwargs.get('app_name', old_rscen.source)
-        ))
+            ResourceAttr.attr_is_var == 'N')
 
-    if len(new_rscens) > 0:
-        db.DBSession.execute(ResourceScenario.__table__.insert(), new_rscens)
+    db.DBSession.execute(ResourceScenario.__table__.insert().from_select(
+        ['dataset_id', 'scenario_id', 'resource_attr_id', 'source'], rs_select))
 
     log.info("ResourceScenarios cloned")
 
-    log.info("Getting old resource group items for scenario %s", scenario_id)
-    old_rgis = db.DBSession.query(ResourceGroupItem).filter(
-        ResourceGroupItem.scenario_id == scenario_id).all()
-    new_rgis = []
-    for old_rgi in old_rgis:
-        new_rgis.append(dict(
-            ref_key=old_rgi.ref_key,
-            node_id=old_rgi.node_id,
-            link_id=old_rgi.link_id,
-            subgroup_id=old_rgi.subgroup_id,
-            group_id=old_rgi.group_id,
-            scenario_id=cloned_scenario_id,
-        ))
-    if len(new_rgis) > 0:
-        db.DBSession.execute(ResourceGroupItem.__table__.insert(), new_rgis)
+    log.info("Cloning resource group items for scenario %s", scenario_id)
+    rgi_select = select(
+        ResourceGroupItem.ref_key,
+        ResourceGroupItem.node_id,
+        ResourceGroupItem.link_id,
+        ResourceGroupItem.subgroup_id,
+        ResourceGroupItem.group_id,
+        literal(cloned_scenario_id)
+    ).where(ResourceGroupItem.scenario_id == scenario_id)
+
+    db.DBSession.execute(ResourceGroupItem.__table__.insert().from_select(
+        ['ref_key', 'node_id', 'link_id', 'subgroup_id', 'group_id', 'scenario_id'], rgi_select))
 
     log.info("Cloning finished.")
 
@@ -710,15 +712,113 @@ def _get_resource_id(resourceattr):
         if resourceattr.get(col) is not None:
             return resourceattr.get(col)
 
+def _get_datasets_for_diff(dataset_ids):
+    """
+        Get the datasets (including values) for a set of dataset IDs, as a
+        dictionary of JSONObjects keyed on dataset ID. The query is done in chunks
+        as sqlite can only handle 'in' with < 1000 elements.
+    """
+    dataset_ids = list(dataset_ids)
+    dataset_dict = {}
+    for idx in range(0, len(dataset_ids), data.qry_in_threshold):
+        rs = db.DBSession.query(
+            Dataset.id,
+            Dataset.type,
+            Dataset.unit_id,
+            Dataset.name,
+            Dataset.hash,
+            Dataset.cr_date,
+            Dataset.created_by,
+            Dataset.hidden,
+            Dataset.value
+        ).filter(Dataset.id.in_(dataset_ids[idx:idx+data.qry_in_threshold])).all()
+
+        for r in rs:
+            dataset_dict[r.id] = JSONObject({
+                'id': r.id,
+                'type': r.type,
+                'unit_id': r.unit_id,
+                'name': r.name,
+                'hash': r.hash,
+                'cr_date': r.cr_date,
+                'created_by': r.created_by,
+                'hidden': r.hidden,
+                'value': r.value,
+                'metadata': {},
+            }, normalize=False)
+
+    return dataset_dict
+
+def _values_within_tolerance(value_1, value_2, tolerance):
+    """
+        Compare two parsed dataset values (scalars, arrays or timeseries / dataframes
+        as nested dicts), treating numbers which differ by no more than 'tolerance'
+        as equal. The structure of the two values must otherwise be identical.
+    """
+    if isinstance(value_1, dict) and isinstance(value_2, dict):
+        if set(value_1.keys()) != set(value_2.keys()):
+            return False
+        return all(_values_within_tolerance(value_1[k], value_2[k], tolerance) for k in value_1)
+
+    if isinstance(value_1, list) and isinstance(value_2, list):
+        if len(value_1) != len(value_2):
+            return False
+        try:
+            arr_1 = np.array(value_1, dtype=float)
+            arr_2 = np.array(value_2, dtype=float)
+            return arr_1.shape == arr_2.shape and bool(np.allclose(arr_1, arr_2, rtol=0, atol=tolerance, equal_nan=True))
+        except (TypeError, ValueError):
+            return all(_values_within_tolerance(v1, v2, tolerance) for v1, v2 in zip(value_1, value_2))
+
+    try:
+        return abs(float(value_1) - float(value_2)) <= tolerance
+    except (TypeError, ValueError):
+        return value_1 == value_2
+
+def _dataset_values_differ(dataset_1, dataset_2, tolerance=None):
+    """
+        Check whether the values of two datasets differ. If a tolerance is specified,
+        numeric values (scalars, arrays, timeseries) are compared to within that
+        tolerance, otherwise the raw values are compared.
+    """
+    if dataset_1.value == dataset_2.value:
+        return False
+
+    if tolerance is None or dataset_1.value is None or dataset_2.value is None:
+        return True
+
+    try:
+        value_1, value_2 = [json.loads(v) if isinstance(v, str) else v
+                            for v in (dataset_1.value, dataset_2.value)]
+    except ValueError:
+        return True
+
+    return not _values_within_tolerance(value_1, value_2, tolerance)
+
 @required_perms("get_network")
-def compare_scenarios(scenario_id_1, scenario_id_2, allow_different_networks=False, include_results=False, **kwargs):
+def compare_scenarios(scenario_id_1,
+                      scenario_id_2,
+                      allow_different_networks=False,
+                      include_results=False,
+                      get_parent_data=True,
+                      tolerance=None,
+                      summary_only=False,
+                      **kwargs):
     """
         Compare two scenarios and return a 'diff' dictionary containing all the differences.
+
+        The resource attribute, dataset ID and hash of each resource scenario are
+        compared first. Dataset values are only loaded for the resource scenarios
+        whose datasets actually differ, in chunks.
+
         Args:
             scenario_1_id (int): Scenario 1 ID
             scenario_2_id (int): Scenario 2 ID
             allow_different_networks (bool) (default False); Flag to indicate whether it should be allowed to compare the scenarios from two independent networks.
             include_results (bool) (default False): If set to true, includes all 'attr_is_var' values. Otherwise it only compares inputs.
+            get_parent_data (bool) (default True): Include the data each scenario inherits from its parent scenarios.
+            tolerance (float) (default None): If set, numeric values (scalars, arrays, timeseries) which differ by no more than this are considered equal.
+            summary_only (bool) (default False): If set to true, only the number of differences is returned in 'summary', without any datasets.
         returns:
             dict: Containing the differences
         raises:
@@ -726,101 +826,117 @@ def compare_scenarios(scenario_id_1, scenario_id_2, allow_different_networks=Fal
     """
     user_id = kwargs.get('user_id')
 
-    scenario_1 = get_scenario(scenario_id_1,
-                              include_parent_data=True,
-                              include_results=include_results,
-                              include_attr=True,
-                              include_metadata=False,
-                              user_id=user_id)
-
-    scenario_2 = get_scenario(scenario_id_2,
-                              include_parent_data=True,
-                              include_results=include_results,
-                              include_attr=True,
-                              include_metadata=False,
-                              user_id=user_id)
+    scenario_1 = _get_scenario(scenario_id_1, user_id)
+    scenario_2 = _get_scenario(scenario_id_2, user_id)
 
     if allow_different_networks is False and scenario_1.network_id != scenario_2.network_id:
         raise HydraError("Cannot compare scenarios that are not"
                          " in the same network!")
 
-    #find a mapping from ID to Name for all nodes / links / groups in scenario 1's network
-    s1_resource_mapping = _get_scenario_network_resources(scenario_1.id, scenario_1)
-    if scenario_1.network_id == scenario_2.network_id:
-        s2_resource_mapping = s1_resource_mapping
-    else:
-        s2_resource_mapping = _get_scenario_network_resources(scenario_2.id, scenario_2)
-
-
-    scenario_1_rs = scenario_1.resourcescenarios
-    scenario_2_rs = scenario_2.resourcescenarios
-
-    scenario_1_rgi = scenario_1.resourcegroupitems
-    scenario_2_rgi = scenario_2.resourcegroupitems
+    scenario_1_rs = scenario_1.get_dataset_hashes(user_id,
+                                                  get_parent_data=get_parent_data,
+                                                  include_results=include_results)
+    scenario_2_rs = scenario_2.get_dataset_hashes(user_id,
+                                                  get_parent_data=get_parent_data,
+                                                  include_results=include_results)
 
+    scenario_1_rgi = scenario_1.get_group_items(get_parent_items=get_parent_data)
+    scenario_2_rgi = scenario_2.get_group_items(get_parent_items=get_parent_data)
 
     scenariodiff = dict(
        object_type = 'ScenarioDiff'
     )
-    resource_diffs = []
-
-    #Make a list of all the resource scenarios (aka data) that are unique
-    #to scenario 1 and that are in both scenarios, but are not the same.
 
     #For efficiency, build a dictionary of the data in scenarios and refer
     #them rather than nesting for loops.
-    r_scen_1_dict = dict()
-    r_scen_2_dict = dict()
-    for s1_rs in scenario_1_rs:
-        r_scen_1_dict[s1_rs.resource_attr_id] = s1_rs
-    for s2_rs in scenario_2_rs:
-        r_scen_2_dict[s2_rs.resource_attr_id] = s2_rs
+    r_scen_1_dict = dict((rs.resource_attr_id, rs) for rs in scenario_1_rs)
+    r_scen_2_dict = dict((rs.resource_attr_id, rs) for rs in scenario_2_rs)
+
+    #Identify the resource scenarios unique to each scenario, and those in both
+    #scenarios whose datasets may differ. Datasets with the same ID or hash have
+    #the same value, so only the remainder need their values compared.
+    scenario_1_only = []
+    candidates = []
+    for ra_id, s1_rs in r_scen_1_dict.items():
+        s2_rs = r_scen_2_dict.get(ra_id)
+        if s2_rs is None:
+            scenario_1_only.append(s1_rs)
+        elif s1_rs.dataset_id != s2_rs.dataset_id and s1_rs.hash != s2_rs.hash:
+            candidates.append((s1_rs, s2_rs))
+
+    scenario_2_only = [s2_rs for ra_id, s2_rs in r_scen_2_dict.items() if ra_id not in r_scen_1_dict]
+
+    log.info("Resource scenarios in 1 not in 2: %s", len(scenario_1_only))
+    log.info("Resource scenarios in 2 not in 1: %s", len(scenario_2_only))
+    log.info("Resource scenarios with different datasets: %s", len(candidates))
+
+    changed = []
+    for idx in range(0, len(candidates), data.qry_in_threshold):
+        candidate_chunk = candidates[idx:idx+data.qry_in_threshold]
+        dataset_ids = set()
+        for s1_rs, s2_rs in candidate_chunk:
+            dataset_ids.add(s1_rs.dataset_id)
+            dataset_ids.add(s2_rs.dataset_id)
+        chunk_datasets = _get_datasets_for_diff(dataset_ids)
+
+        for s1_rs, s2_rs in candidate_chunk:
+            dataset_1 = chunk_datasets[s1_rs.dataset_id]
+            dataset_2 = chunk_datasets[s2_rs.dataset_id]
+            if _dataset_values_differ(dataset_1, dataset_2, tolerance=tolerance):
+                if summary_only is True:
+                    changed.append((s1_rs, None, None))
+                else:
+                    changed.append((s1_rs, dataset_1, dataset_2))
 
-    rscen_1_dataset_ids = set([r_scen.dataset_id for r_scen in scenario_1_rs])
-    rscen_2_dataset_ids = set([r_scen.dataset_id for r_scen in scenario_2_rs])
+    scenariodiff['summary'] = dict(
+        changed = len(changed),
+        scenario_1_only = len(scenario_1_only),
+        scenario_2_only = len(scenario_2_only),
+    )
 
-    log.info("Datasets In 1 not in 2: %s"%(len(rscen_1_dataset_ids - rscen_2_dataset_ids)))
-    log.info("Datasets In 2 not in 1: %s"%(len(rscen_2_dataset_ids - rscen_1_dataset_ids)))
+    if summary_only is True:
+        return scenariodiff
 
-    for ra_id, s1_rs in r_scen_1_dict.items():
-        s2_rs = r_scen_2_dict.get(ra_id)
-        if s2_rs is not None:
-            log.debug("Is %s == %s?"%(s1_rs.dataset_id, s2_rs.dataset_id))
-            if s1_rs.dataset.value != s2_rs.dataset.value:
-                resource_diff = dict(
-                    resource_attr_id = s1_rs.resource_attr_id,
-                    scenario_1_dataset = s1_rs.dataset,
-                    scenario_2_dataset = s2_rs.dataset,
-                    attr_name = s1_rs.resourceattr.attr.name,
-                    resource_name = s1_resource_mapping[s1_rs.resourceattr.ref_key][_get_resource_id(s1_rs.resourceattr)],
-                )
-                resource_diffs.append(resource_diff)
+    #find a mapping from ID to Name for all nodes / links / groups in scenario 1's network
+    s1_resource_mapping = _get_scenario_network_resources(scenario_1.id, scenario_1)
+    if scenario_1.network_id == scenario_2.network_id:
+        s2_resource_mapping = s1_resource_mapping
+    else:
+        s2_resource_mapping = _get_scenario_network_resources(scenario_2.id, scenario_2)
 
-            continue
-        else:
-            #this is unique in scenario 1
-            resource_diff = dict(
-                resource_attr_id = s1_rs.resource_attr_id,
-                scenario_1_dataset = s1_rs.dataset,
-                scenario_2_dataset = None,
-                attr_name = s1_rs.resourceattr.attr.name,
-                resource_name = s1_resource_mapping[s1_rs.resourceattr.ref_key][_get_resource_id(s1_rs.resourceattr)],
-            )
-            resource_diffs.append(resource_diff)
+    unique_datasets = _get_datasets_for_diff(
+        set(rs.dataset_id for rs in scenario_1_only + scenario_2_only))
+
+    resource_diffs = []
+    for s1_rs, dataset_1, dataset_2 in changed:
+        resource_diffs.append(dict(
+            resource_attr_id = s1_rs.resource_attr_id,
+            scenario_1_dataset = dataset_1,
+            scenario_2_dataset = dataset_2,
+            attr_name = s1_rs.attr_name,
+            resource_name = s1_resource_mapping[s1_rs.ref_key][_get_resource_id(s1_rs._asdict())],
+        ))
+
+    for s1_rs in scenario_1_only:
+        #this is unique in scenario 1
+        resource_diffs.append(dict(
+            resource_attr_id = s1_rs.resource_attr_id,
+            scenario_1_dataset = unique_datasets[s1_rs.dataset_id],
+            scenario_2_dataset = None,
+            attr_name = s1_rs.attr_name,
+            resource_name = s1_resource_mapping[s1_rs.ref_key][_get_resource_id(s1_rs._asdict())],
+        ))
 
     #make a list of all the resource scenarios (aka data) that are unique
     #in scenario 2.
-    for ra_id, s2_rs in r_scen_2_dict.items():
-        s1_rs = r_scen_1_dict.get(ra_id)
-        if s1_rs is None:
-            resource_diff = dict(
-                resource_attr_id = ra_id,
-                scenario_1_dataset = None,
-                scenario_2_dataset = s2_rs.dataset,
-                attr_name = s2_rs.resourceattr.attr.name,
-                resource_name = s2_resource_mapping[s2_rs.resourceattr.ref_key][_get_resource_id(s2_rs.resourceattr)],
-            )
-            resource_diffs.append(resource_diff)
+    for s2_rs in scenario_2_only:
+        resource_diffs.append(dict(
+            resource_attr_id = s2_rs.resource_attr_id,
+            scenario_1_dataset = None,
+            scenario_2_dataset = unique_datasets[s2_rs.dataset_id],
+            attr_name = s2_rs.attr_name,
+            resource_name = s2_resource_mapping[s2_rs.ref_key][_get_resource_id(s2_rs._asdict())],
+        ))
 
     scenariodiff['resourcescenarios'] = resource_diffs
 
@@ -1115,6 +1231,278 @@ def bulk_update_resourcedata(scenario_ids, resource_scenarios, **kwargs):
 
     return res
 
+def _iter_result_rows(results):
+    """
+        Yield (resource_attr_id, type, value, unit_id, name) tuples from the
+        'results' argument of ingest_results. This can be an iterable of tuples
+        or dicts, or a columnar batch: a dict of equal-length lists or a pandas
+        DataFrame, with 'resource_attr_id', 'type', 'value' and optionally
+        'unit_id' and 'name' columns.
+    """
+    if isinstance(results, pd.DataFrame):
+        results = results.to_dict(orient='list')
+
+    if isinstance(results, dict):
+        num_rows = len(results['resource_attr_id'])
+        columns = [results[c] if c in results else [None]*num_rows
+                   for c in ('resource_attr_id', 'type', 'value', 'unit_id', 'name')]
+        for row in zip(*columns):
+            yield row
+        return
+
+    for row in results:
+        if isinstance(row, dict):
+            yield (row['resource_attr_id'],
+                   row['type'],
+                   row['value'],
+                   row.get('unit_id'),
+                   row.get('name'))
+        else:
+            row = tuple(row)
+            yield row + (None,)*(5-len(row))
+
+def _normalise_result_value(data_type, value):
+    """
+        Convert an incoming result value into the string stored in tDataset.value.
+        Scalars take a fast path, while other types are validated by their
+        Hydra type, as they would be in Dataset.parse_value.
+    """
+    if data_type.upper() == 'SCALAR':
+        float(value)
+        return str(value)
+
+    if not isinstance(value, str):
+        value = json.dumps(value)
+
+    return HydraObjectFactory.valueFromDataset(data_type, value)
+
+def _delete_results(scenario_id):
+    """
+        Delete all the resource scenarios in a scenario which are linked to
+        resource attributes that have 'attr_is_var' set to 'Y', in a single
+        statement. Returns the number of resource scenarios deleted.
+    """
+    result_ra_ids = select(ResourceAttr.id).where(ResourceAttr.attr_is_var == 'Y')
+    res = db.DBSession.execute(ResourceScenario.__table__.delete().where(
+        ResourceScenario.scenario_id == scenario_id,
+        ResourceScenario.resource_attr_id.in_(result_ra_ids)))
+
+    return res.rowcount
+
+def _check_resource_attrs_in_network(network_id, ra_ids):
+    """
+        Check that all the resource attributes are on a network or on its
+        nodes, links or groups, in a single query.
+    """
+    network_nodes = select(Node.id).where(Node.network_id == network_id)
+    network_links = select(Link.id).where(Link.network_id == network_id)
+    network_groups = select(ResourceGroup.id).where(ResourceGroup.network_id == network_id)
+
+    found_ra_ids = set(r.id for r in db.DBSession.query(ResourceAttr.id).filter(
+        ResourceAttr.id.in_(ra_ids),
+        or_(ResourceAttr.network_id == network_id,
+            ResourceAttr.node_id.in_(network_nodes),
+            ResourceAttr.link_id.in_(network_links),
+            ResourceAttr.group_id.in_(network_groups))))
+
+    bad_ra_ids = sorted(set(ra_ids) - found_ra_ids)
+    if len(bad_ra_ids) > 0:
+        raise HydraError(f"Resource attributes {bad_ra_ids} are not in network {network_id}")
+
+def _ingest_results_chunk(scenario_id, network_id, rows, counts, user_id=None, source=None):
+    """
+        Write one chunk of rows for ingest_results. Datasets are de-duplicated
+        on their hash, both within the chunk and against the database, and then
+        datasets, metadata and resource scenarios are written with executemany.
+    """
+
+    _check_resource_attrs_in_network(network_id, set(row[0] for row in rows))
+
+    #If a resource attribute appears more than once, the last value wins.
+    #A value of None removes the resource scenario, as in update_resourcedata
+    rows_by_ra = {}
+    null_ra_ids = set()
+    for ra_id, data_type, value, unit_id, name in rows:
+        if value is None:
+            rows_by_ra.pop(ra_id, None)
+            null_ra_ids.add(ra_id)
+        else:
+            null_ra_ids.discard(ra_id)
+            rows_by_ra[ra_id] = (data_type, value, unit_id, name)
+
+    if null_ra_ids:
+        res = db.DBSession.execute(ResourceScenario.__table__.delete().where(
+            ResourceScenario.scenario_id == scenario_id,
+            ResourceScenario.resource_attr_id.in_(null_ra_ids)))
+        counts['deleted'] += res.rowcount
+
+    if len(rows_by_ra) == 0:
+        return
+
+    ra_hash = {}
+    incoming = {}
+    for ra_id, (data_type, value, unit_id, name) in rows_by_ra.items():
+        metadata = {}
+        if user_id is not None:
+            metadata['user_id'] = str(user_id)
+        if source is not None:
+            metadata['source'] = str(source)
+
+        dataset = {
+            'type': data_type,
+            'name': (name or 'result')[0:200],
+            'unit_id': unit_id,
+            'created_by': user_id,
+            'value': _normalise_result_value(data_type, value),
+            'metadata': metadata,
+        }
+        dataset['hash'] = generate_data_hash(dataset)
+        incoming[dataset['hash']] = dataset
+        ra_hash[ra_id] = dataset['hash']
+
+    #Re-use any existing datasets which this user can see
+    hash_id_map = {}
+    hashes = list(incoming.keys())
+    for idx in range(0, len(hashes), data.qry_in_threshold):
+        existing = db.DBSession.query(
+            Dataset.id,
+            Dataset.hash,
+            Dataset.hidden,
+            Dataset.created_by,
+            DatasetOwner.user_id.label('owner_id')
+        ).outerjoin(DatasetOwner, and_(DatasetOwner.dataset_id==Dataset.id, DatasetOwner.user_id==user_id)
+        ).filter(Dataset.hash.in_(hashes[idx:idx+data.qry_in_threshold])).all()
+        for d in existing:
+            if d.hidden == 'N' or d.created_by == user_id or d.owner_id is not None:
+                hash_id_map[d.hash] = d.id
+            else:
+                #Not allowed to use the existing dataset, so a new one must be created
+                #with a unique hash
+                new_dataset = data._make_new_dataset(incoming[d.hash])
+                new_dataset['metadata'] = incoming[d.hash]['metadata']
+                for ra_id, ra_dataset_hash in ra_hash.items():
+                    if ra_dataset_hash == d.hash:
+                        ra_hash[ra_id] = new_dataset['hash']
+                del incoming[d.hash]
+                incoming[new_dataset['hash']] = new_dataset
+
+    counts['datasets_reused'] += len(hash_id_map)
+
+    new_datasets = [d for h, d in incoming.items() if h not in hash_id_map]
+    if len(new_datasets) > 0:
+        metadata = dict((d['hash'], d.pop('metadata')) for d in new_datasets)
+
+        data._store_large_values_externally(new_datasets, metadata)
+
+        db.DBSession.execute(Dataset.__table__.insert(), new_datasets)
+
+        new_hashes = list(metadata.keys())
+        for idx in range(0, len(new_hashes), data.qry_in_threshold):
+            inserted = db.DBSession.query(Dataset.id, Dataset.hash).filter(
+                Dataset.hash.in_(new_hashes[idx:idx+data.qry_in_threshold])).all()
+            for d in inserted:
+                hash_id_map[d.hash] = d.id
+
+        metadata_rows = []
+        for dataset_hash, dataset_metadata in metadata.items():
+            for k, v in dataset_metadata.items():
+                metadata_rows.append(dict(key=str(k), value=str(v), dataset_id=hash_id_map[dataset_hash]))
+        if len(metadata_rows) > 0:
+            db.DBSession.execute(Metadata.__table__.insert(), metadata_rows)
+
+        counts['datasets_inserted'] += len(new_datasets)
+
+    #Update the resource scenarios which already exist, and insert the rest.
+    ra_ids = list(ra_hash.keys())
+    existing_ra_ids = set()
+    for idx in range(0, len(ra_ids), data.qry_in_threshold):
+        existing_rs = db.DBSession.query(ResourceScenario.resource_attr_id).filter(
+            ResourceScenario.scenario_id == scenario_id,
+            ResourceScenario.resource_attr_id.in_(ra_ids[idx:idx+data.qry_in_threshold])).all()
+        existing_ra_ids.update(rs.resource_attr_id for rs in existing_rs)
+
+    rs_update = []
+    rs_insert = []
+    for ra_id, dataset_hash in ra_hash.items():
+        if ra_id in existing_ra_ids:
+            rs_update.append(dict(b_scenario_id=scenario_id,
+                                  b_resource_attr_id=ra_id,
+                                  b_dataset_id=hash_id_map[dataset_hash],
+                                  b_source=source))
+        else:
+            rs_insert.append(dict(scenario_id=scenario_id,
+                                  resource_attr_id=ra_id,
+                                  dataset_id=hash_id_map[dataset_hash],
+                                  source=source))
+
+    if len(rs_update) > 0:
+        rs_table = ResourceScenario.__table__
+        db.DBSession.execute(rs_table.update().where(
+            rs_table.c.scenario_id == bindparam('b_scenario_id'),
+            rs_table.c.resource_attr_id == bindparam('b_resource_attr_id')
+        ).values(dataset_id=bindparam('b_dataset_id'), source=bindparam('b_source')), rs_update)
+
+    if len(rs_insert) > 0:
+        db.DBSession.execute(ResourceScenario.__table__.insert(), rs_insert)
+
+    counts['updated'] += len(rs_update)
+    counts['inserted'] += len(rs_insert)
+
+@required_perms("edit_data", "edit_network")
+def ingest_results(scenario_id, results, replace_results=False, chunk_size=None, **kwargs):
+    """
+        Write a large number of values (typically model results) to a scenario.
+        Unlike bulk_update_resourcedata, no Dataset objects are created; rows are
+        hashed and written with executemany in chunks, so memory use is bounded
+        by the chunk size rather than the number of rows.
+
+        Existing datasets are reused by hash and are never modified in place.
+        A value of None removes the resource scenario for that resource attribute.
+
+        args:
+            scenario_id (int): The scenario to write to
+            results: The rows to write. Either an iterable (such as a generator) of
+                (resource_attr_id, type, value, unit_id, name) tuples, or dicts with
+                those keys, or a columnar batch -- a dict of equal-length lists or a
+                pandas DataFrame with those columns. unit_id and name are optional.
+            replace_results (bool): If True, delete all the existing results
+                (resource scenarios of 'attr_is_var' resource attributes) in the
+                scenario before writing. Default False
+            chunk_size (int): The number of rows written at a time. Defaults to
+                the maximum number of elements sqlite supports in an 'in' query.
+        returns:
+            dict: The number of resource scenarios deleted, inserted and updated,
+                  and the number of datasets inserted and reused.
+    """
+    user_id = kwargs.get('user_id')
+    source = kwargs.get('app_name')
+
+    scenario_i = _get_scenario(scenario_id, user_id, check_write=True, check_can_edit=True)
+
+    if chunk_size is None:
+        chunk_size = data.qry_in_threshold
+
+    counts = dict(deleted=0, inserted=0, updated=0, datasets_inserted=0, datasets_reused=0)
+
+    if replace_results is True:
+        counts['deleted'] += _delete_results(scenario_id)
+
+    chunk = []
+    for row in _iter_result_rows(results):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            _ingest_results_chunk(scenario_id, scenario_i.network_id, chunk, counts,
+                                  user_id=user_id, source=source)
+            chunk = []
+
+    if len(chunk) > 0:
+        _ingest_results_chunk(scenario_id, scenario_i.network_id, chunk, counts,
+                              user_id=user_id, source=source)
+
+    log.info("Results ingested into scenario %s: %s", scenario_id, counts)
+
+    return counts
+
 @required_perms("edit_data", "edit_network")
 def update_resourcedata(scenario_id, resource_scenarios, **kwargs):
     """
@@ -1160,16 +1548,11 @@ def delete_scenario_results(scenario_id, **kwargs):
 
     _get_scenario(scenario_id, user_id, check_write=True, check_can_edit=True)
 
-    results_rs = db.DBSession.query(ResourceScenario)\
-        .join(ResourceAttr)\
-        .filter(ResourceScenario.scenario_id == scenario_id)\
-        .filter(ResourceAttr.attr_is_var == 'Y').all()
-    for rs in results_rs:
-        db.DBSession.delete(rs)
+    num_deleted = _delete_results(scenario_id)
 
     db.DBSession.flush()
 
-    log.info("%s resource scenarios deleted", len(results_rs))
+    log.info("%s resource scenarios deleted", num_deleted)
 
 @required_perms("edit_data", "edit_network")
 def delete_resource_scenario(scenario_id, resource_attr_id, quiet=False, **kwargs):
@@ -1733,6 +2116,206 @@ def get_attribute_datasets(attr_id, scenario_id, get_parent_data=False, **kwargs
 
     return json_rs
 
+def _parse_timeseries_column(value, column=None):
+    """
+        Extract a single column of a timeseries value as a dictionary of
+        time -> value. If no column is specified, the first column is used.
+    """
+    ts = json.loads(value)
+    if column is None:
+        column = next(iter(ts))
+    elif column not in ts:
+        raise HydraError(f"Column {column} not found in timeseries")
+    return ts[column]
+
+def _parse_times(time_keys):
+    """
+        Convert the string time keys of a set of timeseries into a sorted time
+        index. Seasonal timeseries are mapped onto the seasonal year, as in get_val.
+        If the keys are not times, they are returned sorted as they are.
+    """
+    seasonal_year = config.get('DEFAULT','seasonal_year', '1678')
+    seasonal_key = config.get('DEFAULT', 'seasonal_key', '9999')
+
+    time_keys = sorted(time_keys)
+    time_strs = [k.replace(seasonal_key, seasonal_year) for k in time_keys]
+    try:
+        times = pd.to_datetime(time_strs, utc=True)
+    except (ValueError, TypeError):
+        #The keys may be written in different formats, so parse them one at a time
+        try:
+            times = pd.DatetimeIndex([pd.to_datetime(k, utc=True) for k in time_strs])
+        except (ValueError, TypeError):
+            return np.array(time_keys), dict((k, i) for i, k in enumerate(time_keys))
+
+    #Different strings may represent the same time, so index on the parsed times
+    unique_times = times.unique().sort_values()
+    time_idx = dict((t, i) for i, t in enumerate(unique_times))
+    key_idx = dict((k, time_idx[t]) for k, t in zip(time_keys, times))
+
+    return unique_times.values, key_idx
+
+@required_perms("get_data", "get_network")
+def get_attribute_matrix(attr_id,
+                         scenario_ids,
+                         ref_key=None,
+                         ref_ids=None,
+                         get_parent_data=False,
+                         column=None,
+                         **kwargs):
+    """
+        Get the values of one attribute across many scenarios (an ensemble) as a
+        single numpy array. All the data is retrieved in one query, and each distinct
+        dataset is parsed only once.
+
+        args:
+            attr_id (int): The attribute to retrieve
+            scenario_ids (list(int)): The scenarios to retrieve, in the order they should
+                appear in the matrix
+            ref_key (string): Optionally limit the resources to 'NODE', 'LINK', 'GROUP' or 'NETWORK'
+            ref_ids (list(int)): Optionally limit the resources to these IDs. Requires ref_key.
+            get_parent_data (bool): Use the data each scenario inherits from its parents. Default False
+            column (string): For timeseries with several columns, the column to use. Defaults to the first.
+        returns:
+            A JSONObject containing:
+                type: 'scalar', 'array' or 'timeseries'
+                matrix: A numpy array. scenario x resource for scalars, scenario x resource x
+                    (time or array element) for timeseries and arrays. Missing values are NaN.
+                scenario_ids: The scenario ID of each row
+                resource_attr_ids, ref_keys, resource_ids: The resource of each column
+                times: The time index, for timeseries.
+        raises:
+            HydraError if the datasets are not all of the same, numeric type.
+    """
+    user_id = kwargs.get('user_id')
+
+    if ref_ids is not None and ref_key is None:
+        raise HydraError("Unable to get data. Must specify a resource type (ref_key) when specifying ref_ids")
+
+    scenario_ids = [int(s_id) for s_id in scenario_ids]
+    scenarios = db.DBSession.query(Scenario).filter(Scenario.id.in_(scenario_ids)).all()
+    scenario_dict = dict((s.id, s) for s in scenarios)
+    missing_ids = set(scenario_ids) - set(scenario_dict)
+    if len(missing_ids) > 0:
+        raise ResourceNotFoundError(f"Scenarios {missing_ids} do not exist.")
+
+    checked_networks = set()
+    for scenario_i in scenarios:
+        if scenario_i.network_id not in checked_networks:
+            scenario_i.network.check_read_permission(user_id)
+            checked_networks.add(scenario_i.network_id)
+
+    if get_parent_data is True:
+        lineages = dict((s_id, scenario_dict[s_id].get_lineage()) for s_id in scenario_ids)
+    else:
+        lineages = dict((s_id, [s_id]) for s_id in scenario_ids)
+    queried_scenario_ids = set(s_id for lineage in lineages.values() for s_id in lineage)
+
+    ref_cols = {'NODE': ResourceAttr.node_id,
+                'LINK': ResourceAttr.link_id,
+                'GROUP': ResourceAttr.group_id,
+                'NETWORK': ResourceAttr.network_id}
+
+    rs_qry = db.DBSession.query(
+        ResourceScenario.scenario_id,
+        ResourceScenario.resource_attr_id,
+        ResourceScenario.dataset_id,
+        ResourceAttr.ref_key,
+        ResourceAttr.node_id,
+        ResourceAttr.link_id,
+        ResourceAttr.group_id,
+        ResourceAttr.network_id,
+    ).join(ResourceAttr, ResourceAttr.id == ResourceScenario.resource_attr_id
+    ).join(Dataset, Dataset.id == ResourceScenario.dataset_id
+    ).outerjoin(DatasetOwner, and_(DatasetOwner.dataset_id==Dataset.id, DatasetOwner.user_id==user_id)
+    ).filter(
+        ResourceAttr.attr_id == attr_id,
+        ResourceScenario.scenario_id.in_(queried_scenario_ids),
+        or_(Dataset.hidden=='N', Dataset.created_by==user_id, DatasetOwner.user_id != None))
+
+    if ref_key is not None:
+        ref_key = ref_key.upper()
+        if ref_key not in ref_cols:
+            raise HydraError(f"Unrecognised ref_key {ref_key}")
+        rs_qry = rs_qry.filter(ResourceAttr.ref_key == ref_key)
+        if ref_ids is not None:
+            rs_qry = rs_qry.filter(ref_cols[ref_key].in_(ref_ids))
+
+    rs_rows = rs_qry.all()
+
+    #Resolve which dataset each scenario uses for each resource attribute,
+    #taking the nearest scenario in its lineage.
+    rs_lookup = dict(((r.scenario_id, r.resource_attr_id), r) for r in rs_rows)
+    resources = {}
+    cells = []
+    rs_ra_ids = set(r.resource_attr_id for r in rs_rows)
+    for row_idx, s_id in enumerate(scenario_ids):
+        for ra_id in rs_ra_ids:
+            for lineage_s_id in lineages[s_id]:
+                r = rs_lookup.get((lineage_s_id, ra_id))
+                if r is not None:
+                    cells.append((row_idx, ra_id, r.dataset_id))
+                    resources[ra_id] = (r.ref_key, getattr(r, ref_cols[r.ref_key].key))
+                    break
+
+    resource_attr_ids = sorted(resources, key=lambda ra_id: (resources[ra_id], ra_id))
+    col_lookup = dict((ra_id, i) for i, ra_id in enumerate(resource_attr_ids))
+
+    #Retrieve and parse each distinct dataset once
+    dataset_ids = list(set(c[2] for c in cells))
+    dataset_rows = []
+    for idx in range(0, len(dataset_ids), data.qry_in_threshold):
+        dataset_rows.extend(db.DBSession.query(Dataset.id, Dataset.type, Dataset.value).filter(
+            Dataset.id.in_(dataset_ids[idx:idx+data.qry_in_threshold])).all())
+
+    data_types = set(d.type.lower() for d in dataset_rows)
+    if len(data_types) > 1:
+        raise HydraError(f"Unable to build a matrix of attribute {attr_id}: the datasets have different types {data_types}")
+    data_type = data_types.pop() if len(data_types) > 0 else 'scalar'
+
+    times = None
+    try:
+        if data_type == 'scalar':
+            parsed = dict(zip([d.id for d in dataset_rows],
+                              np.array([d.value for d in dataset_rows], dtype=float)))
+            values = np.full((len(scenario_ids), len(resource_attr_ids)), np.nan)
+            for row_idx, ra_id, dataset_id in cells:
+                values[row_idx, col_lookup[ra_id]] = parsed[dataset_id]
+
+        elif data_type == 'array':
+            parsed = dict((d.id, np.array(json.loads(d.value), dtype=float).ravel()) for d in dataset_rows)
+            depth = max([len(v) for v in parsed.values()], default=0)
+            values = np.full((len(scenario_ids), len(resource_attr_ids), depth), np.nan)
+            for row_idx, ra_id, dataset_id in cells:
+                arr = parsed[dataset_id]
+                values[row_idx, col_lookup[ra_id], :len(arr)] = arr
+
+        elif data_type == 'timeseries':
+            parsed = dict((d.id, _parse_timeseries_column(d.value, column)) for d in dataset_rows)
+            time_keys = set(k for ts in parsed.values() for k in ts)
+            times, key_idx = _parse_times(time_keys)
+            values = np.full((len(scenario_ids), len(resource_attr_ids), len(times)), np.nan)
+            for dataset_id, ts in parsed.items():
+                parsed[dataset_id] = (np.array([key_idx[k] for k in ts], dtype=int),
+                                      np.array([np.nan if v is None else v for v in ts.values()], dtype=float))
+            for row_idx, ra_id, dataset_id in cells:
+                time_positions, ts_values = parsed[dataset_id]
+                values[row_idx, col_lookup[ra_id], time_positions] = ts_values
+        else:
+            raise HydraError(f"Unable to build a matrix of {data_type} data. Only scalars, arrays and timeseries are supported")
+    except (ValueError, TypeError) as e:
+        raise HydraError(f"Unable to build a matrix of attribute {attr_id}: the values are not all numeric ({e})")
+
+    return JSONObject(dict(
+        type=data_type,
+        matrix=values,
+        scenario_ids=scenario_ids,
+        resource_attr_ids=resource_attr_ids,
+        ref_keys=[resources[ra_id][0] for ra_id in resource_attr_ids],
+        resource_ids=[resources[ra_id][1] for ra_id in resource_attr_ids],
+        times=times,
+    ))
+
 @required_perms("get_data", "get_network")
 def get_resourcegroupitems(group_id, scenario_id, get_parent_items=False, **kwargs):
 
@@ -40,7 +40,8 @@ from hydra_base.util import dataset_util, get_json_as_string, get_json_as_dict
 from hydra_base.lib import units
 from hydra_base.util.permissions import required_perms
 
-from hydra_base.lib.template.utils import check_dimension, get_attr_by_name_and_dimension
+from hydra_base.lib.template.utils import (check_dimension, get_attr_by_name_and_dimension,
+    get_template_types, new_template_version)
 
 from hydra_base.lib.template.xml import (get_template_as_xml, import_template_xml,
     get_network_as_xml_template)
@@ -78,6 +79,7 @@ def _remove_template_from_cache(template_id):
         If a template is in the cache, remove it.
     """
     cache.delete(f"{CACHE_KEY}_{template_id}")
+    new_template_version(template_id)
     log.info("Template %s removed from cache.", template_id)
 
 def parse_json_typeattr(type_i, typeattr_j, attribute_j, default_dataset_j, user_id=None):
@@ -457,6 +459,8 @@ def import_template_dict(template_dict, allow_update=True, **kwargs):
 
     db.DBSession.flush()
 
+    new_template_version(template_i.id)
+
     template_j = JSONObject(template_i)
     _save_template_to_cache(template_j)
 
@@ -663,7 +667,9 @@ def update_template(template, auto_delete=False, **kwargs):
 
     db.DBSession.flush()
 
-    updated_templatetypes = tmpl_i.get_types()
+    new_template_version(tmpl_i.id)
+
+    updated_templatetypes = get_template_types(tmpl_i)
 
     tmpl_j = JSONObject(tmpl_i)
 
@@ -777,7 +783,7 @@ def get_template(template_id, **kwargs):
 
         tmpl_j = JSONObject(tmpl_i)
 
-        tmpl_j.templatetypes = tmpl_i.get_types()
+        tmpl_j.templatetypes = get_template_types(tmpl_i)
 
         #ignore the messing around we've been doing to the ORM objects
         #db.DBSession.expunge(tmpl_i)
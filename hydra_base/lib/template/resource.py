@@ -26,9 +26,11 @@
 
 import json
 import logging
+from collections import defaultdict
 
+import numpy as np
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.orm import noload, joinedload
+from sqlalchemy.orm import joinedload
 from sqlalchemy import or_, and_
 
 from hydra_base import db
@@ -36,10 +38,15 @@ from hydra_base.db.model import Template, TemplateType, Attr, \
                                 Network, Node, Link, ResourceGroup,\
                                 ResourceType, ResourceAttr, ResourceScenario, Scenario
 from hydra_base.lib.objects import JSONObject
-from hydra_base.exceptions import HydraError
+from hydra_base.lib import data
+from hydra_base.lib.resource_attribute_cache import clear_network_resource_attributes_cache
+from hydra_base.exceptions import HydraError, ResourceNotFoundError
 from hydra_base.util import dataset_util
 from hydra_base.lib import units
 from hydra_base.util.permissions import required_perms
+from hydra_base.lib.template.utils import get_template_types
+from hydra_base.lib.template.validation import (validate_network_resources,
+    validate_scenario_data)
 
 log = logging.getLogger(__name__)
 
@@ -150,7 +157,7 @@ def get_types_by_attr(resource, resource_type, template_id=None, **kwargs):
 
     all_types = []
     for template in all_templates:
-        template_types = template.get_types()
+        template_types = get_template_types(template)
         all_types.extend(template_types)
 
     #tmpl type attrs must be a subset of the resource's attrs
@@ -169,21 +176,73 @@ def get_types_by_attr(resource, resource_type, template_id=None, **kwargs):
 
 
 
+def _match_resource_types(resource_ids, resource_attrs, ttypes, block_size=10000):
+    """
+        Find the first type in ttypes whose attributes are all on each resource,
+        as get_types_by_attr does, but for all the resources at once.
+        args:
+            resource_ids: The IDs of the resources
+            resource_attrs: (resource ID, attr ID) pairs of the resources' attributes
+            ttypes: The template types to match, in order of priority
+        returns:
+            dict: The matching type for each matched resource ID
+    """
+    if len(resource_ids) == 0 or len(ttypes) == 0:
+        return {}
+
+    #Only the attributes used by the types matter.
+    attr_ids = sorted(set(ta.attr_id for ttype in ttypes for ta in ttype.typeattrs))
+    attr_idx = dict((attr_id, i) for i, attr_id in enumerate(attr_ids))
+    resource_idx = dict((resource_id, i) for i, resource_id in enumerate(resource_ids))
+
+    #One row of attribute flags per resource and per type
+    resource_attr_flags = np.zeros((len(resource_ids), len(attr_ids)), dtype=bool)
+    pairs = [(resource_idx[ref_id], attr_idx[attr_id])
+             for ref_id, attr_id in resource_attrs if attr_id in attr_idx]
+    if len(pairs) > 0:
+        rows, cols = zip(*pairs)
+        resource_attr_flags[list(rows), list(cols)] = True
+
+    type_attr_flags = np.zeros((len(ttypes), len(attr_ids)), dtype=bool)
+    for i, ttype in enumerate(ttypes):
+        type_attr_flags[i, [attr_idx[ta.attr_id] for ta in ttype.typeattrs]] = True
+    type_attr_flags = type_attr_flags.T.astype(np.int32)
+
+    matches = {}
+    for lower in range(0, len(resource_ids), block_size):
+        block = resource_attr_flags[lower:lower+block_size]
+        #The number of each type's attributes which each resource is missing.
+        num_missing = (~block).astype(np.int32) @ type_attr_flags
+        is_match = num_missing == 0
+        first_match = is_match.argmax(axis=1)
+        for i in np.flatnonzero(is_match.any(axis=1)):
+            matches[resource_ids[lower+i]] = ttypes[first_match[i]]
+
+    return matches
+
 @required_perms("edit_network")
 def apply_template_to_network(template_id, network_id, **kwargs):
     """
         For each node and link in a network, check whether it matches
         a type in a given template. If so, assign the type to the node / link.
+
+        A resource matches a type if it has all the type's attributes, so no
+        resource attributes need to be added to the resources which match.
     """
 
-    net_i = db.DBSession.query(Network).filter(Network.id == network_id).one()
+    #Only check the network exists, raising NoResultFound if not
+    db.DBSession.query(Network.id).filter(Network.id == network_id).one()
+
     #There should only ever be one matching type, but if there are more,
     #all we can do is pick the first one.
+    template_types = []
     try:
         network_template_i = db.DBSession.query(Template).filter(
             Template.id == template_id).one()
 
-        for template_type in network_template_i.get_types():
+        template_types = get_template_types(network_template_i)
+
+        for template_type in template_types:
             if template_type.resource_type == 'NETWORK':
                 network_type_id = template_type.id
                 assign_type_to_resource(network_type_id, 'NETWORK', network_id, **kwargs)
@@ -196,22 +255,71 @@ def apply_template_to_network(template_id, network_id, **kwargs):
     except NoResultFound:
         log.debug("No network type to set.")
 
-    for node_i in net_i.nodes:
-        templates = get_types_by_attr(node_i, 'NODE', template_id, **kwargs)
-        if len(templates) > 0:
-            assign_type_to_resource(templates[0].id, 'NODE', node_i.id, **kwargs)
-    for link_i in net_i.links:
-        templates = get_types_by_attr(link_i, 'LINK', template_id, **kwargs)
-        if len(templates) > 0:
-            assign_type_to_resource(templates[0].id, 'LINK', link_i.id, **kwargs)
+    new_resource_types = []
+    child_template_ids = {}
+    compatibility_errors = {}
+    for ref_key, resource_class, ref_col in (('NODE', Node, 'node_id'),
+                                            ('LINK', Link, 'link_id'),
+                                            ('GROUP', ResourceGroup, 'group_id')):
+        ttypes = [t for t in template_types if t.resource_type == ref_key]
+        if len(ttypes) == 0:
+            continue
 
-    for group_i in net_i.resourcegroups:
-        templates = get_types_by_attr(group_i, 'GROUP', template_id, **kwargs)
-        if len(templates) > 0:
-            assign_type_to_resource(templates[0].id, 'GROUP', group_i.id, **kwargs)
+        resource_ids = [r.id for r in db.DBSession.query(resource_class.id).filter(
+            resource_class.network_id == network_id)]
+
+        ra_ref_col = getattr(ResourceAttr, ref_col)
+        resource_attrs = db.DBSession.query(ra_ref_col, ResourceAttr.attr_id)\
+            .join(resource_class, resource_class.id == ra_ref_col)\
+            .filter(resource_class.network_id == network_id).all()
+
+        matches = _match_resource_types(resource_ids, resource_attrs, ttypes)
+        if len(matches) == 0:
+            continue
+
+        rt_ref_col = getattr(ResourceType, ref_col)
+        existing_type_ids = defaultdict(list)
+        for ref_id, type_id in db.DBSession.query(rt_ref_col, ResourceType.type_id)\
+                .join(resource_class, resource_class.id == rt_ref_col)\
+                .filter(resource_class.network_id == network_id):
+            existing_type_ids[ref_id].append(type_id)
+
+        for ref_id, ttype in matches.items():
+            if ttype.id in existing_type_ids[ref_id]:
+                continue
+
+            for existing_type_id in existing_type_ids[ref_id]:
+                type_pair = (existing_type_id, ttype.id)
+                if type_pair not in compatibility_errors:
+                    compatibility_errors[type_pair] = check_type_compatibility(
+                        existing_type_id, ttype.id, **kwargs)
+                if len(compatibility_errors[type_pair]) > 0:
+                    raise HydraError("Cannot apply type %s to %s %s as it "
+                                     "conflicts with type %s. Errors are: %s"
+                                     %(ttype.name, ref_key, ref_id, existing_type_id,
+                                       ','.join(compatibility_errors[type_pair])))
+
+            if ttype.id not in child_template_ids:
+                child_template_ids[ttype.id] = get_network_template(network_id, ttype.id)
+
+            new_resource_types.append(dict(
+                node_id=ref_id if ref_key == 'NODE' else None,
+                link_id=ref_id if ref_key == 'LINK' else None,
+                group_id=ref_id if ref_key == 'GROUP' else None,
+                network_id=None,
+                ref_key=ref_key,
+                type_id=ttype.id,
+                child_template_id=child_template_ids[ttype.id]
+            ))
 
     db.DBSession.flush()
 
+    if len(new_resource_types) > 0:
+        log.info("Assigning types to %s resources", len(new_resource_types))
+        db.DBSession.execute(ResourceType.__table__.insert(), new_resource_types)
+        #The resources' types have changed underneath the session
+        db.DBSession.expire_all()
+
 @required_perms("edit_network")
 def set_network_template(template_id, network_id, **kwargs):
     """
@@ -257,7 +365,7 @@ def set_network_template(template_id, network_id, **kwargs):
     resource_types.extend(link_types)
     resource_types.extend(group_types)
 
-    assign_types_to_resources(resource_types)
+    assign_types_to_resources(resource_types, template_id=template_id, **kwargs)
 
     log.debug("Finished setting network template")
 
@@ -282,7 +390,7 @@ def remove_template_from_network(network_id, template_id, remove_attrs, **kwargs
     except NoResultFound:
         raise HydraError("Template %s not found"%template_id)
 
-    type_ids = [tmpltype.id for tmpltype in template.get_types()]
+    type_ids = [tmpltype.id for tmpltype in get_template_types(template)]
 
     node_ids = [n.id for n in network.nodes]
     link_ids = [l.id for l in network.links]
@@ -319,7 +427,7 @@ def _get_resources_to_remove(resource, template):
         Given a resource and a template being removed, identify the resource attribtes
         which can be removed.
     """
-    type_ids = [tmpltype.id for tmpltype in template.get_types()]
+    type_ids = [tmpltype.id for tmpltype in get_template_types(template)]
 
     node_attr_ids = dict([(ra.attr_id, ra) for ra in resource.attributes])
     attrs_to_remove = []
@@ -370,9 +478,16 @@ def assign_types_to_resources(resource_types, template_id=None, **kwargs):
         are also added when the type is already assigned. This means that this
         function can also be used to update resources, when a resource type has
         changed.
+
+        The existing attributes and types of all the resources are loaded
+        up front, and the new resource types, resource attributes and default
+        resource scenarios are each inserted in bulk.
     """
 
     log.info("Setting types of %s resources", len(resource_types))
+    if len(resource_types) == 0:
+        return []
+
     #Remove duplicate values from types by turning it into a set
     type_ids = list(set([rt.type_id for rt in resource_types]))
 
@@ -380,7 +495,7 @@ def assign_types_to_resources(resource_types, template_id=None, **kwargs):
     #correct types from the template hierarchy.
     #We assume here that this function can only be called in the context of
     #one template -- you can't send resource types from 2 templates.
-    if template_id is None and resource_types[0].template_id is None:
+    if template_id is None and getattr(resource_types[0], 'template_id', None) is None:
         log.info("No template ID specified. Getting from type")
         db_type = _get_type(resource_types[0].type_id)
         template_id = db_type.template_id
@@ -388,102 +503,172 @@ def assign_types_to_resources(resource_types, template_id=None, **kwargs):
 
     template_i = db.DBSession.query(Template).filter(Template.id == template_id).one()
 
-    template_types = template_i.get_types()
-
-    db_types = []
-    for tt in template_types:
-        if tt.id in type_ids:
-            db_types.append(tt)
+    template_types = get_template_types(template_i)
 
     type_lookup = {}
-    for db_type in db_types:
-        if type_lookup.get(db_type.id) is None:
-            type_lookup[db_type.id] = db_type
+    for tt in template_types:
+        if tt.id in type_ids and type_lookup.get(tt.id) is None:
+            type_lookup[tt.id] = tt
     log.debug("Retrieved all the appropriate template types")
-    res_types = []
-    res_attrs = []
-    res_scenarios = []
-
-    net_id = None
-    node_ids = []
-    link_ids = []
-    grp_ids = []
-    for resource_type in resource_types:
-        ref_id = resource_type.ref_id
-        ref_key = resource_type.ref_key
-        if resource_type.ref_key == 'NETWORK':
-            net_id = ref_id
-        elif resource_type.ref_key == 'NODE':
-            node_ids.append(ref_id)
-        elif resource_type.ref_key == 'LINK':
-            link_ids.append(ref_id)
-        elif resource_type.ref_key == 'GROUP':
-            grp_ids.append(ref_id)
-    if net_id:
-        net = db.DBSession.query(Network).filter(Network.id == net_id).one()
-    nodes = _get_nodes(node_ids)
-    links = _get_links(link_ids)
-    groups = _get_groups(grp_ids)
+
+    types = dict(type_lookup)
+    for type_id in type_ids:
+        if type_id not in types:
+            types[type_id] = _get_type(type_id)
+
+    #The types to assign to each resource, grouped by the kind of resource
+    resource_type_ids = defaultdict(lambda: defaultdict(list))
     for resource_type in resource_types:
-        ref_id = resource_type.ref_id
-        ref_key = resource_type.ref_key
-        type_id = resource_type.type_id
-        if ref_key == 'NETWORK':
-            resource = net
-        elif ref_key == 'NODE':
-            resource = nodes[ref_id]
-        elif ref_key == 'LINK':
-            resource = links[ref_id]
-        elif ref_key == 'GROUP':
-            resource = groups[ref_id]
-
-        ra, rt, rs = set_resource_type(resource, type_id, type_lookup, **kwargs)
-        if rt is not None:
-            res_types.append(rt)
-        if len(ra) > 0:
-            res_attrs.extend(ra)
-        if len(rs) > 0:
-            res_scenarios.extend(rs)
-
-    log.debug("Retrieved all the appropriate resources")
-    if len(res_types) > 0:
-        new_types = db.DBSession.execute(ResourceType.__table__.insert(), res_types)
-
-    new_ras = []
-    if len(res_attrs) > 0:
-        new_res_attrs = db.DBSession.execute(ResourceAttr.__table__.insert(), res_attrs)
-        last_row_id = new_res_attrs.lastrowid or 0
-        new_ras = db.DBSession.query(ResourceAttr).filter(
-            and_(ResourceAttr.id >= last_row_id,
-                 ResourceAttr.id < (last_row_id+len(res_attrs)))).all()
-
-    ra_map = {}
-    for new_ra in new_ras:
-        ra_map[(new_ra.ref_key,
-                new_ra.attr_id,
-                new_ra.node_id,
-                new_ra.link_id,
-                new_ra.group_id,
-                new_ra.network_id)] = new_ra.id
-
-    for rs in res_scenarios:
-        rs['resource_attr_id'] = ra_map[(rs['ref_key'],
-                                         rs['attr_id'],
-                                         rs['node_id'],
-                                         rs['link_id'],
-                                         rs['group_id'],
-                                         rs['network_id'])]
+        ref_id = getattr(resource_type, 'ref_id', None)
+        if ref_id is None:
+            ref_id = resource_type.get_resource_id()
+        if resource_type.type_id not in resource_type_ids[resource_type.ref_key][ref_id]:
+            resource_type_ids[resource_type.ref_key][ref_id].append(resource_type.type_id)
 
-    if len(res_scenarios) > 0:
-        db.DBSession.execute(ResourceScenario.__table__.insert(), res_scenarios)
+    new_res_types = []
+    new_res_attrs = []
+    #The default dataset of each new resource attribute which has one,
+    #keyed on (ref_key, ref_id, attr_id), as the resource attribute IDs aren't known yet
+    default_dataset_ids = {}
+    #The network of each resource
+    network_ids = {}
+    child_template_ids = {}
+    compatibility_errors = {}
+
+    for ref_key, type_ids_by_ref in resource_type_ids.items():
+        ref_ids = list(type_ids_by_ref.keys())
+
+        resource_network_ids, existing_attr_ids, existing_type_ids = \
+            _get_resource_state(ref_key, ref_ids)
+        log.debug("Retrieved %s %s resources", len(resource_network_ids), ref_key)
+
+        for ref_id, ref_type_ids in type_ids_by_ref.items():
+            if ref_id not in resource_network_ids:
+                raise ResourceNotFoundError("%s %s not found"%(ref_key, ref_id))
+
+            network_id = kwargs.get('network_id')
+            if network_id is None:
+                network_id = resource_network_ids[ref_id]
+            network_ids[(ref_key, ref_id)] = network_id
+
+            for type_id in ref_type_ids:
+                type_i = types[type_id]
+
+                # add type to tResourceType if it doesn't exist already
+                if type_id not in existing_type_ids[ref_id]:
+                    for existing_type_id in existing_type_ids[ref_id]:
+                        type_pair = (existing_type_id, type_id)
+                        if type_pair not in compatibility_errors:
+                            compatibility_errors[type_pair] = check_type_compatibility(
+                                existing_type_id, type_id, **kwargs)
+                        if len(compatibility_errors[type_pair]) > 0:
+                            raise HydraError("Cannot apply type %s to %s %s as it "
+                                             "conflicts with type %s. Errors are: %s"
+                                             %(type_i.name, ref_key, ref_id, existing_type_id,
+                                               ','.join(compatibility_errors[type_pair])))
+
+                    child_template_id = kwargs.get('child_template_id')
+                    if child_template_id is None and network_id is not None:
+                        if (network_id, type_id) not in child_template_ids:
+                            child_template_ids[(network_id, type_id)] = \
+                                get_network_template(network_id, type_id)
+                        child_template_id = child_template_ids[(network_id, type_id)]
+
+                    new_res_types.append(dict(
+                        node_id=ref_id if ref_key == 'NODE' else None,
+                        link_id=ref_id if ref_key == 'LINK' else None,
+                        group_id=ref_id if ref_key == 'GROUP' else None,
+                        network_id=ref_id if ref_key == 'NETWORK' else None,
+                        ref_key=ref_key,
+                        type_id=type_id,
+                        child_template_id=child_template_id
+                    ))
+                    existing_type_ids[ref_id].append(type_id)
+
+                # add attributes if necessary
+                for typeattr in type_i.typeattrs:
+                    if typeattr.attr_id in existing_attr_ids[ref_id]:
+                        continue
+                    existing_attr_ids[ref_id].add(typeattr.attr_id)
+
+                    new_res_attrs.append(dict(
+                        ref_key=ref_key,
+                        attr_id=typeattr.attr_id,
+                        attr_is_var=typeattr.attr_is_var,
+                        node_id=ref_id if ref_key == 'NODE' else None,
+                        link_id=ref_id if ref_key == 'LINK' else None,
+                        group_id=ref_id if ref_key == 'GROUP' else None,
+                        network_id=ref_id if ref_key == 'NETWORK' else None,
+                    ))
+
+                    #Network attributes are not given default values in the network's scenarios
+                    if typeattr.default_dataset and ref_key != 'NETWORK':
+                        default_dataset_ids[(ref_key, ref_id, typeattr.attr_id)] = \
+                            typeattr.default_dataset.id
 
-    #Make DBsession 'dirty' to pick up the inserts by doing a fake delete.
-    db.DBSession.query(ResourceAttr).filter(ResourceAttr.attr_id is None).delete()
+    db.DBSession.flush()
+
+    if len(new_res_types) > 0:
+        log.info("Inserting %s resource types", len(new_res_types))
+        db.bulk_insert_ignore(ResourceType, new_res_types)
+
+    if len(new_res_attrs) > 0:
+        log.info("Inserting %s resource attributes", len(new_res_attrs))
+        db.bulk_insert_ignore(ResourceAttr, new_res_attrs)
+
+    if len(default_dataset_ids) > 0:
+        _add_default_resource_scenarios(default_dataset_ids, network_ids)
+
+    for network_id in set(network_ids.values()):
+        clear_network_resource_attributes_cache(network_id)
+
+    #The resources' types and attributes have changed underneath the session
+    db.DBSession.expire_all()
 
     ret_val = list(type_lookup.values())
 
     return ret_val
 
+def _add_default_resource_scenarios(default_dataset_ids, network_ids):
+    """
+        Give new resource attributes the default value of their type attribute
+        in every scenario of their resource's network.
+        default_dataset_ids is keyed on (ref_key, ref_id, attr_id).
+        network_ids is keyed on (ref_key, ref_id)
+    """
+    net_ids = list(set(network_ids[(k[0], k[1])] for k in default_dataset_ids))
+    scenario_ids = defaultdict(list)
+    for lower in range(0, len(net_ids), data.qry_in_threshold):
+        for scenario_id, network_id in db.DBSession.query(Scenario.id, Scenario.network_id)\
+                .filter(Scenario.network_id.in_(net_ids[lower:lower+data.qry_in_threshold])):
+            scenario_ids[network_id].append(scenario_id)
+
+    ref_ids = defaultdict(set)
+    for ref_key, ref_id, _ in default_dataset_ids:
+        ref_ids[ref_key].add(ref_id)
+
+    new_res_scenarios = []
+    for ref_key, ref_key_ids in ref_ids.items():
+        ref_col = getattr(ResourceAttr, _REF_COLS[ref_key])
+        ref_key_ids = list(ref_key_ids)
+        for lower in range(0, len(ref_key_ids), data.qry_in_threshold):
+            for ra_id, ref_id, attr_id in db.DBSession.query(
+                    ResourceAttr.id, ref_col, ResourceAttr.attr_id).filter(
+                        ref_col.in_(ref_key_ids[lower:lower+data.qry_in_threshold])):
+                dataset_id = default_dataset_ids.get((ref_key, ref_id, attr_id))
+                if dataset_id is None:
+                    continue
+                for scenario_id in scenario_ids[network_ids[(ref_key, ref_id)]]:
+                    new_res_scenarios.append(dict(
+                        dataset_id=dataset_id,
+                        scenario_id=scenario_id,
+                        resource_attr_id=ra_id,
+                    ))
+
+    if len(new_res_scenarios) > 0:
+        log.info("Inserting %s default resource scenarios", len(new_res_scenarios))
+        db.bulk_insert_ignore(ResourceScenario, new_res_scenarios)
+
 @required_perms('get_template')
 def check_type_compatibility(type_1_id, type_2_id, **kwargs):
     """
@@ -547,90 +732,52 @@ def check_type_compatibility(type_1_id, type_2_id, **kwargs):
                           " template %(template_2_name)s stores it in %(type_2_unit_id)s"%fmt_dict)
         return errors
 
-def _get_links(link_ids):
-    links = []
-
-    if len(link_ids) == 0:
-        return {}
-
-    block_size = 500
-    limit = len(link_ids)
-    lower = 0
-    while lower < limit:
-        upper = lower+block_size
-        rs = db.DBSession.query(Link)\
-                   .options(joinedload(Link.attributes))\
-                   .options(joinedload(Link.types))\
-                   .filter(Link.id.in_(link_ids[lower:upper])).all()
-        log.debug("Retrieved %s links", len(rs))
-        links.extend(rs)
-        lower = upper
-
-
-    link_dict = {}
-
-    for l in links:
-        l.ref_id = l.id
-        l.ref_key = 'LINK'
-        link_dict[l.id] = l
-
-    return link_dict
-
-def _get_nodes(node_ids):
-    nodes = []
+#The column in tResourceAttr and tResourceType referring to each kind of resource
+_REF_COLS = {
+    'NETWORK': 'network_id',
+    'NODE': 'node_id',
+    'LINK': 'link_id',
+    'GROUP': 'group_id',
+}
 
-    if len(node_ids) == 0:
-        return {}
-
-    block_size = 500
-    limit = len(node_ids)
-    lower = 0
-    while lower < limit:
-        upper = lower+block_size
-        rs = db.DBSession.query(Node)\
-                   .options(joinedload(Node.attributes))\
-                   .options(joinedload(Node.types))\
-                   .filter(Node.id.in_(node_ids[lower:upper])).all()
-        log.debug("Retrieved %s nodes", len(rs))
-        nodes.extend(rs)
-        lower = upper
-
-    node_dict = {}
-
-    for n in nodes:
-        n.ref_id = n.id
-        n.ref_key = 'NODE'
-        node_dict[n.id] = n
-
-    return node_dict
+def _get_resource_state(ref_key, ref_ids):
+    """
+        Get the network ID, and the IDs of the existing attributes and types,
+        of a list of resources of one kind.
+        returns:
+            A dict of resource ID to network ID, containing only the resources
+            which exist, a dict of resource ID to a set of attribute IDs, and a
+            dict of resource ID to a list of type IDs.
+    """
+    ref_col = _REF_COLS[ref_key]
+    ra_ref_col = getattr(ResourceAttr, ref_col)
+    rt_ref_col = getattr(ResourceType, ref_col)
 
-def _get_groups(group_ids):
-    groups = []
+    network_ids = {}
+    attr_ids = defaultdict(set)
+    type_ids = defaultdict(list)
 
-    if len(group_ids) == 0:
-        return {}
+    for lower in range(0, len(ref_ids), data.qry_in_threshold):
+        chunk = ref_ids[lower:lower+data.qry_in_threshold]
 
-    block_size = 500
-    limit = len(group_ids)
-    lower = 0
-    while lower < limit:
-        upper = lower+block_size
-        rs = db.DBSession.query(ResourceGroup)\
-                   .options(joinedload(ResourceGroup.attributes))\
-                   .options(joinedload(ResourceGroup.types))\
-                   .filter(ResourceGroup.id.in_(group_ids[lower:upper])).all()
-        log.debug("Retrieved %s groups", len(rs))
-        groups.extend(rs)
-        lower = upper
+        if ref_key == 'NETWORK':
+            for resource in db.DBSession.query(Network.id).filter(Network.id.in_(chunk)):
+                network_ids[resource.id] = resource.id
+        else:
+            resource_class = {'NODE': Node, 'LINK': Link, 'GROUP': ResourceGroup}[ref_key]
+            for resource in db.DBSession.query(resource_class.id, resource_class.network_id)\
+                    .filter(resource_class.id.in_(chunk)):
+                network_ids[resource.id] = resource.network_id
 
-    group_dict = {}
+        for ref_id, attr_id in db.DBSession.query(ra_ref_col, ResourceAttr.attr_id)\
+                .filter(ra_ref_col.in_(chunk)):
+            attr_ids[ref_id].add(attr_id)
 
-    for g in groups:
-        g.ref_id = g.id
-        g.ref_key = 'GROUP'
-        group_dict[g.id] = g
+        for ref_id, type_id in db.DBSession.query(rt_ref_col, ResourceType.type_id)\
+                .filter(rt_ref_col.in_(chunk)).order_by(ResourceType.id):
+            type_ids[ref_id].append(type_id)
 
-    return group_dict
+    return network_ids, attr_ids, type_ids
 
 @required_perms("edit_network")
 def assign_type_to_resource(type_id, resource_type, resource_id, **kwargs):
@@ -663,6 +810,8 @@ def assign_type_to_resource(type_id, resource_type, resource_id, **kwargs):
 
     if len(res_attrs) > 0:
         db.DBSession.bulk_insert_mappings(ResourceAttr, res_attrs)
+        clear_network_resource_attributes_cache(
+            resource.id if resource_type == 'NETWORK' else resource.network_id)
 
     if len(res_scenarios) > 0:
         db.DBSession.bulk_insert_mappings(ResourceScenario, res_scenarios)
@@ -853,33 +1002,8 @@ def validate_attrs(resource_attr_ids, scenario_id, template_id=None, **kwargs):
         Check that multiple resource attribute satisfy the requirements of the types of resources to
         which the they are attached.
     """
-    multi_rs = db.DBSession.query(ResourceScenario).\
-                            filter(ResourceScenario.resource_attr_id.in_(resource_attr_ids),\
-                                   ResourceScenario.scenario_id == scenario_id).\
-                                   options(joinedload(ResourceScenario.resourceattr)).\
-                                   options(joinedload(ResourceScenario.dataset)).all()
-
-    errors = []
-    for rs in multi_rs:
-        try:
-            validate_resourcescenario(rs, template_id)
-        except HydraError as e:
-
-            error = dict(
-                ref_key=rs.resourceattr.ref_key,
-                ref_id=rs.resourceattr.get_resource_id(),
-                ref_name=rs.resourceattr.get_resource().get_name(),
-                resource_attr_id=rs.resource_attr_id,
-                attr_id=rs.resourceattr.attr.id,
-                attr_name=rs.resourceattr.attr.name,
-                dataset_id=rs.dataset_id,
-                scenario_id=scenario_id,
-                template_id=template_id,
-                error_text=e.args[0])
-
-            errors.append(error)
-
-    return errors
+    return validate_scenario_data(scenario_id, template_id=template_id,
+                                  resource_attr_ids=resource_attr_ids)
 
 @required_perms('get_network')
 def validate_scenario(scenario_id, template_id=None, **kwargs):
@@ -888,31 +1012,7 @@ def validate_scenario(scenario_id, template_id=None, **kwargs):
         correct, based on the templates in a network. If a template is specified,
         only that template will be checked.
     """
-    scenario_rs = db.DBSession.query(ResourceScenario).filter(
-                ResourceScenario.scenario_id==scenario_id)\
-                .options(joinedload(ResourceScenario.resourceattr))\
-                .options(joinedload(ResourceScenario.dataset)).all()
-
-    errors = []
-    for rs in scenario_rs:
-        try:
-            validate_resourcescenario(rs, template_id)
-        except HydraError as e:
-
-            error = dict(
-                ref_key=rs.resourceattr.ref_key,
-                ref_id=rs.resourceattr.get_resource_id(),
-                ref_name=rs.resourceattr.get_resource().get_name(),
-                resource_attr_id=rs.resource_attr_id,
-                attr_id=rs.resourceattr.attr.id,
-                attr_name=rs.resourceattr.attr.name,
-                dataset_id=rs.dataset_id,
-                scenario_id=scenario_id,
-                template_id=template_id,
-                error_text=e.args[0])
-            errors.append(error)
-
-    return errors
+    return validate_scenario_data(scenario_id, template_id=template_id)
 
 
 def validate_resourcescenario(resourcescenario, template_id=None, **kwargs):
@@ -963,64 +1063,33 @@ def validate_network(network_id, template_id, scenario_id=None, **kwargs):
         This validation will not fail if a resource has more than the required type,
         but will fail if it has fewer or if any attribute has a
         conflicting dimension or unit.
+        returns:
+            list of strings, describing each error. Use get_network_validation_errors
+            to get the resource, attribute and dataset of each error as well.
     """
+    errors = get_network_validation_errors(network_id, template_id,
+                                           scenario_id=scenario_id, **kwargs)
+    return [e.error_text for e in errors]
 
-    network = db.DBSession.query(Network).filter(
-        Network.id == network_id).options(noload(Network.scenarios)).first()
+@required_perms('get_network')
+def get_network_validation_errors(network_id, template_id, scenario_id=None, **kwargs):
+    """
+        As validate_network, but returning a JSONObject for each error, containing
+        the ref_key, ref_id and ref_name of the resource, the resource_attr_id,
+        attr_id, attr_name and dataset_id where relevant, and the error_text.
+    """
+    network = db.DBSession.query(Network.id).filter(Network.id == network_id).first()
 
     if network is None:
         raise HydraError("Could not find network %s"%(network_id))
 
-    resource_scenario_dict = {}
     if scenario_id is not None:
-        scenario = db.DBSession.query(Scenario).filter(Scenario.id == scenario_id).first()
+        scenario = db.DBSession.query(Scenario.id).filter(Scenario.id == scenario_id).first()
 
         if scenario is None:
             raise HydraError("Could not find scenario %s"%(scenario_id,))
 
-        for rs in scenario.resourcescenarios:
-            resource_scenario_dict[rs.resource_attr_id] = rs
-
-    template = db.DBSession.query(Template).filter(
-        Template.id == template_id).first()
-
-    if template is None:
-        raise HydraError("Could not find template %s"%(template_id,))
-
-    resource_type_defs = {
-        'NETWORK' : {},
-        'NODE'    : {},
-        'LINK'    : {},
-        'GROUP'   : {},
-    }
-    for tt in template.get_types():
-        resource_type_defs[tt.resource_type][tt.id] = tt
-
-    errors = []
-    #Only check if there are type definitions for a network in the template.
-    if resource_type_defs.get('NETWORK'):
-        net_types = resource_type_defs['NETWORK']
-        errors.extend(validate_resource(network, net_types, resource_scenario_dict))
-
-    #check all nodes
-    if resource_type_defs.get('NODE'):
-        node_types = resource_type_defs['NODE']
-        for node in network.nodes:
-            errors.extend(validate_resource(node, node_types, resource_scenario_dict))
-
-    #check all links
-    if resource_type_defs.get('LINK'):
-        link_types = resource_type_defs['LINK']
-        for link in network.links:
-            errors.extend(validate_resource(link, link_types, resource_scenario_dict))
-
-    #check all groups
-    if resource_type_defs.get('GROUP'):
-        group_types = resource_type_defs['GROUP']
-        for group in network.resourcegroups:
-            errors.extend(validate_resource(group, group_types, resource_scenario_dict))
-
-    return errors
+    return validate_network_resources(network_id, template_id, scenario_id=scenario_id)
 
 def validate_resource(resource, tmpl_types, resource_scenarios=[], **kwargs):
     errors = []
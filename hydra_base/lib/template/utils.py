@@ -19,18 +19,90 @@
 import json
 import logging
 import re
+import uuid
 
 from collections.abc import Sized
 
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
 from hydra_base import db
 from hydra_base.db.model import Attr
 from hydra_base.lib.objects import JSONObject
 from hydra_base.exceptions import HydraError
 from hydra_base.util import dataset_util
 from hydra_base.lib import units
+from hydra_base.lib.cache import cache
 
 log = logging.getLogger(__name__)
 
+TYPES_CACHE_KEY = 'template_types'
+VERSION_CACHE_KEY = 'template_version'
+
+#Set in a session's info to the IDs of the templates it has changed
+PENDING_TEMPLATES_KEY = 'pending_template_versions'
+
+def _get_template_version(template_id):
+    """
+        Get the current version of a template. This is a random token, replaced
+        whenever a transaction which changed the template ends.
+    """
+    version = cache.get(f"{VERSION_CACHE_KEY}_{template_id}")
+    if version is None:
+        version = _renew_template_version(template_id)
+    return version
+
+def _renew_template_version(template_id):
+    version = uuid.uuid4().hex
+    cache.set(f"{VERSION_CACHE_KEY}_{template_id}", version)
+    return version
+
+def new_template_version(template_id):
+    """
+        Give a template a new version once the current transaction ends, so
+        that the compiled types of it, and of any templates which inherit from
+        it, are rebuilt when next requested.
+    """
+    db.DBSession().info.setdefault(PENDING_TEMPLATES_KEY, set()).add(template_id)
+
+@event.listens_for(Session, 'after_transaction_end')
+def _renew_template_versions_after_transaction(session, transaction):
+    """
+        Renew the versions of the templates changed in a transaction once it
+        is committed or rolled back. Types compiled while it was open were
+        not cached, so none can be stored under the new versions.
+    """
+    if transaction.parent is None:
+        for template_id in session.info.pop(PENDING_TEMPLATES_KEY, ()):
+            _renew_template_version(template_id)
+
+def get_template_types(template_i):
+    """
+        Get the types of a template, with everything inherited from its parent
+        templates resolved, as returned by Template.get_types.
+        These are compiled once and kept in the cache along with the version of
+        each template in the inheritance tree they were compiled from, so they
+        are reused until any of those templates changes.
+        If the session has uncommitted changes to any of those templates, the
+        types are compiled from them and not cached.
+    """
+    lineage = template_i.get_lineage()
+
+    pending = db.DBSession().info.get(PENDING_TEMPLATES_KEY, ())
+    if any(t.id in pending for t in lineage):
+        return template_i.get_types()
+
+    versions = [(t.id, str(t.cr_date), _get_template_version(t.id)) for t in lineage]
+
+    compiled = cache.get(f"{TYPES_CACHE_KEY}_{template_i.id}")
+    if compiled is not None and compiled.get('versions') == versions:
+        return compiled['types']
+
+    log.info("Compiling types for template %s", template_i.id)
+    types = template_i.get_types()
+    cache.set(f"{TYPES_CACHE_KEY}_{template_i.id}", {'versions': versions, 'types': types})
+    return types
+
 def get_attr(attr_id):
     attr = db.DBSession.query(Attr).filter(Attr.id == attr_id).one()
     return JSONObject(attr)
@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+
+# (c) Copyright 2013 to 2020 University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+
+"""
+    Validation of whole networks and scenarios against their templates.
+
+    Rather than visiting each resource through the ORM, everything the rules
+    need (the resources, their types and attributes, the attributes'
+    dimensions, the units' dimensions and the resource scenarios) is loaded
+    up front in a handful of queries, and the rules are then checked in memory.
+    Each error is a JSONObject saying which resource, attribute and dataset it
+    relates to, with the description of the problem in 'error_text'.
+"""
+
+import logging
+from collections import defaultdict
+
+from hydra_base import db
+from hydra_base.db.model import (Template, TemplateType, Attr, Unit, Network, Node, Link,
+                                 ResourceGroup, ResourceType, ResourceAttr,
+                                 ResourceScenario, Scenario)
+from hydra_base.db.model import Dataset as ModelDataset
+from hydra_base.lib.objects import JSONObject
+from hydra_base.lib import data
+from hydra_base.exceptions import HydraError, ResourceNotFoundError
+from hydra_base.util import dataset_util
+from hydra_base.lib.template.utils import get_template_types
+
+log = logging.getLogger(__name__)
+
+#The resources within a network, with the column referring to them
+#in the resource attribute and resource type tables.
+_RESOURCE_CLASSES = (
+    ('NODE', Node, 'node_id'),
+    ('LINK', Link, 'link_id'),
+    ('GROUP', ResourceGroup, 'group_id'),
+)
+
+def _load_resource_names(network_id):
+    """
+        returns:
+            dict: The name of each resource, keyed on (ref_key, ref_id)
+    """
+    names = {}
+    network = db.DBSession.query(Network.id, Network.name).filter(
+        Network.id == network_id).one()
+    names[('NETWORK', network.id)] = network.name
+    for ref_key, resource_class, _ in _RESOURCE_CLASSES:
+        for resource in db.DBSession.query(resource_class.id, resource_class.name)\
+                .filter(resource_class.network_id == network_id).order_by(resource_class.id):
+            names[(ref_key, resource.id)] = resource.name
+    return names
+
+def _load_resource_types(network_id):
+    """
+        returns:
+            dict: The (type_id, child_template_id) of each type of each
+                  resource, keyed on (ref_key, ref_id)
+    """
+    resource_types = defaultdict(list)
+
+    for rt in db.DBSession.query(ResourceType.network_id, ResourceType.type_id,
+                                 ResourceType.child_template_id)\
+            .filter(ResourceType.network_id == network_id).order_by(ResourceType.id):
+        resource_types[('NETWORK', rt.network_id)].append((rt.type_id, rt.child_template_id))
+
+    for ref_key, resource_class, ref_col in _RESOURCE_CLASSES:
+        rt_ref_col = getattr(ResourceType, ref_col)
+        for rt in db.DBSession.query(rt_ref_col.label('ref_id'), ResourceType.type_id,
+                                     ResourceType.child_template_id)\
+                .join(resource_class, resource_class.id == rt_ref_col)\
+                .filter(resource_class.network_id == network_id).order_by(ResourceType.id):
+            resource_types[(ref_key, rt.ref_id)].append((rt.type_id, rt.child_template_id))
+
+    return resource_types
+
+def _load_resource_attrs(network_id):
+    """
+        returns:
+            dict: The resource attributes of each resource as (resource_attr_id, attr_id)
+                  pairs, keyed on (ref_key, ref_id)
+    """
+    resource_attrs = defaultdict(list)
+
+    for ra in db.DBSession.query(ResourceAttr.id, ResourceAttr.network_id, ResourceAttr.attr_id)\
+            .filter(ResourceAttr.network_id == network_id).order_by(ResourceAttr.id):
+        resource_attrs[('NETWORK', ra.network_id)].append((ra.id, ra.attr_id))
+
+    for ref_key, resource_class, ref_col in _RESOURCE_CLASSES:
+        ra_ref_col = getattr(ResourceAttr, ref_col)
+        for ra in db.DBSession.query(ResourceAttr.id, ra_ref_col.label('ref_id'), ResourceAttr.attr_id)\
+                .join(resource_class, resource_class.id == ra_ref_col)\
+                .filter(resource_class.network_id == network_id).order_by(ResourceAttr.id):
+            resource_attrs[(ref_key, ra.ref_id)].append((ra.id, ra.attr_id))
+
+    return resource_attrs
+
+def _load_attrs(attr_ids):
+    """
+        returns:
+            dict: The name and dimension of each attribute, keyed on attr ID
+    """
+    attrs = {}
+    attr_ids = list(attr_ids)
+    for lower in range(0, len(attr_ids), data.qry_in_threshold):
+        for attr in db.DBSession.query(Attr.id, Attr.name, Attr.dimension_id).filter(
+                Attr.id.in_(attr_ids[lower:lower+data.qry_in_threshold])):
+            attrs[attr.id] = attr
+    return attrs
+
+def _load_unit_dimensions():
+    """
+        returns:
+            dict: The dimension ID of each unit, keyed on unit ID
+    """
+    return dict(db.DBSession.query(Unit.id, Unit.dimension_id).all())
+
+class _TemplateTypes(object):
+    """
+        Looks up the fully inherited template type of a resource type,
+        compiling each template's types only once.
+    """
+    def __init__(self):
+        self._types = {}
+        self._type_template_ids = {}
+
+    def get(self, type_id, child_template_id=None):
+        template_id = child_template_id
+        if template_id is None:
+            if type_id not in self._type_template_ids:
+                self._type_template_ids[type_id] = db.DBSession.query(TemplateType.template_id)\
+                    .filter(TemplateType.id == type_id).scalar()
+            template_id = self._type_template_ids[type_id]
+
+        if template_id not in self._types:
+            template_i = db.DBSession.query(Template).filter(Template.id == template_id).one()
+            self._types[template_id] = dict((t.id, t) for t in get_template_types(template_i))
+
+        return self._types[template_id].get(type_id)
+
+def _make_error(ref_key, ref_id, ref_name, error_text, resource_attr_id=None, attr_id=None,
+                attr_name=None, dataset_id=None, scenario_id=None, template_id=None):
+    return JSONObject(dict(
+        ref_key=ref_key,
+        ref_id=ref_id,
+        ref_name=ref_name,
+        resource_attr_id=resource_attr_id,
+        attr_id=attr_id,
+        attr_name=attr_name,
+        dataset_id=dataset_id,
+        scenario_id=scenario_id,
+        template_id=template_id,
+        error_text=error_text))
+
+def validate_network_resources(network_id, template_id, scenario_id=None):
+    """
+        Check that every resource in a network which has a type from the template
+        has all the attributes of that type and, if a scenario is given,
+        that the data for those attributes has the type's dimension and unit.
+        returns:
+            list: A JSONObject for each error, in the order network, nodes,
+                  links, groups.
+    """
+    template = db.DBSession.query(Template).filter(Template.id == template_id).first()
+
+    if template is None:
+        raise HydraError("Could not find template %s"%(template_id,))
+
+    resource_type_defs = {
+        'NETWORK' : {},
+        'NODE'    : {},
+        'LINK'    : {},
+        'GROUP'   : {},
+    }
+    for tt in get_template_types(template):
+        resource_type_defs[tt.resource_type][tt.id] = tt
+
+    names = _load_resource_names(network_id)
+    resource_types = _load_resource_types(network_id)
+    resource_attrs = _load_resource_attrs(network_id)
+
+    #The dataset and unit of each resource attribute in the scenario
+    rs_units = {}
+    if scenario_id is not None:
+        for rs in db.DBSession.query(ResourceScenario.resource_attr_id,
+                                     ResourceScenario.dataset_id,
+                                     ModelDataset.unit_id)\
+                .join(ModelDataset, ModelDataset.id == ResourceScenario.dataset_id)\
+                .filter(ResourceScenario.scenario_id == scenario_id):
+            rs_units[rs.resource_attr_id] = rs
+
+    attr_ids = set(ta.attr_id for types in resource_type_defs.values()
+                   for tt in types.values() for ta in tt.typeattrs)
+    attrs = _load_attrs(attr_ids)
+    unit_dimensions = _load_unit_dimensions()
+
+    errors = []
+    for ref_key, ref_id in names:
+        tmpl_types = resource_type_defs[ref_key]
+        #Only check if there are type definitions for this kind of resource
+        #in the template, and no validation is required if the resource has no type.
+        if len(tmpl_types) == 0 or len(resource_types[(ref_key, ref_id)]) == 0:
+            continue
+
+        name = names[(ref_key, ref_id)]
+
+        for type_id, _ in resource_types[(ref_key, ref_id)]:
+            if type_id in tmpl_types:
+                resource_type = tmpl_types[type_id]
+                break
+        else:
+            errors.append(_make_error(ref_key, ref_id, name,
+                                      "No type from template %s found on %s %s"%
+                                      (template_id, ref_key, name),
+                                      template_id=template_id))
+            continue
+
+        ta_dict = dict((ta.attr_id, ta) for ta in resource_type.typeattrs)
+
+        #Make sure the resource has all the attributes specified in the template
+        resource_attr_ids = set(attr_id for _, attr_id in resource_attrs[(ref_key, ref_id)])
+        for attr_id in ta_dict:
+            if attr_id not in resource_attr_ids:
+                errors.append(_make_error(ref_key, ref_id, name,
+                                          "Resource %s does not have attribute %s"%
+                                          (name, attrs[attr_id].name),
+                                          attr_id=attr_id,
+                                          attr_name=attrs[attr_id].name,
+                                          template_id=template_id))
+
+        #if data is included, check to make sure each dataset conforms
+        #to the boundaries specified in the template: i.e. that it has
+        #the correct dimension and (if specified) unit.
+        for resource_attr_id, attr_id in resource_attrs[(ref_key, ref_id)]:
+            rs = rs_units.get(resource_attr_id)
+            if rs is None or attr_id not in ta_dict:
+                continue
+
+            attr = attrs[attr_id]
+
+            rs_dimension_id = None
+            if rs.unit_id is not None:
+                if rs.unit_id not in unit_dimensions:
+                    raise ResourceNotFoundError("Unit %s not found"%(rs.unit_id))
+                rs_dimension_id = unit_dimensions[rs.unit_id]
+
+            type_unit_id = ta_dict[attr_id].unit_id
+
+            error_args = dict(resource_attr_id=resource_attr_id,
+                              attr_id=attr_id,
+                              attr_name=attr.name,
+                              dataset_id=rs.dataset_id,
+                              scenario_id=scenario_id,
+                              template_id=template_id)
+
+            if rs_dimension_id != attr.dimension_id:
+                errors.append(_make_error(ref_key, ref_id, name,
+                                          "Dimension mismatch on %s %s, attribute %s: "
+                                          "%s on attribute, %s on type"%
+                                          (ref_key, name, attr.name,
+                                           rs_dimension_id, attr.dimension_id),
+                                          **error_args))
+
+            if type_unit_id is not None and rs.unit_id != type_unit_id:
+                errors.append(_make_error(ref_key, ref_id, name,
+                                          "Unit mismatch on attribute %s. "
+                                          "%s on attribute, %s on type"%
+                                          (attr.name, rs.unit_id, type_unit_id),
+                                          **error_args))
+
+    if len(errors) > 0:
+        log.warning("%s validation errors found in network %s", len(errors), network_id)
+
+    return errors
+
+def validate_scenario_data(scenario_id, template_id=None, resource_attr_ids=None):
+    """
+        Check the data in a scenario against the data restrictions of the types
+        of the resources the data is on. If a template is specified, only the
+        types from that template are checked.
+        args:
+            resource_attr_ids: Only check the data for these resource attributes
+        returns:
+            list: A JSONObject for each resource scenario which fails, ordered
+                  by resource attribute ID
+    """
+    scenario = db.DBSession.query(Scenario.id, Scenario.name, Scenario.network_id)\
+        .filter(Scenario.id == scenario_id).first()
+
+    if scenario is None:
+        raise HydraError("Could not find scenario %s"%(scenario_id,))
+
+    names = _load_resource_names(scenario.network_id)
+    resource_types = _load_resource_types(scenario.network_id)
+
+    ref_cols = dict([('NETWORK', 'network_id')] +
+                    [(ref_key, ref_col) for ref_key, _, ref_col in _RESOURCE_CLASSES])
+
+    rs_qry = db.DBSession.query(ResourceScenario.resource_attr_id,
+                                ResourceScenario.dataset_id,
+                                ResourceAttr.ref_key,
+                                ResourceAttr.attr_id,
+                                *[getattr(ResourceAttr, col) for col in ref_cols.values()])\
+        .join(ResourceAttr, ResourceAttr.id == ResourceScenario.resource_attr_id)\
+        .filter(ResourceScenario.scenario_id == scenario_id)
+    if resource_attr_ids is not None:
+        resource_attr_ids = list(resource_attr_ids)
+        rs_rows = []
+        for lower in range(0, len(resource_attr_ids), data.qry_in_threshold):
+            rs_rows.extend(rs_qry.filter(ResourceScenario.resource_attr_id.in_(
+                resource_attr_ids[lower:lower+data.qry_in_threshold])).all())
+    else:
+        rs_rows = rs_qry.all()
+    rs_rows.sort(key=lambda rs: rs.resource_attr_id)
+
+    attrs = _load_attrs(set(rs.attr_id for rs in rs_rows))
+    template_types = _TemplateTypes()
+
+    errors = []
+    #The resource scenarios to check, with the data restrictions to check them against
+    to_check = []
+    for rs in rs_rows:
+        ref_id = getattr(rs, ref_cols[rs.ref_key])
+        types = resource_types[(rs.ref_key, ref_id)]
+        if len(types) == 0:
+            continue
+
+        error_args = (rs.ref_key, ref_id, names.get((rs.ref_key, ref_id)))
+        error_kwargs = dict(resource_attr_id=rs.resource_attr_id,
+                            attr_id=rs.attr_id,
+                            attr_name=attrs[rs.attr_id].name,
+                            dataset_id=rs.dataset_id,
+                            scenario_id=scenario_id,
+                            template_id=template_id)
+
+        tmpltypes = [template_types.get(type_id, child_template_id)
+                     for type_id, child_template_id in types]
+        tmpltypes = [tt for tt in tmpltypes if tt is not None]
+
+        if template_id is not None:
+            if template_id not in [tt.template_id for tt in tmpltypes]:
+                errors.append(_make_error(*error_args,
+                                          "Template %s is not used for resource attribute %s in scenario %s"%\
+                                          (template_id, attrs[rs.attr_id].name, scenario.name),
+                                          **error_kwargs))
+                continue
+            tmpltypes = [tt for tt in tmpltypes if tt.template_id == template_id]
+
+        restrictions = [ta.data_restriction for tt in tmpltypes for ta in tt.typeattrs
+                        if ta.attr_id == rs.attr_id and ta.data_restriction]
+        if len(restrictions) > 0:
+            to_check.append((rs, error_args, error_kwargs, restrictions))
+
+    #Only the datasets which have restrictions to check need to be loaded.
+    dataset_ids = list(set(rs.dataset_id for rs, _, _, _ in to_check))
+    datasets = {}
+    for lower in range(0, len(dataset_ids), data.qry_in_threshold):
+        for dataset in db.DBSession.query(ModelDataset).filter(
+                ModelDataset.id.in_(dataset_ids[lower:lower+data.qry_in_threshold])):
+            datasets[dataset.id] = dataset
+
+    #Validate all the values against all their restrictions at once, keeping
+    #the first error for each resource scenario.
+    check_idx = []
+    restrictions = []
+    values = []
+    for i, (rs, error_args, error_kwargs, rs_restrictions) in enumerate(to_check):
+        try:
+            value = datasets[rs.dataset_id].get_val()
+        except HydraError as e:
+            errors.append(_make_error(*error_args, e.args[0], **error_kwargs))
+            continue
+        for restriction in rs_restrictions:
+            check_idx.append(i)
+            restrictions.append(restriction)
+            values.append(value)
+
+    failed = set()
+    for i, error_text in zip(check_idx, dataset_util.validate_values(restrictions, values)):
+        if error_text is not None and i not in failed:
+            failed.add(i)
+            _, error_args, error_kwargs, _ = to_check[i]
+            errors.append(_make_error(*error_args, error_text, **error_kwargs))
+
+    errors.sort(key=lambda e: e.resource_attr_id)
+
+    return errors
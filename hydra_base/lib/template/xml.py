@@ -18,14 +18,17 @@
 
 import json
 import logging
+from collections import defaultdict
 from decimal import Decimal
+from io import BytesIO
 from lxml import etree
 
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, selectinload
 
 from hydra_base import db
-from hydra_base.db.model import Template, TemplateType, TypeAttr, Network, Dataset, Metadata
+from hydra_base.db.model import (Template, TemplateType, TypeAttr, Attr, Network,
+                                 Node, Link, ResourceGroup, ResourceAttr)
 from hydra_base.lib.data import add_dataset
 from hydra_base.exceptions import HydraError
 from hydra_base import config
@@ -33,59 +36,380 @@ from hydra_base.util import dataset_util
 from hydra_base.lib import units
 from hydra_base.util.permissions import required_perms
 
-from hydra_base.lib.template.utils import check_dimension, get_attr_by_name_and_dimension
+from hydra_base.lib.template.utils import new_template_version
 
 log = logging.getLogger(__name__)
 
+#The number of types to read or write at a time
+XML_BATCH_SIZE = 500
+
+
+class _UnitLookup(object):
+    """
+        Look up units by abbreviation and dimensions by name or ID, going to
+        the DB only once for each.
+    """
+    def __init__(self):
+        self._units = {}
+        self._units_by_id = {}
+        self._dimensions = {}
+        self._dimensions_by_id = {}
+
+    def get_unit_by_abbreviation(self, abbreviation):
+        abbreviation = abbreviation.strip()
+        if abbreviation not in self._units:
+            unit = units.get_unit_by_abbreviation(abbreviation)
+            self._units[abbreviation] = unit
+            self._units_by_id[unit.id] = unit
+        return self._units[abbreviation]
+
+    def get_unit(self, unit_id):
+        if unit_id not in self._units_by_id:
+            self._units_by_id[unit_id] = units.get_unit(unit_id)
+        return self._units_by_id[unit_id]
+
+    def get_dimension_by_name(self, dimension_name):
+        key = dimension_name.strip().lower()
+        if key not in self._dimensions:
+            dimension = units.get_dimension_by_name(dimension_name)
+            self._dimensions[key] = dimension
+            self._dimensions_by_id[dimension.id] = dimension
+        return self._dimensions[key]
+
+    def get_dimension(self, dimension_id):
+        if dimension_id not in self._dimensions_by_id:
+            self._dimensions_by_id[dimension_id] = units.get_dimension(
+                dimension_id, do_accept_dimension_id_none=True)
+        return self._dimensions_by_id[dimension_id]
+
+def _write_text_element(xml_file, tag, text):
+    element = etree.Element(tag)
+    element.text = text
+    xml_file.write(element)
 
 @required_perms("get_template")
 def get_template_as_xml(template_id, **kwargs):
     """
-        Turn a template into an xml template
+        Turn a template into an xml template.
+        The types are loaded and written a batch at a time.
     """
-    template_xml = etree.Element("template_definition")
+    template_i = db.DBSession.query(Template).filter(Template.id == template_id).one()
+
+    type_ids = [t.id for t in db.DBSession.query(TemplateType.id).filter(
+        TemplateType.template_id == template_id).order_by(TemplateType.id)]
 
-    template_i = db.DBSession.query(Template).filter(
-        Template.id == template_id).options(
-            joinedload(Template.templatetypes)\
-            .joinedload(TemplateType.typeattrs)\
-            .joinedload(TypeAttr.default_dataset)\
-            .joinedload(Dataset.metadata)
-        ).one()
+    unit_lookup = _UnitLookup()
 
-    template_name = etree.SubElement(template_xml, "template_name")
-    template_name.text = template_i.name
-    template_description = etree.SubElement(template_xml, "template_description")
-    template_description.text = template_i.description
-    resources = etree.SubElement(template_xml, "resources")
+    output = BytesIO()
+    with etree.xmlfile(output, encoding='utf-8') as xml_file:
+        with xml_file.element("template_definition"):
+            _write_text_element(xml_file, "template_name", template_i.name)
+            _write_text_element(xml_file, "template_description", template_i.description)
 
-    for type_i in template_i.templatetypes:
-        xml_resource = etree.SubElement(resources, "resource")
+            with xml_file.element("resources"):
+                for lower in range(0, len(type_ids), XML_BATCH_SIZE):
+                    types_i = db.DBSession.query(TemplateType).filter(
+                        TemplateType.id.in_(type_ids[lower:lower+XML_BATCH_SIZE])).options(
+                            selectinload(TemplateType.typeattrs)\
+                            .joinedload(TypeAttr.attr)).order_by(TemplateType.id).all()
 
-        resource_type = etree.SubElement(xml_resource, "type")
-        resource_type.text = type_i.resource_type
+                    for type_i in types_i:
+                        xml_resource = etree.Element("resource")
 
-        name = etree.SubElement(xml_resource, "name")
-        name.text = type_i.name
+                        resource_type = etree.SubElement(xml_resource, "type")
+                        resource_type.text = type_i.resource_type
 
-        description = etree.SubElement(xml_resource, "description")
-        description.text = type_i.description
+                        name = etree.SubElement(xml_resource, "name")
+                        name.text = type_i.name
 
-        alias = etree.SubElement(xml_resource, "alias")
-        alias.text = type_i.alias
+                        description = etree.SubElement(xml_resource, "description")
+                        description.text = type_i.description
 
-        if type_i.layout is not None and type_i.layout != "":
-            layout = _get_layout_as_etree(type_i.layout)
-            xml_resource.append(layout)
+                        alias = etree.SubElement(xml_resource, "alias")
+                        alias.text = type_i.alias
 
-        for type_attr in type_i.typeattrs:
-            _make_attr_element_from_typeattr(xml_resource, type_attr)
+                        if type_i.layout is not None and type_i.layout != "":
+                            layout = _get_layout_as_etree(type_i.layout)
+                            xml_resource.append(layout)
 
-        resources.append(xml_resource)
+                        for type_attr in type_i.typeattrs:
+                            _make_attr_element_from_typeattr(xml_resource, type_attr,
+                                                             unit_lookup=unit_lookup)
 
-    xml_string = etree.tostring(template_xml, encoding="unicode")
+                        xml_file.write(xml_resource)
 
-    return xml_string
+    return output.getvalue().decode('utf-8')
+
+def _iter_template_xml(template_xml, xmlschema):
+    """
+        Parse a template XML string, validating it as it goes, and yield
+        each element directly within the template_definition (the name,
+        description, layout), then each resource. Resources are removed from
+        the tree once they have been yielded, so only one is held at a time.
+    """
+    if isinstance(template_xml, str):
+        template_xml = template_xml.encode('utf-8')
+
+    for _, element in etree.iterparse(BytesIO(template_xml), events=('end',),
+                                      schema=xmlschema, remove_blank_text=True):
+        parent = element.getparent()
+        if parent is None:
+            continue
+
+        if parent.tag == 'template_definition' and element.tag != 'resources':
+            yield element
+        elif element.tag == 'resource' and parent.tag == 'resources':
+            yield element
+            element.clear()
+            while element.getprevious() is not None:
+                del parent[0]
+
+def _parse_xml_resource(resource):
+    """
+        Read a resource element into a dict, so the element can be discarded.
+        Optional elements are only included if they are present.
+    """
+    resource_j = {'name': resource.find('name').text, 'attributes': []}
+
+    for tag in ('alias', 'description', 'type'):
+        if resource.find(tag) is not None:
+            resource_j[tag] = resource.find(tag).text
+
+    if resource.find('layout') is not None and \
+        resource.find('layout').text is not None:
+        resource_j['layout'] = json.dumps(get_etree_layout_as_dict(resource.find('layout')))
+
+    for attribute in resource.findall('attribute'):
+        attribute_j = {'name': attribute.find('name').text.strip()}
+        for tag in ('dimension', 'unit', 'description', 'is_var', 'data_type'):
+            if attribute.find(tag) is not None:
+                attribute_j[tag] = attribute.find(tag).text
+
+        if attribute.find('properties') is not None:
+            attribute_j['properties'] = str(get_etree_layout_as_dict(attribute.find('properties')))
+
+        if attribute.find('default') is not None:
+            default = attribute.find('default')
+            attribute_j['default'] = {
+                'value': default.find('value').text,
+                'unit': default.find('unit').text if default.find('unit') is not None else None,
+            }
+
+        if attribute.find('restrictions') is not None:
+            attribute_j['restrictions'] = str(dataset_util.get_restriction_as_dict(
+                attribute.find('restrictions')))
+
+        resource_j['attributes'].append(attribute_j)
+
+    return resource_j
+
+class _TemplateXMLImporter(object):
+    """
+        Adds or updates the types of a template from the resources in a
+        template XML file, a batch of resources at a time. The attributes,
+        units and dimensions of a whole batch are looked up together, and
+        the new types and type attributes are inserted in one flush.
+    """
+    def __init__(self, tmpl_i, user_id=None):
+        self.tmpl_i = tmpl_i
+        self.user_id = user_id
+        self.unit_lookup = _UnitLookup()
+        self.type_names = set()
+        #Default datasets added by this import, which may not have been flushed yet
+        self.datasets = {}
+
+        self.existing_types = {}
+        if tmpl_i.id is not None:
+            types_i = db.DBSession.query(TemplateType).filter(
+                TemplateType.template_id == tmpl_i.id).options(
+                    selectinload(TemplateType.typeattrs)).all()
+            self.existing_types = dict((t.name, t) for t in types_i)
+
+    def _get_attr_dimension_id(self, attribute_j):
+        if 'dimension' in attribute_j:
+            dimension_name = attribute_j['dimension']
+            if dimension_name is not None and dimension_name.strip() != '':
+                return self.unit_lookup.get_dimension_by_name(dimension_name).id
+        elif attribute_j.get('unit') is not None and attribute_j['unit'].strip() != '':
+            return self.unit_lookup.get_unit_by_abbreviation(attribute_j['unit']).dimension_id
+        return None
+
+    def _get_attrs(self, resources_j):
+        """
+            Get the attributes used in a batch of resources, keyed on name and
+            dimension ID, creating any which don't exist yet.
+        """
+        keys = set()
+        for resource_j in resources_j:
+            for attribute_j in resource_j['attributes']:
+                attribute_j['dimension_id'] = self._get_attr_dimension_id(attribute_j)
+                keys.add((attribute_j['name'], attribute_j['dimension_id']))
+
+        attrs = {}
+        names = list(set(name for name, _ in keys))
+        for lower in range(0, len(names), XML_BATCH_SIZE):
+            for attr_i in db.DBSession.query(Attr).filter(
+                    Attr.name.in_(names[lower:lower+XML_BATCH_SIZE])):
+                if (attr_i.name, attr_i.dimension_id) in keys:
+                    attrs[(attr_i.name, attr_i.dimension_id)] = attr_i
+
+        for name, dimension_id in keys:
+            if (name, dimension_id) not in attrs:
+                log.debug("Attribute not found, creating new attribute: name:%s, dimen:%s",
+                          name, dimension_id)
+                attr_i = Attr(name=name, dimension_id=dimension_id)
+                db.DBSession.add(attr_i)
+                attrs[(name, dimension_id)] = attr_i
+
+        db.DBSession.flush()
+
+        return attrs
+
+    def _check_dimension(self, unit_id, attr_i):
+        """
+            As utils.check_dimension, using the cached units and dimensions
+        """
+        if unit_id is None:
+            return
+
+        unit = self.unit_lookup.get_unit(unit_id)
+        unit_dimension = self.unit_lookup.get_dimension(unit.dimension_id)
+
+        if attr_i.dimension_id is None:
+            raise HydraError(f"Unit {unit_id} ({unit.abbreviation}) has dimension_id"+
+                             f" {unit_dimension.id}(name=dimension.name),"+
+                             " but attribute has no dimension")
+        elif unit.dimension_id != attr_i.dimension_id:
+            raise HydraError(f"Unit {unit_id} ({unit.abbreviation}) has dimension_id"+
+                             f" {unit_dimension.id}(name=dimension1.name),"+
+                             f" but attribute has id: {unit_dimension.id}({unit_dimension.name})")
+
+    def _set_typeattr(self, type_i, typeattr_i, attribute_j, attr_i):
+        """
+            Set the values in the attribute element on a type attribute.
+        """
+        typeattr_unit_id = None
+        if attribute_j.get('unit') not in ('', None):
+            typeattr_unit_id = self.unit_lookup.get_unit_by_abbreviation(attribute_j['unit']).id
+
+        if typeattr_unit_id is not None:
+            typeattr_i.unit_id = typeattr_unit_id
+
+        self._check_dimension(typeattr_i.unit_id, attr_i)
+
+        for key in ('description', 'properties', 'data_type'):
+            if key in attribute_j:
+                setattr(typeattr_i, key, attribute_j[key])
+
+        if 'is_var' in attribute_j:
+            typeattr_i.attr_is_var = attribute_j['is_var']
+
+        # Analyzing the "default" node
+        if 'default' in attribute_j:
+            default_j = attribute_j['default']
+
+            dataset_unit_id = None
+            if default_j['unit'] not in ('', None):
+                dataset_unit_id = self.unit_lookup.get_unit_by_abbreviation(default_j['unit']).id
+
+            if dataset_unit_id is not None and typeattr_i.unit_id is not None:
+                if dataset_unit_id != typeattr_i.unit_id:
+                    raise HydraError(f"Default value has a unit of {typeattr_i.unit_id}"+
+                                     "but the attribute"+
+                                     f" says the unit should be: {dataset_unit_id}")
+
+            val = default_j['value']
+            try:
+                Decimal(val)
+                data_type = 'scalar'
+            except:
+                data_type = 'descriptor'
+
+            #Datasets with the same type, value and unit share a hash, so are the same dataset
+            dataset_key = (data_type, val, dataset_unit_id)
+            if dataset_key not in self.datasets:
+                self.datasets[dataset_key] = add_dataset(data_type,
+                                                         val,
+                                                         dataset_unit_id,
+                                                         name="%s Default"%attr_i.name,
+                                                         user_id=self.user_id)
+
+            typeattr_i.default_dataset = self.datasets[dataset_key]
+
+        typeattr_i.data_restriction = attribute_j.get('restrictions')
+
+    def add_resources(self, resources_j):
+        """
+            Add or update the types described by a batch of parsed resource elements
+        """
+        attrs = self._get_attrs(resources_j)
+
+        for resource_j in resources_j:
+            type_name = resource_j['name']
+            self.type_names.add(type_name)
+
+            #check if the type is already in the DB. If not, create a new one.
+            type_i = self.existing_types.get(type_name)
+            if type_i is None:
+                log.debug("Type %s not found, creating new one.", type_name)
+                type_i = TemplateType()
+                type_i.name = type_name
+                self.tmpl_i.templatetypes.append(type_i)
+                self.existing_types[type_name] = type_i
+
+            for key in ('alias', 'description', 'layout'):
+                if key in resource_j:
+                    setattr(type_i, key, resource_j[key])
+            if 'type' in resource_j:
+                type_i.resource_type = resource_j['type']
+
+            existing_typeattrs = dict((ta.attr_id, ta) for ta in type_i.typeattrs)
+
+            #Add or update type typeattrs
+            attr_ids = set()
+            for attribute_j in resource_j['attributes']:
+                attr_i = attrs[(attribute_j['name'], attribute_j['dimension_id'])]
+                attr_ids.add(attr_i.id)
+
+                typeattr_i = existing_typeattrs.get(attr_i.id)
+                if typeattr_i is None:
+                    log.debug("Creating type attr: type_id=%s, attr_id=%s", type_i.id, attr_i.id)
+                    typeattr_i = TypeAttr(attr_id=attr_i.id)
+                    type_i.typeattrs.append(typeattr_i)
+                    existing_typeattrs[attr_i.id] = typeattr_i
+
+                self._set_typeattr(type_i, typeattr_i, attribute_j, attr_i)
+
+            #delete any TypeAttrs which are in the DB but not in the XML file
+            for attr_id, typeattr_i in existing_typeattrs.items():
+                if attr_id not in attr_ids:
+                    log.debug("Attr %s in type %s deleted", attr_id, type_i.name)
+                    type_i.typeattrs.remove(typeattr_i)
+                    db.DBSession.delete(typeattr_i)
+
+        db.DBSession.flush()
+
+    def delete_missing_types(self):
+        """
+            Delete any types which are in the DB but no longer in the XML file
+        """
+        types_to_delete = [type_i for type_name, type_i in self.existing_types.items()
+                           if type_name not in self.type_names]
+        if len(types_to_delete) == 0:
+            return
+
+        #Type attributes are not deleted along with their type, so remove them first
+        type_ids = [type_i.id for type_i in types_to_delete]
+        for lower in range(0, len(type_ids), XML_BATCH_SIZE):
+            db.DBSession.query(TypeAttr).filter(
+                TypeAttr.type_id.in_(type_ids[lower:lower+XML_BATCH_SIZE])
+            ).delete(synchronize_session=False)
+
+        for type_i in types_to_delete:
+            log.debug("Deleting type %s", type_i.name)
+            db.DBSession.expire(type_i, ['typeattrs'])
+            self.tmpl_i.templatetypes.remove(type_i)
+            db.DBSession.delete(type_i)
 
 @required_perms("add_template")
 def import_template_xml(template_xml, allow_update=True, **kwargs):
@@ -95,6 +419,9 @@ def import_template_xml(template_xml, allow_update=True, **kwargs):
 
         Delete type, typeattr entries in the DB that are not in the XML file
         The assumption is that they have been deleted and are no longer required.
+
+        The XML is parsed and validated as a stream, and the resources are
+        added in batches, so large templates are not held in memory all at once.
     """
     user_id = kwargs.get('user_id')
 
@@ -103,28 +430,49 @@ def import_template_xml(template_xml, allow_update=True, **kwargs):
 
     xmlschema = etree.XMLSchema(xmlschema_doc)
 
-    xml_tree = etree.fromstring(template_xml)
+    template_name = None
+    template_description = None
+    template_layout = None
+    importer = None
+    resources_j = []
+
+    for element in _iter_template_xml(template_xml, xmlschema):
+        if element.tag == 'template_name':
+            template_name = element.text
+        elif element.tag == 'template_description':
+            template_description = element.text
+        elif element.tag == 'layout':
+            if element.text is not None:
+                template_layout = json.dumps(get_etree_layout_as_dict(element))
+        elif element.tag == 'resource':
+            if importer is None:
+                tmpl_i = _get_xml_template(template_name, template_description,
+                                           template_layout, allow_update)
+                importer = _TemplateXMLImporter(tmpl_i, user_id=user_id)
+
+            resources_j.append(_parse_xml_resource(element))
+            if len(resources_j) >= XML_BATCH_SIZE:
+                importer.add_resources(resources_j)
+                resources_j = []
+
+    if len(resources_j) > 0:
+        importer.add_resources(resources_j)
+
+    importer.delete_missing_types()
 
-    xmlschema.assertValid(xml_tree)
+    db.DBSession.flush()
 
-    template_name = xml_tree.find('template_name').text
-    template_description = xml_tree.find('template_description')
-    if template_description is not None:
-        template_description = template_description.text
+    new_template_version(importer.tmpl_i.id)
 
-    template_layout = None
-    if xml_tree.find('layout') is not None and \
-               xml_tree.find('layout').text is not None:
-        layout = xml_tree.find('layout')
-        layout_string = get_etree_layout_as_dict(layout)
-        template_layout = json.dumps(layout_string)
+    return importer.tmpl_i
 
+def _get_xml_template(template_name, template_description, template_layout, allow_update):
+    """
+        Get the template with the name in the template XML, updating its
+        description and layout, or create it if there isn't one.
+    """
     try:
-        tmpl_i = db.DBSession.query(Template).filter(Template.name == template_name)\
-            .options(joinedload(Template.templatetypes)\
-            .joinedload(TemplateType.typeattrs)\
-            .joinedload(TypeAttr.attr)
-            ).one()
+        tmpl_i = db.DBSession.query(Template).filter(Template.name == template_name).one()
 
         if allow_update == False:
             raise HydraError("Existing Template Found with name %s"%(template_name,))
@@ -138,96 +486,30 @@ def import_template_xml(template_xml, allow_update=True, **kwargs):
                           description=template_description, layout=template_layout)
         db.DBSession.add(tmpl_i)
 
-    types = xml_tree.find('resources')
-    #Delete any types which are in the DB but no longer in the XML file
-    type_name_map = {r.name:r.id for r in tmpl_i.templatetypes}
-    attr_name_map = {}
-    for type_i in tmpl_i.templatetypes:
-        for typeattr in type_i.typeattrs:
-            attr_name_map[typeattr.attr.name] = (typeattr.attr.id, typeattr.type_id)
-
-    existing_types = set([r.name for r in tmpl_i.templatetypes])
-
-    new_types = set([r.find('name').text for r in types.findall('resource')])
-
-    types_to_delete = existing_types - new_types
+    return tmpl_i
 
-    for type_to_delete in types_to_delete:
-        type_id = type_name_map[type_to_delete]
-        try:
-            type_i = db.DBSession.query(TemplateType).filter(TemplateType.id==type_id).one()
-            log.debug("Deleting type %s", type_i.name)
-            db.DBSession.delete(type_i)
-        except NoResultFound:
-            pass
-
-    #Add or update types.
-    for resource in types.findall('resource'):
-        type_name = resource.find('name').text
-        #check if the type is already in the DB. If not, create a new one.
-        type_is_new = False
-        if type_name in existing_types:
-            type_id = type_name_map[type_name]
-            type_i = db.DBSession.query(TemplateType).filter(
-                TemplateType.id == type_id).options(
-                    joinedload(TemplateType.typeattrs)\
-                    .joinedload(TypeAttr.attr)
-                ).one()
+def _get_resource_attrs(network_id):
+    """
+        Get the resource attributes, with their attributes, of all the
+        resources in a network, keyed on (ref_key, resource ID).
+    """
+    resource_attrs = defaultdict(list)
 
-        else:
-            log.debug("Type %s not found, creating new one.", type_name)
-            type_i = TemplateType()
-            type_i.name = type_name
-            tmpl_i.templatetypes.append(type_i)
-            type_is_new = True
-
-        if resource.find('alias') is not None:
-            type_i.alias = resource.find('alias').text
-
-        if resource.find('description') is not None:
-            type_i.description = resource.find('description').text
-
-        if resource.find('type') is not None:
-            type_i.resource_type = resource.find('type').text
-
-        if resource.find('layout') is not None and \
-            resource.find('layout').text is not None:
-            layout = resource.find('layout')
-            layout_string = get_etree_layout_as_dict(layout)
-            type_i.layout = json.dumps(layout_string)
-
-        #delete any TypeAttrs which are in the DB but not in the XML file
-        existing_attrs = []
-        if not type_is_new:
-            for r in tmpl_i.templatetypes:
-                if r.name == type_name:
-                    for typeattr in r.typeattrs:
-                        existing_attrs.append(typeattr.attr.name)
-
-        existing_attrs = set(existing_attrs)
-
-        template_attrs = set([r.find('name').text for r in resource.findall('attribute')])
-
-        attrs_to_delete = existing_attrs - template_attrs
-        for attr_to_delete in attrs_to_delete:
-            attr_id, type_id = attr_name_map[attr_to_delete]
-            try:
-                attr_i = db.DBSession.query(TypeAttr).filter(
-                    TypeAttr.attr_id == attr_id,
-                    TypeAttr.type_id == type_id).options(joinedload(TypeAttr.attr)).one()
-                db.DBSession.delete(attr_i)
-                log.debug("Attr %s in type %s deleted", attr_i.attr.name, attr_i.templatetype.name)
-            except NoResultFound:
-                log.debug("Attr %s not found in type %s",attr_id, type_id)
-                continue
-
-        #Add or update type typeattrs
-        for attribute in resource.findall('attribute'):
-            new_typeattr = _parse_xml_typeattr(type_i, attribute, user_id=user_id)
+    for ra in db.DBSession.query(ResourceAttr).filter(ResourceAttr.network_id == network_id)\
+            .options(joinedload(ResourceAttr.attr)).order_by(ResourceAttr.id):
+        resource_attrs[('NETWORK', ra.network_id)].append(ra)
 
-    db.DBSession.flush()
+    for ref_key, resource_class, ref_col in (('NODE', Node, 'node_id'),
+                                            ('LINK', Link, 'link_id'),
+                                            ('GROUP', ResourceGroup, 'group_id')):
+        ra_ref_col = getattr(ResourceAttr, ref_col)
+        for ra in db.DBSession.query(ResourceAttr)\
+                .join(resource_class, resource_class.id == ra_ref_col)\
+                .filter(resource_class.network_id == network_id)\
+                .options(joinedload(ResourceAttr.attr)).order_by(ResourceAttr.id):
+            resource_attrs[(ref_key, getattr(ra, ref_col))].append(ra)
 
-    return tmpl_i
+    return resource_attrs
 
 @required_perms('get_network')
 def get_network_as_xml_template(network_id, **kwargs):
@@ -237,234 +519,88 @@ def get_network_as_xml_template(network_id, **kwargs):
         If an optional scenario ID is passed in, default
         values will be populated from that scenario.
     """
-    template_xml = etree.Element("template_definition")
-
     net_i = db.DBSession.query(Network).filter(Network.id == network_id).one()
 
-    template_name = etree.SubElement(template_xml, "template_name")
-    template_name.text = "TemplateType from Network %s"%(net_i.name)
-    layout = _get_layout_as_etree(net_i.layout)
-
-    resources = etree.SubElement(template_xml, "resources")
-    if net_i.attributes:
-        net_resource = etree.SubElement(resources, "resource")
-
-        resource_type = etree.SubElement(net_resource, "type")
-        resource_type.text = "NETWORK"
-
-        resource_name = etree.SubElement(net_resource, "name")
-        resource_name.text = net_i.name
-
-        layout = _get_layout_as_etree(net_i.layout)
-        if layout is not None:
-            net_resource.append(layout)
-
-        for net_attr in net_i.attributes:
-            _make_attr_element_from_resourceattr(net_resource, net_attr)
-
-        resources.append(net_resource)
-
-    existing_types = {'NODE': [], 'LINK': [], 'GROUP': []}
-    for node_i in net_i.nodes:
-        node_attributes = node_i.attributes
-        attr_ids = [res_attr.attr_id for res_attr in node_attributes]
-        if len(attr_ids) > 0 and attr_ids not in existing_types['NODE']:
-
-            node_resource = etree.Element("resource")
-
-            resource_type = etree.SubElement(node_resource, "type")
-            resource_type.text = "NODE"
-
-            resource_name = etree.SubElement(node_resource, "name")
-            resource_name.text = node_i.node_name
-
-            layout = _get_layout_as_etree(node_i.layout)
+    resource_attrs = _get_resource_attrs(network_id)
+    unit_lookup = _UnitLookup()
 
-            if layout is not None:
-                node_resource.append(layout)
+    output = BytesIO()
+    with etree.xmlfile(output, encoding='utf-8') as xml_file:
+        with xml_file.element("template_definition"):
+            _write_text_element(xml_file, "template_name",
+                                "TemplateType from Network %s"%(net_i.name))
 
-            for node_attr in node_attributes:
-                _make_attr_element_from_resourceattr(node_resource, node_attr)
+            with xml_file.element("resources"):
+                if len(resource_attrs[('NETWORK', net_i.id)]) > 0:
+                    net_resource = etree.Element("resource")
 
-            existing_types['NODE'].append(attr_ids)
-            resources.append(node_resource)
+                    resource_type = etree.SubElement(net_resource, "type")
+                    resource_type.text = "NETWORK"
 
-    for link_i in net_i.links:
-        link_attributes = link_i.attributes
-        attr_ids = [link_attr.attr_id for link_attr in link_attributes]
-        if len(attr_ids) > 0 and attr_ids not in existing_types['LINK']:
-            link_resource = etree.Element("resource")
+                    resource_name = etree.SubElement(net_resource, "name")
+                    resource_name.text = net_i.name
 
-            resource_type = etree.SubElement(link_resource, "type")
-            resource_type.text = "LINK"
+                    layout = _get_layout_as_etree(net_i.layout)
+                    if layout is not None:
+                        net_resource.append(layout)
 
-            resource_name = etree.SubElement(link_resource, "name")
-            resource_name.text = link_i.link_name
+                    for net_attr in resource_attrs[('NETWORK', net_i.id)]:
+                        _make_attr_element_from_resourceattr(net_resource, net_attr,
+                                                             unit_lookup=unit_lookup)
 
-            layout = _get_layout_as_etree(link_i.layout)
+                    xml_file.write(net_resource)
 
-            if layout is not None:
-                link_resource.append(layout)
+                for ref_key, resource_class in (('NODE', Node), ('LINK', Link), ('GROUP', ResourceGroup)):
+                    columns = [resource_class.id, resource_class.name]
+                    if ref_key != 'GROUP':
+                        columns.append(resource_class.layout)
 
-            for link_attr in link_attributes:
-                _make_attr_element_from_resourceattr(link_resource, link_attr)
+                    #Only make one type for each set of attributes
+                    existing_types = set()
+                    for resource in db.DBSession.query(*columns).filter(
+                            resource_class.network_id == network_id).order_by(resource_class.id):
 
-            existing_types['LINK'].append(attr_ids)
-            resources.append(link_resource)
+                        attributes = resource_attrs[(ref_key, resource.id)]
+                        attr_ids = tuple(res_attr.attr_id for res_attr in attributes)
+                        if len(attr_ids) == 0 or attr_ids in existing_types:
+                            continue
 
-    for group_i in net_i.resourcegroups:
-        group_attributes = group_i.attributes
-        attr_ids = [group_attr.attr_id for group_attr in group_attributes]
-        if len(attr_ids) > 0 and attr_ids not in existing_types['GROUP']:
-            group_resource = etree.Element("resource")
+                        xml_resource = etree.Element("resource")
 
-            resource_type = etree.SubElement(group_resource, "type")
-            resource_type.text = "GROUP"
+                        resource_type = etree.SubElement(xml_resource, "type")
+                        resource_type.text = ref_key
 
-            resource_name = etree.SubElement(group_resource, "name")
-            resource_name.text = group_i.group_name
+                        resource_name = etree.SubElement(xml_resource, "name")
+                        resource_name.text = resource.name
 
+                        if ref_key != 'GROUP':
+                            layout = _get_layout_as_etree(resource.layout)
+                            if layout is not None:
+                                xml_resource.append(layout)
 
-            for group_attr in group_attributes:
-                _make_attr_element_from_resourceattr(group_resource, group_attr)
+                        for res_attr in attributes:
+                            _make_attr_element_from_resourceattr(xml_resource, res_attr,
+                                                                 unit_lookup=unit_lookup)
 
-            existing_types['GROUP'].append(attr_ids)
-            resources.append(group_resource)
+                        existing_types.add(attr_ids)
+                        xml_file.write(xml_resource)
 
-    xml_string = etree.tostring(template_xml, encoding="unicode")
+    return output.getvalue().decode('utf-8')
 
-    return xml_string
-
-def _parse_xml_attribute(attribute):
-    """
-        Parse an attribute as defined in the template XML file
-    """
-    dimension_i = None
-
-    attribute_name = attribute.find('name').text.strip()
-
-    if attribute.find('dimension') is not None:
-        dimension_name = attribute.find('dimension').text
-
-        if dimension_name is not None and dimension_name.strip() != '':
-            dimension_i = units.get_dimension_by_name(dimension_name.strip())
-
-    elif attribute.find('unit') is not None:
-        # Found the unit
-        unit_abbr = attribute.find('unit').text
-        if unit_abbr is not None and unit_abbr.strip() != '':
-            unit_id = units.get_unit_by_abbreviation(unit_abbr).id
-            dimension_i = units.get_dimension_by_unit_id(unit_id,
-                                                         do_accept_unit_id_none=True)
-
-    if dimension_i is None:
-        attr = get_attr_by_name_and_dimension(attribute_name, None)
-    else:
-        attr = get_attr_by_name_and_dimension(attribute_name, dimension_i.id)
-
-    db.DBSession.flush()
-
-    return attr
-
-def _parse_xml_typeattr(type_i, attribute, user_id=None):
-    """
-        convert a typeattr etree element and turn it into a hydra type attr
-    """
-
-    attr = _parse_xml_attribute(attribute)
-
-    for ta in type_i.typeattrs:
-        if ta.attr_id == attr.id:
-            # Find the TypeAttr
-            typeattr_i = ta
-            break
-    else:
-        # Creating a new TypeAttr
-        typeattr_i = TypeAttr()
-        log.debug("Creating type attr: type_id=%s, attr_id=%s", type_i.id, attr.id)
-        typeattr_i.type_id = type_i.id
-        typeattr_i.attr_id = attr.id
-        type_i.typeattrs.append(typeattr_i)
-        db.DBSession.add(typeattr_i)
-
-    typeattr_unit_id = None
-    if attribute.find('unit') is not None:
-        # Found the unit as child at first level
-        unit = attribute.find('unit').text
-        if unit not in ('', None):
-            typeattr_unit_id = units.get_unit_by_abbreviation(unit).id
-
-    if typeattr_unit_id is not None:
-        typeattr_i.unit_id = typeattr_unit_id
-
-    check_dimension(typeattr_i)
-
-    if attribute.find('description') is not None:
-        typeattr_i.description = attribute.find('description').text
-
-    if attribute.find('properties') is not None:
-        properties_string = get_etree_layout_as_dict(attribute.find('properties'))
-        typeattr_i.properties = str(properties_string)
-
-    if attribute.find('is_var') is not None:
-        typeattr_i.attr_is_var = attribute.find('is_var').text
-    if attribute.find('data_type') is not None:
-        typeattr_i.data_type = attribute.find('data_type').text
-
-    # Analyzing the "default" node
-    if attribute.find('default') is not None:
-        default = attribute.find('default')
-
-        dataset_unit_id = None
-        if default.find('unit') is not None:
-            dataset_unit = default.find('unit').text
-            if dataset_unit not in ('', None):
-                dataset_unit_id = units.get_unit_by_abbreviation(dataset_unit).id
-
-        if dataset_unit_id is None and typeattr_i.unit_id is not None:
-            dataset_unit = typeattr_i.unit_id
-
-        if dataset_unit_id is not None and typeattr_i.unit_id is not None:
-            if dataset_unit_id != typeattr_i.unit_id:
-                raise HydraError(f"Default value has a unit of {typeattr_i.unit_id}"+
-                                 "but the attribute"+
-                                 f" says the unit should be: {dataset_unit_id}")
-
-        val = default.find('value').text
-        try:
-            Decimal(val)
-            data_type = 'scalar'
-        except:
-            data_type = 'descriptor'
-
-        dataset = add_dataset(data_type,
-                              val,
-                              dataset_unit_id,
-                              name="%s Default"%attr.name,
-                              user_id=user_id)
-
-        typeattr_i.default_dataset_id = dataset.id
-
-    if attribute.find('restrictions') is not None:
-        restriction = str(dataset_util.get_restriction_as_dict(attribute.find('restrictions')))
-        typeattr_i.data_restriction = restriction
-    else:
-        typeattr_i.data_restriction = None
-
-
-    return typeattr_i
-
-def _make_attr_element_from_typeattr(parent, type_attr_i):
+def _make_attr_element_from_typeattr(parent, type_attr_i, unit_lookup=None):
     """
         General function to add an attribute element to a resource element.
         resource_attr_i can also e a type_attr if being called from get_tempalte_as_xml
     """
 
-    attr = _make_attr_element(parent, type_attr_i.attr)
+    if unit_lookup is None:
+        unit_lookup = _UnitLookup()
+
+    attr = _make_attr_element(parent, type_attr_i.attr, unit_lookup=unit_lookup)
 
     if type_attr_i.unit_id is not None:
         attr_unit = etree.SubElement(attr, 'unit')
-        attr_unit.text = units.get_unit(type_attr_i.unit_id).abbreviation
+        attr_unit.text = unit_lookup.get_unit(type_attr_i.unit_id).abbreviation
 
     attr_is_var = etree.SubElement(attr, 'is_var')
     attr_is_var.text = type_attr_i.attr_is_var
@@ -479,22 +615,25 @@ def _make_attr_element_from_typeattr(parent, type_attr_i):
 
     return attr
 
-def _make_attr_element_from_resourceattr(parent, resource_attr_i):
+def _make_attr_element_from_resourceattr(parent, resource_attr_i, unit_lookup=None):
     """
         General function to add an attribute element to a resource element.
     """
 
-    attr = _make_attr_element(parent, resource_attr_i.attr)
+    attr = _make_attr_element(parent, resource_attr_i.attr, unit_lookup=unit_lookup)
 
     attr_is_var = etree.SubElement(attr, 'is_var')
     attr_is_var.text = resource_attr_i.attr_is_var
 
     return attr
 
-def _make_attr_element(parent, attr_i):
+def _make_attr_element(parent, attr_i, unit_lookup=None):
     """
         create an attribute element from an attribute DB object
     """
+    if unit_lookup is None:
+        unit_lookup = _UnitLookup()
+
     attr = etree.SubElement(parent, "attribute")
 
     attr_name = etree.SubElement(attr, 'name')
@@ -504,8 +643,7 @@ def _make_attr_element(parent, attr_i):
     attr_desc.text = attr_i.description
 
     attr_dimension = etree.SubElement(attr, 'dimension')
-    attr_dimension.text = units.get_dimension(attr_i.dimension_id,
-                                              do_accept_dimension_id_none=True).name
+    attr_dimension.text = unit_lookup.get_dimension(attr_i.dimension_id).name
 
     return attr
 
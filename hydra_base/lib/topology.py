@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# (c) Copyright 2013 to 2017 University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    Queries on the shape of a network: connected components, orphan nodes,
+    upstream and downstream nodes, shortest paths and subnetworks.
+
+    These all work on a compact index of the network's active nodes and links,
+    held in the cache: the node IDs in order, and the links as compressed
+    sparse row (CSR) adjacency arrays of node indices, in both directions.
+    Links are directed from node_1 (upstream) to node_2 (downstream).
+"""
+import numpy as np
+from sqlalchemy import func
+
+from ..exceptions import HydraError, ResourceNotFoundError
+from ..util.permissions import required_perms
+from .. import db
+from ..db.model import Network, Node, Link
+from .objects import JSONObject
+from .cache import cache
+
+import logging
+log = logging.getLogger(__name__)
+
+TOPOLOGY_CACHE_KEY = 'network_topology'
+
+def _topology_cache_key(network_id):
+    return f"{TOPOLOGY_CACHE_KEY}_{network_id}"
+
+def clear_topology_cache(network_id):
+    """
+        Remove a network's topology index from the cache. Call this whenever
+        nodes or links are added or removed, or links are reconnected.
+    """
+    cache.delete(_topology_cache_key(network_id))
+
+def _get_topology_signature(network_id):
+    """
+        A cheap summary of the network's active nodes and links, stored with
+        the index so that an index which has missed an invalidation is not used.
+    """
+    node_sig = db.DBSession.query(func.count(Node.id), func.max(Node.id)).filter(
+        Node.network_id == network_id, Node.status == 'A').one()
+    link_sig = db.DBSession.query(func.count(Link.id), func.max(Link.id)).filter(
+        Link.network_id == network_id, Link.status == 'A').one()
+    return (node_sig[0], node_sig[1], link_sig[0], link_sig[1])
+
+def _make_csr(num_nodes, from_idx, to_idx, link_ids):
+    """
+        Build CSR arrays for the links from from_idx to to_idx. The neighbours
+        of node index i are indices[indptr[i]:indptr[i+1]], reached through
+        the links link_ids[indptr[i]:indptr[i+1]].
+    """
+    order = np.argsort(from_idx, kind='stable')
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(from_idx, minlength=num_nodes), out=indptr[1:])
+    return indptr, to_idx[order], link_ids[order]
+
+def _build_topology(network_id):
+    node_ids = np.array([n.id for n in db.DBSession.query(Node.id).filter(
+        Node.network_id == network_id, Node.status == 'A').order_by(Node.id)], dtype=np.int64)
+
+    links = db.DBSession.query(Link.id, Link.node_1_id, Link.node_2_id).filter(
+        Link.network_id == network_id, Link.status == 'A').order_by(Link.id).all()
+    link_array = np.array([(l.id, l.node_1_id, l.node_2_id) for l in links],
+                          dtype=np.int64).reshape(-1, 3)
+
+    #Ignore any link to a node which is not active
+    active = np.isin(link_array[:, 1], node_ids) & np.isin(link_array[:, 2], node_ids)
+    link_array = link_array[active]
+
+    link_ids = link_array[:, 0]
+    src = np.searchsorted(node_ids, link_array[:, 1])
+    dst = np.searchsorted(node_ids, link_array[:, 2])
+
+    num_nodes = len(node_ids)
+    down_indptr, down_indices, down_links = _make_csr(num_nodes, src, dst, link_ids)
+    up_indptr, up_indices, up_links = _make_csr(num_nodes, dst, src, link_ids)
+
+    return {
+        'node_ids': node_ids,
+        'link_ids': link_ids,
+        'link_src': src,
+        'link_dst': dst,
+        'down': (down_indptr, down_indices, down_links),
+        'up': (up_indptr, up_indices, up_links),
+    }
+
+def _get_topology(network_id, user_id):
+    """
+        Get the topology index of a network, from the cache if it's there
+        and still matches the network.
+    """
+    net_i = db.DBSession.query(Network).filter(Network.id == network_id).first()
+    if net_i is None:
+        raise ResourceNotFoundError("Network %s not found"%(network_id))
+    net_i.check_read_permission(user_id)
+
+    signature = _get_topology_signature(network_id)
+    cached = cache.get(_topology_cache_key(network_id))
+    if cached is not None and cached.get('signature') == signature:
+        return cached
+
+    log.info("Building topology index for network %s", network_id)
+    topology = _build_topology(network_id)
+    topology['signature'] = signature
+    cache.set(_topology_cache_key(network_id), topology, 60*60)
+    return topology
+
+def _get_node_index(topology, node_id):
+    idx = np.searchsorted(topology['node_ids'], node_id)
+    if idx >= len(topology['node_ids']) or topology['node_ids'][idx] != node_id:
+        raise HydraError(f"Node {node_id} is not an active node in this network")
+    return idx
+
+def _expand(adjacency, frontier):
+    """
+        Get the neighbour indices of all the node indices in the frontier at
+        once, returning the neighbours and, for each, the frontier node it was
+        reached from and the ID of the link it was reached through.
+    """
+    indptr, indices, link_ids = adjacency
+    starts = indptr[frontier]
+    counts = indptr[frontier + 1] - starts
+    #The position of each neighbour in 'indices': the start of its frontier
+    #node's row plus its offset within that row.
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    positions = np.repeat(starts, counts) + offsets
+    return indices[positions], np.repeat(frontier, counts), link_ids[positions]
+
+def _reachable(topology, node_id, direction, max_hops=None):
+    """
+        A breadth first search from a node, a whole frontier at a time. Returns
+        the hop distance to every node index (-1 if not reached).
+    """
+    adjacency = topology[direction]
+    distance = np.full(len(topology['node_ids']), -1, dtype=np.int64)
+    start = _get_node_index(topology, node_id)
+    distance[start] = 0
+    frontier = np.array([start], dtype=np.int64)
+    hops = 0
+    while len(frontier) > 0 and (max_hops is None or hops < max_hops):
+        hops += 1
+        neighbours, _, _ = _expand(adjacency, frontier)
+        frontier = np.unique(neighbours[distance[neighbours] < 0])
+        distance[frontier] = hops
+    return distance
+
+def _component_labels(topology):
+    """
+        Label each node index with the smallest node index in its (undirected)
+        connected component, by propagating the minimum label across the
+        links and then jumping each label to its own label until nothing changes.
+    """
+    labels = np.arange(len(topology['node_ids']), dtype=np.int64)
+    src = topology['link_src']
+    dst = topology['link_dst']
+    while True:
+        previous = labels.copy()
+        np.minimum.at(labels, src, labels[dst])
+        np.minimum.at(labels, dst, labels[src])
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+        if np.array_equal(labels, previous):
+            return labels
+
+@required_perms("get_network")
+def get_network_components(network_id, **kwargs):
+    """
+        Get the connected components of a network, ignoring the direction
+        of the links.
+
+        returns:
+            A list of lists of node IDs, one per component, largest first.
+    """
+    topology = _get_topology(network_id, kwargs.get('user_id'))
+    node_ids = topology['node_ids']
+    if len(node_ids) == 0:
+        return []
+
+    labels = _component_labels(topology)
+    order = np.argsort(labels, kind='stable')
+    _, starts = np.unique(labels[order], return_index=True)
+    components = [c.tolist() for c in np.split(node_ids[order], starts[1:])]
+    components.sort(key=len, reverse=True)
+    return components
+
+@required_perms("get_network")
+def get_orphan_nodes(network_id, **kwargs):
+    """
+        Get the IDs of the active nodes in a network which are not connected
+        to any active link.
+    """
+    topology = _get_topology(network_id, kwargs.get('user_id'))
+    degree = np.diff(topology['down'][0]) + np.diff(topology['up'][0])
+    return topology['node_ids'][degree == 0].tolist()
+
+@required_perms("get_network")
+def get_downstream_nodes(network_id, node_id, max_hops=None, **kwargs):
+    """
+        Get the IDs of all the nodes which can be reached from a node by
+        following links from node_1 to node_2, optionally within max_hops links.
+        The node itself is not included.
+    """
+    topology = _get_topology(network_id, kwargs.get('user_id'))
+    distance = _reachable(topology, node_id, 'down', max_hops=max_hops)
+    return topology['node_ids'][distance > 0].tolist()
+
+@required_perms("get_network")
+def get_upstream_nodes(network_id, node_id, max_hops=None, **kwargs):
+    """
+        Get the IDs of all the nodes from which a node can be reached by
+        following links from node_1 to node_2, optionally within max_hops links.
+        The node itself is not included.
+    """
+    topology = _get_topology(network_id, kwargs.get('user_id'))
+    distance = _reachable(topology, node_id, 'up', max_hops=max_hops)
+    return topology['node_ids'][distance > 0].tolist()
+
+@required_perms("get_network")
+def get_shortest_path(network_id, from_node_id, to_node_id, directed=True, **kwargs):
+    """
+        Get a path with the fewest links between two nodes.
+
+        args:
+            directed (bool): If True (the default) links can only be followed
+                             from node_1 to node_2. If False, in either direction.
+        returns:
+            A JSONObject with the node_ids and link_ids along the path, in
+            order, both empty if there is no path.
+    """
+    topology = _get_topology(network_id, kwargs.get('user_id'))
+    node_ids = topology['node_ids']
+    start = _get_node_index(topology, from_node_id)
+    end = _get_node_index(topology, to_node_id)
+
+    directions = ['down'] if directed else ['down', 'up']
+
+    #For each node index reached, the node index and link it was reached through
+    parent = np.full(len(node_ids), -1, dtype=np.int64)
+    parent_link = np.full(len(node_ids), -1, dtype=np.int64)
+    parent[start] = start
+    frontier = np.array([start], dtype=np.int64)
+    while len(frontier) > 0 and parent[end] < 0:
+        next_nodes = []
+        for direction in directions:
+            neighbours, froms, via = _expand(topology[direction], frontier)
+            new = parent[neighbours] < 0
+            neighbours, froms, via = neighbours[new], froms[new], via[new]
+            #Keep the first way each neighbour was reached
+            neighbours, first = np.unique(neighbours, return_index=True)
+            parent[neighbours] = froms[first]
+            parent_link[neighbours] = via[first]
+            next_nodes.append(neighbours)
+        frontier = np.unique(np.concatenate(next_nodes))
+
+    path = JSONObject({'node_ids': [], 'link_ids': []})
+    if parent[end] < 0:
+        return path
+
+    idx = end
+    node_path = [int(node_ids[end])]
+    link_path = []
+    while idx != start:
+        link_path.append(int(parent_link[idx]))
+        idx = parent[idx]
+        node_path.append(int(node_ids[idx]))
+
+    path.node_ids = node_path[::-1]
+    path.link_ids = link_path[::-1]
+    return path
+
+@required_perms("get_network")
+def get_subnetwork(network_id, node_ids, **kwargs):
+    """
+        Get the links between a set of nodes, for example the nodes returned
+        by get_downstream_nodes.
+
+        returns:
+            A JSONObject with the node_ids which are active in the network
+            and the link_ids of the links with both ends among them.
+    """
+    topology = _get_topology(network_id, kwargs.get('user_id'))
+    in_subnetwork = np.isin(topology['node_ids'], np.asarray(node_ids, dtype=np.int64))
+    links = in_subnetwork[topology['link_src']] & in_subnetwork[topology['link_dst']]
+    return JSONObject({
+        'node_ids': topology['node_ids'][in_subnetwork].tolist(),
+        'link_ids': topology['link_ids'][links].tolist(),
+    })
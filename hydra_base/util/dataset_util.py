@@ -27,6 +27,7 @@ import numpy as np
 import pandas as pd
 import re
 from functools import reduce
+from collections import defaultdict
 import json
 
 from hydra_base.util.hydra_dateutil import get_datetime
@@ -700,15 +701,154 @@ validation_func_map = dict(
     ISNULL         = validate_ISNULL,
 )
 
+def _is_number(value):
+    return isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool)
+
+def _get_numeric_array(value):
+    """
+        Get all the values in a dataset (a single value, an array, a timeseries
+        or a dataframe) as one flat numpy array of floats. Returns None if
+        they are not all numbers, in which case the value must be validated
+        using the functions in validation_func_map.
+    """
+    if value is None:
+        return None
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        value = value.values
+    elif isinstance(value, str):
+        try:
+            return np.array([float(value.strip())])
+        except ValueError:
+            return None
+    elif isinstance(value, list) and len(value) > 0 and isinstance(value[0], tuple):
+        return None
+    elif not isinstance(value, (list, np.ndarray)) and not _is_number(value):
+        return None
+
+    try:
+        return np.asarray(value, dtype=float).ravel()
+    except (ValueError, TypeError):
+        return None
+
+def _unwrap_restriction(restriction):
+    #Sometimes restriction values can accidentally be put in the template <item>100</items>,
+    #Making them a list, not a number. Rather than blowing up, just get value 1 from the list.
+    if type(restriction) is list:
+        return restriction[0]
+    return restriction
+
+def _make_comparison_check(name, fails):
+    def check(values, restriction):
+        restriction = _unwrap_restriction(restriction)
+        if not _is_number(restriction):
+            return None
+        return fails(values, restriction), "%s: %s"%(name, restriction)
+    return check
+
+def _check_ENUM(values, restriction):
+    if type(restriction) is not list or not all(_is_number(r) for r in restriction):
+        return None
+    return ~np.isin(values, restriction), "ENUM : %s"%(restriction)
+
+def _check_BOOL10(values, restriction):
+    return ~np.isin(values, [0, 1]), "BOOL10"
+
+def _check_VALUERANGE(values, restriction):
+    if type(restriction) not in (list, tuple) or len(restriction) != 2:
+        return None
+    try:
+        min_val = Decimal(restriction[0])
+        max_val = Decimal(restriction[1])
+    except Exception:
+        return None
+    return (values < float(min_val)) | (values > float(max_val)),\
+            "VALUERANGE: %s, %s"%(min_val, max_val)
+
+def _check_MULTIPLEOF(values, restriction):
+    restriction = _unwrap_restriction(restriction)
+    if not _is_number(restriction) or restriction == 0:
+        return None
+    return np.mod(values, restriction) != 0, "MULTIPLEOF: %s"%(restriction)
+
+def _check_SUMTO(values, restriction):
+    restriction = _unwrap_restriction(restriction)
+    if not _is_number(restriction):
+        return None
+    if len(values) == 0:
+        return False, "SUMTO: %s"%(restriction)
+    return not np.isclose(values.sum(), restriction, rtol=1e-12, atol=0), "SUMTO: %s"%(restriction)
+
+def _check_INCREASING(values, restriction):
+    return np.any(np.diff(values) < 0), "INCREASING"
+
+def _check_DECREASING(values, restriction):
+    return np.any(np.diff(values) > 0), "DECREASING"
+
+#Checks of restrictions which apply to each number on its own, so can be run
+#on many datasets stacked together. Each returns an array flagging the values
+#which fail and the error, or None if the restriction can't be checked this way.
+elementwise_check_map = dict(
+    ENUM = _check_ENUM,
+    BOOL10 = _check_BOOL10,
+    VALUERANGE = _check_VALUERANGE,
+    EQUALTO = _make_comparison_check('EQUALTO', lambda v, r: v != r),
+    NOTEQUALTO = _make_comparison_check('NOTEQUALTO', lambda v, r: v == r),
+    LESSTHAN = _make_comparison_check('LESSTHAN', lambda v, r: v >= r),
+    LESSTHANEQ = _make_comparison_check('LESSTHANEQ', lambda v, r: v > r),
+    GREATERTHAN = _make_comparison_check('GREATERTHAN', lambda v, r: v <= r),
+    GREATERTHANEQ = _make_comparison_check('GREATERTHANEQ', lambda v, r: v < r),
+    MULTIPLEOF = _check_MULTIPLEOF,
+)
+
+#Checks of restrictions on a whole array, timeseries or dataframe.
+array_check_map = dict(
+    SUMTO = _check_SUMTO,
+    INCREASING = _check_INCREASING,
+    DECREASING = _check_DECREASING,
+)
+
+def _check_restriction(restriction_type, restriction, values, is_array):
+    """
+        Check a restriction against the numeric values of a dataset, raising a
+        ValidationError if they break it.
+        returns:
+            bool: False if the restriction can't be checked on the numeric
+                  values, so the validation function must be used instead.
+    """
+    if values is None:
+        return False
+
+    check = elementwise_check_map.get(restriction_type)
+    if check is None and is_array:
+        check = array_check_map.get(restriction_type)
+    if check is None:
+        return False
+
+    result = check(values, restriction)
+    if result is None:
+        return False
+
+    fails, message = result
+    if np.any(fails):
+        raise ValidationError(message)
+    return True
+
 def validate_value(restriction_dict, inval):
     if len(restriction_dict) == 0:
         return
 
+    #Convert the value to numpy once for all the restrictions
+    values = _get_numeric_array(inval)
+    is_array = isinstance(inval, (list, np.ndarray, pd.DataFrame, pd.Series))
+
     try:
         for restriction_type, restriction in restriction_dict.items():
             func = validation_func_map.get(restriction_type)
             if func is None:
                 raise Exception("Validation type {} does not exist".format(restriction_type,))
+            if _check_restriction(restriction_type, restriction, values, is_array):
+                continue
             func(inval, restriction)
     except ValidationError as e:
         log.exception(e)
@@ -720,6 +860,68 @@ def validate_value(restriction_dict, inval):
         log.exception(e)
         raise HydraError("An error occurred in validation. ({})".format(e))
 
+def validate_values(restrictions, values):
+    """
+        Validate many values against their restrictions in one go, for example
+        all the datasets in a scenario against the restrictions of their
+        type attributes.
+        Single numbers which share a restriction are checked together, as one
+        array. Anything else is checked individually using validate_value.
+        args:
+            restrictions: A restriction dict, or its JSON string, for each value
+            values: The values to validate
+        returns:
+            list: For each value, None if it is valid, otherwise the error text
+    """
+    if len(restrictions) != len(values):
+        raise HydraError("There must be one restriction for each value.")
+
+    errors = [None] * len(values)
+
+    parsed_restrictions = {}
+    numbers_by_restriction = defaultdict(list)
+    to_validate = []
+    for i, restriction in enumerate(restrictions):
+        if isinstance(restriction, str):
+            key = restriction
+            if key not in parsed_restrictions:
+                parsed_restrictions[key] = json.loads(restriction)
+        else:
+            key = json.dumps(restriction, sort_keys=True)
+            parsed_restrictions[key] = restriction
+
+        if _is_number(values[i]):
+            numbers_by_restriction[key].append(i)
+        else:
+            to_validate.append((i, key))
+
+    for key, indices in numbers_by_restriction.items():
+        restriction_dict = parsed_restrictions[key]
+        if len(restriction_dict) == 0:
+            continue
+
+        numbers = np.array([values[i] for i in indices], dtype=float)
+        fails = np.zeros(len(indices), dtype=bool)
+        for restriction_type, restriction in restriction_dict.items():
+            check = elementwise_check_map.get(restriction_type)
+            result = check(numbers, restriction) if check is not None else None
+            if result is None:
+                #This can't be checked on all the numbers at once
+                fails[:] = True
+                break
+            fails |= result[0]
+
+        #Get the errors of the failures, one at a time
+        to_validate.extend((indices[i], key) for i in np.flatnonzero(fails))
+
+    for i, key in to_validate:
+        try:
+            validate_value(parsed_restrictions[key], values[i])
+        except HydraError as e:
+            errors[i] = e.args[0]
+
+    return errors
+
 def _flatten_value(value):
     """
         1: Turn a multi-dimensional array into a 1-dimensional array
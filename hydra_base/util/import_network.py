@@ -0,0 +1,47 @@
+"""
+This is a utility which imports a network from a directory of NDJSON or CSV
+parts, a chunk at a time, so that networks too large to load in one go can be
+imported. See hydra_base.lib.network_import for the layout of the directory.
+
+The progress is recorded in a checkpoint file, so if the import is interrupted,
+running the same command again resumes it where it stopped.
+"""
+import os
+
+import click
+import hydra_base as hb
+
+@click.command()
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('-p', '--project-id', type=int, default=None,
+              help="The ID of the project to add the network to. Overrides any"+
+              " project_id in network.json")
+@click.option('-u', '--user-id', type=int, default=1,
+              help="The ID of the user importing the network")
+@click.option('--chunk-size', type=int, default=1000,
+              help="The number of records to insert at a time")
+@click.option('--checkpoint', type=click.Path(), default=None,
+              help="The checkpoint file. Defaults to .import_checkpoint.json"+
+              " in the directory being imported")
+def import_network(directory, project_id=None, user_id=1, chunk_size=1000, checkpoint=None):
+    if checkpoint is None:
+        checkpoint = os.path.join(directory, '.import_checkpoint.json')
+
+    hb.db.connect()
+
+    try:
+        result = hb.import_network_directory(directory,
+                                             project_id=project_id,
+                                             checkpoint_path=checkpoint,
+                                             chunk_size=chunk_size,
+                                             user_id=user_id)
+        hb.commit_transaction()
+    except Exception as e:
+        print("An error has occurred: %s. Run again to resume from the last checkpoint." % e)
+        hb.rollback_transaction()
+        raise
+
+    print("Imported network %s (%s): %s" % (result.name, result.id, result.imported))
+
+if __name__ == '__main__':
+    import_network()
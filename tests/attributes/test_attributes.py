@@ -165,6 +165,40 @@ class TestAttribute:
         #of name/dimension pairs is the same as the length of all attributes
         assert len(attributeset) == len(all_attributes_after_add_2)
 
+    def test_add_attributes_scoped_batch(self, client, network_with_data):
+        existing_attr = client.add_attribute(JSONObject({
+            "name": f'Batch Attribute {datetime.datetime.now()}',
+            "dimension_id": None
+        }))
+
+        suffix = datetime.datetime.now()
+        new_attrs = [JSONObject({
+            "name": f'Batch Attribute {i} {suffix}',
+            "dimension_id": None,
+            "network_id": network_with_data.id
+        }) for i in range(5)]
+
+        #An attribute which exists already, and the same new one twice in one batch
+        batch = new_attrs + [
+            JSONObject({"name": existing_attr.name.upper(), "dimension_id": None,
+                        "network_id": network_with_data.id}),
+            JSONObject({"name": new_attrs[0].name.upper(), "dimension_id": None,
+                        "network_id": network_with_data.id}),
+        ]
+
+        added_attrs = client.add_attributes(batch)
+
+        #The existing global attribute is returned rather than scoping a new one
+        assert existing_attr.id in [a.id for a in added_attrs]
+        scoped_attrs = [a for a in added_attrs if a.id != existing_attr.id]
+        assert len(scoped_attrs) == 5
+        assert set(a.name for a in scoped_attrs) == set(a.name for a in new_attrs)
+        assert all(a.network_id == network_with_data.id for a in scoped_attrs)
+
+        #Adding them again returns the same attributes
+        readded_attrs = client.add_attributes(batch)
+        assert set(a.id for a in readded_attrs) == set(a.id for a in added_attrs)
+
 
     def test_get_attributes(self, client):
         """
@@ -348,6 +382,65 @@ class TestResourceAttribute:
 
         assert len(set([a.id for a in all_network_attributes])) == len(manual_all_network_attributes)
 
+    def test_get_all_network_resourceattributes(self, client, network_with_data, attribute):
+        expected = {}
+        for resource in [network_with_data] + network_with_data.nodes + \
+                network_with_data.links + network_with_data.resourcegroups:
+            for ra in resource.attributes:
+                expected[ra.id] = ra
+
+        network_ras = client.get_all_network_resourceattributes(network_with_data.id)
+        assert set(ra.id for ra in network_ras) == set(expected)
+        for ra in network_ras:
+            assert ra.attr.id == ra.attr_id
+            assert ra.attr_is_var == expected[ra.id].attr_is_var
+            assert ra.ref_key == expected[ra.id].ref_key
+
+        #A second call comes from the cache
+        assert client.get_all_network_resourceattributes(network_with_data.id) == network_ras
+
+        #Adding and removing a resource attribute invalidates the cache
+        node = network_with_data.nodes[0]
+        new_ra = client.add_resource_attribute('NODE', node.id, attribute.id, 'Y')
+        network_ras = client.get_all_network_resourceattributes(network_with_data.id)
+        new_ras = [ra for ra in network_ras if ra.id == new_ra.id]
+        assert len(new_ras) == 1
+        assert new_ras[0].node_id == node.id
+        assert new_ras[0].attr_is_var == 'Y'
+        assert new_ras[0].attr.name == attribute.name
+
+        client.delete_resource_attribute(new_ra.id)
+        network_ras = client.get_all_network_resourceattributes(network_with_data.id)
+        assert new_ra.id not in set(ra.id for ra in network_ras)
+
+        #The template filter is applied to the cached attributes
+        template_id = network_with_data.types[0].template_id
+        template_attr_ids = set(ta.attr_id for t in client.get_template(template_id).templatetypes
+                                for ta in t.typeattrs)
+        template_ras = client.get_all_network_resourceattributes(network_with_data.id,
+                                                                 template_id=template_id)
+        assert set(ra.id for ra in template_ras) == \
+                set(ra.id for ra in network_ras if ra.attr_id in template_attr_ids)
+
+    def test_get_all_network_resourceattributes_rollback(self, client, network_with_data, attribute):
+        """
+            Resource attributes read while they are being changed are not
+            cached, so rolling the change back leaves no stale cache behind.
+        """
+        hb.db.DBSession.commit()
+
+        ra_ids = set(ra.id for ra in client.get_all_network_resourceattributes(network_with_data.id))
+
+        node = network_with_data.nodes[0]
+        new_ra = client.add_resource_attribute('NODE', node.id, attribute.id, 'Y')
+        network_ras = client.get_all_network_resourceattributes(network_with_data.id)
+        assert new_ra.id in set(ra.id for ra in network_ras)
+
+        hb.db.DBSession.rollback()
+
+        network_ras = client.get_all_network_resourceattributes(network_with_data.id)
+        assert set(ra.id for ra in network_ras) == ra_ids
+
 
     def test_add_group_attribute(self, client, network_with_data, attribute):
         group = network_with_data.resourcegroups[0]
@@ -570,6 +663,53 @@ class TestResourceAttribute:
         assert lowest_id in [a.id for a in reduced_attrs]
         assert dupe_attr_2.id not in [a.id for a in reduced_attrs]
 
+    def test_delete_all_duplicate_attributes_dry_run(self, client, network_with_data):
+
+        duplicate_attribute = JSONObject({'name': 'duplicate dry run', 'dimension_id': None})
+        keeper = client.add_attribute(duplicate_attribute, check_existing=False)
+        dupe = client.add_attribute(duplicate_attribute, check_existing=False)
+
+        #Both attributes on one node, with data only on the duplicate, and
+        #the duplicate alone on another
+        node_1 = network_with_data.nodes[0]
+        node_2 = network_with_data.nodes[1]
+        scenario_id = network_with_data.scenarios[0].id
+        client.add_resource_attribute('NODE', node_1.id, keeper.id, 'N')
+        dupe_ra_1 = client.add_resource_attribute('NODE', node_1.id, dupe.id, 'N')
+        dupe_ra_2 = client.add_resource_attribute('NODE', node_2.id, dupe.id, 'N')
+        client.add_data_to_attribute(scenario_id, dupe_ra_1.id, client.get_dataset(1))
+
+        report = client.delete_all_duplicate_attributes(dry_run=True)
+        assert report.dry_run is True
+        assert {'attr_id': dupe.id, 'keeper_id': keeper.id} in report.duplicates
+        assert report.resource_attributes_deleted == 1
+        assert report.resource_attributes_remapped == 1
+        assert report.resource_scenarios_moved == 1
+
+        #Nothing has changed
+        assert dupe.id in [a.id for a in client.get_attributes()]
+        node_1_attrs = client.get_resource_attributes('NODE', node_1.id)
+        assert dupe.id in [ra.attr_id for ra in node_1_attrs]
+
+        report = client.delete_all_duplicate_attributes(batch_size=1)
+        assert report.dry_run is False
+        assert report.attributes_deleted >= 1
+
+        assert dupe.id not in [a.id for a in client.get_attributes()]
+
+        #The duplicate resource attribute has been merged into the one which
+        #was already on the node, taking its data with it
+        node_1_attrs = client.get_resource_attributes('NODE', node_1.id)
+        keeper_ras = [ra for ra in node_1_attrs if ra.attr_id == keeper.id]
+        assert len(keeper_ras) == 1
+        assert dupe_ra_1.id not in [ra.id for ra in node_1_attrs]
+        node_1_data = client.get_resource_data('NODE', node_1.id, scenario_id)
+        assert keeper_ras[0].id in [rs.resource_attr_id for rs in node_1_data]
+
+        #and the other has been pointed at the keeper
+        node_2_attrs = client.get_resource_attributes('NODE', node_2.id)
+        assert dupe_ra_2.id in [ra.id for ra in node_2_attrs if ra.attr_id == keeper.id]
+
     def test_delete_duplicate_resourceattributes(self, client, network_with_data):
 
         #first add a duplicate resourceattr to the network
@@ -377,6 +377,52 @@ class TestScopedAttribute:
 
 
 
+    def test_resolve_attribute(self, client, projectmaker, networkmaker):
+        """
+           Test that a name resolves to the lowest scoped attribute visible from a
+           network, and that this changes when the network is moved to another project.
+                                 p1      p3
+                                /
+                               p2
+                              /
+                             n1
+        """
+        client.user_id = 1
+        proj1 = projectmaker.create(share=False)
+        proj2 = projectmaker.create(share=False, parent_id=proj1.id)
+        proj3 = projectmaker.create(share=False)
+
+        net1 = networkmaker.create(project_id=proj2.id)
+
+        p1_attr = client.add_attribute({'project_id': proj1.id, 'name': 'resolve_attr'})
+        p3_attr = client.add_attribute({'project_id': proj3.id, 'name': 'resolve_attr'})
+        n1_attr = client.add_attribute({'network_id': net1.id, 'name': 'resolve_net_attr'})
+        global_attr = client.add_attribute({'name': 'resolve_global_attr'})
+
+        assert client.resolve_attribute('Resolve_Attr', network_id=net1.id).id == p1_attr.id
+        assert client.resolve_attribute('resolve_attr', project_id=proj2.id).id == p1_attr.id
+        assert client.resolve_attribute('resolve_net_attr', network_id=net1.id).id == n1_attr.id
+        assert client.resolve_attribute('resolve_net_attr', project_id=proj2.id) is None
+        assert client.resolve_attribute('resolve_global_attr', network_id=net1.id).id == global_attr.id
+
+        #A network-scoped attribute can't be added when the project already has one
+        assert client.add_attribute({'network_id': net1.id, 'name': 'resolve_attr'}).id == p1_attr.id
+
+        client.move_network(net1.id, proj3.id)
+
+        assert client.resolve_attribute('resolve_attr', network_id=net1.id).id == p3_attr.id
+
+        client.delete_attribute(p3_attr.id)
+
+        assert client.resolve_attribute('resolve_attr', network_id=net1.id) is None
+
+        #Rescoping an attribute out of the network's hierarchy hides it
+        n1_attr.network_id = None
+        n1_attr.project_id = proj1.id
+        client.update_attribute(n1_attr)
+
+        assert client.resolve_attribute('resolve_net_attr', network_id=net1.id) is None
+
     def test_rescope_attribute(self, client, projectmaker, networkmaker):
         """
            Test to make sure that when a scoped attribute is added to a network
@@ -714,3 +714,71 @@ class TestTemplateInheritance:
         assert len(parent_template_j.templatetypes) == len(child_template_j.templatetypes) == len(child_template_2_j.templatetypes)
 
 
+
+    def test_compiled_template_types(self, client, monkeypatch):
+        """
+            The resolved types of a child template are compiled once and reused
+            until the child or its parent changes.
+        """
+        import hydra_base as hb
+        from hydra_base.db.model import Template
+        from hydra_base.lib.template.utils import get_template_types
+
+        parent_template_j = client.testutils.create_template()
+        child_template_j = client.testutils.create_child_template(parent_template_j.id)
+
+        #Types compiled in a transaction which changed the templates aren't cached
+        hb.db.DBSession.commit()
+
+        child_template_i = hb.db.DBSession.query(Template).filter(
+            Template.id == child_template_j.id).one()
+
+        compiled_types = get_template_types(child_template_i)
+        assert len(compiled_types) == len(parent_template_j.templatetypes)
+        assert [t.id for t in compiled_types] == [t.id for t in child_template_i.get_types()]
+
+        #The second time round, the types come from the cache
+        def fail_get_types(self, *args, **kwargs):
+            raise Exception("The template types should not be rebuilt")
+        monkeypatch.setattr(Template, 'get_types', fail_get_types)
+        assert len(get_template_types(child_template_i)) == len(compiled_types)
+        monkeypatch.undo()
+
+        #Adding a typeattr to the parent invalidates the child's compiled types
+        parent_type = parent_template_j.templatetypes[0]
+        newattr = client.testutils.create_attribute('compiled_attr', None)
+        client.add_typeattr(JSONObject({'attr_id': newattr.id, 'type_id': parent_type.id}))
+
+        child_template_i = hb.db.DBSession.query(Template).filter(
+            Template.id == child_template_j.id).one()
+        recompiled_types = get_template_types(child_template_i)
+        recompiled_type = [t for t in recompiled_types
+                           if parent_type.id in (t.id, t.parent_id)][0]
+        assert newattr.id in [ta.attr_id for ta in recompiled_type.typeattrs]
+
+    def test_compiled_template_types_rollback(self, client):
+        """
+            Types compiled while a template is being changed are not cached,
+            so rolling the change back leaves no stale types behind.
+        """
+        import hydra_base as hb
+        from hydra_base.db.model import Template
+        from hydra_base.lib.template.utils import get_template_types
+
+        template_j = client.testutils.create_template()
+        hb.db.DBSession.commit()
+
+        template_i = hb.db.DBSession.query(Template).filter(
+            Template.id == template_j.id).one()
+        type_names = sorted(t.name for t in get_template_types(template_i))
+
+        template_j = client.get_template(template_j.id)
+        template_j.templatetypes[0].name = 'ROLLED_BACK_NAME'
+        updated_template_j = client.update_template(template_j)
+        assert 'ROLLED_BACK_NAME' in [t.name for t in updated_template_j.templatetypes]
+
+        hb.db.DBSession.rollback()
+
+        template_i = hb.db.DBSession.query(Template).filter(
+            Template.id == template_j.id).one()
+        assert sorted(t.name for t in get_template_types(template_i)) == type_names
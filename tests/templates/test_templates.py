@@ -173,6 +173,43 @@ class TestTemplates:
 
         xmlschema.assertValid(xml_tree)
 
+    def test_update_xml(self, client, template_json_object):
+        """
+            Re-import a template's XML with one type and one type attribute
+            removed, and check they are removed, and everything else is kept.
+        """
+        xml_tmpl = template_json_object
+
+        xml_tree = etree.fromstring(client.get_template_as_xml(xml_tmpl.id))
+
+        resources = xml_tree.find('resources').findall('resource')
+        removed_type_name = resources[0].find('name').text
+        resources[0].getparent().remove(resources[0])
+
+        kept_type_name = resources[1].find('name').text
+        kept_attributes = resources[1].findall('attribute')
+        removed_attr_name = kept_attributes[-1].find('name').text
+        resources[1].remove(kept_attributes[-1])
+
+        updated_tmpl = JSONObject(client.import_template_xml(
+            etree.tostring(xml_tree).decode('utf-8')))
+
+        assert updated_tmpl.id == xml_tmpl.id
+
+        db_template = client.get_template(xml_tmpl.id)
+        type_names = [t.name for t in db_template.templatetypes]
+        assert removed_type_name not in type_names
+        assert kept_type_name in type_names
+
+        kept_type = [t for t in db_template.templatetypes if t.name == kept_type_name][0]
+        attr_names = [ta.attr.name for ta in kept_type.typeattrs]
+        assert removed_attr_name not in attr_names
+        assert len(attr_names) == len(kept_attributes) - 1
+
+        with pytest.raises(HydraError):
+            client.import_template_xml(etree.tostring(xml_tree).decode('utf-8'),
+                                       allow_update=False)
+
     def test_get_dict(self, client, template_json_object):
 
         # Upload the xml file initally to avoid having to manage 2 template files
@@ -831,6 +868,45 @@ class TestTemplates:
 
         assert str(results[0].id) in [str(x.type_id) for x in node.types]
 
+    def test_assign_types_to_resources_with_defaults(self, client, template_json_object, network_with_data):
+        """
+            Assign a type with default values to all the nodes in a network and
+            check the missing attributes are added, with the defaults in every scenario.
+        """
+        network = network_with_data
+        template = client.get_template(template_json_object.id)
+        templatetype = [t for t in template.templatetypes if t.name == 'Desalination Plant'][0]
+        default_attr_ids = set(ta.attr_id for ta in templatetype.typeattrs
+                               if ta.default_dataset_id is not None)
+
+        resource_types = [JSONObject({
+            'ref_key': 'NODE',
+            'ref_id': node.id,
+            'type_id': templatetype.id
+            }) for node in network.nodes]
+        #Assigning the same type twice does nothing
+        resource_types.append(resource_types[0])
+
+        client.assign_types_to_resources(resource_types)
+
+        for node in network.nodes:
+            node_j = client.get_node(node.id)
+            assert len([t for t in node_j.types if t.type_id == templatetype.id]) == 1
+            node_attr_ids = [a.attr_id for a in node_j.attributes]
+            for typeattr in templatetype.typeattrs:
+                assert node_attr_ids.count(typeattr.attr_id) == 1
+
+        assert len(default_attr_ids) > 0
+
+        for scenario in network.scenarios:
+            scenario_data = client.get_resource_data('NODE', network.nodes[0].id, scenario.id)
+            assert default_attr_ids.issubset(set(rs.resourceattr.attr_id for rs in scenario_data))
+
+        #Running it again adds nothing more
+        client.assign_types_to_resources(resource_types)
+        node_j = client.get_node(network.nodes[0].id)
+        assert len(node_j.types) == len(set(t.type_id for t in node_j.types))
+
     def test_remove_type_from_resource(self, client, mock_template, network_with_data):
         network = network_with_data
         template = mock_template
@@ -981,6 +1057,25 @@ class TestTemplates:
             assert n.types[0].name == 'Default Node'
 
 
+    def test_match_resource_types(self):
+        """
+            Resources match the first type whose attributes they all have.
+        """
+        from hydra_base.lib.template.resource import _match_resource_types
+
+        def make_type(type_id, attr_ids):
+            return JSONObject({'id': type_id,
+                               'typeattrs': [{'attr_id': a} for a in attr_ids]})
+
+        ttypes = [make_type(1, [10, 11]), make_type(2, [10]), make_type(3, [12])]
+        resource_attrs = [(100, 10), (100, 11), (101, 10), (101, 13), (102, 13)]
+
+        matches = _match_resource_types([100, 101, 102], resource_attrs, ttypes, block_size=2)
+
+        assert matches[100].id == 1
+        assert matches[101].id == 2
+        assert 102 not in matches
+
     def test_remove_template_from_network(self, client, network_with_data):
         network = network_with_data
         template_id = network.types[0].template_id
@@ -1145,6 +1240,30 @@ class TestTemplates:
             except AssertionError:
                 assert err.startswith("Dimension mismatch")
 
+    def test_get_network_validation_errors(self, client, network_with_data):
+        network = network_with_data
+
+        client.testutils.update_template(network.types[0].template_id)
+
+        scenario = network.scenarios[0]
+        template_id = network.nodes[0].types[0].template_id
+
+        errors = client.get_network_validation_errors(network.id, template_id, scenario.id)
+        error_texts = client.validate_network(network.id, template_id, scenario.id)
+
+        assert [e.error_text for e in errors] == error_texts
+
+        assert errors[0].ref_key == 'NETWORK'
+        assert errors[0].ref_id == network.id
+        assert errors[0].attr_name == 'net_attr_d'
+
+        node_ids = set(n.id for n in network.nodes)
+        for error in errors[1:]:
+            assert error.ref_key == 'NODE'
+            assert error.ref_id in node_ids
+            assert error.dataset_id is not None
+            assert error.scenario_id == scenario.id
+
     def test_type_compatibility(self, client, mock_template, mock_template_copy):
         """
             Check function that thests whether two types are compatible -- the
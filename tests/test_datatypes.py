@@ -158,3 +158,42 @@ def test_dataframe_time_index_order_preserved():
     parsed_value = dataframe_dataset.parse_value()
 
     assert parsed_value == df.to_json()
+
+
+""" Restriction validation tests """
+
+restriction_cases = [
+    ({"VALUERANGE": [1, 10]}, 5, True),
+    ({"VALUERANGE": [1, 10]}, [1, 2, 11], False),
+    ({"LESSTHAN": 3}, "2", True),
+    ({"LESSTHAN": 3}, "three", False),
+    ({"SUMTO": 1}, [0.25, 0.75], True),
+    ({"SUMTO": 1}, [[0.5, 0.5], [0.5, 0.5]], False),
+    ({"INCREASING": None}, [1, 2, 2, 3], True),
+    ({"DECREASING": None}, [3, 4], False),
+    ({"ENUM": [1, 2]}, [1, 2, 1], True),
+    ({"ENUM": ["a", "b"]}, "c", False),
+    ({"MULTIPLEOF": 2}, [2, 4, 5], False),
+    ({"GREATERTHAN": 0}, pd.DataFrame({"A": [1, 2], "B": [3, -1]}), False),
+]
+
+@pytest.mark.parametrize("restriction, value, is_valid", restriction_cases)
+def test_validate_value(restriction, value, is_valid):
+    if is_valid:
+        hb.util.dataset_util.validate_value(restriction, value)
+    else:
+        with pytest.raises(HydraError):
+            hb.util.dataset_util.validate_value(restriction, value)
+
+def test_validate_values():
+    restrictions = [json.dumps(r) for r, _, _ in restriction_cases]
+    values = [v for _, v, _ in restriction_cases]
+
+    #Lots of single numbers sharing a restriction are checked together
+    restrictions.extend(['{"LESSTHAN": 5, "GREATERTHANEQ": 0}'] * 1000)
+    values.extend([i % 6 for i in range(1000)])
+
+    errors = hb.util.dataset_util.validate_values(restrictions, values)
+
+    expected = [is_valid for _, _, is_valid in restriction_cases] + [i % 6 != 5 for i in range(1000)]
+    assert [e is None for e in errors] == expected
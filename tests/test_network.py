@@ -384,6 +384,43 @@ class TestNetwork:
         assert updated_network.nodes[1].layout['color'] == 'green'
 
 
+    def test_update_network_applies_only_changes(self, client, network_with_data):
+        """
+            Check that update_network only writes the resources which have
+            changed, and can add linked new nodes and links in the same call.
+        """
+        net = hb.JSONObject(client.get_network(network_with_data.id))
+
+        #Nothing has changed
+        updated_network = client.update_network(net)
+        assert updated_network.changes['nodes_updated'] == 0
+        assert updated_network.changes['links_updated'] == 0
+        assert updated_network.changes['groups_updated'] == 0
+        assert updated_network.changes['attributes_added'] == 0
+        assert updated_network.changes['types_added'] == 0
+
+        net.nodes[0].x = float(net.nodes[0].x) + 1
+        net.nodes[0].attributes.append(hb.JSONObject({'id': -1, 'attr_id': net.attributes[0].attr_id}))
+        net.nodes.append(hb.JSONObject({'id': -1, 'name': 'New Node', 'x': 1, 'y': 2}))
+        net.links.append(hb.JSONObject({'id': -1, 'name': 'New Link',
+                                        'node_1_id': net.nodes[0].id, 'node_2_id': -1}))
+
+        updated_network = client.update_network(net)
+        assert updated_network.changes['nodes_updated'] == 1
+        assert updated_network.changes['nodes_added'] == 1
+        assert updated_network.changes['links_added'] == 1
+        assert updated_network.changes['links_updated'] == 0
+        assert updated_network.changes['attributes_added'] == 1
+
+        updated_network = client.get_network(net.id)
+        new_node = [n for n in updated_network.nodes if n.name == 'New Node'][0]
+        new_link = [l for l in updated_network.links if l.name == 'New Link'][0]
+        assert new_link.node_1_id == net.nodes[0].id
+        assert new_link.node_2_id == new_node.id
+        node_0 = [n for n in updated_network.nodes if n.id == net.nodes[0].id][0]
+        assert float(node_0.x) == net.nodes[0].x
+        assert net.attributes[0].attr_id in [ra.attr_id for ra in node_0.attributes]
+
 ############################################################
     def test_add_links(self, client, projectmaker):
 
@@ -667,6 +704,175 @@ class TestNetwork:
 
         assert len(network.nodes)+len(nodes) == len(new_network.nodes); "new nodes were not added correctly_2",
 
+    def test_import_network_directory(self, client, projectmaker, attribute, tmp_path):
+        """
+            Test importing a network from NDJSON and CSV parts, a couple of
+            records at a time, and resuming an import which failed part way.
+        """
+        project = projectmaker.create('test')
+        attr_id = attribute.id
+
+        with open(tmp_path / 'network.json', 'w') as f:
+            json.dump({'name': 'Streamed network',
+                       'description': 'Imported in parts',
+                       'scenarios': [{'name': 'Baseline'}]}, f)
+
+        with open(tmp_path / 'nodes_1.ndjson', 'w') as f:
+            for i in range(3):
+                f.write(json.dumps({'name': f'node {i}', 'x': i, 'y': i,
+                                    'attributes': [{'attr_id': attr_id}]}) + '\n')
+        with open(tmp_path / 'nodes_2.csv', 'w') as f:
+            f.write('name,description,x,y\n')
+            for i in range(3, 5):
+                f.write(f'node {i},csv node,{i},{i}\n')
+
+        with open(tmp_path / 'links.csv', 'w') as f:
+            f.write('name,node_1,node_2\n')
+            for i in range(4):
+                f.write(f'link {i},node {i},node {i+1}\n')
+
+        with open(tmp_path / 'groups.ndjson', 'w') as f:
+            f.write(json.dumps({'name': 'group 0'}) + '\n')
+
+        with open(tmp_path / 'groupitems.csv', 'w') as f:
+            f.write('scenario,group,ref_key,resource\n')
+            f.write('Baseline,group 0,NODE,node 0\n')
+            f.write('Baseline,group 0,LINK,link 0\n')
+
+        #The last row refers to a node which doesn't exist, so the import fails there.
+        with open(tmp_path / 'data.csv', 'w') as f:
+            f.write('scenario,ref_key,resource,attr_id,type,value\n')
+            for i in range(5):
+                f.write(f'Baseline,NODE,node {i},{attr_id},scalar,{i * 10}\n')
+            f.write(f'Baseline,NODE,node 99,{attr_id},scalar,99\n')
+
+        checkpoint_path = str(tmp_path / 'checkpoint.json')
+        with pytest.raises(hb.HydraError):
+            client.import_network_directory(str(tmp_path),
+                                            project_id=project.id,
+                                            checkpoint_path=checkpoint_path,
+                                            chunk_size=2)
+
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        assert checkpoint['parts']['nodes_1.ndjson'] == 3
+        assert checkpoint['parts']['data.csv'] == 4
+
+        #Remove the bad row and resume
+        with open(tmp_path / 'data.csv') as f:
+            lines = f.readlines()
+        with open(tmp_path / 'data.csv', 'w') as f:
+            f.writelines(lines[:-1])
+
+        result = client.import_network_directory(str(tmp_path),
+                                                 project_id=project.id,
+                                                 checkpoint_path=checkpoint_path,
+                                                 chunk_size=2)
+        assert result.id == checkpoint['network_id']
+        assert result.imported.nodes == 0
+        assert result.imported.data == 1
+
+        net = client.get_network(result.id, include_data=True)
+        assert net.name == 'Streamed network'
+        assert sorted(n.name for n in net.nodes) == [f'node {i}' for i in range(5)]
+        assert len(net.links) == 4
+        assert len(net.resourcegroups) == 1
+        assert len(net.scenarios[0].resourcegroupitems) == 2
+
+        node_names = dict((n.id, n.name) for n in net.nodes)
+        values = {}
+        for rs in net.scenarios[0].resourcescenarios:
+            node_id = rs.resourceattr.node_id
+            values[node_names[node_id]] = float(rs.dataset.value)
+        assert values == dict((f'node {i}', i * 10) for i in range(5))
+
+        #If the import is interrupted after the last chunk is committed but
+        #before the checkpoint is saved, resuming doesn't add it again.
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        checkpoint['parts']['data.csv'] = 4
+        with open(checkpoint_path, 'w') as f:
+            json.dump(checkpoint, f)
+
+        result = client.import_network_directory(str(tmp_path),
+                                                 project_id=project.id,
+                                                 checkpoint_path=checkpoint_path,
+                                                 chunk_size=2)
+        assert result.imported.data == 0
+
+        net = client.get_network(result.id, include_data=True)
+        assert len(net.scenarios[0].resourcescenarios) == 5
+
+    def test_network_archive(self, client, network_with_data, projectmaker, tmp_path):
+        """
+            Test exporting a network to an archive and importing it into
+            another project.
+        """
+        net = client.get_network(network_with_data.id, include_data=True)
+        archive_path = str(tmp_path / 'network.zip')
+
+        written = client.export_network_archive(net.id, archive_path, chunk_size=3)
+        assert written.nodes == len(net.nodes)
+        assert written.links == len(net.links)
+        assert written.groups == len(net.resourcegroups)
+
+        #A dataset used by several resource scenarios is only written once
+        rs_count = sum(len(s.resourcescenarios) for s in net.scenarios)
+        assert written.data == rs_count
+        assert written.datasets == len(set(rs.dataset.hash for s in net.scenarios
+                                           for rs in s.resourcescenarios))
+
+        #The archive is much smaller than the same network as JSON
+        with open(archive_path, 'rb') as f:
+            archive_size = len(f.read())
+        assert archive_size * 3 < len(json.dumps(net, default=str))
+
+        project = projectmaker.create('archive test')
+        imported = client.import_network_archive(archive_path, project_id=project.id, chunk_size=3)
+        new_net = client.get_network(imported.id, include_data=True)
+
+        assert new_net.name == net.name
+        assert sorted(n.name for n in new_net.nodes) == sorted(n.name for n in net.nodes)
+        assert sorted((l.name, l.node_1_id in [n.id for n in new_net.nodes]) for l in new_net.links) \
+                == sorted((l.name, True) for l in net.links)
+        assert sorted(n.types[0].id for n in new_net.nodes) == sorted(n.types[0].id for n in net.nodes)
+        assert len(new_net.attributes) == len(net.attributes)
+
+        def _data(network):
+            names = {}
+            for resources in (network.nodes, network.links, network.resourcegroups):
+                for r in resources:
+                    for ra in r.attributes:
+                        names[ra.id] = r.name
+            for ra in network.attributes:
+                names[ra.id] = None
+            return dict(((s.name, names[rs.resource_attr_id], rs.resourceattr.attr_id), rs.dataset.value)
+                        for s in network.scenarios for rs in s.resourcescenarios)
+
+        assert _data(new_net) == _data(net)
+        assert sorted(len(s.resourcegroupitems) for s in new_net.scenarios) == \
+                sorted(len(s.resourcegroupitems) for s in net.scenarios)
+
+    def test_bulk_insert_returning_ids(self, client, network_with_data):
+        """
+            Test that bulk inserted rows are given back their IDs in the
+            order they were passed in, across several chunks.
+        """
+        from hydra_base.db.model import Node
+        rows = [{'network_id': network_with_data.id,
+                 'name': 'bulk node %s' % i,
+                 'x': i,
+                 'y': -i} for i in range(25)]
+
+        new_ids = hb.db.bulk_insert_returning_ids(Node, rows, chunk_size=10)
+
+        assert len(new_ids) == len(rows)
+        inserted = hb.db.DBSession.query(Node.id, Node.name).filter(Node.id.in_(new_ids)).all()
+        id_name_map = dict(inserted)
+        assert [id_name_map[i] for i in new_ids] == [r['name'] for r in rows]
+
+        assert hb.db.bulk_insert_returning_ids(Node, []) == []
+
     ########################################
 
 
@@ -842,6 +1048,40 @@ class TestNetwork:
         network_attributes = client.get_resource_attributes('NETWORK', network.id)
         assert len(network_attributes) == 0
 
+    def test_purge_network_data(self, client, network_with_data, second_network_with_data):
+        """
+            Test that purging a network with purge_data removes all its contents,
+            and the datasets used only by it, leaving datasets shared with
+            another network.
+        """
+        network = client.get_network(network_with_data.id, include_data=True)
+        other_network = client.get_network(second_network_with_data.id, include_data=True)
+
+        dataset_ids = set(rs.dataset.id for s in network.scenarios for rs in s.resourcescenarios)
+        other_dataset_ids = set(rs.dataset.id for s in other_network.scenarios for rs in s.resourcescenarios)
+
+        client.purge_network(network.id, 'Y')
+
+        with pytest.raises(hb.exceptions.HydraError):
+            client.get_network(network.id)
+        with pytest.raises(hb.exceptions.HydraError):
+            client.get_link(network.links[0].id)
+        with pytest.raises(hb.exceptions.HydraError):
+            client.get_scenario(network.scenarios[0].id)
+        assert len(client.get_resource_attributes('NODE', network.nodes[0].id)) == 0
+
+        for dataset_id in dataset_ids - other_dataset_ids:
+            with pytest.raises(hb.exceptions.HydraError):
+                client.get_dataset(dataset_id)
+        for dataset_id in dataset_ids & other_dataset_ids:
+            assert client.get_dataset(dataset_id).id == dataset_id
+
+        #The other network is unaffected
+        other_network_after = client.get_network(other_network.id, include_data=True)
+        assert len(other_network_after.nodes) == len(other_network.nodes)
+        assert len(other_network_after.scenarios[0].resourcescenarios) == \
+            len(other_network.scenarios[0].resourcescenarios)
+
     def test_get_node(self, client, network_with_data):
         network = network_with_data
         n = network.nodes[0]
@@ -947,6 +1187,58 @@ class TestNetwork:
         result = client.validate_network_topology(network.id)
         assert len(result) == 1#This means orphan nodes are present
 
+    def test_topology_queries(self, client, projectmaker):
+        """
+            Test the traversal queries on a network shaped:
+                A -> B -> C <- D    E -> F    G
+        """
+        project = projectmaker.create('test')
+        names = ['A', 'B', 'C', 'D', 'E', 'F', 'G']
+        nodes = [hb.JSONObject({'id': -(i+1), 'name': n, 'x': i, 'y': i}) for i, n in enumerate(names)]
+        node_ids = dict((n.name, n.id) for n in nodes)
+        links = []
+        for i, (n1, n2) in enumerate([('A', 'B'), ('B', 'C'), ('D', 'C'), ('E', 'F')]):
+            links.append(hb.JSONObject({'id': -(i+1), 'name': n1 + n2,
+                                        'node_1_id': node_ids[n1],
+                                        'node_2_id': node_ids[n2]}))
+
+        network = client.add_network(hb.JSONObject({
+            'project_id': project.id,
+            'name': 'Topology @ %s' % datetime.datetime.now(),
+            'nodes': nodes,
+            'links': links}))
+        network = client.get_network(network.id)
+        ids = dict((n.name, n.id) for n in network.nodes)
+        names_of = lambda node_ids: sorted(n.name for n in network.nodes if n.id in node_ids)
+
+        components = client.get_network_components(network.id)
+        assert [names_of(c) for c in components] == [['A', 'B', 'C', 'D'], ['E', 'F'], ['G']]
+
+        assert names_of(client.get_orphan_nodes(network.id)) == ['G']
+        assert names_of(client.get_downstream_nodes(network.id, ids['A'])) == ['B', 'C']
+        assert names_of(client.get_downstream_nodes(network.id, ids['A'], max_hops=1)) == ['B']
+        assert names_of(client.get_upstream_nodes(network.id, ids['C'])) == ['A', 'B', 'D']
+
+        path = client.get_shortest_path(network.id, ids['A'], ids['D'])
+        assert path.node_ids == []
+        path = client.get_shortest_path(network.id, ids['A'], ids['D'], directed=False)
+        assert names_of(path.node_ids) == ['A', 'B', 'C', 'D']
+        assert path.node_ids[0] == ids['A'] and path.node_ids[-1] == ids['D']
+        assert len(path.link_ids) == 3
+
+        subnetwork = client.get_subnetwork(network.id, [ids['A'], ids['B'], ids['D']])
+        assert [l.name for l in network.links if l.id in subnetwork.link_ids] == ['AB']
+
+        #The cached index is rebuilt when the topology changes
+        client.add_link(network.id, hb.JSONObject({'name': 'CE',
+                                                   'node_1_id': ids['C'],
+                                                   'node_2_id': ids['E']}))
+        assert names_of(client.get_downstream_nodes(network.id, ids['A'])) == ['B', 'C', 'E', 'F']
+
+        client.delete_node(ids['B'], 'N')
+        assert names_of(client.get_downstream_nodes(network.id, ids['A'])) == []
+        assert names_of(client.get_orphan_nodes(network.id)) == ['A', 'G']
+
     def test_consistency_of_update(self, client, network_with_data):
         """
             Test to ensure that updating a network which has not changed
@@ -1144,6 +1436,11 @@ class TestNetwork:
         node_id_to_delete = net.nodes[0].id
 
         node_datasets = client.get_resource_data('NODE', node_id_to_delete, scenario_id)
+        other_node_datasets = client.get_resource_data('NODE', net.nodes[1].id, scenario_id)
+        shared_dataset_ids = set(rs.dataset.id for rs in node_datasets) & \
+                set(rs.dataset.id for rs in other_node_datasets)
+        assert len(shared_dataset_ids) > 0
+
         log.info("Deleting node %s", node_id_to_delete)
         client.delete_node(node_id_to_delete, 'Y')
 
@@ -1166,6 +1463,10 @@ class TestNetwork:
                 with pytest.raises(hb.exceptions.HydraError):
                     dataset = client.get_dataset(d.id)
 
+        #Datasets also used by other nodes are kept
+        for dataset_id in shared_dataset_ids:
+            assert client.get_dataset(dataset_id).id == dataset_id
+
     def test_delete_link(self, client, network_with_data):
         net = network_with_data
         scenario_id = net.scenarios[0].id
@@ -1193,6 +1494,46 @@ class TestNetwork:
                 with pytest.raises(hb.exceptions.HydraError):
                     client.get_dataset(d.id)
 
+    def test_delete_many_resources(self, client, network_with_data):
+        net = network_with_data
+        scenario_id = net.scenarios[0].id
+
+        node_ids_to_delete = [net.nodes[0].id, net.nodes[1].id]
+        attached_link_ids = [l.id for l in net.links
+                             if l.node_1_id in node_ids_to_delete or l.node_2_id in node_ids_to_delete]
+        link_id_to_delete = [l.id for l in net.links if l.id not in attached_link_ids][0]
+        group_id_to_delete = net.resourcegroups[0].id
+
+        node_datasets = client.get_resource_data('NODE', node_ids_to_delete[0], scenario_id)
+
+        client.delete_nodes(node_ids_to_delete, 'Y')
+        client.delete_links([link_id_to_delete])
+        client.delete_groups([group_id_to_delete])
+
+        updated_net = client.get_network(net.id, True)
+
+        remaining_node_ids = set(n.id for n in updated_net.nodes)
+        remaining_link_ids = set(l.id for l in updated_net.links)
+        assert len(remaining_node_ids) == len(net.nodes) - 2
+        assert remaining_node_ids.isdisjoint(node_ids_to_delete)
+        assert remaining_link_ids.isdisjoint(attached_link_ids + [link_id_to_delete])
+        assert len(remaining_link_ids) == len(net.links) - len(attached_link_ids) - 1
+        assert group_id_to_delete not in [g.id for g in updated_net.resourcegroups]
+
+        group_items = client.get_resourcegroupitems(None, scenario_id)
+        for item in group_items:
+            assert item.node_id not in node_ids_to_delete
+            assert item.group_id != group_id_to_delete
+
+        for rs in node_datasets:
+            #All timeseries are unique to their resources in these tests
+            if rs.dataset.type == 'timeseries':
+                with pytest.raises(hb.exceptions.HydraError):
+                    client.get_dataset(rs.dataset.id)
+
+        with pytest.raises(hb.exceptions.ResourceNotFoundError):
+            client.delete_nodes(node_ids_to_delete)
+
     def test_get_all_network_owners(self, client, projectmaker, networkmaker):
         proj = projectmaker.create()
 
@@ -1283,6 +1624,74 @@ class TestNetwork:
         cloned_network = client.get_network(cloned_network_id, include_data=True)
         assert cloned_network.name == 'My New Name'
 
+    def test_clone_network_contents(self, client, network_with_data):
+        """
+            Check that the cloned resources, types, attributes and data refer
+            to each other in the same way as in the original network.
+        """
+        net = client.get_network(network_with_data.id, include_data=True)
+
+        cloned_network_id = client.clone_network(net.id, new_project=False, include_outputs=True)
+        cloned_net = client.get_network(cloned_network_id, include_data=True)
+
+        def _describe(network):
+            node_names = dict((n.id, n.name) for n in network.nodes)
+            link_names = dict((l.id, l.name) for l in network.links)
+            group_names = dict((g.id, g.name) for g in network.resourcegroups)
+            ra_names = {}
+            resources = {}
+            for ref_key, resource_list in (('NODE', network.nodes),
+                                           ('LINK', network.links),
+                                           ('GROUP', network.resourcegroups),
+                                           ('NETWORK', [network])):
+                for r in resource_list:
+                    resource = (ref_key, r.name if ref_key != 'NETWORK' else None)
+                    resources[resource] = dict(
+                        types=sorted(t.type_id for t in r.types),
+                        attrs=sorted((ra.attr_id, ra.attr_is_var) for ra in r.attributes))
+                    for ra in r.attributes:
+                        ra_names[ra.id] = (resource, ra.attr_id)
+
+            links = sorted((l.name, node_names[l.node_1_id], node_names[l.node_2_id]) for l in network.links)
+            scenario = network.scenarios[0]
+            data = sorted((ra_names[rs.resource_attr_id], rs.dataset.id) for rs in scenario.resourcescenarios)
+            items = sorted((group_names[i.group_id], i.ref_key,
+                            node_names.get(i.node_id), link_names.get(i.link_id), group_names.get(i.subgroup_id))
+                           for i in scenario.resourcegroupitems)
+            return resources, links, data, items
+
+        #The network-scoped attribute is re-scoped to the project, so keeps its ID
+        assert _describe(cloned_net) == _describe(net)
+
+    def test_clone_network_many(self, client, network_with_data):
+        net = network_with_data
+
+        new_network_ids = client.clone_network_many(net.id, [
+            {'new_network_name': 'Copy', 'new_project': False},
+            {'new_network_name': 'Copy', 'new_project': False},
+            {'project_name': 'Copies project', 'include_outputs': True},
+        ])
+
+        assert len(new_network_ids) == 3
+
+        copies = [client.get_network(new_network_ids[i], include_data=True) for i in range(3)]
+        assert copies[0].name == 'Copy'
+        assert copies[1].name == 'Copy (1)'
+        assert copies[0].project_id == copies[1].project_id == net.project_id
+        assert copies[2].project_id != net.project_id
+
+        for copy in copies:
+            assert len(copy.nodes) == len(net.nodes)
+            assert len(copy.links) == len(net.links)
+            assert len(copy.scenarios) == len(net.scenarios)
+
+        #Outputs are only cloned when requested
+        assert len(copies[2].scenarios[0].resourcescenarios) == \
+                len(copies[0].scenarios[0].resourcescenarios) + 10
+
+        with pytest.raises(hb.exceptions.HydraError):
+            client.clone_network_many(net.id, [{'not_an_argument': 1}])
+
     def test_clone_network_with_scoped_attributes(self, client, network_with_data):
         net = network_with_data
 
@@ -20,6 +20,7 @@ import datetime
 import copy
 import json
 import hydra_base
+import numpy as np
 import pytest
 from hydra_base.exceptions import HydraError
 from hydra_base.lib.objects import JSONObject, Dataset
@@ -529,6 +530,121 @@ class TestScenario:
             if ra_id == descriptor['resource_attr_id']:
                 assert rs.dataset.value == descriptor.dataset.value
 
+    def test_ingest_results(self, client, network_with_data):
+        """
+            Test writing results to a scenario with ingest_results, both as
+            rows and as a columnar batch, replacing and updating existing results.
+        """
+        network = network_with_data
+        scenario = network.scenarios[0]
+
+        result_ra_ids = []
+        for node in network.nodes:
+            for ra in node.attributes:
+                if ra.attr_is_var == 'Y':
+                    result_ra_ids.append(ra.id)
+
+        assert len(result_ra_ids) > 0
+
+        rows = [{'resource_attr_id': ra_id, 'type': 'scalar', 'value': 10 + i}
+                for i, ra_id in enumerate(result_ra_ids)]
+        counts = client.ingest_results(scenario.id, rows, replace_results=True, chunk_size=3)
+
+        assert counts['deleted'] == len(result_ra_ids)
+        assert counts['inserted'] == len(result_ra_ids)
+        assert counts['updated'] == 0
+        assert counts['datasets_inserted'] == len(result_ra_ids)
+
+        rs_dict = client.get_resourceattr_data(result_ra_ids, scenario.id)
+        for i, ra_id in enumerate(result_ra_ids):
+            assert float(rs_dict[ra_id].dataset.value) == 10 + i
+
+        #Write the same values again, as a columnar batch. The datasets are
+        #reused, and the last result is removed by setting it to None.
+        values = [10 + i for i in range(len(result_ra_ids))]
+        values[-1] = None
+        counts = client.ingest_results(scenario.id, {
+            'resource_attr_id': result_ra_ids,
+            'type': ['scalar'] * len(result_ra_ids),
+            'value': values,
+        })
+
+        assert counts['updated'] == len(result_ra_ids) - 1
+        assert counts['inserted'] == 0
+        assert counts['deleted'] == 1
+        assert counts['datasets_inserted'] == 0
+        assert counts['datasets_reused'] == len(result_ra_ids) - 1
+
+        rs_dict = client.get_resourceattr_data(result_ra_ids, scenario.id)
+        assert len(rs_dict) == len(result_ra_ids) - 1
+
+        #Resource attributes which are not in the scenario's network are rejected
+        with pytest.raises(HydraError):
+            client.ingest_results(scenario.id, [
+                {'resource_attr_id': 999999999, 'type': 'scalar', 'value': 1}])
+
+    def test_get_attribute_matrix(self, client, network_with_data):
+        """
+            Test retrieving the scalar and timeseries values of an attribute
+            across several scenarios as a single result.
+        """
+        network = network_with_data
+        scenario = network.scenarios[0]
+
+        #Find a result attribute which is on several nodes
+        result_ras = {}
+        for node in network.nodes:
+            for ra in node.attributes:
+                if ra.attr_is_var == 'Y':
+                    result_ras.setdefault(ra.attr_id, []).append(ra)
+        attr_id, ras = max(result_ras.items(), key=lambda x: len(x[1]))
+        ras = sorted(ras, key=lambda ra: ra.node_id)
+
+        client.ingest_results(scenario.id, [
+            {'resource_attr_id': ra.id, 'type': 'scalar', 'value': i}
+            for i, ra in enumerate(ras)], replace_results=True)
+
+        cloned_scenario_id = client.clone_scenario(scenario.id, retain_results=True)['id']
+        client.ingest_results(cloned_scenario_id, [
+            {'resource_attr_id': ras[0].id, 'type': 'scalar', 'value': 100}])
+
+        result = client.get_attribute_matrix(attr_id, [cloned_scenario_id, scenario.id], ref_key='NODE')
+
+        assert result.type == 'scalar'
+        assert list(result.scenario_ids) == [cloned_scenario_id, scenario.id]
+        assert list(result.resource_attr_ids) == [ra.id for ra in ras]
+        assert list(result.resource_ids) == [ra.node_id for ra in ras]
+        assert result.matrix.shape == (2, len(ras))
+        assert result.matrix[0][0] == 100
+        assert list(result.matrix[1]) == list(range(len(ras)))
+
+        #Restrict the matrix to a subset of the nodes
+        result = client.get_attribute_matrix(attr_id, [scenario.id], ref_key='NODE',
+                                             ref_ids=[ras[1].node_id])
+        assert result.matrix.shape == (1, 1)
+        assert result.matrix[0][0] == 1
+
+        #Timeseries of different lengths are aligned on a common time index
+        ts_1 = json.dumps({'0': {'2020-01-01T00:00:00': 1.0, '2020-01-02T00:00:00': 2.0}})
+        ts_2 = json.dumps({'0': {'2020-01-02T00:00:00': 3.0, '2020-01-03T00:00:00': 4.0}})
+        client.ingest_results(scenario.id, [
+            {'resource_attr_id': ras[0].id, 'type': 'timeseries', 'value': ts_1},
+            {'resource_attr_id': ras[1].id, 'type': 'timeseries', 'value': ts_2}],
+            replace_results=True)
+
+        result = client.get_attribute_matrix(attr_id, [scenario.id])
+        assert result.type == 'timeseries'
+        assert result.matrix.shape == (1, 2, 3)
+        assert len(result.times) == 3
+        assert list(result.matrix[0][0][:2]) == [1.0, 2.0]
+        assert np.isnan(result.matrix[0][0][2])
+        assert np.isnan(result.matrix[0][1][0])
+        assert list(result.matrix[0][1][1:]) == [3.0, 4.0]
+
+        #Mixed types cannot be combined into one matrix
+        with pytest.raises(HydraError):
+            client.get_attribute_matrix(attr_id, [cloned_scenario_id, scenario.id])
+
     def test_bulk_update_resourcedata_skips_unchanged_values(self, client, network_with_data):
         """
             Regression test for the pre-pass "unchanged" short-circuit in
@@ -1133,6 +1249,56 @@ class TestScenario:
 
         assert len(inherited_resource_data) == len(parent_resource_data)
 
+    def test_inherited_data_from_intermediate_scenario(self, client, network_with_grandchild_scenario):
+        """
+            Test that a grandchild with no data of its own inherits the value
+            set on the child, rather than the value set on the root scenario.
+        """
+
+        network = network_with_grandchild_scenario
+
+        sorted_scenario = sorted(network.scenarios, key=lambda x : x.id )
+
+        parent = sorted_scenario[0]
+        child  = sorted_scenario[1]
+        grandchild  = sorted_scenario[2]
+
+        ra_to_update = None
+        for a in network.nodes[0].attributes:
+            if a.name == 'node_attr_a':
+                ra_to_update = a.id
+
+        for rs in parent.resourcescenarios:
+            if rs.resource_attr_id == ra_to_update:
+                rs_to_update = rs
+                break
+
+        rs_to_update.dataset.value = 999
+
+        client.update_resourcedata(child.id, [rs_to_update])
+
+        grandchild_scenario = client.get_scenario(grandchild.id, get_parent_data=True)
+        assert len(grandchild_scenario.resourcescenarios) == len(parent.resourcescenarios)
+
+        inherited_rs = [rs for rs in grandchild_scenario.resourcescenarios
+                        if rs.resource_attr_id == ra_to_update]
+        assert len(inherited_rs) == 1
+        assert inherited_rs[0].scenario_id == child.id
+        assert int(inherited_rs[0].dataset.value) == 999
+
+        rs = client.get_resource_scenario(ra_to_update, grandchild.id, get_parent_data=True)
+        assert rs.scenario_id == child.id
+
+        inherited_resource_data = client.get_resource_data('NODE',
+                                                           network.nodes[0].id,
+                                                           grandchild.id,
+                                                           get_parent_data=True)
+        for rs in inherited_resource_data:
+            if rs.resource_attr_id == ra_to_update:
+                assert rs.scenario_id == child.id
+            else:
+                assert rs.scenario_id == parent.id
+
 
     def test_compare(self, client, network_with_data):
 
@@ -1194,6 +1360,44 @@ class TestScenario:
         assert len(scenario_diff.groups.scenario_2_items) == 1, "Group comparison was not successful!"
         assert scenario_diff.groups.scenario_1_items == [], "Group comparison was not successful!"
 
+    def test_compare_with_tolerance(self, client, network_with_data):
+
+        network =  network_with_data
+
+        scenario = network.scenarios[0]
+
+        clone = client.clone_scenario(scenario.id)
+        new_scenario = client.get_scenario(clone.id)
+
+        scalar_rs = None
+        for rs in new_scenario.resourcescenarios:
+            if rs.dataset.type.lower() == 'scalar':
+                scalar_rs = rs
+                break
+
+        scalar_rs.dataset = Dataset({
+            'type' : 'scalar',
+            'name' : 'Slightly different scalar',
+            'unit_id' : scalar_rs.dataset.unit_id,
+            'value' : float(scalar_rs.dataset.value) + 0.001,
+        })
+
+        client.update_resourcedata(new_scenario.id, [scalar_rs])
+
+        scenario_diff = JSONObject(client.compare_scenarios(scenario.id, new_scenario.id))
+        assert len(scenario_diff.resourcescenarios) == 1
+        assert scenario_diff.summary.changed == 1
+
+        scenario_diff = JSONObject(client.compare_scenarios(scenario.id, new_scenario.id, tolerance=0.01))
+        assert len(scenario_diff.resourcescenarios) == 0
+        assert scenario_diff.summary.changed == 0
+
+        scenario_diff = JSONObject(client.compare_scenarios(scenario.id, new_scenario.id, summary_only=True))
+        assert scenario_diff.get('resourcescenarios') is None
+        assert scenario_diff.summary.changed == 1
+        assert scenario_diff.summary.scenario_1_only == 0
+        assert scenario_diff.summary.scenario_2_only == 0
+
     def test_purge_scenario(self, client, network_with_data):
 
         #Make a network with 2 scenarios